@@ -0,0 +1,87 @@
+# --------------------------------License Notice----------------------------------
+# CNTOSync - Carpe Noctem Tactical Operations ArmA3 mod synchronization tool
+# Copyright (C) 2018 Carpe Noctem - Tactical Operations (aka. CNTO) (contact@carpenoctem.co)
+#
+# The authors of this software are listed in the AUTHORS file at the
+# root of this software's source code tree.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# All rights reserved.
+# --------------------------------License Notice----------------------------------
+
+"""Measure how soon small files complete while large ones share a rate limited link.
+
+A directory of small and large files is served over a simulated slow link and downloaded
+with a rate limit below the link rate, once with priority lanes and once with every file in
+the same lane, largest first as without a bandwidth scheduler. Run with
+``python -m benchmarks.bench_bandwidth [--rate BYTES] [--large-files COUNT]`` from the source
+tree root.
+"""
+
+import argparse
+import os
+import tempfile
+import time
+from typing import Dict, List
+
+from cntosync import bandwidth
+from cntosync.download import DownloadJob, Downloader, file_url
+
+from tests.httpserver import serve
+
+
+def main() -> None:
+    """Serve generated files and time their download with and without priority lanes."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rate', type=int, default=4 * 1024 * 1024)
+    parser.add_argument('--small-files', type=int, default=50)
+    parser.add_argument('--large-files', type=int, default=8)
+    parser.add_argument('--large-size', type=int, default=4 * 1024 * 1024)
+    parser.add_argument('--workers', type=int, default=16)
+    arguments = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        remote = os.path.join(directory, 'remote')
+        os.makedirs(remote)
+        sizes = {'small{0}.cpp'.format(index): 4096 for index in range(arguments.small_files)}
+        sizes.update({'large{0}.pbo'.format(index): arguments.large_size
+                      for index in range(arguments.large_files)})
+        for name, size in sizes.items():
+            with open(os.path.join(remote, name), mode='wb') as stream:
+                stream.write(os.urandom(size))
+
+        with serve(remote, rate=arguments.rate * 2) as server:
+            for lanes in (False, True):
+                jobs: List[DownloadJob] = [
+                    DownloadJob(file_url(server.url, name),
+                                os.path.join(directory, 'local', name), size,
+                                priority=bandwidth.file_priority(size) if lanes
+                                else bandwidth.PRIORITY_REQUIRED)
+                    for name, size in sizes.items()]
+                completed: Dict[str, float] = {}
+                bucket = bandwidth.TokenBucket(arguments.rate)
+                start = time.perf_counter()
+                with Downloader(arguments.workers, connections_per_host=arguments.workers,
+                                bucket=bucket) as downloader:
+                    downloader.download(jobs, on_segment=lambda job, offset, length:
+                                        completed.__setitem__(job.path, time.perf_counter()))
+                elapsed = time.perf_counter() - start
+                small = max(completed[job.path] for job in jobs if job.size == 4096) - start
+                print('{0:>5}: small files done after {1:5.2f}s, all after {2:5.2f}s, '
+                      '{3:5.2f} MiB/s'.format('lanes' if lanes else 'fifo', small, elapsed,
+                                              sum(sizes.values()) / elapsed / 2 ** 20))
+
+
+if __name__ == '__main__':
+    main()
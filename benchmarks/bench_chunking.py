@@ -0,0 +1,84 @@
+# --------------------------------License Notice----------------------------------
+# CNTOSync - Carpe Noctem Tactical Operations ArmA3 mod synchronization tool
+# Copyright (C) 2018 Carpe Noctem - Tactical Operations (aka. CNTO) (contact@carpenoctem.co)
+#
+# The authors of this software are listed in the AUTHORS file at the
+# root of this software's source code tree.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# All rights reserved.
+# --------------------------------License Notice----------------------------------
+
+"""Measure content-defined chunking deduplication and throughput on near-duplicate mods.
+
+Run with ``python -m benchmarks.bench_chunking [--average-size BYTES]`` from the source
+tree root to compare chunk size targets.
+"""
+
+import argparse
+import os
+import random
+import tempfile
+
+from cntosync import configuration
+from cntosync.filesync import Repository
+
+
+def generate_tree(directory: str, mods: int, library_size: int, seed: int = 0) -> None:
+    """Create `mods` mods shipping slightly edited copies of the same library."""
+    generator = random.Random(seed)
+    library = os.urandom(library_size)
+    for mod in range(mods):
+        addons = os.path.join(directory, '@mod{0:03d}'.format(mod), 'addons')
+        os.makedirs(addons, exist_ok=True)
+        position = generator.randrange(library_size)
+        patched = library[:position] + os.urandom(generator.randrange(1, 4096)) + \
+            library[position:]
+        with open(os.path.join(addons, 'library.pbo'), 'wb') as stream:
+            stream.write(patched)
+        with open(os.path.join(addons, 'own.pbo'), 'wb') as stream:
+            stream.write(os.urandom(library_size // 4))
+
+
+def main() -> None:
+    """Generate a tree, chunk it and report deduplication and throughput."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--mods', type=int, default=6)
+    parser.add_argument('--library-size', type=int, default=4 * 1024 * 1024)
+    parser.add_argument('--average-size', type=int, default=configuration.chunk_average_size)
+    arguments = parser.parse_args()
+
+    configuration.chunk_average_size = arguments.average_size
+    configuration.chunk_min_size = arguments.average_size // 4
+    configuration.chunk_max_size = arguments.average_size * 4
+
+    with tempfile.TemporaryDirectory() as directory:
+        generate_tree(directory, arguments.mods, arguments.library_size)
+        repository = Repository.initialize(directory, 'benchmark', 'file://benchmark')
+        result = repository.build_index(arguments.workers, content_defined_chunking=True)
+
+    statistics = result.chunk_statistics
+    print('chunk sizes: min {0}, average {1}, max {2}'.format(
+        configuration.chunk_min_size, configuration.chunk_average_size,
+        configuration.chunk_max_size))
+    print('chunks: {0} ({1} unique), bytes: {2} ({3} unique)'.format(
+        statistics.chunks, statistics.unique_chunks, statistics.logical_bytes,
+        statistics.unique_bytes))
+    print('dedup ratio: {0:.2f}, throughput: {1:.1f} MB/s per core on {2} workers'.format(
+        statistics.dedup_ratio, statistics.throughput_per_core, statistics.workers))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+# --------------------------------License Notice----------------------------------
+# CNTOSync - Carpe Noctem Tactical Operations ArmA3 mod synchronization tool
+# Copyright (C) 2018 Carpe Noctem - Tactical Operations (aka. CNTO) (contact@carpenoctem.co)
+#
+# The authors of this software are listed in the AUTHORS file at the
+# root of this software's source code tree.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# All rights reserved.
+# --------------------------------License Notice----------------------------------
+
+"""Compare transferred bytes and CPU time of raw, always compressed and per-file transfers.
+
+The generated tree mixes incompressible texture-like files with text-like configs and
+scripts. CPU time covers compressing on the publishing side and decompressing on the client.
+Run with ``python -m benchmarks.bench_compression [--files COUNT] [--codec gzip|zstd]`` from
+the source tree root.
+"""
+
+import argparse
+import io
+import os
+import random
+import tempfile
+import time
+from typing import List, Tuple
+
+from cntosync import compression
+
+
+WORDS = [b'class', b'CfgPatches', b'units', b'weapons', b'requiredAddons', b'scope',
+         b'displayName', b'params', b'private', b'_unit', b'if', b'then', b'exitWith',
+         b'forEach', b'count', b'select', b'=', b'{', b'};', b'[]', b'"cnto_core"', b'1.0']
+
+
+def generate_tree(directory: str, files: int, texture_ratio: float) -> List[Tuple[str, int]]:
+    """Write `files` files of which a `texture_ratio` share are incompressible.
+
+    Return the path and size of every file.
+    """
+    generator = random.Random(0)
+    written = []
+    for index in range(files):
+        size = generator.randint(256 * 1024, 4 * 1024 * 1024)
+        if generator.random() < texture_ratio:
+            path = os.path.join(directory, 'texture{0}.paa'.format(index))
+            data = os.urandom(size)
+        else:
+            path = os.path.join(directory, 'config{0}.cpp'.format(index))
+            words = generator.choices(WORDS, k=size // 6)
+            data = b' '.join(words)[:size]
+        with open(path, mode='wb') as stream:
+            stream.write(data)
+        written.append((path, len(data)))
+
+    return written
+
+
+def transfer_size(path: str, size: int, codec: str) -> int:
+    """Compress the file at `path` with `codec`, decompress it and return its compressed size."""
+    target = io.BytesIO()
+    with open(path, mode='rb') as source:
+        compression.compress_stream(source, target, codec, size)
+    data = target.getvalue()
+    decompressor = compression.decompressor(codec)
+    for offset in range(0, len(data), 64 * 1024):
+        decompressor.decompress(data[offset:offset + 64 * 1024])
+    decompressor.flush()
+
+    return len(data)
+
+
+def main() -> None:
+    """Generate a mixed tree and report the cost of each transfer strategy."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--files', type=int, default=40)
+    parser.add_argument('--textures', type=float, default=0.7,
+                        help='share of incompressible files')
+    parser.add_argument('--codec', choices=compression.available_compressions(),
+                        default=compression.preferred_compression())
+    arguments = parser.parse_args()
+
+    codec = arguments.codec
+    with tempfile.TemporaryDirectory() as directory:
+        tree = generate_tree(directory, arguments.files, arguments.textures)
+        total = sum(size for _, size in tree)
+
+        start = time.process_time()
+        always = sum(transfer_size(path, size, codec) for path, size in tree)
+        always_time = time.process_time() - start
+
+        start = time.process_time()
+        chosen = 0
+        for path, size in tree:
+            with open(path, mode='rb') as stream:
+                choice = compression.choose_compression(stream, size)
+            chosen += transfer_size(path, size, codec) if choice is not None else size
+        chosen_time = time.process_time() - start
+
+    print('files: {0}, {1:.1f} MiB, codec {2}'.format(len(tree), total / 2 ** 20, codec))
+    for name, size, cpu_time in (('raw', total, 0.0), ('always', always, always_time),
+                                 ('per-file', chosen, chosen_time)):
+        print('{0:>8}: {1:8.1f} MiB transferred ({2:5.1%}), {3:6.2f}s CPU'.format(
+            name, size / 2 ** 20, size / total, cpu_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+# --------------------------------License Notice----------------------------------
+# CNTOSync - Carpe Noctem Tactical Operations ArmA3 mod synchronization tool
+# Copyright (C) 2018 Carpe Noctem - Tactical Operations (aka. CNTO) (contact@carpenoctem.co)
+#
+# The authors of this software are listed in the AUTHORS file at the
+# root of this software's source code tree.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# All rights reserved.
+# --------------------------------License Notice----------------------------------
+
+"""Compare the index bytes fetched by a client after an update, with and without deltas.
+
+A published repository of many small files is synchronized once, then a fraction of its
+files is changed and it is published again. The manifest of the new revision is fetched
+by a client holding the previous one, which only needs the delta index, and by a client
+without it. Run with ``python -m benchmarks.bench_delta [--mods COUNT] [--changed RATIO]``
+from the source tree root.
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import time
+from typing import Iterator, List, Optional
+
+from cntosync import bandwidth
+from cntosync import transfer
+from cntosync.download import Downloader
+from cntosync.filesync import Repository
+from cntosync.publish import publish
+
+from tests.httpserver import serve
+
+from .bench_indexer import generate_tree
+
+
+class CountingDownloader(Downloader):
+    """Downloader counting the bytes fetched outside of segmented downloads."""
+
+    fetched = 0
+
+    def fetch(self, url: str, offset: int = 0, length: Optional[int] = None,
+              priority: int = bandwidth.PRIORITY_INDEX) -> Iterator[bytes]:
+        """Stream the requested data, counting its size."""
+        for data in super().fetch(url, offset, length, priority):
+            self.fetched += len(data)
+            yield data
+
+
+def main() -> None:
+    """Publish two revisions of a generated repository and time fetching the second."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--mods', type=int, default=100)
+    parser.add_argument('--small-files', type=int, default=200)
+    parser.add_argument('--changed', type=float, default=0.01)
+    arguments = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        remote = Repository.initialize(os.path.join(directory, 'remote'), 'remote',
+                                       'http://localhost/')
+        generate_tree(remote.directory, arguments.mods, arguments.small_files, 0, 0)
+        publish(remote)
+        paths: List[str] = [entry.path for entry in remote.manifest]
+        base = os.path.join(directory, 'base')
+
+        downloader = CountingDownloader()
+        with serve(remote.directory) as server, downloader:
+            transfer.fetch_manifest(server.url, downloader, base).close()
+            generator = random.Random(0)
+            for path in generator.sample(paths, int(len(paths) * arguments.changed)):
+                with open(os.path.join(remote.directory, path), mode='wb') as stream:
+                    stream.write(os.urandom(512))
+            result = publish(remote)
+            print('{0} files, revision {1}'.format(len(paths), result.revision))
+
+            for mode in ('delta', 'full'):
+                path = os.path.join(directory, mode)
+                if mode == 'delta':
+                    os.replace(base, path)
+                downloader.fetched = 0
+                start = time.perf_counter()
+                publication = transfer.fetch_publication(server.url, downloader)
+                transfer.fetch_manifest(server.url, downloader, path,
+                                        publication=publication).close()
+                print('{0:>5}: {1:9.1f} KiB fetched in {2:6.3f}s'.format(
+                    mode, downloader.fetched / 1024, time.perf_counter() - start))
+
+
+if __name__ == '__main__':
+    main()
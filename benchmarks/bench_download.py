@@ -0,0 +1,72 @@
+# --------------------------------License Notice----------------------------------
+# CNTOSync - Carpe Noctem Tactical Operations ArmA3 mod synchronization tool
+# Copyright (C) 2018 Carpe Noctem - Tactical Operations (aka. CNTO) (contact@carpenoctem.co)
+#
+# The authors of this software are listed in the AUTHORS file at the
+# root of this software's source code tree.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# All rights reserved.
+# --------------------------------License Notice----------------------------------
+
+"""Benchmark concurrent HTTP downloads against a local server.
+
+Run with ``python -m benchmarks.bench_download [--delay SECONDS]`` from the source tree root.
+The delay is added to every request to simulate the round-trip time of a remote server,
+which is what limits naive clients on repositories made of many small files.
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from cntosync import indexer
+from cntosync.download import DownloadJob, Downloader, file_url
+
+from tests.httpserver import serve
+
+from .bench_indexer import generate_tree
+
+
+def main() -> None:
+    """Generate a tree, serve it and download it with several concurrency settings."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--mods', type=int, default=4)
+    parser.add_argument('--small-files', type=int, default=250)
+    parser.add_argument('--large-files', type=int, default=1)
+    parser.add_argument('--large-size', type=int, default=64 * 1024 * 1024)
+    parser.add_argument('--delay', type=float, default=0.02)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4, 16])
+    arguments = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as remote, tempfile.TemporaryDirectory() as local:
+        written = generate_tree(remote, arguments.mods, arguments.small_files,
+                                arguments.large_files, arguments.large_size)
+        files = list(indexer.scan(remote))
+        with serve(remote, delay=arguments.delay) as server:
+            for workers in arguments.workers:
+                jobs = [DownloadJob(file_url(server.url, path),
+                                    os.path.join(local, str(workers), path), stat.st_size)
+                        for path, stat in files]
+                with Downloader(workers=workers, connections_per_host=workers) as downloader:
+                    start = time.perf_counter()
+                    downloader.download(jobs)
+                    elapsed = time.perf_counter() - start
+                print('workers: {0:3d}, elapsed: {1:.2f}s, {2:.1f} MB/s, {3:.0f} files/s'.format(
+                    workers, elapsed, written / elapsed / 1e6, len(jobs) / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+# --------------------------------License Notice----------------------------------
+# CNTOSync - Carpe Noctem Tactical Operations ArmA3 mod synchronization tool
+# Copyright (C) 2018 Carpe Noctem - Tactical Operations (aka. CNTO) (contact@carpenoctem.co)
+#
+# The authors of this software are listed in the AUTHORS file at the
+# root of this software's source code tree.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# All rights reserved.
+# --------------------------------License Notice----------------------------------
+
+"""Benchmark `Repository.build_index` on a synthetic repository tree.
+
+Run with ``python -m benchmarks.bench_indexer [--workers N]`` from the source tree root.
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from cntosync.filesync import Repository
+
+
+def generate_tree(directory: str, mods: int, small_files: int, large_files: int,
+                  large_size: int) -> int:
+    """Fill `directory` with an ArmA-like layout and return the number of bytes written."""
+    written = 0
+    for mod in range(mods):
+        addons = os.path.join(directory, '@mod{0:03d}'.format(mod), 'addons')
+        os.makedirs(addons, exist_ok=True)
+        for number in range(small_files):
+            content = os.urandom(512)
+            with open(os.path.join(addons, 'file{0:04d}.bisign'.format(number)), 'wb') as stream:
+                stream.write(content)
+            written += len(content)
+        for number in range(large_files):
+            with open(os.path.join(addons, 'data{0:02d}.pbo'.format(number)), 'wb') as stream:
+                for _ in range(large_size // (1024 * 1024)):
+                    stream.write(os.urandom(1024 * 1024))
+            written += large_size - large_size % (1024 * 1024)
+
+    return written
+
+
+def main() -> None:
+    """Generate a tree, index it and report throughput."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--mods', type=int, default=8)
+    parser.add_argument('--small-files', type=int, default=500)
+    parser.add_argument('--large-files', type=int, default=2)
+    parser.add_argument('--large-size', type=int, default=64 * 1024 * 1024)
+    arguments = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        written = generate_tree(directory, arguments.mods, arguments.small_files,
+                                arguments.large_files, arguments.large_size)
+        repository = Repository.initialize(directory, 'benchmark', 'file://benchmark')
+
+        start = time.perf_counter()
+        result = repository.build_index(arguments.workers, incremental=False)
+        elapsed = time.perf_counter() - start
+
+        start = time.perf_counter()
+        repository.build_index(arguments.workers)
+        unchanged_elapsed = time.perf_counter() - start
+
+    print('files: {0}, bytes: {1}'.format(result.hashed_files, written))
+    print('elapsed: {0:.3f}s, throughput: {1:.1f} MB/s, {2:.0f} files/s'.format(
+        elapsed, written / elapsed / 1e6, result.hashed_files / elapsed))
+    print('incremental re-index without changes: {0:.3f}s'.format(unchanged_elapsed))
+
+
+if __name__ == '__main__':
+    main()
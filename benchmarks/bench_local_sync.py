@@ -0,0 +1,100 @@
+# --------------------------------License Notice----------------------------------
+# CNTOSync - Carpe Noctem Tactical Operations ArmA3 mod synchronization tool
+# Copyright (C) 2018 Carpe Noctem - Tactical Operations (aka. CNTO) (contact@carpenoctem.co)
+#
+# The authors of this software are listed in the AUTHORS file at the
+# root of this software's source code tree.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# All rights reserved.
+# --------------------------------License Notice----------------------------------
+
+"""Compare building a repository from a local master by copying through Python or with sync.
+
+``copy`` synchronizes with reflinks or in-kernel copies, ``link`` with hard links. Disk usage
+is measured from the free space of the filesystem holding the temporary directory. Run with
+``python -m benchmarks.bench_local_sync [--mods COUNT] [--large-size BYTES]`` from the source
+tree root.
+"""
+
+import argparse
+import os
+import pathlib
+import tempfile
+import time
+
+from cntosync import configuration
+from cntosync.filesync import Repository
+
+from .bench_indexer import generate_tree
+
+
+def python_copy(source: str, target: str) -> None:
+    """Copy the files under `source` to `target` by reading and writing them in Python."""
+    for root, _, files in os.walk(source):
+        relative = os.path.relpath(root, source)
+        if relative.split(os.sep)[0] == configuration.index_directory:
+            continue
+        os.makedirs(os.path.join(target, relative), exist_ok=True)
+        for name in files:
+            with open(os.path.join(root, name), mode='rb') as input_stream, \
+                    open(os.path.join(target, relative, name), mode='wb') as output_stream:
+                while True:
+                    data = input_stream.read(configuration.read_chunk_size)
+                    if not data:
+                        break
+                    output_stream.write(data)
+
+
+def free_space(path: str) -> int:
+    """Return the number of bytes available on the filesystem holding `path`."""
+    stat = os.statvfs(path)
+    return stat.f_bavail * stat.f_frsize
+
+
+def main() -> None:
+    """Generate a master repository and time building copies of it."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--mods', type=int, default=8)
+    parser.add_argument('--small-files', type=int, default=200)
+    parser.add_argument('--large-files', type=int, default=4)
+    parser.add_argument('--large-size', type=int, default=32 * 1024 * 1024)
+    arguments = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        master = Repository.initialize(os.path.join(directory, 'master'), 'master',
+                                       'http://localhost/')
+        written = generate_tree(master.directory, arguments.mods, arguments.small_files,
+                                arguments.large_files, arguments.large_size)
+        master.build_index()
+        url = pathlib.Path(master.directory).as_uri()
+        print('master: {0:.1f} MiB'.format(written / 2 ** 20))
+
+        for mode in ('python', 'copy', 'link'):
+            target = os.path.join(directory, mode)
+            os.sync()
+            free = free_space(directory)
+            start = time.perf_counter()
+            if mode == 'python':
+                python_copy(master.directory, target)
+            else:
+                Repository.initialize(target, mode, url).sync(link=mode == 'link')
+            elapsed = time.perf_counter() - start
+            os.sync()
+            print('{0:>7}: {1:6.2f}s, {2:7.1f} MiB of disk space used'.format(
+                mode, elapsed, (free - free_space(directory)) / 2 ** 20))
+
+
+if __name__ == '__main__':
+    main()
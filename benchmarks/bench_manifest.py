@@ -0,0 +1,86 @@
+# --------------------------------License Notice----------------------------------
+# CNTOSync - Carpe Noctem Tactical Operations ArmA3 mod synchronization tool
+# Copyright (C) 2018 Carpe Noctem - Tactical Operations (aka. CNTO) (contact@carpenoctem.co)
+#
+# The authors of this software are listed in the AUTHORS file at the
+# root of this software's source code tree.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# All rights reserved.
+# --------------------------------License Notice----------------------------------
+
+"""Compare manifest open time and lookup latency with decoding a plain msgpack index.
+
+Run with ``python -m benchmarks.bench_manifest [--files COUNT]`` from the source tree root.
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from cntosync.manifest import Manifest, write_manifest
+
+import msgpack
+
+from .bench_plan import generate_manifests
+
+
+def main() -> None:
+    """Write both index formats and time opening them and looking up random paths."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--files', type=int, default=100000)
+    parser.add_argument('--lookups', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    arguments = parser.parse_args()
+
+    entries, _ = generate_manifests(arguments.files, 0)
+    paths = [entry[0] for entry in random.Random(0).choices(entries, k=arguments.lookups)]
+    with tempfile.TemporaryDirectory() as directory:
+        manifest_path = os.path.join(directory, 'manifest')
+        msgpack_path = os.path.join(directory, 'index')
+        write_manifest(manifest_path, entries)
+        with open(msgpack_path, mode='wb') as stream:
+            stream.write(msgpack.packb({'files': entries}, use_bin_type=True))
+
+        start = time.perf_counter()
+        for _ in range(arguments.repeat):
+            with open(msgpack_path, mode='rb') as stream:
+                index = {entry[0]: entry for entry in
+                         msgpack.unpackb(stream.read(), raw=False)['files']}
+        decode_time = (time.perf_counter() - start) / arguments.repeat
+        start = time.perf_counter()
+        for path in paths:
+            index[path]
+        dict_time = (time.perf_counter() - start) / len(paths)
+
+        start = time.perf_counter()
+        for _ in range(arguments.repeat):
+            Manifest(manifest_path).close()
+        open_time = (time.perf_counter() - start) / arguments.repeat
+        with Manifest(manifest_path) as manifest:
+            start = time.perf_counter()
+            for path in paths:
+                manifest.get(path)
+            lookup_time = (time.perf_counter() - start) / len(paths)
+
+    print('entries: {0}'.format(len(entries)))
+    print('msgpack: open {0:.1f}ms, lookup {1:.2f}us'.format(decode_time * 1e3, dict_time * 1e6))
+    print('manifest: open {0:.1f}us, lookup {1:.2f}us'.format(
+        open_time * 1e6, lookup_time * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+# --------------------------------License Notice----------------------------------
+# CNTOSync - Carpe Noctem Tactical Operations ArmA3 mod synchronization tool
+# Copyright (C) 2018 Carpe Noctem - Tactical Operations (aka. CNTO) (contact@carpenoctem.co)
+#
+# The authors of this software are listed in the AUTHORS file at the
+# root of this software's source code tree.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# All rights reserved.
+# --------------------------------License Notice----------------------------------
+
+"""Measure downloads spread across mirrors of different speeds, one of them stalling.
+
+The same directory is served by simulated mirrors with different round-trip times and link
+rates, and downloaded from the slowest one alone, from the fastest one alone, and from all
+of them with the slowest one given as the repository URL. A last run makes the fastest mirror
+stall midway through its responses. Run with
+``python -m benchmarks.bench_mirrors [--files COUNT] [--size BYTES]`` from the source tree
+root.
+"""
+
+import argparse
+import os
+import tempfile
+import time
+from typing import Dict, List
+
+from cntosync import configuration
+from cntosync.download import DownloadJob, Downloader, file_url
+
+from tests.httpserver import serve
+
+
+def main() -> None:
+    """Serve generated files from simulated mirrors and time their download."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--files', type=int, default=16)
+    parser.add_argument('--size', type=int, default=2 * 1024 * 1024)
+    parser.add_argument('--segment-size', type=int, default=256 * 1024)
+    parser.add_argument('--workers', type=int, default=8)
+    arguments = parser.parse_args()
+    configuration.mirror_stall_timeout = 1.0
+
+    with tempfile.TemporaryDirectory() as directory:
+        remote = os.path.join(directory, 'remote')
+        os.makedirs(os.path.join(remote, configuration.index_directory))
+        with open(os.path.join(remote, configuration.index_directory,
+                               configuration.index_file), mode='wb') as stream:
+            stream.write(b'index')
+        names = ['file{0:03d}.pbo'.format(number) for number in range(arguments.files)]
+        for name in names:
+            with open(os.path.join(remote, name), mode='wb') as stream:
+                stream.write(os.urandom(arguments.size))
+
+        with serve(remote, delay=0.15, rate=2 * 2 ** 20) as slow, \
+                serve(remote, delay=0.05, rate=8 * 2 ** 20) as medium, \
+                serve(remote, delay=0.02, rate=16 * 2 ** 20) as fast:
+            runs: Dict[str, List[str]] = {
+                'slow only': [slow.url], 'fast only': [fast.url],
+                'mirrors': [slow.url, medium.url, fast.url],
+                'stalling': [slow.url, medium.url, fast.url]}
+            for mode, urls in runs.items():
+                fast.stall_after = 64 * 1024 if mode == 'stalling' else None
+                local = os.path.join(directory, mode.replace(' ', '-'))
+                jobs = [DownloadJob(file_url(urls[0], name), os.path.join(local, name),
+                                    arguments.size) for name in names]
+                completed: Dict[str, float] = {}
+                start = time.perf_counter()
+                with Downloader(arguments.workers, segment_size=arguments.segment_size,
+                                mirrors=urls) as downloader:
+                    downloader.probe(configuration.index_directory + '/' +
+                                     configuration.index_file)
+                    downloader.download(jobs, on_segment=lambda job, offset, length:
+                                        completed.__setitem__(job.path, time.perf_counter()))
+                    served = '' if downloader.mirrors is None else ', requests per mirror ' + \
+                        '/'.join(str(mirror.requests) for mirror in downloader.mirrors.mirrors)
+                elapsed = time.perf_counter() - start
+                times = sorted(completed[job.path] - start for job in jobs)
+                print('{0:>9}: {1:6.2f}s, median file {2:5.2f}s, last file {3:5.2f}s, '
+                      '{4:5.1f} MiB/s{5}'.format(
+                          mode, elapsed, times[len(times) // 2], times[-1],
+                          arguments.files * arguments.size / elapsed / 2 ** 20, served))
+            fast.stall_after = None
+
+
+if __name__ == '__main__':
+    main()
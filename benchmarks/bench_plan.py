@@ -0,0 +1,116 @@
+# --------------------------------License Notice----------------------------------
+# CNTOSync - Carpe Noctem Tactical Operations ArmA3 mod synchronization tool
+# Copyright (C) 2018 Carpe Noctem - Tactical Operations (aka. CNTO) (contact@carpenoctem.co)
+#
+# The authors of this software are listed in the AUTHORS file at the
+# root of this software's source code tree.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# All rights reserved.
+# --------------------------------License Notice----------------------------------
+
+"""Measure sync planning on large synthetic manifests.
+
+Run with ``python -m benchmarks.bench_plan [--files COUNT]`` from the source tree root.
+Manifests are planned from memory, then streamed from manifest files, for which the peak
+memory allocated while planning is reported as well.
+"""
+
+import argparse
+import hashlib
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+from typing import Any, List, Tuple
+
+from cntosync import manifest
+from cntosync.plan import SyncPlan, plan_sync
+
+Manifest = List[List[Any]]
+
+
+def digest(number: int) -> bytes:
+    """Return a digest standing for the content numbered `number`."""
+    return hashlib.blake2b(number.to_bytes(8, 'little', signed=True), digest_size=20).digest()
+
+
+def generate_manifests(files: int, changes: float, seed: int = 0) -> Tuple[Manifest, Manifest]:
+    """Return local and remote manifests of `files` entries, a fraction of them changed."""
+    generator = random.Random(seed)
+    local: Manifest = [
+        ['@mod{0:03d}/addons/file{1:06d}.pbo'.format(number % 200, number),
+         generator.randrange(1 << 24), 0, digest(number)] for number in range(files)]
+    local.sort()
+    remote: Manifest = []
+    for item in local:
+        draw = generator.random()
+        if draw < changes / 4:
+            continue
+        elif draw < changes / 2:
+            remote.append([item[0], item[1], 1, digest(-1 - len(remote))])
+        elif draw < changes * 3 / 4:
+            remote.append(['@moved/' + item[0], item[1], item[2], item[3]])
+        elif draw < changes:
+            remote.append([item[0] + '.new', item[1], item[2], digest(files + len(remote))])
+            remote.append(item)
+        else:
+            remote.append(item)
+    remote.sort()
+
+    return local, remote
+
+
+def report(label: str, entries: int, elapsed: float, plan: SyncPlan) -> None:
+    """Print the outcome of one planning run."""
+    print('{0}: entries: {1}, elapsed: {2:.3f}s, to transfer: {3} files, {4:.1f} MB, '
+          'renamed or moved: {5}, deleted: {6}'.format(
+              label, entries, elapsed, len(plan.transfers), plan.bytes_to_transfer / 1e6,
+              len(plan.renamed) + len(plan.moved), len(plan.deleted)))
+
+
+def main() -> None:
+    """Plan the synchronization of generated manifests and report the elapsed time."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--files', type=int, default=150000)
+    parser.add_argument('--changes', type=float, default=0.1)
+    arguments = parser.parse_args()
+
+    local, remote = generate_manifests(arguments.files, arguments.changes)
+    start = time.perf_counter()
+    plan = plan_sync(local, remote)
+    report('in memory', len(remote), time.perf_counter() - start, plan)
+
+    with tempfile.TemporaryDirectory() as directory:
+        local_path = os.path.join(directory, 'local')
+        remote_path = os.path.join(directory, 'remote')
+        manifest.write_manifest(local_path, local)
+        manifest.write_manifest(remote_path, remote)
+        del local, remote
+        with manifest.Manifest(local_path) as local_manifest, \
+                manifest.Manifest(remote_path) as remote_manifest:
+            start = time.perf_counter()
+            plan = plan_sync(local_manifest, remote_manifest)
+            report('streamed', len(remote_manifest), time.perf_counter() - start, plan)
+            del plan
+            tracemalloc.start()
+            plan_sync(local_manifest, remote_manifest)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        print('peak memory allocated while streaming: {0:.1f} MB'.format(peak / 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+# --------------------------------License Notice----------------------------------
+# CNTOSync - Carpe Noctem Tactical Operations ArmA3 mod synchronization tool
+# Copyright (C) 2018 Carpe Noctem - Tactical Operations (aka. CNTO) (contact@carpenoctem.co)
+#
+# The authors of this software are listed in the AUTHORS file at the
+# root of this software's source code tree.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# All rights reserved.
+# --------------------------------License Notice----------------------------------
+
+"""Time the verification modes of `Repository.verify` on a synthetic repository.
+
+File pages are evicted from the page cache before each run when the platform allows it, so
+that reads hit the disk as they would after a reboot. Run with
+``python -m benchmarks.bench_verify [--large-size BYTES]`` from the source tree root.
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from cntosync import verify
+from cntosync.filesync import Repository
+
+from .bench_indexer import generate_tree
+
+
+def evict(directory: str) -> None:
+    """Ask the kernel to drop the cached pages of every file under `directory`."""
+    if not hasattr(os, 'posix_fadvise'):
+        return
+    for root, _, files in os.walk(directory):
+        for name in files:
+            descriptor = os.open(os.path.join(root, name), os.O_RDONLY)
+            try:
+                os.fdatasync(descriptor)
+                os.posix_fadvise(descriptor, 0, 0, os.POSIX_FADV_DONTNEED)
+            finally:
+                os.close(descriptor)
+
+
+def main() -> None:
+    """Generate and index a tree, then verify it in every mode."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--mods', type=int, default=4)
+    parser.add_argument('--small-files', type=int, default=100)
+    parser.add_argument('--large-files', type=int, default=4)
+    parser.add_argument('--large-size', type=int, default=64 * 1024 * 1024)
+    parser.add_argument('--workers', type=int, default=None)
+    arguments = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        repository = Repository.initialize(directory, 'benchmark', 'http://localhost/')
+        written = generate_tree(directory, arguments.mods, arguments.small_files,
+                                arguments.large_files, arguments.large_size)
+        repository.build_index(arguments.workers)
+        print('repository: {0:.1f} MiB'.format(written / 2 ** 20))
+
+        for mode in verify.modes:
+            evict(directory)
+            start = time.perf_counter()
+            result = repository.verify(mode, arguments.workers)
+            elapsed = time.perf_counter() - start
+            print('{0:>8}: {1:7.3f}s, {2:8.1f} MiB read, ok: {3}'.format(
+                mode, elapsed, result.checked_bytes / 2 ** 20, result.ok))
+
+
+if __name__ == '__main__':
+    main()
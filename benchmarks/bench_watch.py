@@ -0,0 +1,102 @@
+# --------------------------------License Notice----------------------------------
+# CNTOSync - Carpe Noctem Tactical Operations ArmA3 mod synchronization tool
+# Copyright (C) 2018 Carpe Noctem - Tactical Operations (aka. CNTO) (contact@carpenoctem.co)
+#
+# The authors of this software are listed in the AUTHORS file at the
+# root of this software's source code tree.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# All rights reserved.
+# --------------------------------License Notice----------------------------------
+
+"""Measure how fast and how cheaply the watcher keeps a repository index up to date.
+
+A mod of many files is dropped into a large indexed repository. The benchmark times a
+cron-like incremental re-index of the whole tree against an update limited to the paths
+reported by the watcher, then measures the CPU time the watcher uses while idle. Run with
+``python -m benchmarks.bench_watch [--files COUNT]`` from the source tree root.
+"""
+
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+from cntosync import watcher
+from cntosync.filesync import Repository
+
+from .bench_indexer import generate_tree
+
+
+def drop_mod(directory: str, name: str, files: int) -> None:
+    """Copy a mod of `files` small files into `directory`."""
+    addons = os.path.join(directory, name, 'addons')
+    os.makedirs(addons)
+    for number in range(files):
+        with open(os.path.join(addons, 'file{0:04d}.pbo'.format(number)), 'wb') as stream:
+            stream.write(os.urandom(4096))
+
+
+def idle_cpu_time(directory: str, polling: bool, duration: float) -> float:
+    """Return the CPU time used by watching `directory` without changes for `duration`."""
+    stop = threading.Event()
+    thread = threading.Thread(target=watcher.watch,
+                              args=(directory, lambda changes: None, stop, polling))
+    thread.start()
+    time.sleep(1)
+    start = time.process_time()
+    time.sleep(duration)
+    used = time.process_time() - start
+    stop.set()
+    thread.join()
+
+    return used
+
+
+def main() -> None:
+    """Generate a repository, drop a mod into it and compare update strategies."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--mods', type=int, default=50)
+    parser.add_argument('--files', type=int, default=1000, help='files per existing mod')
+    parser.add_argument('--mod-files', type=int, default=500, help='files of the dropped mod')
+    parser.add_argument('--idle', type=float, default=15.0, help='idle measurement duration')
+    arguments = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        repository = Repository.initialize(directory, 'benchmark', 'http://localhost/')
+        generate_tree(directory, arguments.mods, arguments.files, 0, 0)
+        repository.build_index()
+        print('repository: {0} files'.format(arguments.mods * arguments.files))
+
+        drop_mod(directory, '@dropped', arguments.mod_files)
+        start = time.perf_counter()
+        result = repository.build_index(changed=['@dropped'])
+        print('watched update: {0:.3f}s, {1} files added'.format(
+            time.perf_counter() - start, len(result.added)))
+
+        drop_mod(directory, '@cron', arguments.mod_files)
+        start = time.perf_counter()
+        result = repository.build_index()
+        print('full re-index:  {0:.3f}s, {1} files added'.format(
+            time.perf_counter() - start, len(result.added)))
+
+        for polling in (False, True):
+            print('idle {0}: {1:.3f}s CPU over {2:.0f}s'.format(
+                'polling' if polling else 'inotify',
+                idle_cpu_time(directory, polling, arguments.idle), arguments.idle))
+
+
+if __name__ == '__main__':
+    main()
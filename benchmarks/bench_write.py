@@ -0,0 +1,86 @@
+# --------------------------------License Notice----------------------------------
+# CNTOSync - Carpe Noctem Tactical Operations ArmA3 mod synchronization tool
+# Copyright (C) 2018 Carpe Noctem - Tactical Operations (aka. CNTO) (contact@carpenoctem.co)
+#
+# The authors of this software are listed in the AUTHORS file at the
+# root of this software's source code tree.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# All rights reserved.
+# --------------------------------License Notice----------------------------------
+
+"""Compare the write throughput of small files downloaded one by one and through the writer.
+
+A tree of small files is served over HTTP and downloaded into empty directories, once with
+every file preallocated, written, flushed and renamed on its own as larger files are, and
+once through the batched writer stage. Run with
+``python -m benchmarks.bench_write [--files COUNT] [--size BYTES]`` from the source tree
+root, with the temporary directory on the disk to measure, for instance
+``TMPDIR=/mnt/hdd``.
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from cntosync import configuration
+from cntosync import indexer
+from cntosync.download import Downloader
+from cntosync.journal import TransferJournal
+from cntosync.transfer import transfer_files
+
+from tests.httpserver import serve
+
+
+def main() -> None:
+    """Serve generated small files and time their transfer with and without the writer."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--files', type=int, default=2000)
+    parser.add_argument('--size', type=int, default=4096)
+    parser.add_argument('--mods', type=int, default=8)
+    parser.add_argument('--workers', type=int, default=16)
+    arguments = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        remote = os.path.join(directory, 'remote')
+        for number in range(arguments.files):
+            path = os.path.join(remote, '@mod{0:03d}'.format(number % arguments.mods),
+                                'addons', 'file{0:05d}.sqf'.format(number))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, mode='wb') as stream:
+                stream.write(os.urandom(arguments.size))
+        entries = indexer.build(remote).entries
+        batched_write_size = configuration.batched_write_size
+
+        with serve(remote) as server:
+            for mode in ('per-file', 'batched'):
+                configuration.batched_write_size = \
+                    0 if mode == 'per-file' else batched_write_size
+                local = os.path.join(directory, mode)
+                journal = TransferJournal(os.path.join(local, configuration.index_directory,
+                                                       configuration.journal_file))
+                os.sync()
+                start = time.perf_counter()
+                with Downloader(arguments.workers) as downloader:
+                    transfer_files(local, server.url, entries, journal, downloader)
+                elapsed = time.perf_counter() - start
+                print('{0:>8}: {1:6.2f}s, {2:7.0f} files/s, {3:6.2f} MiB/s'.format(
+                    mode, elapsed, len(entries) / elapsed,
+                    len(entries) * arguments.size / elapsed / 2 ** 20))
+        configuration.batched_write_size = batched_write_size
+
+
+if __name__ == '__main__':
+    main()
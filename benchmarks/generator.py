@@ -0,0 +1,189 @@
+# --------------------------------License Notice----------------------------------
+# CNTOSync - Carpe Noctem Tactical Operations ArmA3 mod synchronization tool
+# Copyright (C) 2018 Carpe Noctem - Tactical Operations (aka. CNTO) (contact@carpenoctem.co)
+#
+# The authors of this software are listed in the AUTHORS file at the
+# root of this software's source code tree.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# All rights reserved.
+# --------------------------------License Notice----------------------------------
+
+"""Generate deterministic ArmA-like repository trees for benchmarks.
+
+Every mod holds ``mod.cpp`` and ``meta.cpp`` configs, a key, small PBOs of varied sizes,
+half of them text-like and compressible, each signed with a ``.bisign`` file, and large
+PBOs of random data. Near-duplicate mods are copies of other mods with a few files changed
+and added, as forks and versions of the same mod are found in real repositories. The same
+seed and parameters always produce the same tree, so that results are comparable between
+commits.
+"""
+
+import os
+import random
+import shutil
+from typing import List, NamedTuple
+
+_CHUNK_SIZE = 1024 * 1024
+_WORDS = ('class', 'CfgPatches', 'CfgVehicles', 'units', 'weapons', 'requiredAddons',
+          'scope', 'displayName', 'model', 'author', 'hiddenSelections', 'magazines',
+          'requiredVersion', 'faction', 'side', 'editorCategory', 'armor', 'maxSpeed')
+
+
+class TreeStats(NamedTuple):
+    """Number of files and bytes of a generated tree."""
+
+    files: int
+    size: int
+
+
+def random_bytes(generator: random.Random, size: int) -> bytes:
+    """Return `size` bytes drawn from `generator`."""
+    return generator.getrandbits(8 * size).to_bytes(size, 'little') if size else b''
+
+
+def config_text(generator: random.Random, size: int) -> bytes:
+    """Return about `size` bytes of config-like text drawn from `generator`."""
+    lines: List[str] = []
+    written = 0
+    while written < size:
+        line = '{0} {1}{2} = {3};\n'.format(
+            generator.choice(_WORDS), generator.choice(_WORDS), generator.randrange(1000),
+            generator.randrange(10 ** 6))
+        lines.append(line)
+        written += len(line)
+    return ''.join(lines).encode()[:size]
+
+
+def write_random_file(path: str, generator: random.Random, size: int) -> None:
+    """Write `size` random bytes drawn from `generator` to `path`."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, mode='wb') as stream:
+        for offset in range(0, size, _CHUNK_SIZE):
+            stream.write(random_bytes(generator, min(_CHUNK_SIZE, size - offset)))
+
+
+def _write(path: str, data: bytes) -> int:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, mode='wb') as stream:
+        stream.write(data)
+    return len(data)
+
+
+def small_file_size(generator: random.Random) -> int:
+    """Return the size of a small PBO, most of them a few KiB and some up to 4 MiB."""
+    return min(int(generator.lognormvariate(10, 1.5)), 4 * 1024 * 1024)
+
+
+def generate_mod(directory: str, name: str, generator: random.Random, small_files: int,
+                 large_files: int, large_size: int) -> TreeStats:
+    """Write the mod `name` into `directory` and return its statistics."""
+    mod = os.path.join(directory, name)
+    written = _write(os.path.join(mod, 'mod.cpp'), config_text(generator, 600))
+    written += _write(os.path.join(mod, 'meta.cpp'), config_text(generator, 200))
+    written += _write(os.path.join(mod, 'keys', name[1:] + '.bikey'),
+                      random_bytes(generator, 150))
+    files = 3
+    for number in range(small_files):
+        path = os.path.join(mod, 'addons', '{0}_{1:04d}.pbo'.format(name[1:], number))
+        size = small_file_size(generator)
+        data = config_text(generator, size) if number % 2 else random_bytes(generator, size)
+        written += _write(path, data)
+        written += _write('{0}.{1}.bisign'.format(path, name[1:]), random_bytes(generator, 570))
+        files += 2
+    for number in range(large_files):
+        path = os.path.join(mod, 'addons', '{0}_data{1:02d}.pbo'.format(name[1:], number))
+        write_random_file(path, generator, large_size)
+        written += large_size
+        files += 1
+
+    return TreeStats(files, written)
+
+
+def modify_file(path: str, generator: random.Random, length: int = 4096) -> None:
+    """Overwrite `length` bytes of `path` at a position drawn from `generator`."""
+    size = os.path.getsize(path)
+    with open(path, mode='r+b') as stream:
+        stream.seek(generator.randrange(max(size - length, 0) + 1))
+        stream.write(random_bytes(generator, min(length, size)))
+
+
+def fork_mod(directory: str, source: str, name: str, generator: random.Random) -> TreeStats:
+    """Copy the mod `source` as `name` with about a tenth of its PBOs changed and one added."""
+    target = os.path.join(directory, name)
+    shutil.copytree(os.path.join(directory, source), target)
+    pbos = sorted(path for path in os.listdir(os.path.join(target, 'addons'))
+                  if path.endswith('.pbo'))
+    for path in pbos[::10]:
+        modify_file(os.path.join(target, 'addons', path), generator)
+    _write(os.path.join(target, 'addons', name[1:] + '_patch.pbo'),
+           random_bytes(generator, small_file_size(generator)))
+    files = written = 0
+    for root, _, names in os.walk(target):
+        for path in names:
+            written += os.path.getsize(os.path.join(root, path))
+            files += 1
+
+    return TreeStats(files, written)
+
+
+def generate_repository(directory: str, seed: int = 0, mods: int = 8, small_files: int = 100,
+                        large_files: int = 1, large_size: int = 64 * 1024 * 1024,
+                        duplicate_mods: int = 2) -> TreeStats:
+    """Fill `directory` with `mods` mods and `duplicate_mods` near-duplicates of them.
+
+    Each mod has `small_files` small PBOs and `large_files` PBOs of `large_size` bytes.
+    """
+    generator = random.Random(seed)
+    files = written = 0
+    for mod in range(mods):
+        stats = generate_mod(directory, '@mod{0:03d}'.format(mod), generator, small_files,
+                             large_files, large_size)
+        files += stats.files
+        written += stats.size
+    for fork in range(min(duplicate_mods, mods)):
+        stats = fork_mod(directory, '@mod{0:03d}'.format(fork), '@mod{0:03d}_fork'.format(fork),
+                         generator)
+        files += stats.files
+        written += stats.size
+
+    return TreeStats(files, written)
+
+
+def update_repository(directory: str, seed: int, fraction: float = 0.05) -> int:
+    """Change about `fraction` of the mod files under `directory` as a mod update would.
+
+    Changed small files are rewritten, large ones get a region overwritten; one file is
+    removed and one added per changed mod. Return the number of files changed.
+    """
+    generator = random.Random(seed)
+    changed = 0
+    for mod in sorted(name for name in os.listdir(directory) if name.startswith('@')):
+        addons = os.path.join(directory, mod, 'addons')
+        paths = sorted(os.listdir(addons))
+        updated = [path for path in paths if generator.random() < fraction]
+        if not updated:
+            continue
+        for path in updated:
+            full_path = os.path.join(addons, path)
+            if os.path.getsize(full_path) > 4 * 1024 * 1024:
+                modify_file(full_path, generator, _CHUNK_SIZE)
+            else:
+                _write(full_path, random_bytes(generator, small_file_size(generator)))
+        os.remove(os.path.join(addons, paths[generator.randrange(len(paths))]))
+        _write(os.path.join(addons, '{0}_update{1}.pbo'.format(mod[1:], seed)),
+               config_text(generator, small_file_size(generator)))
+        changed += len(updated) + 2
+
+    return changed
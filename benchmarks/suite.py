@@ -0,0 +1,196 @@
+# --------------------------------License Notice----------------------------------
+# CNTOSync - Carpe Noctem Tactical Operations ArmA3 mod synchronization tool
+# Copyright (C) 2018 Carpe Noctem - Tactical Operations (aka. CNTO) (contact@carpenoctem.co)
+#
+# The authors of this software are listed in the AUTHORS file at the
+# root of this software's source code tree.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# All rights reserved.
+# --------------------------------License Notice----------------------------------
+
+"""Time the main operations of CNTOSync on a generated repository and record them as JSON.
+
+The suite generates a master repository with :mod:`benchmarks.generator`, then times
+repository initialization, indexing, index loading, diffing, and synchronizing copies of the
+master from the filesystem and over HTTP against a local server, first from scratch then
+after an update of the master. Run with::
+
+  python -m benchmarks.suite [--profile quick|full] [--repeat N] [--output results.json]
+                             [--compare baseline.json]
+
+from the source tree root. The ``full`` profile includes multi-GB PBOs. With ``--repeat``,
+the suite runs several times on fresh trees and the shortest durations are kept, which
+makes results less noisy. Results hold the commit, machine and parameters they were
+measured with, so that runs of different commits on the same hardware can be compared with
+``--compare``.
+"""
+
+import argparse
+import datetime
+import json
+import os
+import pathlib
+import platform
+import subprocess
+import tempfile
+import time
+from typing import Any, Callable, Dict, Optional
+
+from cntosync.filesync import Repository
+from cntosync.publish import publish
+
+from tests.httpserver import serve
+
+from .generator import generate_repository, update_repository
+
+PROFILES: Dict[str, Dict[str, int]] = {
+    'quick': {'mods': 8, 'small_files': 100, 'large_files': 1, 'large_size': 64 * 1024 * 1024,
+              'duplicate_mods': 2},
+    'full': {'mods': 40, 'small_files': 200, 'large_files': 2,
+             'large_size': 2 * 1024 * 1024 * 1024, 'duplicate_mods': 6},
+}
+_REPEATED = 5
+
+
+def git_commit() -> Optional[str]:
+    """Return the commit of the source tree, None outside a git checkout."""
+    try:
+        process = subprocess.run(['git', 'rev-parse', 'HEAD'], stdout=subprocess.PIPE,
+                                 stderr=subprocess.DEVNULL, check=True,
+                                 cwd=os.path.dirname(os.path.abspath(__file__)))
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return process.stdout.decode().strip()
+
+
+def timed(function: Callable[[], Any], repeat: int = 1) -> float:
+    """Return the shortest duration of `repeat` calls to `function`, in seconds."""
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+    return min(durations)
+
+
+def run(directory: str, parameters: Dict[str, int], seed: int,
+        workers: Optional[int]) -> Dict[str, Dict[str, Any]]:
+    """Run every benchmark in `directory` and return their results by name."""
+    results: Dict[str, Dict[str, Any]] = {}
+
+    def record(name: str, seconds: float, **details: Any) -> None:
+        results[name] = dict(seconds=round(seconds, 4), **details)
+        print('{0:>22}: {1:9.4f}s'.format(name, seconds))
+
+    master_directory = os.path.join(directory, 'master')
+    os.makedirs(master_directory)
+    stats = generate_repository(master_directory, seed, **parameters)
+    print('master: {0} files, {1:.1f} MiB'.format(stats.files, stats.size / 2 ** 20))
+
+    counter = iter(range(_REPEATED))
+    record('initialize', timed(lambda: Repository.initialize(
+        os.path.join(directory, 'initialize', str(next(counter))), 'benchmark',
+        'http://localhost/'), _REPEATED))
+    master = Repository.initialize(master_directory, 'master', 'http://localhost/')
+
+    record('index', timed(lambda: master.build_index(workers, incremental=False)),
+           files=stats.files, bytes=stats.size)
+    record('index_unchanged', timed(lambda: master.build_index(workers), _REPEATED))
+
+    def load_index() -> None:
+        with master.open_manifest() as manifest:
+            for entry in manifest:
+                manifest.get(entry.path)
+    record('index_load', timed(load_index, _REPEATED))
+
+    url = pathlib.Path(master.directory).as_uri()
+    local = Repository.initialize(os.path.join(directory, 'local'), 'local', url)
+    record('sync_local', timed(lambda: local.sync(workers)), bytes=stats.size)
+    with serve(master.directory) as server:
+        remote = Repository.initialize(os.path.join(directory, 'http'), 'http', server.url)
+        record('publish', timed(lambda: publish(master, workers)))
+        record('sync_http', timed(lambda: remote.sync(workers)), bytes=stats.size)
+
+        changed = update_repository(master.directory, seed + 1)
+        record('index_update', timed(lambda: master.build_index(workers)), files=changed)
+        with master.open_manifest() as manifest:
+            record('diff', timed(lambda: local.plan_sync(manifest), _REPEATED))
+        record('sync_local_update', timed(lambda: local.sync(workers)), files=changed)
+        publish(master, workers)
+        record('sync_http_update', timed(lambda: remote.sync(workers)), files=changed)
+
+    return results
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any]) -> None:
+    """Print the duration of every benchmark of `results` relative to `baseline`."""
+    print('compared to {0} ({1}):'.format(baseline.get('commit'), baseline.get('date')))
+    if baseline['parameters'] != results['parameters']:
+        print('warning: the baseline was measured with different parameters')
+    if baseline['machine'] != results['machine']:
+        print('warning: the baseline was measured on a different machine')
+    for name, result in results['results'].items():
+        reference = baseline['results'].get(name)
+        if reference is None or not reference['seconds']:
+            continue
+        print('{0:>22}: {1:9.4f}s vs {2:9.4f}s, {3:+6.1f}%'.format(
+            name, result['seconds'], reference['seconds'],
+            (result['seconds'] / reference['seconds'] - 1) * 100))
+
+
+def main() -> None:
+    """Run the suite and record its results."""
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--profile', choices=sorted(PROFILES), default='quick')
+    for name in PROFILES['quick']:
+        parser.add_argument('--' + name.replace('_', '-'), type=int, default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--output', help='file the JSON results are written to')
+    parser.add_argument('--compare', help='JSON results of a previous run to compare with')
+    arguments = parser.parse_args()
+
+    parameters = dict(PROFILES[arguments.profile])
+    for name in parameters:
+        if getattr(arguments, name) is not None:
+            parameters[name] = getattr(arguments, name)
+    best: Dict[str, Dict[str, Any]] = {}
+    for _ in range(arguments.repeat):
+        with tempfile.TemporaryDirectory() as directory:
+            for name, result in run(directory, parameters, arguments.seed,
+                                    arguments.workers).items():
+                if name not in best or result['seconds'] < best[name]['seconds']:
+                    best[name] = result
+    results = {
+        'commit': git_commit(),
+        'date': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'machine': {'platform': platform.platform(), 'python': platform.python_version(),
+                    'processor': platform.processor(), 'cpus': os.cpu_count()},
+        'parameters': dict(parameters, seed=arguments.seed, workers=arguments.workers),
+        'results': best,
+    }
+
+    if arguments.output:
+        with open(arguments.output, mode='w') as stream:
+            json.dump(results, stream, indent=2, sort_keys=True)
+    if arguments.compare:
+        with open(arguments.compare) as stream:
+            compare(results, json.load(stream))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+# --------------------------------License Notice----------------------------------
+# CNTOSync - Carpe Noctem Tactical Operations ArmA3 mod synchronization tool
+# Copyright (C) 2018 Carpe Noctem - Tactical Operations (aka. CNTO) (contact@carpenoctem.co)
+#
+# The authors of this software are listed in the AUTHORS file at the
+# root of this software's source code tree.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# All rights reserved.
+# --------------------------------License Notice----------------------------------
+
+"""Drive repositories from an asyncio event loop without blocking it.
+
+Front-ends such as a GUI or a launcher cannot afford to wait on disk or network I/O in their
+event loop. :class:`AsyncRepository` runs each operation of a :class:`Repository` on a thread
+of the loop executor and returns an :class:`Operation`: awaiting it gives the result of the
+operation, iterating over it asynchronously gives its progress.
+
+An operation is cancelled with :meth:`Operation.cancel` or by cancelling the task awaiting
+it. Workers check the stop event between pieces of data and batches of files, so that they
+stop within a fraction of a second, and the transfer journal is flushed before the awaiting
+task gets :class:`asyncio.CancelledError`: the next synchronization resumes where this one
+stopped.
+"""
+
+import asyncio
+import functools
+import threading
+from typing import Any, AsyncIterator, Callable, Collection, Generator, Generic, Iterable, \
+    Optional, Sequence, TypeVar
+
+from . import bandwidth
+from . import configuration
+from . import exceptions
+from . import indexer
+from . import plan
+from . import transfer
+from . import verify
+from .filesync import Repository
+
+_Result = TypeVar('_Result')
+
+
+async def _run(function: Callable[..., _Result], *args: Any, **kwargs: Any) -> _Result:
+    """Return ``function(*args, **kwargs)`` called on a thread of the loop executor."""
+    return await asyncio.get_event_loop().run_in_executor(
+        None, functools.partial(function, *args, **kwargs))
+
+
+class Operation(Generic[_Result]):
+    """An operation running on a thread of the loop executor.
+
+    Iterating asynchronously over the operation yields the number of bytes processed so far,
+    at most every `configuration.progress_interval` seconds and once more when it ends.
+    """
+
+    def __init__(self, function: Callable[..., _Result]) -> None:
+        """Start ``function(progress=callback, stop=event)`` in the running event loop."""
+        self.stop = threading.Event()
+        self.done = 0
+        self._lock = threading.Lock()
+        self._future: 'asyncio.Future[_Result]' = asyncio.get_event_loop().run_in_executor(
+            None, functools.partial(function, progress=self._progress, stop=self.stop))
+
+    def _progress(self, size: int) -> None:
+        with self._lock:
+            self.done += size
+
+    def cancel(self) -> None:
+        """Ask the operation to stop, awaiting it raises :class:`asyncio.CancelledError`."""
+        self.stop.set()
+
+    async def result(self) -> _Result:
+        """Wait for the operation to complete and return its result.
+
+        When the awaiting task is cancelled, the operation is cancelled and waited for.
+        """
+        try:
+            return await asyncio.shield(self._future)
+        except asyncio.CancelledError:
+            self.stop.set()
+            await asyncio.wait([self._future])
+            # Retrieve the exception the workers stopped with, the cancellation is raised.
+            if not self._future.cancelled():
+                self._future.exception()
+            raise
+        except exceptions.Cancelled:
+            raise asyncio.CancelledError()
+
+    def __await__(self) -> Generator[Any, None, _Result]:
+        """Wait for the result of the operation, see :meth:`result`."""
+        return self.result().__await__()
+
+    async def __aiter__(self) -> AsyncIterator[int]:
+        """Yield the number of bytes processed whenever it changed, until the operation ends."""
+        reported = None
+        while True:
+            finished = self._future.done()
+            done = self.done
+            if done != reported:
+                reported = done
+                yield done
+            if finished:
+                return
+            await asyncio.wait([self._future], timeout=configuration.progress_interval)
+
+
+class AsyncRepository(object):
+    """Run the operations of a :class:`Repository` without blocking the event loop.
+
+    Operations start when their method is called, which must happen in the event loop.
+    """
+
+    def __init__(self, repository: Repository) -> None:
+        """Wrap `repository`, see :meth:`open_repository` and :meth:`initialize` to get one."""
+        self.repository = repository
+
+    @classmethod
+    async def open_repository(cls, directory: str) -> 'AsyncRepository':
+        """Open the repository in `directory`, loading its index file.
+
+        :class:`FileNotFoundError` is raised if `directory` contains no repository, and
+        :class:`exceptions.UnsupportedVersion` if it was written by an incompatible version.
+        """
+        repository = Repository(directory)
+        await _run(lambda: repository.metadata)
+
+        return cls(repository)
+
+    @classmethod
+    async def initialize(cls, directory: str, display_name: str, url: str,
+                         overwrite: bool = False, subscriptions: Optional[Iterable[str]] = None,
+                         mirrors: Sequence[str] = ()) -> 'AsyncRepository':
+        """Create a repository in `directory`, see :meth:`Repository.initialize`."""
+        return cls(await _run(Repository.initialize, directory, display_name, url, overwrite,
+                              subscriptions, mirrors))
+
+    def build_index(self, workers: Optional[int] = None, incremental: bool = True,
+                    content_defined_chunking: bool = False) -> Operation[indexer.IndexResult]:
+        """Index the repository, progress counting hashed bytes.
+
+        See :meth:`Repository.build_index`.
+        """
+        return Operation(functools.partial(self.repository.build_index, workers, incremental,
+                                           content_defined_chunking))
+
+    async def plan_sync(self, remote_manifest: Iterable[Sequence[Any]]) -> plan.SyncPlan:
+        """Return the operations synchronizing the index with `remote_manifest`.
+
+        See :meth:`Repository.plan_sync`.
+        """
+        return await _run(self.repository.plan_sync, remote_manifest)
+
+    def sync(self, workers: Optional[int] = None, link: bool = False,
+             bucket: Optional[bandwidth.TokenBucket] = None,
+             optional_mods: Collection[str] = ()) -> Operation[transfer.TransferResult]:
+        """Synchronize the repository, progress counting received bytes.
+
+        See :meth:`Repository.sync`.
+        """
+        return Operation(functools.partial(self.repository.sync, workers, link=link,
+                                           bucket=bucket, optional_mods=optional_mods))
+
+    def verify(self, mode: str = 'quick',
+               workers: Optional[int] = None) -> Operation[verify.VerifyResult]:
+        """Check the files of the repository, progress counting read bytes.
+
+        See :meth:`Repository.verify`.
+        """
+        return Operation(functools.partial(self.repository.verify, mode, workers))
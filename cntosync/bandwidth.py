@@ -0,0 +1,118 @@
+# --------------------------------License Notice----------------------------------
+# CNTOSync - Carpe Noctem Tactical Operations ArmA3 mod synchronization tool
+# Copyright (C) 2018 Carpe Noctem - Tactical Operations (aka. CNTO) (contact@carpenoctem.co)
+#
+# The authors of this software are listed in the AUTHORS file at the
+# root of this software's source code tree.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# All rights reserved.
+# --------------------------------License Notice----------------------------------
+
+"""Share a download rate limit between transfers, serving the most urgent ones first.
+
+A token bucket holds up to `configuration.bandwidth_burst` bytes worth of tokens, refilled
+at the configured rate. Transfers take tokens for the data they receive and wait when the
+bucket is empty, the waiting transfer of highest priority being served first: index files,
+then small files, then files of required mods, then those of optional mods, then large files.
+As transfers consume tokens in small pieces, a small file is delayed by at most a piece of
+each running large transfer.
+"""
+
+import heapq
+import itertools
+import threading
+import time
+from typing import List, Optional, Tuple
+
+from . import configuration
+
+PRIORITY_INDEX = 0
+PRIORITY_SMALL = 1
+PRIORITY_REQUIRED = 2
+PRIORITY_OPTIONAL = 3
+PRIORITY_LARGE = 4
+
+
+def file_priority(size: int, optional: bool = False) -> int:
+    """Return the priority of downloading a file of `size` bytes, of an `optional` mod or not.
+
+    Large files of optional mods come after those of required mods.
+    """
+    if size < configuration.small_priority_size:
+        return PRIORITY_SMALL
+    if size >= configuration.large_priority_size:
+        return PRIORITY_LARGE + optional
+
+    return PRIORITY_OPTIONAL if optional else PRIORITY_REQUIRED
+
+
+class TokenBucket(object):
+    """Limit the rate at which threads consume bytes, a rate of None meaning unlimited."""
+
+    def __init__(self, rate: Optional[float] = None, burst: Optional[int] = None) -> None:
+        """Initialize a full bucket refilled at `rate` bytes per second."""
+        self.burst: int = burst or configuration.bandwidth_burst
+        self._rate = rate or None
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._waiting: List[Tuple[int, int]] = []
+        self._tickets = itertools.count()
+        self._condition = threading.Condition()
+
+    @property
+    def rate(self) -> Optional[float]:
+        """Return the number of bytes per second allowed, None if unlimited."""
+        return self._rate
+
+    @rate.setter
+    def rate(self, rate: Optional[float]) -> None:
+        """Change the rate, waiting threads adapting immediately."""
+        with self._condition:
+            self._refill()
+            self._rate = rate or None
+            self._condition.notify_all()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        if self._rate is not None:
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self._rate)
+        else:
+            self._tokens = float(self.burst)
+        self._updated = now
+
+    def consume(self, amount: int, priority: int = PRIORITY_INDEX) -> None:
+        """Wait until `amount` bytes may be consumed, lower `priority` values going first.
+
+        Amounts larger than the burst size are granted once the bucket is full, the following
+        consumers waiting for the deficit to be refilled.
+        """
+        with self._condition:
+            if self._rate is None:
+                return
+            ticket = (priority, next(self._tickets))
+            heapq.heappush(self._waiting, ticket)
+            try:
+                while self._rate is not None:
+                    self._refill()
+                    needed = min(amount, self.burst) - self._tokens
+                    if self._waiting[0] == ticket and needed <= 0:
+                        self._tokens -= amount
+                        return
+                    self._condition.wait(needed / self._rate if self._waiting[0] == ticket
+                                         else None)
+            finally:
+                self._waiting.remove(ticket)
+                heapq.heapify(self._waiting)
+                self._condition.notify_all()
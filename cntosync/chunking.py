@@ -0,0 +1,259 @@
+# --------------------------------License Notice----------------------------------
+# CNTOSync - Carpe Noctem Tactical Operations ArmA3 mod synchronization tool
+# Copyright (C) 2018 Carpe Noctem - Tactical Operations (aka. CNTO) (contact@carpenoctem.co)
+#
+# The authors of this software are listed in the AUTHORS file at the
+# root of this software's source code tree.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# All rights reserved.
+# --------------------------------License Notice----------------------------------
+
+"""Split files into content-defined chunks and track them in a deduplication table.
+
+Chunk boundaries are found with the FastCDC algorithm: a gear hash is rolled over the data
+and a boundary is declared where its top bits are all zero. As boundaries only depend on the
+content around them, data shifted by insertions or deletions, or copied into another file,
+yields the same chunks, which are then stored and transferred only once.
+"""
+
+import hashlib
+import mmap
+import os
+import time
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import msgpack
+
+from . import configuration
+from .fileutils import atomic_write
+
+_MASK_64 = 0xFFFFFFFFFFFFFFFF
+GEAR = tuple(int.from_bytes(hashlib.blake2b(bytes([value]), digest_size=8).digest(), 'little')
+             for value in range(256))
+
+Chunk = Tuple[bytes, int]
+
+
+def object_name(digest: bytes) -> str:
+    """Return the path of the chunk `digest` relative to the object directory."""
+    hexdigest = digest.hex()
+
+    return hexdigest[:2] + '/' + hexdigest
+
+
+def _top_bits_mask(bits: int) -> int:
+    """Return a 64 bits mask selecting the `bits` most significant bits."""
+    return ((1 << bits) - 1) << (64 - bits)
+
+
+def cut_points(data: Any, min_size: Optional[int] = None, average_size: Optional[int] = None,
+               max_size: Optional[int] = None) -> List[int]:
+    """Return the end offsets of the chunks of `data`, the last one being ``len(data)``.
+
+    Chunk sizes are normalized around `average_size`: a stricter mask is used before the
+    average size is reached and a looser one after, as described in the FastCDC paper.
+    """
+    min_size = min_size or configuration.chunk_min_size
+    average_size = average_size or configuration.chunk_average_size
+    max_size = max_size or configuration.chunk_max_size
+    bits = average_size.bit_length() - 1
+    mask_strict, mask_loose = _top_bits_mask(bits + 2), _top_bits_mask(bits - 2)
+    gear = GEAR
+
+    points: List[int] = []
+    start, end = 0, len(data)
+    while start < end:
+        limit = min(start + max_size, end)
+        normal = min(start + average_size, limit)
+        cut = limit
+        if limit - start > min_size:
+            fingerprint = 0
+            for position in range(start + min_size, normal):
+                fingerprint = ((fingerprint << 1) + gear[data[position]]) & _MASK_64
+                if not fingerprint & mask_strict:
+                    cut = position + 1
+                    break
+            else:
+                for position in range(normal, limit):
+                    fingerprint = ((fingerprint << 1) + gear[data[position]]) & _MASK_64
+                    if not fingerprint & mask_loose:
+                        cut = position + 1
+                        break
+        points.append(cut)
+        start = cut
+
+    return points
+
+
+def chunk_digest(data: Any) -> bytes:
+    """Return the digest identifying the chunk holding `data`."""
+    return hashlib.blake2b(data, digest_size=configuration.digest_size).digest()
+
+
+def chunk_file(path: str) -> List[Chunk]:
+    """Return the ``(digest, size)`` pairs of the content-defined chunks of `path`."""
+    with open(path, mode='rb') as stream:
+        if not os.fstat(stream.fileno()).st_size:
+            return []
+        with mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            chunks: List[Chunk] = []
+            start = 0
+            for end in cut_points(data):
+                chunks.append((chunk_digest(data[start:end]), end - start))
+                start = end
+
+    return chunks
+
+
+def chunk_batch(paths: Sequence[str]) -> List[List[Chunk]]:
+    """Return the chunks of every file in `paths`, in order."""
+    return [chunk_file(path) for path in paths]
+
+
+class ChunkStatistics(NamedTuple):
+    """Deduplication and throughput figures of a chunking run."""
+
+    files: int
+    chunks: int
+    unique_chunks: int
+    logical_bytes: int
+    unique_bytes: int
+    chunked_bytes: int
+    elapsed: float
+    workers: int
+
+    @property
+    def dedup_ratio(self) -> float:
+        """Return the ratio of logical bytes to bytes actually stored."""
+        return self.logical_bytes / self.unique_bytes if self.unique_bytes else 1.0
+
+    @property
+    def throughput_per_core(self) -> float:
+        """Return the chunking throughput in MB/s for each worker process."""
+        if not self.elapsed:
+            return 0.0
+        return self.chunked_bytes / self.elapsed / self.workers / 1e6
+
+
+class ChunkTable(object):
+    """Reference-counted table of the chunks making up the files of a repository.
+
+    `chunks` maps a chunk digest to ``[size, reference_count]``, `files` maps a relative path
+    to ``[file_digest, chunk_digests]``. `dirty` tells whether the table changed since it was
+    loaded.
+    """
+
+    def __init__(self, chunks: Optional[Dict[bytes, List[int]]] = None,
+                 files: Optional[Dict[str, List[Any]]] = None) -> None:
+        """Initialize the table from already known `chunks` and `files`."""
+        self.chunks: Dict[bytes, List[int]] = chunks or {}
+        self.files: Dict[str, List[Any]] = files or {}
+        self.dirty = False
+
+    @classmethod
+    def load(cls, path: str) -> 'ChunkTable':
+        """Load the table stored at `path`, an empty one if missing."""
+        try:
+            with open(path, mode='rb') as stream:
+                chunks, files = msgpack.unpackb(stream.read(), raw=False)
+        except FileNotFoundError:
+            return cls()
+
+        return cls(chunks, files)
+
+    def save(self, path: str) -> None:
+        """Atomically store the table at `path`."""
+        atomic_write(path, msgpack.packb([self.chunks, self.files], use_bin_type=True))
+        self.dirty = False
+
+    def remove(self, relative_path: str) -> None:
+        """Drop the references held by `relative_path`."""
+        _, digests = self.files.pop(relative_path)
+        self.dirty = True
+        for digest in digests:
+            reference = self.chunks[digest]
+            reference[1] -= 1
+            if not reference[1]:
+                del self.chunks[digest]
+
+    def add(self, relative_path: str, file_digest: bytes, chunks: Sequence[Chunk]) -> None:
+        """Record that `relative_path` is made of `chunks`."""
+        if relative_path in self.files:
+            self.remove(relative_path)
+        for digest, size in chunks:
+            self.chunks.setdefault(digest, [size, 0])[1] += 1
+        self.files[relative_path] = [file_digest, [digest for digest, _ in chunks]]
+        self.dirty = True
+
+    def chunks_of(self, relative_path: str) -> List[Chunk]:
+        """Return the ``(digest, size)`` pairs making up `relative_path`."""
+        return [(digest, self.chunks[digest][0]) for digest in self.files[relative_path][1]]
+
+    def locations(self, directory: str) -> Dict[bytes, Tuple[str, int]]:
+        """Return the path under `directory` and offset of a file holding each chunk."""
+        locations: Dict[bytes, Tuple[str, int]] = {}
+        for relative_path, (_, digests) in self.files.items():
+            offset = 0
+            path = os.path.join(directory, *relative_path.split('/'))
+            for digest in digests:
+                locations.setdefault(digest, (path, offset))
+                offset += self.chunks[digest][0]
+
+        return locations
+
+    def update(self, directory: str, entries: Sequence[Any], workers: Optional[int] = None) \
+            -> ChunkStatistics:
+        """Bring the table in line with the manifest `entries` of the files in `directory`.
+
+        Only files whose digest is unknown to the table are chunked, chunks of files that were
+        renamed or copied are reused from the entry holding the same digest.
+        """
+        current = {entry.path for entry in entries}
+        known: Dict[bytes, List[Chunk]] = {}
+        for relative_path, (file_digest, _) in self.files.items():
+            known.setdefault(file_digest, self.chunks_of(relative_path))
+
+        for relative_path in [path for path in self.files if path not in current]:
+            self.remove(relative_path)
+
+        pending = []
+        for entry in entries:
+            recorded = self.files.get(entry.path)
+            if recorded is not None and recorded[0] == entry.digest:
+                continue
+            if entry.digest in known:
+                self.add(entry.path, entry.digest, known[entry.digest])
+            else:
+                pending.append(entry)
+
+        start = time.perf_counter()
+        workers = min(workers or os.cpu_count() or 1, max(len(pending), 1))
+        paths = [os.path.join(directory, entry.path) for entry in pending]
+        if workers == 1:
+            results = chunk_batch(paths)
+        else:
+            from concurrent.futures import ProcessPoolExecutor
+
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(chunk_file, paths))
+        for entry, chunks in zip(pending, results):
+            self.add(entry.path, entry.digest, chunks)
+        elapsed = time.perf_counter() - start
+
+        return ChunkStatistics(
+            len(self.files), sum(len(digests) for _, digests in self.files.values()),
+            len(self.chunks), sum(size * references for size, references in self.chunks.values()),
+            sum(size for size, _ in self.chunks.values()),
+            sum(entry.size for entry in pending), elapsed, workers)
@@ -0,0 +1,352 @@
+# --------------------------------License Notice----------------------------------
+# CNTOSync - Carpe Noctem Tactical Operations ArmA3 mod synchronization tool
+# Copyright (C) 2018 Carpe Noctem - Tactical Operations (aka. CNTO) (contact@carpenoctem.co)
+#
+# The authors of this software are listed in the AUTHORS file at the
+# root of this software's source code tree.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# All rights reserved.
+# --------------------------------License Notice----------------------------------
+
+"""Command line interface, installed as the ``cntosync`` command.
+
+Modules are imported by the commands needing them, so that commands run periodically by
+scripts, such as ``cntosync status``, do not pay for the HTTP, multiprocessing and
+compression stacks.
+"""
+
+import argparse
+import os
+import signal
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Iterator, Optional, Sequence, TYPE_CHECKING, Tuple, Type
+
+if TYPE_CHECKING:  # pragma: no cover
+    from .filesync import Repository
+
+
+def _repository(directory: str) -> Optional['Repository']:
+    """Return the repository in `directory`, None once reported that there is none."""
+    from .filesync import Repository
+
+    if not Repository.check_presence(directory):
+        print('{0} is not a repository'.format(directory), file=sys.stderr)
+        return None
+
+    return Repository(directory)
+
+
+def _errors() -> Tuple[Type[Exception], ...]:
+    """Return the errors reported by commands instead of ending in a traceback."""
+    from . import exceptions
+
+    return (OSError, exceptions.IntegrityError, exceptions.InvalidIndex,
+            exceptions.UnsupportedURLSchema, exceptions.UnsupportedVersion)
+
+
+def _report(action: str, error: Exception) -> int:
+    """Report that `action` failed with `error`, return the exit status of the command."""
+    from . import exceptions
+
+    if isinstance(error, exceptions.UnsupportedVersion):
+        message = 'repository written by the incompatible version {0}'.format(error.version)
+    elif isinstance(error, exceptions.UnsupportedURLSchema):
+        message = 'unsupported URL scheme, supported schemes are {0}'.format(
+            ', '.join(error.supported_schemas))
+    else:
+        message = str(error) or type(error).__name__
+    print('{0} failed: {1}'.format(action, message), file=sys.stderr)
+
+    return 1
+
+
+@contextmanager
+def _stop_on_interrupt() -> Iterator[threading.Event]:
+    """Yield an event set on Ctrl+C, so that workers stop cleanly instead of being interrupted."""
+    stop = threading.Event()
+    previous = signal.signal(signal.SIGINT, lambda *_: stop.set())
+    try:
+        yield stop
+    finally:
+        signal.signal(signal.SIGINT, previous)
+
+
+def _init(arguments: argparse.Namespace) -> int:
+    """Initialize a repository synchronized from the URL given on the command line."""
+    from . import exceptions
+    from .filesync import Repository
+
+    directory = os.path.abspath(arguments.directory)
+    if Repository.check_presence(directory) and not arguments.overwrite:
+        print('{0} is already a repository'.format(directory), file=sys.stderr)
+        return 1
+    name = arguments.name or os.path.basename(directory)
+    try:
+        Repository.initialize(directory, name, arguments.url, arguments.overwrite,
+                              arguments.subscriptions, arguments.mirrors or ())
+    except exceptions.InvalidURL:
+        print('Invalid URL {0}'.format(arguments.url), file=sys.stderr)
+        return 1
+    except exceptions.UnsupportedURLSchema as error:
+        return _report('Initialization', error)
+    print('Initialized repository {0} in {1}'.format(name, directory))
+
+    return 0
+
+
+def _status(arguments: argparse.Namespace) -> int:
+    """Describe the repository given on the command line."""
+    repository = _repository(arguments.directory)
+    if repository is None:
+        return 1
+
+    try:
+        metadata = repository.metadata
+        files = None
+        if os.path.isfile(repository.manifest_path):
+            with repository.open_manifest() as manifest:
+                files = len(manifest)
+    except _errors() as error:
+        return _report('Reading the repository', error)
+    print('Repository: {0}'.format(metadata['display_name']))
+    print('URL: {0}'.format(metadata['url']))
+    if metadata.get('mirrors'):
+        print('Mirrors: {0}'.format(', '.join(metadata['mirrors'])))
+    if metadata.get('subscriptions') is not None:
+        print('Subscriptions: {0}'.format(', '.join(metadata['subscriptions'])))
+    if files is not None:
+        built = time.localtime(os.path.getmtime(repository.manifest_path))
+        print('Index: {0} files, built {1}'.format(files,
+                                                   time.strftime('%Y-%m-%d %H:%M:%S', built)))
+    else:
+        print('Index: not built')
+    if os.path.isfile(repository.journal_path):
+        print('Synchronization interrupted, run sync to resume it')
+
+    return 0
+
+
+def _index(arguments: argparse.Namespace) -> int:
+    """Index the repository given on the command line."""
+    from .exceptions import Cancelled
+
+    repository = _repository(arguments.directory)
+    if repository is None:
+        return 1
+
+    with _stop_on_interrupt() as stop:
+        try:
+            result = repository.build_index(arguments.workers, not arguments.full, stop=stop)
+        except Cancelled:
+            print('Indexing cancelled', file=sys.stderr)
+            return 130
+        except _errors() as error:
+            return _report('Indexing', error)
+    print('Indexed {0} files, {1} hashed ({2} bytes): {3} added, {4} modified, {5} deleted '
+          'and {6} renamed'.format(len(result.entries), result.hashed_files, result.hashed_bytes,
+                                   len(result.added), len(result.modified),
+                                   len(result.deleted), len(result.renamed)))
+
+    return 0
+
+
+def _sync(arguments: argparse.Namespace) -> int:
+    """Synchronize the repository given on the command line with its remote."""
+    from .bandwidth import TokenBucket
+    from .exceptions import Cancelled
+
+    repository = _repository(arguments.directory)
+    if repository is None:
+        return 1
+
+    bucket = TokenBucket(arguments.limit * 1024) if arguments.limit else None
+    with _stop_on_interrupt() as stop:
+        try:
+            result = repository.sync(arguments.workers, link=arguments.link, bucket=bucket,
+                                     optional_mods=arguments.optional_mods or (), stop=stop)
+        except Cancelled:
+            print('Synchronization cancelled, run sync again to resume it', file=sys.stderr)
+            return 130
+        except _errors() as error:
+            return _report('Synchronization', error)
+    print('Synchronized {0} files: {1} bytes fetched, {2} bytes resumed'.format(
+        result.files, result.fetched_bytes, result.resumed_bytes))
+
+    return 0
+
+
+def _verify(arguments: argparse.Namespace) -> int:
+    """Check the files of the repository given on the command line against its index."""
+    from .exceptions import Cancelled
+
+    repository = _repository(arguments.directory)
+    if repository is None:
+        return 1
+    if not os.path.isfile(repository.manifest_path):
+        print('{0} is not indexed, run index first'.format(arguments.directory),
+              file=sys.stderr)
+        return 1
+
+    with _stop_on_interrupt() as stop:
+        try:
+            result = repository.verify(arguments.mode, arguments.workers, stop=stop)
+        except Cancelled:
+            print('Verification cancelled', file=sys.stderr)
+            return 130
+        except _errors() as error:
+            return _report('Verification', error)
+    for path in result.missing:
+        print('missing: {0}'.format(path))
+    for path in result.corrupted:
+        print('corrupted: {0}'.format(path))
+    print('Verified {0} files, {1} bytes read: {2} missing, {3} corrupted'.format(
+        result.files, result.checked_bytes, len(result.missing), len(result.corrupted)))
+
+    return 0 if result.ok else 1
+
+
+def _publish(arguments: argparse.Namespace) -> int:
+    """Publish the repository given on the command line."""
+    from .publish import publish
+
+    repository = _repository(arguments.directory)
+    if repository is None:
+        return 1
+    try:
+        result = publish(repository, arguments.workers, arguments.chunks,
+                         arguments.compressions)
+    except _errors() as error:
+        return _report('Publication', error)
+    print('Published generation {0}, revision {1}: {2} shards, {3} files written ({4} bytes), '
+          '{5} files removed'.format(result.generation, result.revision, result.shards,
+                                     result.written_files, result.written_bytes,
+                                     result.removed_files))
+
+    return 0
+
+
+def _watch(arguments: argparse.Namespace) -> int:
+    """Keep the index of the repository given on the command line up to date."""
+    repository = _repository(arguments.directory)
+    if repository is None:
+        return 1
+
+    def report(result: Any) -> None:
+        if result.changed:
+            print('Indexed {0} added, {1} modified, {2} deleted and {3} renamed files'.format(
+                len(result.added), len(result.modified), len(result.deleted),
+                len(result.renamed)), flush=True)
+
+    try:
+        repository.watch(arguments.workers, on_update=report, polling=arguments.polling)
+    except KeyboardInterrupt:
+        pass
+    except _errors() as error:
+        return _report('Watching', error)
+
+    return 0
+
+
+def parser() -> argparse.ArgumentParser:
+    """Return the parser of the command line arguments."""
+    main_parser = argparse.ArgumentParser(prog='cntosync', description=__doc__.split('\n')[0])
+    subparsers = main_parser.add_subparsers(dest='command', metavar='command')
+    subparsers.required = True
+
+    init_parser = subparsers.add_parser(
+        'init', help='create a repository synchronized from a remote repository')
+    init_parser.add_argument('url', help='URL of the remote repository, file, http or https')
+    init_parser.add_argument('directory', nargs='?', default='.')
+    init_parser.add_argument('--name', help='display name, the directory name by default')
+    init_parser.add_argument('--mirror', dest='mirrors', action='append',
+                             help='URL of a mirror of the remote repository, may be repeated')
+    init_parser.add_argument('--subscribe', dest='subscriptions', action='append',
+                             help='only synchronize this top-level mod folder, may be repeated')
+    init_parser.add_argument('--overwrite', action='store_true',
+                             help='initialize the repository again if it exists')
+    init_parser.set_defaults(handler=_init)
+
+    status_parser = subparsers.add_parser(
+        'status', help='describe a repository and the state of its index')
+    status_parser.add_argument('directory', nargs='?', default='.')
+    status_parser.set_defaults(handler=_status)
+
+    index_parser = subparsers.add_parser(
+        'index', help='hash the files of a repository which changed since the last run')
+    index_parser.add_argument('directory', nargs='?', default='.')
+    index_parser.add_argument('--workers', type=int, default=None,
+                              help='number of hashing processes, one per CPU by default')
+    index_parser.add_argument('--full', action='store_true',
+                              help='hash every file, ignoring the previous run')
+    index_parser.set_defaults(handler=_index)
+
+    sync_parser = subparsers.add_parser(
+        'sync', help='synchronize a repository with its remote repository')
+    sync_parser.add_argument('directory', nargs='?', default='.')
+    sync_parser.add_argument('--workers', type=int, default=None,
+                             help='number of concurrent transfers')
+    sync_parser.add_argument('--link', action='store_true',
+                             help='hard link the files of a local remote repository')
+    sync_parser.add_argument('--limit', type=int, default=None,
+                             help='download rate limit in KiB per second')
+    sync_parser.add_argument('--optional', dest='optional_mods', action='append',
+                             help='download this top-level mod folder last, may be repeated')
+    sync_parser.set_defaults(handler=_sync)
+
+    verify_parser = subparsers.add_parser(
+        'verify', help='check that the files of a repository match its index')
+    verify_parser.add_argument('directory', nargs='?', default='.')
+    verify_parser.add_argument('--mode', choices=['quick', 'sampled', 'full'], default='quick',
+                               help='compare stat information, sample blocks or hash files')
+    verify_parser.add_argument('--workers', type=int, default=None,
+                               help='number of hashing processes, one per CPU by default')
+    verify_parser.set_defaults(handler=_verify)
+
+    publish_parser = subparsers.add_parser(
+        'publish', help='index a repository and write the static files served to clients')
+    publish_parser.add_argument('directory', nargs='?', default='.')
+    publish_parser.add_argument('--workers', type=int, default=None,
+                                help='number of hashing processes, one per CPU by default')
+    publish_parser.add_argument('--chunks', action='store_true',
+                                help='publish content-defined chunks of every file')
+    publish_parser.add_argument('--compression', dest='compressions', action='append',
+                                choices=['gzip', 'zstd'],
+                                help='compression of the published index, may be repeated')
+    publish_parser.set_defaults(handler=_publish)
+
+    watch_parser = subparsers.add_parser(
+        'watch', help='keep the index of a repository up to date as its files change')
+    watch_parser.add_argument('directory', nargs='?', default='.')
+    watch_parser.add_argument('--workers', type=int, default=None,
+                              help='number of hashing processes, one per CPU by default')
+    watch_parser.add_argument('--polling', action='store_true',
+                              help='scan the repository periodically instead of using inotify')
+    watch_parser.set_defaults(handler=_watch)
+
+    return main_parser
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    """Run the command given by `argv`, the process arguments by default."""
+    arguments = parser().parse_args(argv)
+
+    return int(arguments.handler(arguments))
+
+
+if __name__ == '__main__':  # pragma: no cover
+    sys.exit(main())
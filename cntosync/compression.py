@@ -0,0 +1,196 @@
+# --------------------------------License Notice----------------------------------
+# CNTOSync - Carpe Noctem Tactical Operations ArmA3 mod synchronization tool
+# Copyright (C) 2018 Carpe Noctem - Tactical Operations (aka. CNTO) (contact@carpenoctem.co)
+#
+# The authors of this software are listed in the AUTHORS file at the
+# root of this software's source code tree.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# All rights reserved.
+# --------------------------------License Notice----------------------------------
+
+"""Compress data with gzip, or with zstd when the optional zstandard package is installed.
+
+Files are only worth compressing for transfers when they shrink enough: their compression
+ratio is estimated by compressing a few evenly spaced samples with a fast setting.
+
+Invalid compressed data raises :class:`exceptions.IntegrityError`, whatever the compression.
+"""
+
+import functools
+import gzip
+import importlib
+import io
+import shutil
+import zlib
+from typing import Any, BinaryIO, Dict, List, Optional, Tuple, Type
+
+from . import configuration
+from . import exceptions
+
+
+def _optional_module(name: str) -> Any:
+    """Return the module `name`, None if it is not installed."""
+    try:
+        return importlib.import_module(name)
+    except ImportError:
+        return None
+
+
+@functools.lru_cache(maxsize=None)
+def _zstandard() -> Any:
+    """Return the zstandard module, imported on first use, None if it is not installed."""
+    return _optional_module('zstandard')
+
+
+suffixes: Dict[str, str] = {'gzip': '.gz', 'zstd': '.zst'}
+
+
+def available_compressions() -> List[str]:
+    """Return the configured compressions which are available, preferred first."""
+    return [name for name in configuration.publish_compressions
+            if name != 'zstd' or _zstandard() is not None]
+
+
+def compress(data: bytes, compression: str) -> bytes:
+    """Return `data` compressed with `compression`, ``gzip`` or ``zstd``."""
+    zstandard = _zstandard()
+    if compression == 'zstd' and zstandard is not None:
+        return bytes(zstandard.ZstdCompressor(level=configuration.zstd_level).compress(data))
+    elif compression == 'gzip':
+        buffer = io.BytesIO()
+        with gzip.GzipFile(fileobj=buffer, mode='wb', compresslevel=configuration.gzip_level,
+                           mtime=0) as stream:
+            stream.write(data)
+        return buffer.getvalue()
+    raise ValueError('Unsupported compression {0}'.format(compression))
+
+
+def _decoding_errors() -> Tuple[Type[BaseException], ...]:
+    """Return the exception types raised by decompressors on invalid data."""
+    zstandard = _zstandard()
+
+    return (zlib.error, EOFError, OSError) + ((zstandard.ZstdError,) if zstandard else ())
+
+
+def decompress(data: bytes, compression: str) -> bytes:
+    """Return `data` decompressed from `compression`, ``gzip`` or ``zstd``."""
+    zstandard = _zstandard()
+    try:
+        if compression == 'zstd' and zstandard is not None:
+            return bytes(zstandard.ZstdDecompressor().decompress(data))
+        elif compression == 'gzip':
+            return gzip.decompress(data)
+    except _decoding_errors() as error:
+        raise exceptions.IntegrityError('Invalid {0} data: {1}'.format(
+            compression, error)) from error
+    raise ValueError('Unsupported compression {0}'.format(compression))
+
+
+def preferred_compression() -> str:
+    """Return the compression used for file transfers, zstd when available."""
+    return 'zstd' if _zstandard() is not None else 'gzip'
+
+
+def sample_ratio(stream: BinaryIO, size: int) -> float:
+    """Estimate the compression ratio of the `size` bytes of seekable `stream`.
+
+    The ratio is the compressed size divided by the original size of the samples, compressed
+    with the fastest setting of zstd, or of zlib when zstd is not available.
+    """
+    zstandard = _zstandard()
+    if zstandard is not None:
+        compress_sample = zstandard.ZstdCompressor(level=1).compress
+    else:
+        def compress_sample(data: bytes) -> bytes:
+            return zlib.compress(data, 1)
+    sample_size = configuration.compression_sample_size
+    samples = min(configuration.compression_samples, max(size // sample_size, 1))
+    step = (size - sample_size) // max(samples - 1, 1)
+    original = compressed = 0
+    for index in range(samples):
+        stream.seek(max(index * step, 0))
+        data = stream.read(sample_size)
+        original += len(data)
+        compressed += len(compress_sample(data))
+
+    return compressed / original if original else 1.0
+
+
+def choose_compression(stream: BinaryIO, size: int) -> Optional[str]:
+    """Return the compression worth applying to `stream` of `size` bytes, None if not worth it."""
+    if size < configuration.compression_min_size or \
+            sample_ratio(stream, size) > configuration.compression_ratio_threshold:
+        return None
+
+    return preferred_compression()
+
+
+def compress_stream(source: BinaryIO, target: BinaryIO, compression: str, size: int = -1) \
+        -> None:
+    """Write the content of `source` compressed with `compression` to `target`.
+
+    `size`, the number of bytes `source` holds, is stored in zstd frames when known. Faster
+    settings than those of :func:`compress` are used, as files can be large.
+    """
+    zstandard = _zstandard()
+    if compression == 'zstd' and zstandard is not None:
+        compressor = zstandard.ZstdCompressor(level=configuration.blob_zstd_level)
+        compressor.copy_stream(source, target, size=size, read_size=configuration.read_chunk_size)
+    elif compression == 'gzip':
+        with gzip.GzipFile(fileobj=target, mode='wb',
+                           compresslevel=configuration.blob_gzip_level, mtime=0) as stream:
+            shutil.copyfileobj(source, stream, configuration.read_chunk_size)
+    else:
+        raise ValueError('Unsupported compression {0}'.format(compression))
+
+
+def blob_name(digest: bytes, compression: str) -> str:
+    """Return the name of the blob of content `digest` compressed with `compression`."""
+    return digest.hex() + suffixes[compression]
+
+
+class _Decompressor(object):
+    """Streaming decompressor raising :class:`exceptions.IntegrityError` on invalid data."""
+
+    def __init__(self, compression: str, decompressor: Any) -> None:
+        """Wrap the `decompressor` object of `compression`."""
+        self.compression = compression
+        self._decompressor = decompressor
+
+    def decompress(self, data: bytes) -> bytes:
+        """Return the decompressed data available once `data` is fed."""
+        try:
+            return bytes(self._decompressor.decompress(data))
+        except _decoding_errors() as error:
+            raise exceptions.IntegrityError('Invalid {0} data: {1}'.format(
+                self.compression, error)) from error
+
+    def flush(self) -> bytes:
+        """Return the remaining decompressed data."""
+        try:
+            return bytes(self._decompressor.flush())
+        except _decoding_errors() as error:
+            raise exceptions.IntegrityError('Invalid {0} data: {1}'.format(
+                self.compression, error)) from error
+
+
+def decompressor(compression: str) -> _Decompressor:
+    """Return an object decompressing `compression` data fed in pieces to its `decompress`."""
+    zstandard = _zstandard()
+    if compression == 'zstd' and zstandard is not None:
+        return _Decompressor(compression, zstandard.ZstdDecompressor().decompressobj())
+    elif compression == 'gzip':
+        return _Decompressor(compression, zlib.decompressobj(16 + zlib.MAX_WBITS))
+    raise ValueError('Unsupported compression {0}'.format(compression))
@@ -25,4 +25,65 @@
 version = '0.1.0'
 index_directory = '.cntosync'
 index_file = 'repoinfo'
+manifest_file = 'manifest'
 extension = '.cntosync'
+digest_size = 20
+read_chunk_size = 1024 * 1024
+small_file_threshold = 256 * 1024
+small_file_batch_size = 128
+stat_cache_file = 'statcache'
+block_size = 64 * 1024
+strong_digest_size = 8
+delta_threshold = 1024 * 1024
+rolling_search_limit = 64 * 1024 * 1024
+chunk_table_file = 'chunks'
+chunk_min_size = 16 * 1024
+chunk_average_size = 64 * 1024
+chunk_max_size = 256 * 1024
+download_workers = 16
+connections_per_host = 8
+connection_timeout = 30
+download_retries = 2
+segment_size = 16 * 1024 * 1024
+journal_file = 'journal'
+partial_directory = 'partial'
+journal_flush_interval = 1.0
+remote_manifest_file = 'remote-manifest'
+publication_file = 'publication'
+shard_directory = 'shards'
+object_directory = 'objects'
+publish_compressions = ('gzip', 'zstd')
+gzip_level = 9
+zstd_level = 19
+compression_min_size = 64 * 1024
+compression_sample_size = 64 * 1024
+compression_samples = 4
+compression_ratio_threshold = 0.9
+blob_directory = 'blobs'
+blob_zstd_level = 9
+blob_gzip_level = 6
+verification_stride = 4 * 1024 * 1024
+watch_debounce = 2.0
+watch_max_delay = 30.0
+watch_poll_interval = 10.0
+bandwidth_burst = 256 * 1024
+bandwidth_chunk_size = 16 * 1024
+small_priority_size = 256 * 1024
+large_priority_size = 16 * 1024 * 1024
+metrics_file = 'metrics.json'
+shard_cache_directory = 'shard-cache'
+batched_write_size = 256 * 1024
+write_batch_files = 128
+write_batch_bytes = 32 * 1024 * 1024
+write_batch_interval = 1.0
+write_queue_size = 64
+write_buffer_size = 1024 * 1024
+delta_revisions = 8
+mirror_stall_timeout = 10.0
+mirror_backoff = 5.0
+mirror_smoothing = 0.3
+mirror_sample_size = 64 * 1024
+mirror_default_rtt = 0.1
+mirror_default_throughput = 1024 * 1024
+progress_interval = 0.1
+cancel_poll_interval = 0.1
@@ -0,0 +1,382 @@
+# --------------------------------License Notice----------------------------------
+# CNTOSync - Carpe Noctem Tactical Operations ArmA3 mod synchronization tool
+# Copyright (C) 2018 Carpe Noctem - Tactical Operations (aka. CNTO) (contact@carpenoctem.co)
+#
+# The authors of this software are listed in the AUTHORS file at the
+# root of this software's source code tree.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# All rights reserved.
+# --------------------------------License Notice----------------------------------
+
+"""Download repository files concurrently over HTTP.
+
+Connections are kept alive and pooled per host, with a cap on the number of concurrent
+connections to each host. Files larger than `configuration.segment_size` are split into
+segments fetched in parallel with range requests, every segment being written in place into
+a target file preallocated to its final size. Given a `bandwidth.TokenBucket`, transfers share
+its rate limit according to their priority.
+"""
+
+import http.client
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from typing import (Callable, Dict, Iterator, List, NamedTuple, Optional, Sequence, Set,
+                    Tuple)
+from urllib.parse import quote, urlparse
+
+from . import bandwidth
+from . import configuration
+from . import exceptions
+from . import metrics
+from .fileutils import allocate
+from .mirrors import Mirror, MirrorSet
+
+_RETRIED_ERRORS = (http.client.RemoteDisconnected, http.client.IncompleteRead,
+                   ConnectionResetError, BrokenPipeError)
+
+ProgressCallback = Callable[[int], None]
+SegmentCallback = Callable[['DownloadJob', int, int], None]
+
+
+def file_url(base_url: str, relative_path: str) -> str:
+    """Return the URL of `relative_path` inside the repository served at `base_url`."""
+    return base_url.rstrip('/') + '/' + quote(relative_path, safe='/@')
+
+
+class DownloadJob(NamedTuple):
+    """A remote file to write at `path`, expected to be `size` bytes long.
+
+    When `ranges` is set, only these ``(offset, length)`` ranges are fetched into the
+    existing file at `path`, otherwise the file is created and fetched completely. `priority`
+    is a `bandwidth` priority, lower values being downloaded first.
+    """
+
+    url: str
+    path: str
+    size: int
+    ranges: Optional[List[Tuple[int, int]]] = None
+    priority: int = bandwidth.PRIORITY_REQUIRED
+
+
+def preallocate(path: str, size: int) -> None:
+    """Create `path` with its final `size`, reserving disk space when supported."""
+    os.makedirs(os.path.dirname(path) or os.curdir, exist_ok=True)
+    with open(path, mode='wb') as stream:
+        allocate(stream.fileno(), size)
+
+
+class ConnectionPool(object):
+    """Keep-alive HTTP connections shared between threads, capped per host."""
+
+    def __init__(self, connections_per_host: Optional[int] = None,
+                 timeout: Optional[float] = None) -> None:
+        """Initialize an empty pool."""
+        self.connections_per_host: int = \
+            connections_per_host or configuration.connections_per_host
+        self.timeout: float = timeout or configuration.connection_timeout
+        self._lock = threading.Lock()
+        self._idle: Dict[Tuple[str, str], List[http.client.HTTPConnection]] = {}
+        self._slots: Dict[Tuple[str, str], threading.BoundedSemaphore] = {}
+
+    def _new_connection(self, scheme: str, netloc: str) -> http.client.HTTPConnection:
+        if scheme == 'https':
+            return http.client.HTTPSConnection(netloc, timeout=self.timeout)
+        return http.client.HTTPConnection(netloc, timeout=self.timeout)
+
+    @contextmanager
+    def connection(self, scheme: str, netloc: str) -> Iterator[http.client.HTTPConnection]:
+        """Borrow a connection to `netloc`, waiting while the host is at its cap.
+
+        The connection goes back to the pool when the context exits normally, it is closed
+        if an exception is raised.
+        """
+        key = (scheme, netloc)
+        with self._lock:
+            slots = self._slots.setdefault(
+                key, threading.BoundedSemaphore(self.connections_per_host))
+        with slots:
+            with self._lock:
+                idle = self._idle.setdefault(key, [])
+                connection = idle.pop() if idle else self._new_connection(scheme, netloc)
+            try:
+                yield connection
+            except BaseException:
+                connection.close()
+                raise
+            with self._lock:
+                self._idle[key].append(connection)
+
+    def close(self) -> None:
+        """Close every idle connection."""
+        with self._lock:
+            for idle in self._idle.values():
+                for connection in idle:
+                    connection.close()
+            self._idle.clear()
+
+
+class Downloader(object):
+    """Fetch files over HTTP with a pool of worker threads and pooled connections."""
+
+    supported_url_schemas = ('http', 'https')
+
+    def __init__(self, workers: Optional[int] = None, connections_per_host: Optional[int] = None,
+                 segment_size: Optional[int] = None,
+                 bucket: Optional[bandwidth.TokenBucket] = None,
+                 mirrors: Optional[Sequence[str]] = None,
+                 stop: Optional[threading.Event] = None) -> None:
+        """Initialize the downloader, missing parameters come from the configuration.
+
+        Received data is accounted against `bucket` when given. With several `mirrors` base
+        URLs, requests for a URL under one of them are spread across all of them, see
+        :meth:`fetch`. Once `stop` is set, requests and responses being read raise
+        :class:`exceptions.Cancelled`.
+        """
+        self.workers: int = workers or configuration.download_workers
+        self.segment_size: int = segment_size or configuration.segment_size
+        self.bucket = bucket
+        self.stop = stop
+        self.mirrors = MirrorSet(mirrors) if mirrors is not None and len(mirrors) > 1 else None
+        self.pool = ConnectionPool(connections_per_host, configuration.mirror_stall_timeout
+                                   if self.mirrors is not None else None)
+
+    def close(self) -> None:
+        """Release the pooled connections."""
+        self.pool.close()
+
+    def __enter__(self) -> 'Downloader':
+        """Use the downloader as a context manager closing its connections on exit."""
+        return self
+
+    def __exit__(self, *args: object) -> None:
+        """Close the pooled connections."""
+        self.close()
+
+    def _check_stop(self) -> None:
+        if self.stop is not None and self.stop.is_set():
+            raise exceptions.Cancelled('Download cancelled')
+
+    def _request(self, url: str, offset: int, length: Optional[int],
+                 priority: int) -> Iterator[bytes]:
+        self._check_stop()
+        parsed_url = urlparse(url)
+        target = parsed_url.path + ('?' + parsed_url.query if parsed_url.query else '')
+        headers = {}
+        if length is not None:
+            headers['Range'] = 'bytes={0}-{1}'.format(offset, offset + length - 1)
+        elif offset:
+            headers['Range'] = 'bytes={0}-'.format(offset)
+
+        with self.pool.connection(parsed_url.scheme, parsed_url.netloc) as connection:
+            connection.request('GET', target, headers=headers)
+            response = connection.getresponse()
+            partial = response.status == 206
+            whole = response.status == 200 and not offset and \
+                (length is None or response.length == length)
+            if not partial and not whole:
+                response.read()
+                raise exceptions.DownloadError(
+                    url, 'Unexpected HTTP status {0} for {1}'.format(response.status, url),
+                    status=response.status)
+            while True:
+                limited = self.bucket is not None and self.bucket.rate is not None
+                data = response.read(configuration.bandwidth_chunk_size if limited
+                                     else configuration.read_chunk_size)
+                if not data:
+                    break
+                self._check_stop()
+                if self.bucket is not None:
+                    self.bucket.consume(len(data), priority)
+                yield data
+
+    def fetch(self, url: str, offset: int = 0, length: Optional[int] = None,
+              priority: int = bandwidth.PRIORITY_INDEX) -> Iterator[bytes]:
+        """Stream `length` bytes of `url` from `offset`, or the whole file without `length`.
+
+        Requests default to the highest priority, as index files are needed to plan the
+        transfer of other files.
+
+        Requests failing on a dropped keep-alive connection are retried before any data is
+        yielded.
+
+        With mirrors, requests under the base URL of a mirror are sent to the mirror expected
+        to serve them fastest. When a mirror fails, stalls or ends the response early, the
+        remaining data is fetched from another one, transparently for the caller.
+        """
+        if self.mirrors is not None:
+            relative = self.mirrors.relative(url)
+            if relative is not None:
+                yield from self._fetch_mirrored(self.mirrors, relative, offset, length, priority)
+                return
+        yield from self._fetch(url, offset, length, priority)
+
+    def _fetch_mirrored(self, mirrors: MirrorSet, relative: str, offset: int,
+                        length: Optional[int], priority: int) -> Iterator[bytes]:
+        tried: Set[Mirror] = set()
+        received = 0
+        error: Optional[BaseException] = None
+        not_found: Optional[exceptions.DownloadError] = None
+        while True:
+            remaining = None if length is None else length - received
+            mirror = mirrors.choose(remaining, tried)
+            if mirror is None:
+                # A file missing from a mirror is reported rather than failures of others.
+                if not_found is not None:
+                    raise not_found
+                if error is None:
+                    raise exceptions.DownloadError(relative, 'No mirror to fetch {0} from'.format(
+                        relative))
+                raise error
+            tried.add(mirror)
+            start = time.perf_counter()
+            first: Optional[float] = None
+            size = 0
+            try:
+                for data in self._fetch(mirror.url + relative, offset + received, remaining,
+                                        priority):
+                    if first is None:
+                        first = time.perf_counter()
+                    size += len(data)
+                    received += len(data)
+                    yield data
+            except exceptions.DownloadError as download_error:
+                if download_error.status == 404:
+                    not_found = download_error
+                else:
+                    error = download_error
+                    mirrors.fail(mirror)
+                continue
+            except (OSError, http.client.HTTPException) as request_error:
+                error = request_error
+                mirrors.fail(mirror)
+                continue
+            end = time.perf_counter()
+            if length is not None and received < length:
+                error = exceptions.DownloadError(mirror.url + relative, 'Truncated response '
+                                                 'for {0}'.format(mirror.url + relative))
+                mirrors.fail(mirror)
+                continue
+            mirrors.record(mirror, (first or end) - start, size, end - (first or end))
+            return
+
+    def probe(self, relative_path: str) -> None:
+        """Measure the round-trip time of every mirror with a request for `relative_path`.
+
+        Mirrors which do not answer are avoided for a while.
+        """
+        mirrors = self.mirrors
+        if mirrors is None:
+            return
+
+        def probe_mirror(mirror: Mirror) -> None:
+            start = time.perf_counter()
+            try:
+                for _ in self._fetch(file_url(mirror.url, relative_path), 0, 1,
+                                     bandwidth.PRIORITY_INDEX):
+                    pass
+            except (OSError, http.client.HTTPException):
+                mirrors.fail(mirror)
+            else:
+                mirrors.record(mirror, time.perf_counter() - start)
+
+        with ThreadPoolExecutor(max_workers=len(mirrors.mirrors)) as executor:
+            list(executor.map(probe_mirror, mirrors.mirrors))
+
+    def _fetch(self, url: str, offset: int, length: Optional[int],
+               priority: int) -> Iterator[bytes]:
+        for attempt in range(configuration.download_retries + 1):
+            chunks = self._request(url, offset, length, priority)
+            try:
+                first = next(chunks, b'')
+            except _RETRIED_ERRORS:
+                if attempt == configuration.download_retries:
+                    raise
+                continue
+            if first:
+                yield first
+            yield from chunks
+            return
+
+    def _download_segment(self, job: DownloadJob, offset: int, length: int,
+                          progress: Optional[ProgressCallback],
+                          on_segment: Optional[SegmentCallback]) -> None:
+        recorder = metrics.active()
+        written = 0
+        with open(job.path, mode='r+b', buffering=configuration.write_buffer_size) as stream:
+            stream.seek(offset)
+            start = time.perf_counter()
+            for data in self.fetch(job.url, offset, length, job.priority):
+                fetched = time.perf_counter()
+                stream.write(data)
+                if recorder is not None:
+                    recorder.add(metrics.FETCH, size=len(data), seconds=fetched - start)
+                    recorder.add(metrics.WRITE, size=len(data),
+                                 seconds=time.perf_counter() - fetched)
+                written += len(data)
+                if progress is not None:
+                    progress(len(data))
+                start = time.perf_counter()
+            if on_segment is not None:
+                stream.flush()
+                os.fsync(stream.fileno())
+                if recorder is not None:
+                    recorder.add(metrics.WRITE, seconds=time.perf_counter() - start)
+        if written != length:
+            raise exceptions.DownloadError(job.url, 'Truncated response for {0}'.format(job.url))
+        if on_segment is not None:
+            on_segment(job, offset, length)
+
+    def segments(self, job: DownloadJob) -> List[Tuple[int, int]]:
+        """Return the ``(offset, length)`` ranges `job` is split into."""
+        ranges = [(0, job.size)] if job.ranges is None else job.ranges
+        return [(start, min(self.segment_size, offset + length - start))
+                for offset, length in ranges
+                for start in range(offset, offset + length, self.segment_size)]
+
+    def download(self, jobs: Sequence[DownloadJob], progress: Optional[ProgressCallback] = None,
+                 on_segment: Optional[SegmentCallback] = None) -> None:
+        """Download every job concurrently, calling `progress` with each received byte count.
+
+        Target files are preallocated first, then segments are fetched by priority and largest
+        file first within a priority, so that big files do not end up downloading alone at the
+        end. When `on_segment` is given,
+        each segment is flushed to disk before ``on_segment(job, offset, length)`` is called.
+        On the first error, pending transfers are cancelled and the error is raised once
+        running ones completed.
+        """
+        tasks: List[Tuple[DownloadJob, int, int]] = []
+        for job in sorted(jobs, key=lambda job: (job.priority, -job.size)):
+            if job.ranges is None:
+                preallocate(job.path, job.size)
+            tasks.extend((job, offset, length) for offset, length in self.segments(job))
+
+        def download_segment(job: DownloadJob, offset: int, length: int) -> None:
+            with pool.task():
+                self._download_segment(job, offset, length, progress, on_segment)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor, \
+                metrics.pool('download', self.workers, len(tasks)) as pool:
+            futures = [executor.submit(download_segment, job, offset, length)
+                       for job, offset, length in tasks]
+            try:
+                for future in as_completed(futures):
+                    future.result()
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
@@ -22,7 +22,36 @@
 
 """This module contains the set of custom exceptions used."""
 
-from typing import Sequence
+from typing import Any, Optional, Sequence
+
+
+class Cancelled(Exception):
+    """The operation was stopped at the request of the caller before completing."""
+
+    pass
+
+
+class DownloadError(OSError):
+    """A remote file could not be downloaded."""
+
+    def __init__(self, url: str, *args: Any, status: Optional[int] = None) -> None:
+        """Initialize DownloadError with the `url` which failed and the HTTP `status`, if any."""
+        self.url: str = url
+        self.status: Optional[int] = status
+
+        super().__init__(*args)
+
+
+class IntegrityError(ValueError):
+    """The data does not match its expected digest."""
+
+    pass
+
+
+class InvalidIndex(ValueError):
+    """The index file is malformed."""
+
+    pass
 
 
 class InvalidURL(ValueError):
@@ -39,3 +68,13 @@ class UnsupportedURLSchema(ValueError):
         self.supported_schemas: Sequence = supported_schemas
 
         super().__init__(*args)
+
+
+class UnsupportedVersion(ValueError):
+    """The repository was written by an incompatible version."""
+
+    def __init__(self, version: Any, *args: str) -> None:
+        """Initialize UnsupportedVersion with the `version` of the repository."""
+        self.version: Any = version
+
+        super().__init__(*args)
@@ -20,22 +20,120 @@
 # All rights reserved.
 # --------------------------------License Notice----------------------------------
 
-"""Provide an interface for operations on a repository."""
+"""Provide an interface for operations on a repository.
 
+Modules only needed to index, transfer, verify or watch files are imported when first used,
+so that opening a repository and reading its state only loads its index file and manifest.
+"""
+
+import functools
 import os
+import threading
+from typing import (Any, Callable, Collection, Dict, Iterable, List, Mapping, Optional,
+                    Sequence, TYPE_CHECKING, Tuple, TypeVar, cast)
 from urllib.parse import urlparse
 
 import msgpack
 
 from . import configuration
 from . import exceptions
+from .manifest import FileEntry, Manifest
+
+if TYPE_CHECKING:  # pragma: no cover
+    from . import bandwidth, indexer, plan
+    from .download import ProgressCallback
+    from .transfer import TransferResult
+    from .verify import VerifyResult
 
 
 def valid_url(url: str) -> bool:
-    """Check if string `url` is a valid URL compliant to RFC2396."""
+    """Check if string `url` is a valid URL compliant to RFC2396.
+
+    ``file`` URLs may omit the host, as in ``file:///srv/repository``.
+    """
     parsed_url = urlparse(url)
 
-    return all([parsed_url.scheme, parsed_url.netloc])
+    return all([parsed_url.scheme, parsed_url.netloc or
+                (parsed_url.scheme == 'file' and parsed_url.path)])
+
+
+def compatible_version(version: Any) -> bool:
+    """Check if a repository written by configuration `version` can be used.
+
+    Versions must share the major number and not be more recent than the current one.
+    """
+    try:
+        major, minor = (int(part) for part in str(version).split('.')[:2])
+        current_major, current_minor = (int(part) for part in configuration.version.split('.')[:2])
+    except ValueError:
+        return False
+
+    return major == current_major and minor <= current_minor
+
+
+FileKey = Tuple[int, int, int]
+
+
+def file_key(path: str) -> FileKey:
+    """Return the inode, size and modification time of `path`, which change with its content."""
+    stat = os.stat(path)
+
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+class _RepositoryHandle(object):
+    """Parsed files of a repository, shared by every `Repository` of the same directory.
+
+    Each file is loaded again once its `file_key` changes.
+    """
+
+    __slots__ = ('lock', 'metadata_key', 'metadata', 'manifest_key', 'manifest')
+
+    def __init__(self) -> None:
+        """Initialize a handle with nothing loaded."""
+        self.lock = threading.Lock()
+        self.metadata_key: Optional[FileKey] = None
+        self.metadata: Dict[str, Any] = {}
+        self.manifest_key: Optional[FileKey] = None
+        self.manifest: Optional[Manifest] = None
+
+    def invalidate(self) -> None:
+        """Load every file again on next access."""
+        with self.lock:
+            self.metadata_key = self.manifest_key = None
+
+
+_handles: Dict[str, _RepositoryHandle] = {}
+_handles_lock = threading.Lock()
+
+
+def _handle(directory: str) -> _RepositoryHandle:
+    """Return the process-wide handle of the repository at the absolute path `directory`."""
+    handle = _handles.get(directory)
+    if handle is None:
+        with _handles_lock:
+            handle = _handles.setdefault(directory, _RepositoryHandle())
+
+    return handle
+
+
+_Method = TypeVar('_Method', bound=Callable[..., Any])
+
+
+def _operation(name: str) -> Callable[[_Method], _Method]:
+    """Record calls to the decorated `Repository` method as operation `name`.
+
+    See :func:`metrics.operation`, the metrics summary is written into the repository.
+    """
+    def decorator(method: _Method) -> _Method:
+        @functools.wraps(method)
+        def wrapper(self: 'Repository', *args: Any, **kwargs: Any) -> Any:
+            from . import metrics
+
+            with metrics.operation(name, self.directory):
+                return method(self, *args, **kwargs)
+        return cast(_Method, wrapper)
+    return decorator
 
 
 class Repository(object):
@@ -44,8 +142,45 @@ class Repository(object):
     supported_url_schemas = ('file', 'http', 'https')
 
     def __init__(self, directory: str) -> None:
-        """Attempt to load existing repository configuration."""
-        pass
+        """Refer to the repository in `directory`, its files are loaded on first access.
+
+        Parsed files are cached for the whole process and shared by every instance referring
+        to the same directory.
+        """
+        self.directory: str = os.path.abspath(directory)
+        self._handle = _handle(self.directory)
+
+    @property
+    def index_file_path(self) -> str:
+        """Return the absolute path of the repository index file."""
+        return os.path.join(self.directory, configuration.index_directory,
+                            configuration.index_file)
+
+    @property
+    def journal_path(self) -> str:
+        """Return the absolute path of the transfer journal."""
+        return os.path.join(self.directory, configuration.index_directory,
+                            configuration.journal_file)
+
+    @property
+    def metadata(self) -> Dict[str, Any]:
+        """Return the content of the repository index file.
+
+        :class:`exceptions.UnsupportedVersion` is raised if the repository was written by an
+        incompatible version.
+        """
+        key = file_key(self.index_file_path)
+        handle = self._handle
+        with handle.lock:
+            if handle.metadata_key != key:
+                with open(self.index_file_path, mode='rb') as index_file:
+                    metadata = msgpack.unpackb(index_file.read(), raw=False)
+                version = metadata.get('configuration_version')
+                if not compatible_version(version):
+                    raise exceptions.UnsupportedVersion(version)
+                handle.metadata, handle.metadata_key = metadata, key
+
+            return dict(handle.metadata)
 
     @staticmethod
     def check_presence(directory: str) -> bool:
@@ -60,15 +195,52 @@ class Repository(object):
             os.path.isfile(index_file_path),
         ])
 
+    @property
+    def subscriptions(self) -> Optional[List[str]]:
+        """Return the top-level mod folders synchronized, None for the whole repository."""
+        return self.metadata.get('subscriptions')
+
+    def subscribe(self, folders: Optional[Iterable[str]]) -> None:
+        """Only synchronize the top-level mod `folders` from now on, or everything with None.
+
+        Files at the root of the repository are not part of any subscription. Folders no
+        longer subscribed are left alone: they are no longer indexed, updated or deleted.
+        """
+        metadata = self.metadata
+        if folders is None:
+            metadata.pop('subscriptions', None)
+        else:
+            metadata['subscriptions'] = sorted(set(folders))
+        from .fileutils import atomic_write
+
+        atomic_write(self.index_file_path, msgpack.packb(metadata))
+
+    @property
+    def mirrors(self) -> List[str]:
+        """Return the URLs of the mirrors of the remote repository, on top of its URL."""
+        return self.metadata.get('mirrors', [])
+
     @classmethod
-    def initialize(cls, directory: str, display_name: str, url: str, overwrite: bool = False) \
-            -> 'Repository':
-        """Create new repository using `directory` as location."""
-        if not valid_url(url):
-            raise exceptions.InvalidURL('URL is not valid')
+    def initialize(cls, directory: str, display_name: str, url: str, overwrite: bool = False,
+                   subscriptions: Optional[Iterable[str]] = None,
+                   mirrors: Sequence[str] = ()) -> 'Repository':
+        """Create new repository using `directory` as location.
+
+        `subscriptions` lists the top-level mod folders to synchronize, see :meth:`subscribe`.
+        `mirrors` lists URLs serving the same repository as `url`, over HTTP like it.
+        """
+        for repository_url in [url] + list(mirrors):
+            if not valid_url(repository_url):
+                raise exceptions.InvalidURL('URL is not valid')
         parsed_url = urlparse(url)
         if parsed_url.scheme not in cls.supported_url_schemas:
             raise exceptions.UnsupportedURLSchema(cls.supported_url_schemas)
+        if mirrors:
+            from .download import Downloader
+
+            if any(urlparse(repository_url).scheme not in Downloader.supported_url_schemas
+                   for repository_url in [url] + list(mirrors)):
+                raise exceptions.UnsupportedURLSchema(Downloader.supported_url_schemas)
 
         path = os.path.abspath(directory)
         if not os.path.isdir(path):
@@ -84,11 +256,262 @@ class Repository(object):
         os.makedirs(index_directory_path, exist_ok=True)
 
         index_file_path = os.path.join(index_directory_path, configuration.index_file)
-        repository_index = {'display_name': display_name, 'url': url,
-                            'configuration_version': configuration.version,
-                            'index_file_name': configuration.index_file,
-                            'sync_file_extension': configuration.extension}
+        repository_index: Dict[str, Any] = {
+            'display_name': display_name, 'url': url,
+            'configuration_version': configuration.version,
+            'index_file_name': configuration.index_file,
+            'sync_file_extension': configuration.extension}
+        if subscriptions is not None:
+            repository_index['subscriptions'] = sorted(set(subscriptions))
+        if mirrors:
+            repository_index['mirrors'] = list(mirrors)
         with open(index_file_path, mode='wb') as index_file:
             index_file.write(msgpack.packb(repository_index))
+        _handle(path).invalidate()
 
         return cls(directory)
+
+    @property
+    def stat_cache_path(self) -> str:
+        """Return the absolute path of the stat cache used by incremental indexing."""
+        return os.path.join(self.directory, configuration.index_directory,
+                            configuration.stat_cache_file)
+
+    @property
+    def manifest_path(self) -> str:
+        """Return the absolute path of the file manifest."""
+        return os.path.join(self.directory, configuration.index_directory,
+                            configuration.manifest_file)
+
+    @property
+    def remote_manifest_path(self) -> str:
+        """Return the absolute path of the remote manifest kept since the last sync."""
+        return os.path.join(self.directory, configuration.index_directory,
+                            configuration.remote_manifest_file)
+
+    @property
+    def chunk_table_path(self) -> str:
+        """Return the absolute path of the chunk deduplication table."""
+        return os.path.join(self.directory, configuration.index_directory,
+                            configuration.chunk_table_file)
+
+    @_operation('index')
+    def build_index(self, workers: Optional[int] = None, incremental: bool = True,
+                    content_defined_chunking: bool = False,
+                    trusted: Optional[Mapping[str, Sequence[Any]]] = None,
+                    write_signatures: bool = True,
+                    changed: Optional[Iterable[str]] = None,
+                    progress: Optional['ProgressCallback'] = None,
+                    stop: Optional[threading.Event] = None) -> 'indexer.IndexResult':
+        """Hash the files of the repository and store them in the manifest file.
+
+        Hashing is spread over a pool of `workers` processes, one per CPU by default. In
+        `incremental` mode only files whose stat information changed since the previous run
+        are hashed. With `content_defined_chunking`, changed files are also split into
+        content-defined chunks recorded in the chunk deduplication table, and the result
+        carries the deduplication statistics. `trusted`, `write_signatures` and the `changed`
+        paths limiting an incremental run are passed to :func:`indexer.build`. Only the
+        subscribed folders are indexed, see :meth:`subscribe`.
+
+        `progress` is called with the size of hashed files. Once `stop` is set,
+        :class:`exceptions.Cancelled` is raised and the manifest is left as it was.
+        """
+        from . import chunking
+        from . import indexer
+        from .manifest import write_manifest
+
+        stat_cache = indexer.load_stat_cache(self.stat_cache_path) if incremental else None
+        result = indexer.build(self.directory, workers, stat_cache, trusted, write_signatures,
+                               changed, self.subscriptions, progress, stop)
+        if content_defined_chunking:
+            chunk_table = chunking.ChunkTable.load(self.chunk_table_path)
+            statistics = chunk_table.update(self.directory, result.entries, workers)
+            if chunk_table.dirty:
+                chunk_table.save(self.chunk_table_path)
+            result = result._replace(chunk_statistics=statistics)
+        if stat_cache is not None and stat_cache.timestamp and not result.changed and \
+                os.path.isfile(self.manifest_path):
+            return result
+
+        write_manifest(self.manifest_path, (entry.pack() for entry in result.entries))
+        indexer.save_stat_cache(self.stat_cache_path, result.stat_cache)
+
+        return result
+
+    def open_manifest(self) -> Manifest:
+        """Open the manifest written by the last :meth:`build_index` for the caller to close."""
+        return Manifest(self.manifest_path)
+
+    @property
+    def manifest(self) -> Manifest:
+        """Return the shared handle on the manifest, opened again when the file changes.
+
+        The handle is shared by every instance referring to the same directory and must not be
+        closed.
+        """
+        key = file_key(self.manifest_path)
+        handle = self._handle
+        with handle.lock:
+            if handle.manifest is None or handle.manifest_key != key:
+                handle.manifest, handle.manifest_key = self.open_manifest(), key
+
+            return handle.manifest
+
+    def lookup(self, relative_path: str) -> Optional[FileEntry]:
+        """Return the manifest entry of `relative_path`, None if the file is not indexed."""
+        return self.manifest.get(relative_path)
+
+    def plan_sync(self, remote_manifest: Iterable[Sequence[Any]]) -> 'plan.SyncPlan':
+        """Return the operations synchronizing the last built index with `remote_manifest`."""
+        from . import metrics
+        from . import plan
+
+        with metrics.stage(metrics.DIFF) as stage:
+            sync_plan = plan.plan_sync(self.manifest if os.path.isfile(self.manifest_path)
+                                       else [], remote_manifest)
+            stage.count(len(sync_plan.transfers), sync_plan.bytes_to_transfer)
+
+        return sync_plan
+
+    @_operation('sync')
+    def sync(self, workers: Optional[int] = None, progress: Optional['ProgressCallback'] = None,
+             link: bool = False, bucket: Optional['bandwidth.TokenBucket'] = None,
+             optional_mods: Collection[str] = (),
+             stop: Optional[threading.Event] = None) -> 'TransferResult':
+        """Synchronize the repository with the remote repository at the configured URL.
+
+        Local files whose content is still needed are moved or copied to their new path,
+        files absent from the remote are deleted and other files are downloaded, compressed
+        when the remote published a compressed blob of them. Large modified files only fetch
+        the blocks their local copy does not hold. Files of repositories published with
+        chunks fetch the chunks they share with other transferred files once, and reuse those
+        the local chunk table locates. Progress is recorded in the transfer journal, so that a
+        synchronization interrupted at any point resumes without fetching or verifying
+        committed data again.
+
+        Repositories with a ``file`` URL are read through the filesystem, their index must be
+        up to date. Their files are reflinked or copied within the kernel, or hard linked
+        with `link` so that they use no additional disk space.
+
+        Files of HTTP repositories with mirrors are fetched from all of them, in proportion to
+        their measured speed, failing over between them, see :meth:`Downloader.fetch`.
+
+        Downloads share the rate limit of `bucket`, if any, files of `optional_mods` folders
+        and large files coming last, see :mod:`bandwidth`.
+
+        With subscriptions, only the subscribed folders are indexed, compared and transferred,
+        and only their manifest shards are fetched from published repositories.
+
+        The remote manifest is kept between synchronizations: published repositories only
+        send the delta indexes of the revisions published since, see
+        :func:`transfer.update_manifest`.
+
+        Once `stop` is set, workers stop after their current piece of data and
+        :class:`exceptions.Cancelled` is raised, the journal keeping the progress made.
+        """
+        from . import chunking
+        from . import indexer
+        from . import plan
+        from . import transfer
+        from .download import Downloader
+        from .journal import TransferJournal
+
+        url = self.metadata['url']
+        scheme = urlparse(url).scheme
+        if scheme != 'file' and scheme not in Downloader.supported_url_schemas:
+            raise exceptions.UnsupportedURLSchema(('file',) + Downloader.supported_url_schemas)
+
+        journal = TransferJournal.load(self.journal_path)
+        if scheme == 'file':
+            source = transfer.local_path(url)
+            self.build_index(workers, trusted=journal.completed, write_signatures=False,
+                             stop=stop)
+            with Manifest(os.path.join(source, configuration.index_directory,
+                                       configuration.manifest_file)) as remote:
+                subscriptions = self.subscriptions
+                sync_plan = self.plan_sync(remote if subscriptions is None
+                                           else remote.select(subscriptions))
+            plan.apply_local_changes(self.directory, sync_plan, journal)
+            result = transfer.copy_files(self.directory, source, sync_plan.transfers, journal,
+                                         workers, link, progress, stop)
+        else:
+            mirrors = self.mirrors
+            with Downloader(workers, bucket=bucket,
+                            mirrors=[url] + mirrors if mirrors else None,
+                            stop=stop) as downloader:
+                downloader.probe(configuration.index_directory + '/' + configuration.index_file)
+                self.build_index(workers, trusted=journal.completed, write_signatures=False,
+                                 stop=stop)
+                subscriptions = self.subscriptions
+                publication = transfer.fetch_publication(url, downloader)
+                with transfer.fetch_manifest(url, downloader, self.remote_manifest_path,
+                                             subscriptions, publication) as remote:
+                    sync_plan = self.plan_sync(remote)
+                plan.apply_local_changes(self.directory, sync_plan, journal)
+                compressed = transfer.fetch_compressed_table(
+                    url, downloader, publication, subscriptions) if sync_plan.transfers else {}
+                recipes = transfer.fetch_recipes(
+                    url, downloader, publication,
+                    {indexer.mod_folder(entry.path) for entry in sync_plan.transfers}) \
+                    if publication is not None else {}
+                chunk_sources = chunking.ChunkTable.load(self.chunk_table_path).locations(
+                    self.directory) if recipes else None
+                result = transfer.transfer_files(self.directory, url, sync_plan.transfers,
+                                                 journal, downloader, progress, compressed,
+                                                 optional_mods, recipes, chunk_sources)
+
+        self.build_index(workers, trusted=journal.completed, write_signatures=False)
+        journal.clear()
+
+        return result
+
+    def watch(self, workers: Optional[int] = None, stop: Optional[threading.Event] = None,
+              on_update: Optional[Callable[['indexer.IndexResult'], Any]] = None,
+              polling: bool = False) -> None:
+        """Keep the index up to date with the changes made to the repository until `stop`.
+
+        Changed paths are batched and only they are looked at by the incremental indexer,
+        see :func:`watcher.watch`. `on_update` is called with the result of every update.
+        With `polling`, the tree is scanned periodically instead of relying on inotify.
+        """
+        from . import watcher
+
+        def update(changed: 'watcher.Changes') -> None:
+            result = self.build_index(workers, changed=changed)
+            if on_update is not None:
+                on_update(result)
+
+        watcher.watch(self.directory, update, stop, polling)
+
+    @_operation('verify')
+    def verify(self, mode: str = 'quick', workers: Optional[int] = None,
+               progress: Optional['ProgressCallback'] = None,
+               stop: Optional[threading.Event] = None) -> 'VerifyResult':
+        """Check that the files of the repository match the remote manifest or the index.
+
+        Files are checked against the remote manifest kept by the last :meth:`sync`, if any,
+        so that a file corrupted then indexed again is still reported, and against the last
+        built index otherwise. In ``quick`` mode, files indexed with another content than
+        the remote one are reported without reading them.
+
+        `mode` is ``quick`` to compare stat information only, ``sampled`` to also check
+        random blocks against sidecar signatures, or ``full`` to hash every file with
+        `workers` processes. `progress` and `stop` are passed to :func:`verify.verify`.
+        """
+        from . import metrics
+        from . import verify
+
+        with metrics.stage(metrics.VERIFY) as stage:
+            if os.path.isfile(self.remote_manifest_path):
+                with Manifest(self.remote_manifest_path) as remote:
+                    subscriptions = self.subscriptions
+                    result = verify.verify_remote(
+                        self.directory, remote if subscriptions is None
+                        else remote.select(subscriptions), self.manifest.get, mode, workers,
+                        progress=progress, stop=stop)
+            else:
+                result = verify.verify(self.directory, self.manifest, mode, workers,
+                                       progress=progress, stop=stop)
+            stage.count(result.files, result.checked_bytes)
+
+        return result
@@ -0,0 +1,203 @@
+# --------------------------------License Notice----------------------------------
+# CNTOSync - Carpe Noctem Tactical Operations ArmA3 mod synchronization tool
+# Copyright (C) 2018 Carpe Noctem - Tactical Operations (aka. CNTO) (contact@carpenoctem.co)
+#
+# The authors of this software are listed in the AUTHORS file at the
+# root of this software's source code tree.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# All rights reserved.
+# --------------------------------License Notice----------------------------------
+
+"""Provide filesystem helpers shared by the repository operations."""
+
+import errno
+import os
+import sys
+import tempfile
+from contextlib import contextmanager
+from typing import BinaryIO, Iterator
+
+from . import configuration
+
+if sys.platform.startswith('linux'):
+    import fcntl
+
+# Linux ioctl making a file share the extents of another one, see ioctl_ficlone(2).
+_FICLONE = 0x40049409
+# Errors telling a copy or link method is not supported between the files involved.
+_UNSUPPORTED_ERRORS = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP,
+                       errno.ENOTSUP, errno.ETXTBSY, errno.EPERM, errno.EMLINK, errno.ENOTTY}
+
+
+@contextmanager
+def atomic_open(path: str) -> Iterator[BinaryIO]:
+    """Yield a binary stream whose content replaces `path` once the block exits successfully.
+
+    The data is written to a temporary file in the same directory, flushed to disk, then
+    renamed over `path`, so that readers never see a partial file.
+    """
+    directory, name = os.path.split(path)
+    descriptor, temporary_path = tempfile.mkstemp(prefix='.' + name + '.', dir=directory)
+    try:
+        with os.fdopen(descriptor, mode='wb') as stream:
+            yield stream
+            stream.flush()
+            os.fsync(stream.fileno())
+        os.replace(temporary_path, path)
+    finally:
+        if os.path.exists(temporary_path):
+            os.unlink(temporary_path)
+
+
+def atomic_write(path: str, data: bytes) -> None:
+    """Replace the content of `path` with `data` so that readers never see a partial file."""
+    with atomic_open(path) as stream:
+        stream.write(data)
+
+
+def allocate(descriptor: int, size: int) -> None:
+    """Extend the file of `descriptor` to `size` bytes, reserving disk space when supported.
+
+    Reserved space is allocated in as few extents as possible, so that files written in
+    pieces are not fragmented.
+    """
+    if size and hasattr(os, 'posix_fallocate'):
+        try:
+            os.posix_fallocate(descriptor, 0, size)
+            return
+        except OSError:
+            pass
+    os.ftruncate(descriptor, size)
+
+
+def sync_directory(path: str) -> None:
+    """Flush the entries of directory `path` to disk, so that renames into it are durable.
+
+    Directories cannot be opened on every platform, they are then left alone.
+    """
+    try:
+        descriptor = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(descriptor)
+    except OSError as error:
+        if error.errno not in (errno.EINVAL, errno.EBADF, errno.EACCES):
+            raise
+    finally:
+        os.close(descriptor)
+
+
+def reflink(source: int, target: int) -> bool:
+    """Make descriptor `target` share the data of `source`, tell whether it succeeded.
+
+    Reflinks are supported by copy-on-write filesystems such as Btrfs and XFS: no data is
+    copied and no disk space is used until either file is modified.
+    """
+    if not sys.platform.startswith('linux'):
+        return False
+    try:
+        fcntl.ioctl(target, _FICLONE, source)
+    except OSError as error:
+        if error.errno not in _UNSUPPORTED_ERRORS:
+            raise
+        return False
+
+    return True
+
+
+def copy_range(source: int, target: int, size: int) -> int:
+    """Copy `size` bytes from the position of descriptor `source` to `target`.
+
+    Data is copied within the kernel with :func:`os.copy_file_range`, which network and
+    copy-on-write filesystems may serve without transferring data, or :func:`os.sendfile`,
+    falling back to reads and writes. Return the number of bytes copied, less than `size`
+    if `source` ends before.
+    """
+    copied = 0
+    if hasattr(os, 'copy_file_range'):
+        try:
+            while copied < size:
+                count = os.copy_file_range(source, target, size - copied)
+                if not count:
+                    return copied
+                copied += count
+        except OSError as error:
+            if error.errno not in _UNSUPPORTED_ERRORS or copied:
+                raise
+    if copied < size and sys.platform.startswith('linux'):
+        try:
+            while copied < size:
+                count = os.sendfile(target, source, None, size - copied)
+                if not count:
+                    return copied
+                copied += count
+        except OSError as error:
+            if error.errno not in _UNSUPPORTED_ERRORS or copied:
+                raise
+    while copied < size:
+        data = os.read(source, min(configuration.read_chunk_size, size - copied))
+        if not data:
+            break
+        os.write(target, data)
+        copied += len(data)
+
+    return copied
+
+
+def clone_file(source_path: str, target_path: str, link: bool = False) -> str:
+    """Create `target_path` with the content of `source_path`, copying as little as possible.
+
+    With `link`, `target_path` is made a hard link of `source_path` when both are on the same
+    filesystem, so that they share their data and any later change. Otherwise the data is
+    shared by a reflink or copied within the kernel. Return the method used, ``hardlink``,
+    ``reflink`` or ``copy``.
+    """
+    if link:
+        try:
+            os.link(source_path, target_path)
+            return 'hardlink'
+        except OSError as error:
+            if error.errno not in _UNSUPPORTED_ERRORS:
+                raise
+
+    with open(source_path, mode='rb', buffering=0) as source, \
+            open(target_path, mode='wb', buffering=0) as target:
+        if reflink(source.fileno(), target.fileno()):
+            return 'reflink'
+        size = os.fstat(source.fileno()).st_size
+        copy_range(source.fileno(), target.fileno(), size)
+
+    return 'copy'
+
+
+def copy_file(source_path: str, target_path: str, link: bool = False) -> str:
+    """Replace `target_path` with a clone of `source_path`, see :func:`clone_file`.
+
+    The clone is made next to `target_path` then renamed over it, so that files hard linked
+    to the previous `target_path` are left untouched.
+    """
+    directory, name = os.path.split(target_path)
+    descriptor, temporary_path = tempfile.mkstemp(prefix='.' + name + '.', dir=directory)
+    os.close(descriptor)
+    try:
+        os.remove(temporary_path)
+        method = clone_file(source_path, temporary_path, link)
+        os.replace(temporary_path, target_path)
+    finally:
+        if os.path.exists(temporary_path):
+            os.unlink(temporary_path)
+
+    return method
@@ -0,0 +1,437 @@
+# --------------------------------License Notice----------------------------------
+# CNTOSync - Carpe Noctem Tactical Operations ArmA3 mod synchronization tool
+# Copyright (C) 2018 Carpe Noctem - Tactical Operations (aka. CNTO) (contact@carpenoctem.co)
+#
+# The authors of this software are listed in the AUTHORS file at the
+# root of this software's source code tree.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# All rights reserved.
+# --------------------------------License Notice----------------------------------
+
+"""Build the file manifest of a repository by hashing its content."""
+
+import bisect
+import hashlib
+import os
+import stat as stat_module
+import threading
+import time
+from typing import Any, Callable, Collection, Dict, Iterable, Iterator, List, Mapping, \
+    NamedTuple, Optional, Sequence, Set, Tuple, Union
+
+import msgpack
+
+from . import chunking
+from . import compression
+from . import configuration
+from . import exceptions
+from . import metrics
+from . import signature
+from .fileutils import atomic_write
+from .manifest import FileEntry
+
+
+class StatCache(NamedTuple):
+    """Stat information and digest of every file seen by the previous indexing run.
+
+    `files` maps relative paths to ``[inode, size, mtime_ns, digest]``. `timestamp` is the
+    time in nanoseconds at which the scan started: files modified at or after it may have
+    changed again within the filesystem timestamp granularity and are always re-hashed.
+    """
+
+    timestamp: int
+    files: Dict[str, Sequence[Any]]
+
+
+class IndexResult(NamedTuple):
+    """Outcome of an indexing run.
+
+    `renamed` holds ``(old_path, new_path)`` pairs, these paths are neither part of `added`
+    nor of `deleted`. `chunk_statistics` is only set when content-defined chunking ran.
+    """
+
+    entries: List[FileEntry]
+    hashed_files: int
+    hashed_bytes: int
+    added: List[str]
+    modified: List[str]
+    deleted: List[str]
+    renamed: List[Tuple[str, str]]
+    stat_cache: StatCache
+    chunk_statistics: Optional[chunking.ChunkStatistics] = None
+
+    @property
+    def changed(self) -> bool:
+        """Tell whether any file was hashed or the manifest differs from the previous run."""
+        return bool(self.hashed_files or self.added or self.modified or self.deleted
+                    or self.renamed)
+
+
+class _CachedStat(NamedTuple):
+    """Stat information of a file taken from the stat cache instead of the filesystem."""
+
+    st_ino: int
+    st_size: int
+    st_mtime_ns: int
+
+
+def mod_folder(relative_path: str) -> str:
+    """Return the top-level folder of the relative POSIX path, empty for files at the root."""
+    folder, separator, _ = relative_path.partition('/')
+
+    return folder if separator else ''
+
+
+def new_hash() -> Any:
+    """Return a fresh BLAKE2b hash object of the configured digest size."""
+    return hashlib.blake2b(digest_size=configuration.digest_size)
+
+
+def hash_file(path: str, write_signature: bool = False) -> bytes:
+    """Return the digest of the file at `path`, reading it in fixed-size chunks.
+
+    With `write_signature`, the block signature of files needing a sidecar is computed in the
+    same pass and stored in their sidecar file along with the compression worth using when
+    transferring them, estimated from samples of their content.
+    """
+    digest = new_hash()
+    buffer = bytearray(configuration.read_chunk_size)
+    view = memoryview(buffer)
+    with open(path, mode='rb', buffering=0) as stream:
+        size = os.fstat(stream.fileno()).st_size
+        hasher = signature.BlockHasher() \
+            if write_signature and signature.needs_sidecar(size) else None
+        while True:
+            read = stream.readinto(buffer)
+            if not read:
+                break
+            digest.update(view[:read])
+            if hasher is not None:
+                hasher.update(view[:read])
+        choice = compression.choose_compression(stream, size) if hasher is not None else None
+
+    if hasher is not None:
+        atomic_write(signature.sidecar_path(path),
+                     hasher.finish(size, digest.digest(), choice).pack())
+
+    return digest.digest()
+
+
+def hash_batch(paths: Sequence[str], write_signatures: bool = False) -> List[bytes]:
+    """Return the digests of every file in `paths`, in order."""
+    return [hash_file(path, write_signatures) for path in paths]
+
+
+def _timed_hash_batch(paths: Sequence[str],
+                      write_signatures: bool = False) -> Tuple[List[bytes], float]:
+    """Return the digests of `paths` and the time spent hashing them in the worker."""
+    start = time.perf_counter()
+    digests = hash_batch(paths, write_signatures)
+    return digests, time.perf_counter() - start
+
+
+def scan(directory: str, sidecars: Optional[Set[str]] = None,
+         folders: Optional[Iterable[str]] = None) -> Iterator[Tuple[str, os.stat_result]]:
+    """Yield the relative POSIX path and stat of every file under `directory`.
+
+    The index directory of the repository is skipped. Sidecar files are not yielded, their
+    relative paths are added to `sidecars` when given. When `folders` are given, only these
+    top-level folders are scanned.
+    """
+    if folders is None:
+        pending = ['']
+    else:
+        pending = [folder + '/' for folder in folders
+                   if folder != configuration.index_directory and
+                   os.path.isdir(os.path.join(directory, folder)) and
+                   not os.path.islink(os.path.join(directory, folder))]
+    while pending:
+        relative = pending.pop()
+        with os.scandir(os.path.join(directory, relative)) as iterator:
+            for item in iterator:
+                relative_path = relative + item.name
+                if item.is_dir(follow_symlinks=False):
+                    if relative_path != configuration.index_directory:
+                        pending.append(relative_path + '/')
+                elif not item.is_file():
+                    continue
+                elif item.name.endswith(configuration.extension):
+                    if sidecars is not None:
+                        sidecars.add(relative_path)
+                else:
+                    yield relative_path, item.stat()
+
+
+def rescan(directory: str, cached_files: Mapping[str, Sequence[Any]], changed: Iterable[str],
+           sidecars: Set[str]) -> List[Tuple[str, Union[os.stat_result, _CachedStat]]]:
+    """Return the files under `directory`, only looking at the `changed` relative paths.
+
+    Files outside of `changed` are assumed unchanged since they were recorded in
+    `cached_files`, as are their sidecar files. Changed directories are scanned completely.
+    Sidecar files of changed paths are added to `sidecars`.
+    """
+    stats: Dict[str, Union[os.stat_result, _CachedStat]] = {
+        path: _CachedStat(*record[:3]) for path, record in cached_files.items()}
+    sidecar_size = signature.sidecar_min_size()
+    sidecars.update(path + configuration.extension for path, record in cached_files.items()
+                    if record[1] >= sidecar_size)
+    cached_paths = sorted(cached_files)
+    for relative_path in changed:
+        relative_path = relative_path.strip('/')
+        if not relative_path or relative_path.endswith(configuration.extension) or \
+                relative_path.split('/', 1)[0] == configuration.index_directory:
+            continue
+        prefix = relative_path + '/'
+        start = bisect.bisect_left(cached_paths, prefix)
+        end = bisect.bisect_left(cached_paths, prefix + chr(0x10ffff), start)
+        for path in [relative_path] + cached_paths[start:end]:
+            stats.pop(path, None)
+            sidecars.discard(path + configuration.extension)
+
+        path = os.path.join(directory, *relative_path.split('/'))
+        try:
+            stat = os.stat(path)
+        except (FileNotFoundError, NotADirectoryError):
+            stat = None
+        if stat is not None and stat_module.S_ISDIR(stat.st_mode) and not os.path.islink(path):
+            subtree_sidecars: Set[str] = set()
+            for subpath, substat in scan(path, subtree_sidecars):
+                stats[prefix + subpath] = substat
+            sidecars.update(prefix + sidecar for sidecar in subtree_sidecars)
+            continue
+        if stat is not None and stat_module.S_ISREG(stat.st_mode):
+            stats[relative_path] = stat
+        if os.path.isfile(path + configuration.extension):
+            sidecars.add(relative_path + configuration.extension)
+
+    return sorted(stats.items())
+
+
+def _batches(sizes: Sequence[Tuple[int, int]]) -> List[List[int]]:
+    """Group file positions into work units, biggest first.
+
+    `sizes` holds ``(position, size)`` pairs. Large files form a unit on their own so that
+    they are streamed by a single worker, small files are grouped to amortize the cost of
+    inter-process communication.
+    """
+    batches: List[List[int]] = []
+    small: List[int] = []
+    for position, size in sorted(sizes, key=lambda item: item[1], reverse=True):
+        if size >= configuration.small_file_threshold:
+            batches.append([position])
+            continue
+        small.append(position)
+        if len(small) == configuration.small_file_batch_size:
+            batches.append(small)
+            small = []
+    if small:
+        batches.append(small)
+
+    return batches
+
+
+def hash_files(paths: Sequence[str], sizes: Sequence[int], workers: Optional[int] = None,
+               write_signatures: bool = False,
+               progress: Optional[Callable[[int], None]] = None,
+               stop: Optional[threading.Event] = None) -> List[bytes]:
+    """Return the digests of `paths` computed on a process pool of `workers` processes.
+
+    `progress` is called with the size of every hashed batch of files. Once `stop` is set,
+    pending batches are dropped and :class:`exceptions.Cancelled` is raised without waiting for
+    running ones.
+    """
+    digests: List[bytes] = [b''] * len(paths)
+    batches = _batches(list(enumerate(sizes)))
+    if workers == 1 or len(batches) <= 1:
+        with metrics.pool('hash', 1, len(batches)) as pool:
+            for batch in batches:
+                if stop is not None and stop.is_set():
+                    raise exceptions.Cancelled('Hashing cancelled')
+                with pool.task():
+                    batch_digests = hash_batch([paths[i] for i in batch], write_signatures)
+                for position, digest in zip(batch, batch_digests):
+                    digests[position] = digest
+                if progress is not None:
+                    progress(sum(sizes[i] for i in batch))
+        return digests
+
+    from concurrent.futures import ProcessPoolExecutor, wait
+
+    executor = ProcessPoolExecutor(max_workers=workers)
+    cancelled = False
+    try:
+        with metrics.pool('hash', workers or os.cpu_count() or 1) as pool:
+            futures = [(batch, executor.submit(_timed_hash_batch, [paths[i] for i in batch],
+                                               write_signatures))
+                       for batch in batches]
+            for completed, (batch, future) in enumerate(futures, 1):
+                while stop is not None:
+                    if stop.is_set():
+                        cancelled = True
+                        for _, pending in futures:
+                            pending.cancel()
+                        raise exceptions.Cancelled('Hashing cancelled')
+                    if wait([future], configuration.cancel_poll_interval).done:
+                        break
+                batch_digests, elapsed = future.result()
+                pool.busy(elapsed)
+                pool.queue(len(futures) - completed)
+                for position, digest in zip(batch, batch_digests):
+                    digests[position] = digest
+                if progress is not None:
+                    progress(sum(sizes[i] for i in batch))
+    finally:
+        executor.shutdown(wait=not cancelled)
+
+    return digests
+
+
+def load_stat_cache(path: str) -> StatCache:
+    """Load the stat cache stored at `path`, an empty one if missing or unreadable."""
+    try:
+        with open(path, mode='rb') as stream:
+            timestamp, files = msgpack.unpackb(stream.read(), raw=False)
+    except (OSError, ValueError, TypeError, msgpack.exceptions.UnpackException):
+        return StatCache(0, {})
+
+    return StatCache(timestamp, files)
+
+
+def save_stat_cache(path: str, stat_cache: StatCache) -> None:
+    """Atomically store `stat_cache` at `path`."""
+    atomic_write(path, msgpack.packb([stat_cache.timestamp, stat_cache.files],
+                                     use_bin_type=True))
+
+
+def build(directory: str, workers: Optional[int] = None, stat_cache: Optional[StatCache] = None,
+          trusted: Optional[Mapping[str, Sequence[Any]]] = None, write_signatures: bool = True,
+          changed: Optional[Iterable[str]] = None,
+          folders: Optional[Collection[str]] = None,
+          progress: Optional[Callable[[int], None]] = None,
+          stop: Optional[threading.Event] = None) -> IndexResult:
+    """Hash the files under `directory` and return the sorted manifest.
+
+    When a `stat_cache` from a previous run is given, only files whose inode, size or
+    modification time changed are hashed. Files which disappeared while a new file with the
+    same stat information appeared are reported as renamed without being hashed.
+
+    `trusted` holds stat cache records known to be accurate, such as those of files written
+    and verified by a synchronization, they are used even if recent and reported as added or
+    modified when they differ from the stat cache.
+
+    With `write_signatures`, the sidecar signatures of files large enough for delta or
+    compressed transfers are kept in sync: written when hashing, moved along
+    renamed files and removed when stale.
+
+    When `changed` relative paths are given along with a `stat_cache`, only these files and
+    directories are looked at, see :func:`rescan`. When `folders` are given, only the files
+    of these top-level folders are indexed, files indexed before outside of them are reported
+    as deleted.
+
+    `progress` and `stop` are passed to :func:`hash_files`.
+    """
+    timestamp = time.time_ns() if hasattr(time, 'time_ns') else int(time.time() * 1e9)
+    previous = stat_cache.files if stat_cache is not None else {}
+    racy_after = stat_cache.timestamp if stat_cache is not None else 0
+    trusted = trusted or {}
+    cached_files = previous
+    if trusted:
+        previous = {**previous, **trusted}
+
+    sidecars: Set[str] = set()
+    with metrics.stage(metrics.SCAN) as stage:
+        if changed is not None and stat_cache is not None and folders is not None:
+            scanned = rescan(directory, {path: record for path, record in cached_files.items()
+                                         if mod_folder(path) in folders},
+                             [path for path in changed
+                              if path.strip('/').split('/', 1)[0] in folders], sidecars)
+        elif changed is not None and stat_cache is not None:
+            scanned = rescan(directory, cached_files, changed, sidecars)
+        else:
+            scanned = sorted(scan(directory, sidecars, folders))
+        stage.count(len(scanned))
+    current_paths = {relative_path for relative_path, _ in scanned}
+    vanished = {(value[0], value[1], value[2]): path for path, value in previous.items()
+                if path not in current_paths and value[0]}
+
+    files: Dict[str, Sequence[Any]] = {}
+    pending: List[Tuple[str, List[Any]]] = []
+    added: List[str] = []
+    modified: List[str] = []
+    renamed: List[Tuple[str, str]] = []
+    for relative_path, stat in scanned:
+        inode, size, mtime = stat.st_ino, stat.st_size, stat.st_mtime_ns
+        cached = previous.get(relative_path)
+        needs_sidecar = write_signatures and signature.needs_sidecar(size) and \
+            relative_path + configuration.extension not in sidecars
+        if cached is not None and cached[0] == inode and cached[1] == size and \
+                cached[2] == mtime and (mtime < racy_after or relative_path in trusted) and \
+                not needs_sidecar:
+            files[relative_path] = [inode, size, mtime, cached[3]]
+            if relative_path in trusted and cached_files.get(relative_path) != cached:
+                (modified if relative_path in cached_files else added).append(relative_path)
+            continue
+
+        record = [inode, size, mtime, b'']
+        files[relative_path] = record
+        key = (inode, size, mtime)
+        if cached is not None:
+            modified.append(relative_path)
+        elif key in vanished and mtime < racy_after:
+            old_path = vanished.pop(key)
+            renamed.append((old_path, relative_path))
+            record[3] = previous[old_path][3]
+            old_sidecar = old_path + configuration.extension
+            if old_sidecar in sidecars:
+                os.replace(os.path.join(directory, old_sidecar),
+                           os.path.join(directory, relative_path + configuration.extension))
+                sidecars.discard(old_sidecar)
+                sidecars.add(relative_path + configuration.extension)
+            elif write_signatures and signature.needs_sidecar(size):
+                pending.append((relative_path, record))
+            continue
+        else:
+            added.append(relative_path)
+        pending.append((relative_path, record))
+
+    hashed_sizes = [record[1] for _, record in pending]
+    with metrics.stage(metrics.HASH) as stage:
+        hashed = hash_files([os.path.join(directory, relative_path)
+                             for relative_path, _ in pending],
+                            hashed_sizes, workers, write_signatures, progress, stop)
+        stage.count(len(pending), sum(hashed_sizes))
+    unchanged = set()
+    for (relative_path, record), digest in zip(pending, hashed):
+        record[3] = digest
+        if relative_path in previous and previous[relative_path][3] == digest:
+            unchanged.add(relative_path)
+    modified = [relative_path for relative_path in modified if relative_path not in unchanged]
+
+    for sidecar in sidecars if write_signatures else ():
+        described = files.get(sidecar[:-len(configuration.extension)])
+        if described is None or not signature.needs_sidecar(described[1]):
+            try:
+                os.remove(os.path.join(directory, sidecar))
+            except FileNotFoundError:
+                pass
+
+    renamed_from = {old_path for old_path, _ in renamed}
+    deleted = sorted(path for path in previous
+                     if path not in current_paths and path not in renamed_from)
+    entries = [FileEntry(relative_path, record[1], record[2], record[3])
+               for relative_path, record in files.items()]
+
+    return IndexResult(entries, len(pending), sum(hashed_sizes), added, modified, deleted,
+                       renamed, StatCache(timestamp, files))
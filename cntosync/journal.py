@@ -0,0 +1,185 @@
+# --------------------------------License Notice----------------------------------
+# CNTOSync - Carpe Noctem Tactical Operations ArmA3 mod synchronization tool
+# Copyright (C) 2018 Carpe Noctem - Tactical Operations (aka. CNTO) (contact@carpenoctem.co)
+#
+# The authors of this software are listed in the AUTHORS file at the
+# root of this software's source code tree.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# All rights reserved.
+# --------------------------------License Notice----------------------------------
+
+"""Record the progress of a synchronization so that it can resume after an interruption.
+
+The journal keeps the byte ranges already written to each partially downloaded file and the
+files already completed, with their stat information so that they are trusted on resume
+without being hashed again. It is persisted atomically, a range being recorded only once its
+data reached the disk.
+"""
+
+import os
+import shutil
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import msgpack
+
+from . import configuration
+from .fileutils import atomic_write
+
+Range = Tuple[int, int]
+
+
+def merge_ranges(ranges: Sequence[Range]) -> List[Range]:
+    """Return `ranges` of ``(offset, length)`` sorted with overlapping or adjacent ones merged."""
+    merged: List[Range] = []
+    for offset, length in sorted(ranges):
+        if merged and merged[-1][0] + merged[-1][1] >= offset:
+            last_offset, last_length = merged[-1]
+            merged[-1] = (last_offset, max(last_length, offset + length - last_offset))
+        else:
+            merged.append((offset, length))
+
+    return merged
+
+
+class TransferJournal(object):
+    """Persistent record of completed files and byte ranges of a synchronization.
+
+    `completed` maps relative paths to ``[inode, size, mtime_ns, digest]`` as in the stat
+    cache, `partial` maps the digest of a file being downloaded to its completed ranges.
+    Methods are safe to call from several download threads.
+    """
+
+    def __init__(self, path: str, completed: Optional[Dict[str, List[Any]]] = None,
+                 partial: Optional[Dict[bytes, List[Range]]] = None) -> None:
+        """Initialize a journal persisted at `path`."""
+        self.path: str = path
+        self.completed: Dict[str, List[Any]] = completed or {}
+        self.partial: Dict[bytes, List[Range]] = partial or {}
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._flushed_at = time.monotonic()
+
+    @classmethod
+    def load(cls, path: str) -> 'TransferJournal':
+        """Load the journal stored at `path`, an empty one if missing or unreadable."""
+        try:
+            with open(path, mode='rb') as stream:
+                completed, partial = msgpack.unpackb(stream.read(), raw=False)
+        except (OSError, ValueError, TypeError, msgpack.exceptions.UnpackException):
+            return cls(path)
+
+        return cls(path, completed, {digest: [tuple(item) for item in ranges]
+                                     for digest, ranges in partial.items()})
+
+    @property
+    def partial_directory(self) -> str:
+        """Return the directory holding partially downloaded files."""
+        return os.path.join(os.path.dirname(self.path), configuration.partial_directory)
+
+    def partial_path(self, digest: bytes) -> str:
+        """Return the path of the partially downloaded file of content `digest`."""
+        return os.path.join(self.partial_directory, digest.hex())
+
+    def chunk_path(self, digest: bytes) -> str:
+        """Return the path of the downloaded chunk `digest`, kept until the journal is cleared."""
+        return os.path.join(self.partial_directory, configuration.object_directory,
+                            digest.hex())
+
+    def missing_ranges(self, digest: bytes, size: int) -> List[Range]:
+        """Return the ranges of the file of content `digest` not downloaded yet."""
+        with self._lock:
+            done = self.partial.get(digest, [])
+        missing: List[Range] = []
+        position = 0
+        for offset, length in done:
+            if offset > position:
+                missing.append((position, offset - position))
+            position = max(position, offset + length)
+        if position < size:
+            missing.append((position, size - position))
+
+        return missing
+
+    def start_file(self, digest: bytes) -> bool:
+        """Register a download of content `digest`, return False if one was already started."""
+        with self._lock:
+            if digest in self.partial:
+                return False
+            self.partial[digest] = []
+            self._dirty = True
+            return True
+
+    def complete_range(self, digest: bytes, offset: int, length: int) -> None:
+        """Record that `length` bytes from `offset` of content `digest` are on disk."""
+        with self._lock:
+            self.partial[digest] = merge_ranges(self.partial.get(digest, []) +
+                                                [(offset, length)])
+            self._dirty = True
+
+    def complete_file(self, relative_path: str, digest: bytes, stat: os.stat_result) -> None:
+        """Record that `relative_path` holds content `digest` and drop its partial ranges."""
+        with self._lock:
+            self.partial.pop(digest, None)
+            self.completed[relative_path] = [stat.st_ino, stat.st_size, stat.st_mtime_ns, digest]
+            self._dirty = True
+
+    def discard(self, digest: bytes) -> None:
+        """Forget the partial download of content `digest` and remove its file."""
+        with self._lock:
+            if self.partial.pop(digest, None) is not None:
+                self._dirty = True
+        try:
+            os.remove(self.partial_path(digest))
+        except FileNotFoundError:
+            pass
+
+    def is_completed(self, relative_path: str, digest: bytes, stat: os.stat_result) -> bool:
+        """Tell whether `relative_path` was completed with content `digest` and is unchanged."""
+        with self._lock:
+            record = self.completed.get(relative_path)
+        return record is not None and record[3] == digest and \
+            record[:3] == [stat.st_ino, stat.st_size, stat.st_mtime_ns]
+
+    def flush(self, force: bool = False) -> None:
+        """Persist the journal if it changed, at most once per flush interval unless `force`."""
+        with self._lock:
+            if not self._dirty or (not force and time.monotonic() - self._flushed_at <
+                                   configuration.journal_flush_interval):
+                return
+            data = msgpack.packb([self.completed, self.partial], use_bin_type=True)
+            self._dirty = False
+            self._flushed_at = time.monotonic()
+            atomic_write(self.path, data)
+
+    def clear(self) -> None:
+        """Forget everything and remove the persisted journal, partial files and chunks."""
+        with self._lock:
+            self.completed.clear()
+            digests = list(self.partial)
+            self.partial.clear()
+            self._dirty = False
+        for digest in digests:
+            try:
+                os.remove(self.partial_path(digest))
+            except FileNotFoundError:
+                pass
+        shutil.rmtree(os.path.join(self.partial_directory, configuration.object_directory),
+                      ignore_errors=True)
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
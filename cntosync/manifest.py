@@ -0,0 +1,262 @@
+# --------------------------------License Notice----------------------------------
+# CNTOSync - Carpe Noctem Tactical Operations ArmA3 mod synchronization tool
+# Copyright (C) 2018 Carpe Noctem - Tactical Operations (aka. CNTO) (contact@carpenoctem.co)
+#
+# The authors of this software are listed in the AUTHORS file at the
+# root of this software's source code tree.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# All rights reserved.
+# --------------------------------License Notice----------------------------------
+
+"""Store the file manifest of a repository in a streaming, seekable format.
+
+A manifest file starts with a magic header followed by one msgpack record per file, sorted by
+path. The records are followed by a table of their offsets, as little-endian 64-bit integers,
+and by a footer holding the record count and the table offset. Records can then be streamed
+with a bounded buffer, or looked up by path with a binary search on the memory-mapped file
+which compares the encoded paths in place and only decodes the record found.
+"""
+
+import mmap
+import os
+import struct
+import sys
+from array import array
+from typing import Any, BinaryIO, Iterable, Iterator, List, Mapping, NamedTuple, Optional, \
+    Sequence, Tuple
+
+import msgpack
+
+from . import configuration
+from . import exceptions
+
+MAGIC = b'CNTOMAN\x01'
+
+_FOOTER = struct.Struct('<QQ8s')
+_OFFSET = struct.Struct('<Q')
+
+
+class FileEntry(NamedTuple):
+    """Describe one file of the repository manifest."""
+
+    path: str
+    size: int
+    mtime: int
+    digest: bytes
+
+    def pack(self) -> List[Any]:
+        """Return the compact representation stored in the index."""
+        return [self.path, self.size, self.mtime, self.digest]
+
+    @classmethod
+    def unpack(cls, packed: Sequence[Any]) -> 'FileEntry':
+        """Rebuild an entry from its compact representation."""
+        return cls(*packed)
+
+
+def dump_manifest(stream: BinaryIO, entries: Iterable[Sequence[Any]]) -> int:
+    """Write `entries`, packed file entries sorted by path, as a manifest to `stream`.
+
+    Return the number of entries written.
+    """
+    packer = msgpack.Packer(use_bin_type=True)
+    offsets = array('Q')
+    previous = None
+    stream.write(MAGIC)
+    position = len(MAGIC)
+    for entry in entries:
+        if previous is not None and entry[0] <= previous:
+            raise ValueError('Manifest entries must be sorted by path')
+        previous = entry[0]
+        record = packer.pack(list(entry))
+        offsets.append(position)
+        stream.write(record)
+        position += len(record)
+    if sys.byteorder != 'little':
+        offsets.byteswap()
+    stream.write(offsets.tobytes())
+    stream.write(_FOOTER.pack(len(offsets), position, MAGIC))
+
+    return len(offsets)
+
+
+def write_manifest(path: str, entries: Iterable[Sequence[Any]]) -> int:
+    """Atomically store `entries` as a manifest at `path`, see :func:`dump_manifest`."""
+    from .fileutils import atomic_open
+
+    with atomic_open(path) as stream:
+        return dump_manifest(stream, entries)
+
+
+def apply_changes(entries: Iterable[FileEntry],
+                  changes: Mapping[str, Optional[Sequence[Any]]]) -> Iterator[Sequence[Any]]:
+    """Yield packed `entries` with `changes` applied, in path order.
+
+    `changes` maps paths to their new packed entry, None for deleted paths. `entries` are
+    streamed and merged with the sorted changed paths, so that applying a small change set
+    to a large manifest needs no more memory than the change set.
+    """
+    paths = sorted(changes)
+    position = 0
+    for entry in entries:
+        while position < len(paths) and paths[position] < entry.path:
+            changed = changes[paths[position]]
+            if changed is not None:
+                yield changed
+            position += 1
+        if position < len(paths) and paths[position] == entry.path:
+            changed = changes[paths[position]]
+            if changed is not None:
+                yield changed
+            position += 1
+        else:
+            yield entry.pack()
+    for path in paths[position:]:
+        changed = changes[path]
+        if changed is not None:
+            yield changed
+
+
+def _path_bounds(data: mmap.mmap, offset: int) -> Tuple[int, int]:
+    """Return the bounds of the encoded path of the record at `offset` of `data`.
+
+    Records are msgpack arrays of less than 16 items starting with the path string.
+    """
+    kind = data[offset + 1]
+    if kind & 0xe0 == 0xa0:
+        return offset + 2, offset + 2 + (kind & 0x1f)
+    elif kind == 0xd9:
+        return offset + 3, offset + 3 + data[offset + 2]
+    elif kind == 0xda:
+        return offset + 4, offset + 4 + struct.unpack_from('>H', data, offset + 2)[0]
+    elif kind == 0xdb:
+        return offset + 6, offset + 6 + struct.unpack_from('>I', data, offset + 2)[0]
+    raise exceptions.InvalidIndex('Unexpected manifest record type {0:#x}'.format(kind))
+
+
+class Manifest(object):
+    """Read-only access to a manifest file which never loads all of its records at once.
+
+    The file is memory-mapped, so that opening it costs a few system calls and lookups only
+    touch the pages they read. Replacing the file does not affect an opened manifest.
+    Lookups may be performed from several threads.
+    """
+
+    def __init__(self, path: str) -> None:
+        """Open the manifest stored at `path`, raise `exceptions.InvalidIndex` if malformed."""
+        self.path: str = path
+        with open(path, mode='rb') as stream:
+            size = os.fstat(stream.fileno()).st_size
+            if size < len(MAGIC) + _FOOTER.size:
+                raise exceptions.InvalidIndex('{0} is truncated'.format(self.path))
+            self._map = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+        count, table_offset, magic = _FOOTER.unpack_from(self._map, size - _FOOTER.size)
+        if magic != MAGIC or self._map[:len(MAGIC)] != MAGIC or \
+                table_offset + count * _OFFSET.size + _FOOTER.size != size:
+            self._map.close()
+            raise exceptions.InvalidIndex('{0} is not a valid manifest'.format(self.path))
+        self._count: int = count
+        self._table_offset: int = table_offset
+        table_end = table_offset + count * _OFFSET.size
+        self._offsets: Sequence[int]
+        if sys.byteorder == 'little':
+            with memoryview(self._map) as view:
+                self._offsets = view[table_offset:table_end].cast('Q')
+        else:
+            offsets = array('Q', self._map[table_offset:table_end])
+            offsets.byteswap()
+            self._offsets = offsets
+
+    def close(self) -> None:
+        """Unmap the file."""
+        if isinstance(self._offsets, memoryview):
+            self._offsets.release()
+        self._map.close()
+
+    def __enter__(self) -> 'Manifest':
+        """Return the manifest itself."""
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        """Close the manifest."""
+        self.close()
+
+    def __len__(self) -> int:
+        """Return the number of entries."""
+        return self._count
+
+    def __iter__(self) -> Iterator[FileEntry]:
+        """Stream the entries in path order from the mapped file, a piece at a time."""
+        unpacker = msgpack.Unpacker(raw=False)
+        for offset in range(len(MAGIC), self._table_offset, configuration.read_chunk_size):
+            unpacker.feed(self._map[offset:min(offset + configuration.read_chunk_size,
+                                               self._table_offset)])
+            for record in unpacker:
+                yield FileEntry(*record)
+
+    def entry(self, position: int) -> FileEntry:
+        """Return the entry at `position` in path order."""
+        if not 0 <= position < self._count:
+            raise IndexError('Manifest position out of range')
+        end = self._offsets[position + 1] if position + 1 < self._count else self._table_offset
+
+        return FileEntry(*msgpack.unpackb(self._map[self._offsets[position]:end], raw=False))
+
+    def _lower_bound(self, key: bytes) -> int:
+        """Return the position of the first entry whose encoded path is not below `key`.
+
+        Encoded paths sort like the strings they encode, they are compared without being
+        decoded.
+        """
+        data, offsets = self._map, self._offsets
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            offset = offsets[middle]
+            kind = data[offset + 1]
+            if kind & 0xe0 == 0xa0:
+                # Most paths are shorter than 32 bytes, decode their header inline.
+                probe = data[offset + 2:offset + 2 + (kind & 0x1f)]
+            else:
+                start, end = _path_bounds(data, offset)
+                probe = data[start:end]
+            if probe < key:
+                low = middle + 1
+            else:
+                high = middle
+
+        return low
+
+    def get(self, path: str) -> Optional[FileEntry]:
+        """Return the entry of the relative POSIX `path`, None if absent."""
+        key = path.encode('utf-8')
+        position = self._lower_bound(key)
+        if position == self._count:
+            return None
+        start, end = _path_bounds(self._map, self._offsets[position])
+
+        return self.entry(position) if self._map[start:end] == key else None
+
+    def select(self, folders: Iterable[str]) -> Iterator[FileEntry]:
+        """Yield the entries under the top-level `folders` in path order.
+
+        The entries of a folder are contiguous, they are found with two binary searches so
+        that only the pages holding them are read.
+        """
+        for folder in sorted(set(folders), key=lambda folder: folder + '/'):
+            key = folder.encode('utf-8')
+            # '0' follows '/', the entries of the folder are those between both prefixes.
+            for position in range(self._lower_bound(key + b'/'), self._lower_bound(key + b'0')):
+                yield self.entry(position)
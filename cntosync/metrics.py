@@ -0,0 +1,393 @@
+# --------------------------------License Notice----------------------------------
+# CNTOSync - Carpe Noctem Tactical Operations ArmA3 mod synchronization tool
+# Copyright (C) 2018 Carpe Noctem - Tactical Operations (aka. CNTO) (contact@carpenoctem.co)
+#
+# The authors of this software are listed in the AUTHORS file at the
+# root of this software's source code tree.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# All rights reserved.
+# --------------------------------License Notice----------------------------------
+
+"""Record timers and counters of the indexing and synchronization stages.
+
+Instrumented code reports to the active :class:`Recorder`, set with :func:`recording`. Stages
+are timed with :func:`stage` and count the files and bytes they processed, worker pools
+opened with :func:`pool` record their utilization and the depth of their queue. Times of
+stages run by several workers add up, so they can exceed the duration of the operation.
+
+Without an active recorder, :func:`stage` and :func:`pool` return a shared object doing
+nothing and :func:`active` returns None, so that hooks cost close to nothing. The recorder is
+global to the process, as work is spread over worker threads.
+"""
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, TYPE_CHECKING, Union
+
+from . import configuration
+from .fileutils import atomic_write
+
+if TYPE_CHECKING:  # pragma: no cover
+    import cProfile
+
+SCAN = 'scan'
+HASH = 'hash'
+DIFF = 'diff'
+FETCH = 'fetch'
+WRITE = 'write'
+VERIFY = 'verify'
+stages = (SCAN, HASH, DIFF, FETCH, WRITE, VERIFY)
+profilers = ('cprofile', 'tracemalloc')
+
+Callback = Callable[[str, str, Dict[str, Any]], None]
+
+
+class StageMetrics(object):
+    """Time spent in a stage, number of times it ran and files and bytes it processed."""
+
+    __slots__ = ('seconds', 'calls', 'files', 'bytes')
+
+    def __init__(self) -> None:
+        """Initialize empty counters."""
+        self.seconds = 0.0
+        self.calls = 0
+        self.files = 0
+        self.bytes = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Return the counters and the throughput of the stage, in bytes per second."""
+        return {'seconds': self.seconds, 'calls': self.calls, 'files': self.files,
+                'bytes': self.bytes,
+                'throughput': self.bytes / self.seconds if self.bytes and self.seconds else None}
+
+
+class PoolMetrics(object):
+    """Busy time, duration and queue depths of a pool of workers."""
+
+    __slots__ = ('workers', 'seconds', 'capacity', 'busy', 'tasks', 'queue_max', 'queue_total',
+                 'samples')
+
+    def __init__(self) -> None:
+        """Initialize empty counters."""
+        self.workers = 0
+        self.seconds = 0.0
+        self.capacity = 0.0
+        self.busy = 0.0
+        self.tasks = 0
+        self.queue_max = 0
+        self.queue_total = 0
+        self.samples = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Return the counters, the mean queue depth and the utilization of the workers."""
+        return {'workers': self.workers, 'seconds': self.seconds, 'busy': self.busy,
+                'tasks': self.tasks,
+                'utilization': self.busy / self.capacity if self.capacity else None,
+                'queue_max': self.queue_max,
+                'queue_mean': self.queue_total / self.samples if self.samples else None}
+
+
+class _NullHook(object):
+    """Stand in for stages, pools and tasks when no recorder is active."""
+
+    def __enter__(self) -> '_NullHook':
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        pass
+
+    def count(self, files: int = 0, size: int = 0) -> None:
+        """Ignore processed files and bytes."""
+        pass
+
+    def task(self) -> '_NullHook':
+        """Return the hook itself, doing nothing."""
+        return self
+
+    def busy(self, seconds: float) -> None:
+        """Ignore the busy time of a worker."""
+        pass
+
+    def queue(self, depth: int) -> None:
+        """Ignore a queue depth."""
+        pass
+
+
+_NULL = _NullHook()
+
+
+class _Stage(object):
+    """Time a stage of `recorder` run as a context manager."""
+
+    def __init__(self, recorder: 'Recorder', name: str) -> None:
+        self.recorder = recorder
+        self.name = name
+        self.files = self.size = 0
+        self.start = 0.0
+
+    def __enter__(self) -> '_Stage':
+        self.recorder._start_profile(self.name)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        elapsed = time.perf_counter() - self.start
+        self.recorder._stop_profile(self.name)
+        self.recorder.add(self.name, self.files, self.size, elapsed, calls=1)
+        if self.recorder.callback is not None:
+            self.recorder.callback('stage', self.name,
+                                   self.recorder.stage_metrics(self.name).to_dict())
+
+    def count(self, files: int = 0, size: int = 0) -> None:
+        """Count `files` and `size` bytes as processed by the stage."""
+        self.files += files
+        self.size += size
+
+
+class _Task(object):
+    """Time a task run by a worker of `pool`."""
+
+    def __init__(self, pool: '_Pool') -> None:
+        self.pool = pool
+        self.start = 0.0
+
+    def __enter__(self) -> '_Task':
+        self.pool._started()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.pool.busy(time.perf_counter() - self.start)
+
+
+class _Pool(object):
+    """Record the use of a pool of `workers` running `tasks` tasks as a context manager."""
+
+    def __init__(self, recorder: 'Recorder', name: str, workers: int, tasks: int) -> None:
+        self.recorder = recorder
+        self.metrics = recorder.pool_metrics(name)
+        self.workers = workers
+        self.queued = tasks
+        self.start = 0.0
+
+    def __enter__(self) -> '_Pool':
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        elapsed = time.perf_counter() - self.start
+        with self.recorder.lock:
+            self.metrics.seconds += elapsed
+            self.metrics.capacity += elapsed * self.workers
+            self.metrics.workers = max(self.metrics.workers, self.workers)
+
+    def _started(self) -> None:
+        with self.recorder.lock:
+            self.queued -= 1
+            self._sample(self.queued)
+
+    def _sample(self, depth: int) -> None:
+        self.metrics.tasks += 1
+        self.metrics.queue_max = max(self.metrics.queue_max, depth)
+        self.metrics.queue_total += depth
+        self.metrics.samples += 1
+
+    def task(self) -> _Task:
+        """Return a context manager timing a task of the pool."""
+        return _Task(self)
+
+    def busy(self, seconds: float) -> None:
+        """Count `seconds` of work done by a worker."""
+        with self.recorder.lock:
+            self.metrics.busy += seconds
+
+    def queue(self, depth: int) -> None:
+        """Record that a task completed with `depth` tasks left in the queue."""
+        with self.recorder.lock:
+            self._sample(depth)
+
+
+class Recorder(object):
+    """Accumulate the metrics of the operations run while it is active.
+
+    `callback` is called with ``'stage'``, the name and the metrics of every stage when it
+    ends, and with ``'operation'``, the name and the summary of every outermost operation.
+    The `profile` stage is run under a `profiler`, one of :data:`profilers`, in the thread
+    running the stage: hashing must run with a single worker to be profiled.
+    """
+
+    def __init__(self, callback: Optional[Callback] = None, profile: Optional[str] = None,
+                 profiler: str = 'cprofile') -> None:
+        """Initialize a recorder without metrics."""
+        if profiler not in profilers:
+            raise ValueError('Unknown profiler {0}'.format(profiler))
+        self.callback = callback
+        self.profile = profile
+        self.profiler = profiler
+        self.lock = threading.Lock()
+        self.stages: Dict[str, StageMetrics] = {}
+        self.pools: Dict[str, PoolMetrics] = {}
+        self.operations: Dict[str, StageMetrics] = {}
+        self.depth = 0
+        self.peak_memory = 0
+        self.allocations: List[str] = []
+        self._profile: Optional['cProfile.Profile'] = None
+        self._profiling = False
+        self._tracing = False
+
+    def stage_metrics(self, name: str) -> StageMetrics:
+        """Return the metrics of stage `name`, created empty if needed."""
+        if name not in self.stages:
+            self.stages[name] = StageMetrics()
+        return self.stages[name]
+
+    def pool_metrics(self, name: str) -> PoolMetrics:
+        """Return the metrics of pool `name`, created empty if needed."""
+        if name not in self.pools:
+            self.pools[name] = PoolMetrics()
+        return self.pools[name]
+
+    def add(self, name: str, files: int = 0, size: int = 0, seconds: float = 0.0,
+            calls: int = 0) -> None:
+        """Count `files`, `size` bytes and `seconds` spent in stage `name`."""
+        with self.lock:
+            metrics = self.stage_metrics(name)
+            metrics.seconds += seconds
+            metrics.calls += calls
+            metrics.files += files
+            metrics.bytes += size
+
+    def _start_profile(self, name: str) -> None:
+        if name != self.profile or self._profiling:
+            return
+        import cProfile
+        import tracemalloc
+
+        self._profiling = True
+        if self.profiler == 'cprofile':
+            if self._profile is None:
+                self._profile = cProfile.Profile()
+            self._profile.enable()
+        elif not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._tracing = True
+
+    def _stop_profile(self, name: str) -> None:
+        if name != self.profile or not self._profiling:
+            return
+        import tracemalloc
+
+        self._profiling = False
+        if self._profile is not None:
+            self._profile.disable()
+        elif tracemalloc.is_tracing():
+            self.peak_memory = max(self.peak_memory, tracemalloc.get_traced_memory()[1])
+            self.allocations = [str(statistic) for statistic in
+                                tracemalloc.take_snapshot().statistics('lineno')[:10]]
+            if self._tracing:
+                tracemalloc.stop()
+                self._tracing = False
+
+    def summary(self) -> Dict[str, Any]:
+        """Return the metrics recorded so far."""
+        with self.lock:
+            summary: Dict[str, Any] = {
+                'operations': {name: {'seconds': metrics.seconds, 'calls': metrics.calls}
+                               for name, metrics in self.operations.items()},
+                'stages': {name: metrics.to_dict() for name, metrics in self.stages.items()},
+                'pools': {name: metrics.to_dict() for name, metrics in self.pools.items()},
+            }
+        if self.profile is not None:
+            summary['profile'] = {'stage': self.profile, 'profiler': self.profiler}
+            if self.profiler == 'tracemalloc':
+                summary['profile'].update(peak_memory=self.peak_memory,
+                                          allocations=self.allocations)
+        return summary
+
+    def write(self, directory: str) -> Dict[str, Any]:
+        """Write the summary into the index directory of `directory` and return it.
+
+        The cProfile statistics of the profiled stage are written along it.
+        """
+        path = os.path.join(directory, configuration.index_directory,
+                            configuration.metrics_file)
+        summary = self.summary()
+        if self._profile is not None:
+            profile_path = '{0}-{1}.prof'.format(os.path.splitext(path)[0], self.profile)
+            self._profile.dump_stats(profile_path)
+            summary['profile']['path'] = profile_path
+        import json
+
+        atomic_write(path, json.dumps(summary, indent=2, sort_keys=True).encode())
+        return summary
+
+
+_recorder: Optional[Recorder] = None
+
+
+def active() -> Optional[Recorder]:
+    """Return the active recorder, None if metrics are disabled."""
+    return _recorder
+
+
+@contextmanager
+def recording(recorder: Recorder) -> Iterator[Recorder]:
+    """Make `recorder` the active recorder for the duration of the context."""
+    global _recorder
+    previous, _recorder = _recorder, recorder
+    try:
+        yield recorder
+    finally:
+        _recorder = previous
+
+
+def stage(name: str) -> Union[_Stage, _NullHook]:
+    """Return a context manager timing stage `name`, which may count processed data."""
+    return _NULL if _recorder is None else _Stage(_recorder, name)
+
+
+def pool(name: str, workers: int, tasks: int = 0) -> Union[_Pool, _NullHook]:
+    """Return a context manager recording the use of a pool of `workers` for `tasks`."""
+    return _NULL if _recorder is None else _Pool(_recorder, name, workers, tasks)
+
+
+@contextmanager
+def operation(name: str, directory: str) -> Iterator[None]:
+    """Time operation `name` on the repository at `directory`.
+
+    When the outermost operation ends, the summary is written into the index directory and
+    passed to the callback of the recorder.
+    """
+    recorder = _recorder
+    if recorder is None:
+        yield
+        return
+
+    recorder.depth += 1
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        recorder.depth -= 1
+        with recorder.lock:
+            metrics = recorder.operations.setdefault(name, StageMetrics())
+            metrics.seconds += time.perf_counter() - start
+            metrics.calls += 1
+        if not recorder.depth:
+            summary = recorder.write(directory)
+            if recorder.callback is not None:
+                recorder.callback('operation', name, summary)
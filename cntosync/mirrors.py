@@ -0,0 +1,145 @@
+# --------------------------------License Notice----------------------------------
+# CNTOSync - Carpe Noctem Tactical Operations ArmA3 mod synchronization tool
+# Copyright (C) 2018 Carpe Noctem - Tactical Operations (aka. CNTO) (contact@carpenoctem.co)
+#
+# The authors of this software are listed in the AUTHORS file at the
+# root of this software's source code tree.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# All rights reserved.
+# --------------------------------License Notice----------------------------------
+
+"""Choose between the mirrors of a repository by their measured latency and throughput.
+
+Every mirror serves the same files under its own base URL. Each request goes to a mirror
+drawn at random with a weight inversely proportional to the time the request is expected to
+take on it: its round-trip time plus the requested length at its throughput. Faster mirrors
+thus serve proportionally more range requests, while slower ones keep being measured. Mirrors
+which fail or stall are avoided for a backoff period growing with their consecutive failures.
+"""
+
+import random
+import threading
+import time
+from typing import Collection, List, Optional, Sequence
+
+from . import configuration
+
+
+class Mirror(object):
+    """A mirror base URL with its measured round-trip time and throughput.
+
+    `rtt` is in seconds and `throughput` in bytes per second, both moving averages, None
+    until measured. `retry_at` is the monotonic time until which the mirror is avoided.
+    """
+
+    def __init__(self, url: str) -> None:
+        """Initialize an unmeasured mirror serving the repository at `url`."""
+        self.url: str = url.rstrip('/')
+        self.rtt: Optional[float] = None
+        self.throughput: Optional[float] = None
+        self.failures = 0
+        self.retry_at = 0.0
+        self.requests = 0
+        self.received = 0
+
+    def __repr__(self) -> str:
+        """Return the URL and measurements of the mirror."""
+        return '<Mirror {0} rtt={1} throughput={2} failures={3}>'.format(
+            self.url, self.rtt, self.throughput, self.failures)
+
+
+def _average(previous: Optional[float], sample: float) -> float:
+    if previous is None:
+        return sample
+    return previous + configuration.mirror_smoothing * (sample - previous)
+
+
+class MirrorSet(object):
+    """Mirrors of one repository, chosen per request by their expected speed.
+
+    Methods are safe to call from several download threads.
+    """
+
+    def __init__(self, urls: Sequence[str], seed: Optional[int] = None) -> None:
+        """Initialize unmeasured mirrors for the base `urls`, drawn with a `seed` if given."""
+        self.mirrors: List[Mirror] = [Mirror(url) for url in urls]
+        self._lock = threading.Lock()
+        self._random = random.Random(seed)
+
+    def relative(self, url: str) -> Optional[str]:
+        """Return the part of `url` following the base URL of a mirror, None if none matches."""
+        for mirror in self.mirrors:
+            if url.startswith(mirror.url + '/'):
+                return url[len(mirror.url):]
+
+        return None
+
+    def expected_time(self, mirror: Mirror, length: Optional[int]) -> float:
+        """Return the seconds a request of `length` bytes is expected to take on `mirror`.
+
+        Measurements missing for `mirror` are assumed to be the average of the other mirrors.
+        """
+        rtt = mirror.rtt
+        if rtt is None:
+            known = [other.rtt for other in self.mirrors if other.rtt is not None]
+            rtt = sum(known) / len(known) if known else configuration.mirror_default_rtt
+        throughput = mirror.throughput
+        if throughput is None:
+            rates = [other.throughput for other in self.mirrors if other.throughput is not None]
+            throughput = sum(rates) / len(rates) if rates \
+                else configuration.mirror_default_throughput
+
+        return rtt + (length or 0) / throughput
+
+    def choose(self, length: Optional[int] = None,
+               exclude: Collection[Mirror] = ()) -> Optional[Mirror]:
+        """Draw the mirror serving a request of `length` bytes, None if all are excluded.
+
+        Mirrors in their backoff period are only chosen when no other one is left, the one
+        whose period ends first.
+        """
+        with self._lock:
+            candidates = [mirror for mirror in self.mirrors if mirror not in exclude]
+            if not candidates:
+                return None
+            now = time.monotonic()
+            available = [mirror for mirror in candidates if mirror.retry_at <= now]
+            if not available:
+                return min(candidates, key=lambda mirror: mirror.retry_at)
+            weights = [1 / max(self.expected_time(mirror, length), 1e-6)
+                       for mirror in available]
+            return self._random.choices(available, weights)[0]
+
+    def record(self, mirror: Mirror, rtt: float, size: int = 0, seconds: float = 0.0) -> None:
+        """Account for a request served by `mirror`.
+
+        `rtt` is the time until the response started, `seconds` the time spent receiving its
+        `size` bytes. Throughput is only sampled from responses large enough to measure it.
+        """
+        with self._lock:
+            mirror.rtt = _average(mirror.rtt, rtt)
+            if size >= configuration.mirror_sample_size and seconds > 0:
+                mirror.throughput = _average(mirror.throughput, size / seconds)
+            mirror.requests += 1
+            mirror.received += size
+            mirror.failures = 0
+            mirror.retry_at = 0.0
+
+    def fail(self, mirror: Mirror) -> None:
+        """Avoid `mirror` for a while after it failed or stalled."""
+        with self._lock:
+            mirror.failures += 1
+            mirror.retry_at = time.monotonic() + configuration.mirror_backoff * \
+                2 ** min(mirror.failures - 1, 6)
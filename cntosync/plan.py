@@ -0,0 +1,183 @@
+# --------------------------------License Notice----------------------------------
+# CNTOSync - Carpe Noctem Tactical Operations ArmA3 mod synchronization tool
+# Copyright (C) 2018 Carpe Noctem - Tactical Operations (aka. CNTO) (contact@carpenoctem.co)
+#
+# The authors of this software are listed in the AUTHORS file at the
+# root of this software's source code tree.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# All rights reserved.
+# --------------------------------License Notice----------------------------------
+
+"""Compare a local and a remote manifest and plan the operations synchronizing them.
+
+Manifests sorted by path are merged in a single streaming pass, then the files to fetch are
+joined on their digest with the local files, so that content already present locally is
+moved or copied instead of downloaded. Memory use grows with the number of changes rather
+than with the size of the repository.
+"""
+
+import os
+from typing import Any, Dict, Iterable, List, NamedTuple, Sequence, Set, Tuple
+
+from . import configuration
+from . import indexer
+from .fileutils import copy_file
+from .journal import TransferJournal
+
+
+class SyncPlan(NamedTuple):
+    """Operations bringing a local repository to the state of a remote one.
+
+    `added` and `modified` hold the remote entries which must be downloaded, `deleted` the
+    local paths absent from the remote. `renamed`, `moved` and `copied` hold
+    ``(source, target)`` pairs of local files reused for remote entries with the same
+    content: renamed files stay in the same mod folder while moved files change mod folder,
+    both are removed from their source. Copied files are kept at their source. `digests`
+    maps the targets of these reused files to their content digest.
+    """
+
+    added: List[indexer.FileEntry]
+    modified: List[indexer.FileEntry]
+    deleted: List[str]
+    renamed: List[Tuple[str, str]]
+    moved: List[Tuple[str, str]]
+    copied: List[Tuple[str, str]]
+    digests: Dict[str, bytes]
+
+    @property
+    def transfers(self) -> List[indexer.FileEntry]:
+        """Return the entries to download."""
+        return self.added + self.modified
+
+    @property
+    def bytes_to_transfer(self) -> int:
+        """Return the amount of bytes to download."""
+        return sum(entry.size for entry in self.added) + \
+            sum(entry.size for entry in self.modified)
+
+    @property
+    def empty(self) -> bool:
+        """Tell whether the local repository is already synchronized."""
+        return not (self.added or self.modified or self.deleted or self.renamed or self.moved
+                    or self.copied)
+
+
+def plan_sync(local: Iterable[Sequence[Any]], remote: Iterable[Sequence[Any]]) -> SyncPlan:
+    """Return the plan synchronizing the `local` manifest with the `remote` one.
+
+    Manifests hold packed :class:`indexer.FileEntry` records sorted by path, such as
+    :class:`manifest.Manifest` instances. Local files deleted by the plan are preferably
+    reused by moving them, unchanged local files are copied, other contents are downloaded.
+    `local` is iterated a second time to find the files to copy when needed.
+    """
+    local_items, remote_items = iter(local), iter(remote)
+    local_item, remote_item = next(local_items, None), next(remote_items, None)
+    fetched: List[Tuple[Sequence[Any], bool]] = []
+    removed: Dict[bytes, List[str]] = {}
+    deleted: Set[str] = set()
+    while local_item is not None or remote_item is not None:
+        if local_item is not None and (remote_item is None or local_item[0] < remote_item[0]):
+            removed.setdefault(local_item[3], []).append(local_item[0])
+            deleted.add(local_item[0])
+            local_item = next(local_items, None)
+        elif remote_item is not None and (local_item is None or remote_item[0] < local_item[0]):
+            fetched.append((remote_item, False))
+            remote_item = next(remote_items, None)
+        elif local_item is not None and remote_item is not None:
+            if local_item[3] != remote_item[3]:
+                fetched.append((remote_item, True))
+            local_item, remote_item = next(local_items, None), next(remote_items, None)
+
+    overwritten = {item[0] for item, existing in fetched if existing}
+    needed = {item[3] for item, _ in fetched if item[3] not in removed}
+    kept: Dict[bytes, str] = {}
+    for item in local if needed else ():
+        if item[3] in needed and item[3] not in kept and item[0] not in deleted and \
+                item[0] not in overwritten:
+            kept[item[3]] = item[0]
+
+    added: List[indexer.FileEntry] = []
+    modified: List[indexer.FileEntry] = []
+    renamed: List[Tuple[str, str]] = []
+    moved: List[Tuple[str, str]] = []
+    copied: List[Tuple[str, str]] = []
+    digests: Dict[str, bytes] = {}
+    for item, existing in fetched:
+        path, digest = item[0], item[3]
+        sources = removed.get(digest)
+        if sources:
+            source = sources.pop()
+            deleted.discard(source)
+            if indexer.mod_folder(source) == indexer.mod_folder(path):
+                renamed.append((source, path))
+            else:
+                moved.append((source, path))
+        elif digest in kept:
+            copied.append((kept[digest], path))
+        elif existing:
+            modified.append(indexer.FileEntry.unpack(item))
+            continue
+        else:
+            added.append(indexer.FileEntry.unpack(item))
+            continue
+        digests[path] = digest
+
+    return SyncPlan(added, modified, sorted(deleted), renamed, moved, copied, digests)
+
+
+def _remove(directory: str, relative_path: str) -> None:
+    """Remove `relative_path` and its sidecar, then its parent folders left empty."""
+    path = os.path.join(directory, *relative_path.split('/'))
+    for stale in (path, path + configuration.extension):
+        try:
+            os.remove(stale)
+        except FileNotFoundError:
+            pass
+    parent = os.path.dirname(path)
+    while parent != directory:
+        try:
+            os.rmdir(parent)
+        except OSError:
+            break
+        parent = os.path.dirname(parent)
+
+
+def apply_local_changes(directory: str, plan: SyncPlan, journal: TransferJournal) -> None:
+    """Copy, rename, move and delete the local files of `directory` according to `plan`.
+
+    Sidecar files follow the files they describe. Reused files are recorded as completed in
+    `journal` so that they are trusted without being hashed again.
+    """
+    operations = [(source, target, copy_file) for source, target in plan.copied] + \
+        [(source, target, os.replace) for source, target in plan.renamed + plan.moved]
+    for source, target, operation in operations:
+        source_path = os.path.join(directory, *source.split('/'))
+        target_path = os.path.join(directory, *target.split('/'))
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+        operation(source_path, target_path)
+        if os.path.isfile(source_path + configuration.extension):
+            operation(source_path + configuration.extension,
+                      target_path + configuration.extension)
+        else:
+            try:
+                os.remove(target_path + configuration.extension)
+            except FileNotFoundError:
+                pass
+        journal.complete_file(target, plan.digests[target], os.stat(target_path))
+    for source, _ in plan.renamed + plan.moved:
+        _remove(directory, source)
+    for relative_path in plan.deleted:
+        _remove(directory, relative_path)
+    journal.flush(force=True)
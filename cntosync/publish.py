@@ -0,0 +1,330 @@
+# --------------------------------License Notice----------------------------------
+# CNTOSync - Carpe Noctem Tactical Operations ArmA3 mod synchronization tool
+# Copyright (C) 2018 Carpe Noctem - Tactical Operations (aka. CNTO) (contact@carpenoctem.co)
+#
+# The authors of this software are listed in the AUTHORS file at the
+# root of this software's source code tree.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# All rights reserved.
+# --------------------------------License Notice----------------------------------
+
+"""Turn a repository into static files which any HTTP server can serve as they are.
+
+Publishing writes into the index directory of the repository:
+
+* one manifest shard per mod folder, files at the root of the repository sharing the shard
+  of the empty mod name, so that clients only fetch the shards of the mods they use;
+* precompressed variants of every shard, named after it with a ``.gz`` or ``.zst`` suffix
+  as expected by static servers such as nginx;
+* with content-defined chunking, one file per chunk and per mod a recipe listing the digest
+  and size of the chunks of each of its files;
+* a compressed blob of every file whose sidecar tells compression pays off, named after its
+  digest, and per mod a table listing the compression and size of each blob so that clients
+  fetch them instead of the originals.
+* per content revision, a delta index holding the entries changed since the previous
+  revision, so that clients a few revisions behind update their copy of the manifest
+  without fetching it again.
+
+Shards, recipes, chunks and blobs are content-addressed and never modified once written, so that
+publishing again only writes what changed. The publication file referencing them is replaced
+atomically last: clients reading it always find a complete, consistent set of files. Files of
+the previous publication are kept for clients still fetching it.
+"""
+
+import io
+import os
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Sequence, Set
+
+import msgpack
+
+from . import chunking
+from . import compression
+from . import configuration
+from . import exceptions
+from . import indexer
+from . import signature
+from . import transfer
+from .chunking import object_name
+from .filesync import Repository
+from .fileutils import atomic_open, atomic_write
+from .manifest import Manifest, dump_manifest
+
+
+class PublishResult(NamedTuple):
+    """Outcome of a publication.
+
+    `generation` counts publications, `revision` those which changed the manifest.
+    `written_files` and `written_bytes` count the shards, recipes, compressed variants,
+    chunks, blobs and deltas written, as opposed to those already published. `removed_files` counts
+    files of older publications which were removed.
+    """
+
+    generation: int
+    revision: int
+    shards: int
+    written_files: int
+    written_bytes: int
+    removed_files: int
+
+
+def load_publication(path: str) -> Dict[str, Any]:
+    """Load the publication file at `path`, an empty publication if missing."""
+    try:
+        with open(path, mode='rb') as stream:
+            return msgpack.unpackb(stream.read(), raw=False)
+    except FileNotFoundError:
+        return {'generation': 0, 'revision': 0, 'shards': {}, 'recipes': {}}
+
+
+class _Publisher(object):
+    """Write content-addressed files, keeping track of what was written."""
+
+    def __init__(self, directory: str, compressions: Sequence[str]) -> None:
+        """Initialize a publisher storing files in `directory`."""
+        self.directory = directory
+        self.compressions = compressions
+        self.written_files = 0
+        self.written_bytes = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def write(self, data: bytes) -> str:
+        """Store `data` and its compressed variants unless present, return its name."""
+        digest = indexer.new_hash()
+        digest.update(data)
+        name = digest.hexdigest()
+        path = os.path.join(self.directory, name)
+        if not os.path.exists(path):
+            for compression_name in self.compressions:
+                compressed = compression.compress(data, compression_name)
+                atomic_write(path + compression.suffixes[compression_name], compressed)
+                self.count_written(len(compressed))
+            atomic_write(path, data)
+            self.count_written(len(data))
+
+        return name
+
+    def count_written(self, size: int) -> None:
+        """Account for a file of `size` bytes written."""
+        self.written_files += 1
+        self.written_bytes += size
+
+
+def _shards(entries: Iterable[indexer.FileEntry]) -> Dict[str, List[indexer.FileEntry]]:
+    """Group manifest `entries` by mod folder, preserving their order."""
+    shards: Dict[str, List[indexer.FileEntry]] = {}
+    for entry in entries:
+        shards.setdefault(indexer.mod_folder(entry.path), []).append(entry)
+
+    return shards
+
+
+def _write_delta(publisher: _Publisher, previous: Dict[str, Any], shards: Dict[str, str],
+                 entries: Dict[str, List[indexer.FileEntry]]) -> Optional[str]:
+    """Store the entries changed since the `previous` publication, return the delta name.
+
+    Only the mods whose shard changed are compared with their previous shard. None is
+    returned if one of these shards is no longer available.
+    """
+    deleted: List[str] = []
+    changed: List[List[Any]] = []
+    for mod in set(previous['shards']) | set(shards):
+        previous_name = previous['shards'].get(mod)
+        if previous_name == shards.get(mod):
+            continue
+        previous_entries: Dict[str, indexer.FileEntry] = {}
+        if previous_name is not None:
+            try:
+                with Manifest(os.path.join(publisher.directory, previous_name)) as shard:
+                    previous_entries = {entry.path: entry for entry in shard}
+            except (OSError, exceptions.InvalidIndex):
+                return None
+        for entry in entries.get(mod, ()):
+            if previous_entries.pop(entry.path, None) != entry:
+                changed.append(entry.pack())
+        deleted.extend(previous_entries)
+
+    return publisher.write(msgpack.packb([sorted(deleted), sorted(changed)], use_bin_type=True))
+
+
+def _write_objects(repository: Repository, chunk_table: chunking.ChunkTable,
+                   publisher: _Publisher) -> None:
+    """Store every chunk of `chunk_table` missing from the object directory."""
+    directory = os.path.join(repository.directory, configuration.index_directory,
+                             configuration.object_directory)
+    for relative_path, (_, digests) in chunk_table.files.items():
+        offset = 0
+        with open(os.path.join(repository.directory, relative_path), mode='rb') as source:
+            for digest in digests:
+                size = chunk_table.chunks[digest][0]
+                path = os.path.join(directory, *object_name(digest).split('/'))
+                if not os.path.exists(path):
+                    source.seek(offset)
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    with atomic_open(path) as stream:
+                        stream.write(source.read(size))
+                    publisher.count_written(size)
+                offset += size
+
+
+def _write_blobs(repository: Repository, entries: Iterable[indexer.FileEntry],
+                 publisher: _Publisher) -> Dict[bytes, List[Any]]:
+    """Store compressed blobs of `entries` worth compressing, return the compressed table.
+
+    The table maps digests to the compression and size of their blob. Entries without an
+    up to date sidecar are published uncompressed.
+    """
+    directory = os.path.join(repository.directory, configuration.index_directory,
+                             configuration.blob_directory)
+    available = compression.available_compressions()
+    table: Dict[bytes, List[Any]] = {}
+    for entry in entries:
+        if entry.digest in table or not signature.needs_sidecar(entry.size):
+            continue
+        path = os.path.join(repository.directory, *entry.path.split('/'))
+        try:
+            file_signature = signature.read_sidecar(path)
+        except (OSError, ValueError, TypeError, msgpack.exceptions.UnpackException):
+            continue
+        if file_signature.compression is None or file_signature.digest != entry.digest:
+            continue
+        compression_name = file_signature.compression \
+            if file_signature.compression in available else 'gzip'
+        blob_path = os.path.join(directory, compression.blob_name(entry.digest, compression_name))
+        if not os.path.exists(blob_path):
+            os.makedirs(directory, exist_ok=True)
+            with open(path, mode='rb') as source, atomic_open(blob_path) as stream:
+                compression.compress_stream(source, stream, compression_name, entry.size)
+            publisher.count_written(os.path.getsize(blob_path))
+        size = os.path.getsize(blob_path)
+        if size < entry.size:
+            table[entry.digest] = [compression_name, size]
+
+    return table
+
+
+def load_compressed_table(publisher: _Publisher, publication: Dict[str, Any]) \
+        -> Dict[bytes, List[Any]]:
+    """Load the compressed tables of every mod of `publication` into a single table."""
+    table: Dict[bytes, List[Any]] = {}
+    for name in set(transfer.compressed_tables(publication).values()):
+        with open(os.path.join(publisher.directory, name), mode='rb') as stream:
+            table.update(msgpack.unpackb(stream.read(), raw=False))
+
+    return table
+
+
+def _collect_garbage(repository: Repository, publisher: _Publisher,
+                     publications: Sequence[Dict[str, Any]],
+                     chunk_digests: Set[bytes]) -> int:
+    """Remove shards, recipes, chunks and blobs referenced by none of `publications`.
+
+    `chunk_digests` holds chunks to keep on top of those listed in the recipes.
+    """
+    referenced = set()
+    recipes = set()
+    blobs: Set[str] = set()
+    for publication in publications:
+        referenced.update(publication['shards'].values())
+        recipes.update(publication['recipes'].values())
+        referenced.update(transfer.compressed_tables(publication).values())
+        referenced.update(name for _, name in publication.get('deltas', ()))
+        blobs.update(compression.blob_name(digest, compression_name)
+                     for digest, (compression_name, _)
+                     in load_compressed_table(publisher, publication).items())
+    referenced.update(recipes)
+    removed = 0
+    for name in os.listdir(publisher.directory):
+        if not name.startswith('.') and name.split('.', 1)[0] not in referenced:
+            os.remove(os.path.join(publisher.directory, name))
+            removed += 1
+
+    for name in recipes:
+        with open(os.path.join(publisher.directory, name), mode='rb') as stream:
+            for chunks in msgpack.unpackb(stream.read(), raw=False).values():
+                chunk_digests.update(digest for digest, _ in chunks)
+    objects = os.path.join(repository.directory, configuration.index_directory,
+                           configuration.object_directory)
+    for prefix in os.listdir(objects) if os.path.isdir(objects) else ():
+        for name in os.listdir(os.path.join(objects, prefix)):
+            if not name.startswith('.') and bytes.fromhex(name) not in chunk_digests:
+                os.remove(os.path.join(objects, prefix, name))
+                removed += 1
+
+    blob_directory = os.path.join(repository.directory, configuration.index_directory,
+                                  configuration.blob_directory)
+    for name in os.listdir(blob_directory) if os.path.isdir(blob_directory) else ():
+        if not name.startswith('.') and name not in blobs:
+            os.remove(os.path.join(blob_directory, name))
+            removed += 1
+
+    return removed
+
+
+def publish(repository: Repository, workers: Optional[int] = None, chunks: bool = False,
+            compressions: Optional[Sequence[str]] = None) -> PublishResult:
+    """Index `repository` and publish its manifest shards, and its chunks with `chunks`.
+
+    `compressions` lists the precompressed variants of shards and recipes, it defaults to
+    every available compression. Compressed blobs use the compression chosen by the indexer,
+    gzip if it is not available.
+    """
+    if compressions is None:
+        compressions = compression.available_compressions()
+    repository.build_index(workers, content_defined_chunking=chunks)
+    publication_path = os.path.join(repository.directory, configuration.index_directory,
+                                    configuration.publication_file)
+    previous = load_publication(publication_path)
+    publisher = _Publisher(os.path.join(repository.directory, configuration.index_directory,
+                                        configuration.shard_directory), compressions)
+
+    shards: Dict[str, str] = {}
+    recipes: Dict[str, str] = {}
+    chunk_table = chunking.ChunkTable.load(repository.chunk_table_path) if chunks else None
+    compressed: Dict[str, str] = {}
+    mod_entries = _shards(repository.manifest)
+    for mod, entries in mod_entries.items():
+        buffer = io.BytesIO()
+        dump_manifest(buffer, (entry.pack() for entry in entries))
+        shards[mod] = publisher.write(buffer.getvalue())
+        if chunk_table is not None:
+            recipe = {entry.path: chunk_table.chunks_of(entry.path) for entry in entries}
+            recipes[mod] = publisher.write(msgpack.packb(recipe, use_bin_type=True))
+        compressed_table = _write_blobs(repository, entries, publisher)
+        if compressed_table:
+            compressed[mod] = publisher.write(msgpack.packb(compressed_table,
+                                                            use_bin_type=True))
+    if chunk_table is not None:
+        _write_objects(repository, chunk_table, publisher)
+
+    manifest_digest = indexer.hash_file(repository.manifest_path).hex()
+    revision = previous.get('revision', 0)
+    deltas = previous.get('deltas', [])
+    if manifest_digest != previous.get('manifest'):
+        revision += 1
+        delta = _write_delta(publisher, previous, shards, mod_entries) \
+            if previous.get('manifest') is not None else None
+        deltas = [] if delta is None else \
+            (deltas + [[previous['manifest'], delta]])[-configuration.delta_revisions:]
+
+    publication = {'version': configuration.version, 'generation': previous['generation'] + 1,
+                   'revision': revision, 'manifest': manifest_digest, 'deltas': deltas,
+                   'shards': shards, 'recipes': recipes, 'compressions': list(compressions),
+                   'compressed': compressed}
+    atomic_write(publication_path, msgpack.packb(publication, use_bin_type=True))
+    removed = _collect_garbage(repository, publisher, [previous, publication],
+                               set(chunk_table.chunks) if chunk_table is not None else set())
+
+    return PublishResult(publication['generation'], revision, len(shards),
+                         publisher.written_files, publisher.written_bytes, removed)
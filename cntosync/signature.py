@@ -0,0 +1,388 @@
+# --------------------------------License Notice----------------------------------
+# CNTOSync - Carpe Noctem Tactical Operations ArmA3 mod synchronization tool
+# Copyright (C) 2018 Carpe Noctem - Tactical Operations (aka. CNTO) (contact@carpenoctem.co)
+#
+# The authors of this software are listed in the AUTHORS file at the
+# root of this software's source code tree.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# All rights reserved.
+# --------------------------------License Notice----------------------------------
+
+"""Compute and match the block signatures used for delta transfers.
+
+A signature splits a file into blocks of `configuration.block_size` bytes and records, for
+each of them, a weak rolling checksum (Adler-32) and a truncated BLAKE2b digest, in the
+manner of rsync and zsync. It is stored in a sidecar file next to the file it describes, so
+that a client holding an older version of the file only needs to fetch the blocks it lacks.
+The sidecar also records whether the file is worth compressing for transfers.
+"""
+
+import array
+import hashlib
+import mmap
+import os
+import sys
+import zlib
+from typing import Any, BinaryIO, Callable, Dict, Iterable, Iterator, List, NamedTuple, \
+    Optional, Sequence, Tuple, cast
+
+import msgpack
+
+from . import configuration
+from . import exceptions
+
+_ADLER_MODULO = 65521
+_FORMAT_VERSION = 2
+
+
+def sidecar_path(path: str) -> str:
+    """Return the path of the sidecar file holding the signature of `path`."""
+    return path + configuration.extension
+
+
+def sidecar_min_size() -> int:
+    """Return the size from which files are described by a sidecar file.
+
+    Sidecars are kept for files large enough for delta transfers or compression.
+    """
+    return min(configuration.delta_threshold, configuration.compression_min_size)
+
+
+def needs_sidecar(size: int) -> bool:
+    """Tell whether a file of `size` bytes is described by a sidecar file."""
+    return size >= sidecar_min_size()
+
+
+def strong_hash(data: Any) -> bytes:
+    """Return the strong digest of one block."""
+    return hashlib.blake2b(data, digest_size=configuration.strong_digest_size).digest()
+
+
+class Signature(NamedTuple):
+    """Block signature of a file.
+
+    `compression` names the compression worth applying to the file for transfers, None if
+    it does not shrink the file enough.
+    """
+
+    size: int
+    block_size: int
+    digest: bytes
+    weak: List[int]
+    strong: List[bytes]
+    compression: Optional[str] = None
+
+    def pack(self) -> bytes:
+        """Return the serialized signature, as stored in sidecar files."""
+        weak = array.array('I', self.weak)
+        if sys.byteorder == 'big':
+            weak.byteswap()
+        strong_size = len(self.strong[0]) if self.strong else configuration.strong_digest_size
+
+        return msgpack.packb([_FORMAT_VERSION, self.size, self.block_size, self.digest,
+                              strong_size, weak.tobytes(), b''.join(self.strong),
+                              self.compression], use_bin_type=True)
+
+    @classmethod
+    def unpack(cls, data: bytes) -> 'Signature':
+        """Rebuild a signature from its serialized form."""
+        version, size, block_size, digest, strong_size, weak_data, strong_data, *extra = \
+            msgpack.unpackb(data, raw=False)
+        if not 1 <= version <= _FORMAT_VERSION:
+            raise ValueError('Unsupported signature format version {0}'.format(version))
+        weak = array.array('I')
+        weak.frombytes(weak_data)
+        if sys.byteorder == 'big':
+            weak.byteswap()
+        strong = [strong_data[offset:offset + strong_size]
+                  for offset in range(0, len(strong_data), strong_size)]
+
+        return cls(size, block_size, digest, weak.tolist(), strong, *extra[:1])
+
+    def block_length(self, index: int) -> int:
+        """Return the length of block `index`, only the last block may be short."""
+        return min(self.block_size, self.size - index * self.block_size)
+
+
+class BlockHasher(object):
+    """Accumulate block signatures of a stream fed in pieces of arbitrary length."""
+
+    def __init__(self, block_size: Optional[int] = None) -> None:
+        """Prepare an empty signature using blocks of `block_size` bytes."""
+        self.block_size: int = block_size or configuration.block_size
+        self.weak: List[int] = []
+        self.strong: List[bytes] = []
+        self._pending = bytearray()
+
+    def _add(self, block: Any) -> None:
+        self.weak.append(zlib.adler32(block))
+        self.strong.append(strong_hash(block))
+
+    def update(self, data: Any) -> None:
+        """Feed the next piece of the stream."""
+        view = memoryview(data)
+        if self._pending:
+            needed = self.block_size - len(self._pending)
+            self._pending += view[:needed]
+            view = view[needed:]
+            if len(self._pending) < self.block_size:
+                return
+            self._add(self._pending)
+            self._pending = bytearray()
+
+        full = len(view) - len(view) % self.block_size
+        for offset in range(0, full, self.block_size):
+            self._add(view[offset:offset + self.block_size])
+        self._pending += view[full:]
+
+    def finish(self, size: int, digest: bytes, compression: Optional[str] = None) -> Signature:
+        """Return the signature of the whole stream of `size` bytes and file `digest`."""
+        if self._pending:
+            self._add(self._pending)
+            self._pending = bytearray()
+
+        return Signature(size, self.block_size, digest, self.weak, self.strong, compression)
+
+
+def verify_blocks(signature: Signature, offset: int, data: Any) -> bool:
+    """Tell whether `data`, read at `offset` of the file, matches the signature blocks.
+
+    `data` must start on a block boundary and end on one or at the end of the file.
+    """
+    block_size = signature.block_size
+    first = offset // block_size
+    view = memoryview(data)
+    for index, start in enumerate(range(0, len(view), block_size), first):
+        if index >= len(signature.strong) or \
+                strong_hash(view[start:start + block_size]) != signature.strong[index]:
+            return False
+
+    return True
+
+
+def read_sidecar(path: str) -> Signature:
+    """Load the signature stored in the sidecar file of `path`."""
+    with open(sidecar_path(path), mode='rb') as stream:
+        return Signature.unpack(stream.read())
+
+
+class Delta(NamedTuple):
+    """Describe how to rebuild a file from a local seed file and remote byte ranges.
+
+    `copies` holds ``(target_offset, seed_offset, length)`` ranges available in the seed,
+    `missing` holds ``(offset, length)`` ranges to fetch from the remote file. Contiguous
+    ranges are coalesced so that they map to as few range requests as possible.
+    """
+
+    size: int
+    digest: bytes
+    copies: List[Tuple[int, int, int]]
+    missing: List[Tuple[int, int]]
+
+    @property
+    def transfer_size(self) -> int:
+        """Return the number of bytes to fetch from the remote file."""
+        return sum(length for _, length in self.missing)
+
+
+def _find_blocks(seed: Any, signature: Signature,
+                 found: Optional[Dict[int, int]] = None) -> Dict[int, int]:
+    """Return a mapping of signature block index to the offset of its content in `seed`.
+
+    Blocks already `found` are not searched again.
+
+    Each aligned position of the seed is checked first, which is enough for in-place
+    changes. When a block does not match, the following bytes are searched with the rolling
+    checksum to re-synchronize after insertions or deletions. As the rolling search runs
+    byte per byte, it is capped to `configuration.rolling_search_limit` bytes per file;
+    past that, only aligned positions are checked.
+    """
+    block_size = signature.block_size
+    full_blocks = signature.size // block_size
+    found = dict(found or {})
+    candidates: Dict[int, List[int]] = {}
+    for index in range(full_blocks):
+        if index not in found:
+            candidates.setdefault(signature.weak[index], []).append(index)
+
+    def match(weak: int, position: int) -> bool:
+        indexes = candidates.get(weak)
+        if not indexes:
+            return False
+        strong = strong_hash(seed[position:position + block_size])
+        matched = [index for index in indexes if signature.strong[index] == strong]
+        for index in matched:
+            found[index] = position
+            indexes.remove(index)
+        if not indexes:
+            del candidates[weak]
+        return bool(matched)
+
+    seed_size = len(seed)
+    budget = configuration.rolling_search_limit
+    position = 0
+    while candidates and position + block_size <= seed_size:
+        weak = zlib.adler32(seed[position:position + block_size])
+        if match(weak, position):
+            position += block_size
+            continue
+        last_start = min(position + block_size - 1, seed_size - block_size)
+        if budget <= 0 or last_start <= position:
+            position += block_size
+            continue
+
+        low, high = weak & 0xffff, weak >> 16
+        budget -= last_start - position
+        for start in range(position + 1, last_start + 1):
+            outgoing, incoming = seed[start - 1], seed[start + block_size - 1]
+            low = (low - outgoing + incoming) % _ADLER_MODULO
+            high = (high - block_size * outgoing + low - 1) % _ADLER_MODULO
+            if match(high << 16 | low, start):
+                position = start + block_size
+                break
+        else:
+            position += block_size
+
+    tail_length = signature.size - full_blocks * block_size
+    if tail_length and full_blocks not in found:
+        tail = signature.strong[full_blocks]
+        for position in (full_blocks * block_size, seed_size - tail_length):
+            if 0 <= position <= seed_size - tail_length and \
+                    strong_hash(seed[position:position + tail_length]) == tail:
+                found[full_blocks] = position
+                break
+
+    return found
+
+
+def compute_delta(seed_path: Optional[str], signature: Signature,
+                  seed_signature: Optional[Signature] = None) -> Delta:
+    """Return the delta needed to rebuild the file described by `signature`.
+
+    `seed_path` is an older or similar local file whose matching blocks can be reused, the
+    whole file is fetched remotely when it is None, missing or empty. With the
+    `seed_signature` of the seed, blocks left in place are matched without reading the seed,
+    which is only searched for the other blocks.
+    """
+    found: Dict[int, int] = {}
+    seed_size = os.path.getsize(seed_path) \
+        if seed_path is not None and os.path.isfile(seed_path) else 0
+    if seed_size and seed_signature is not None and seed_signature.size == seed_size and \
+            seed_signature.block_size == signature.block_size:
+        found = {index: index * signature.block_size
+                 for index, strong in enumerate(seed_signature.strong[:len(signature.strong)])
+                 if strong == signature.strong[index] and
+                 seed_signature.block_length(index) == signature.block_length(index)}
+    if seed_size and len(found) < len(signature.strong):
+        with open(cast(str, seed_path), mode='rb') as stream, \
+                mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ) as seed:
+            found = _find_blocks(seed, signature, found)
+
+    copies: List[Tuple[int, int, int]] = []
+    missing: List[Tuple[int, int]] = []
+    block_size = signature.block_size
+    for index in range(len(signature.weak)):
+        target_offset, length = index * block_size, signature.block_length(index)
+        seed_offset = found.get(index)
+        if seed_offset is not None:
+            if copies and copies[-1][0] + copies[-1][2] == target_offset and \
+                    copies[-1][1] + copies[-1][2] == seed_offset:
+                copies[-1] = (copies[-1][0], copies[-1][1], copies[-1][2] + length)
+            else:
+                copies.append((target_offset, seed_offset, length))
+        elif missing and sum(missing[-1]) == target_offset:
+            missing[-1] = (missing[-1][0], missing[-1][1] + length)
+        else:
+            missing.append((target_offset, length))
+
+    return Delta(signature.size, signature.digest, copies, missing)
+
+
+def _read_range(stream: BinaryIO, offset: int, length: int) -> Iterator[bytes]:
+    """Yield `length` bytes of `stream` starting at `offset`, in bounded pieces."""
+    stream.seek(offset)
+    while length > 0:
+        data = stream.read(min(length, configuration.read_chunk_size))
+        if not data:
+            return
+        length -= len(data)
+        yield data
+
+
+def _split_piece(offset: int, length: int,
+                 done: Sequence[Tuple[int, int]]) -> Iterator[Tuple[int, int, bool]]:
+    """Split a range into ``(offset, length, written)`` pieces at the bounds of `done` ranges.
+
+    Pieces left to write are at most `configuration.segment_size` bytes long.
+    """
+    end = offset + length
+    while offset < end:
+        piece_end, written = min(end, offset + configuration.segment_size), False
+        for done_offset, done_length in done:
+            if done_offset <= offset < done_offset + done_length:
+                piece_end, written = min(end, done_offset + done_length), True
+                break
+            if offset < done_offset < piece_end:
+                piece_end = done_offset
+        yield offset, piece_end - offset, written
+        offset = piece_end
+
+
+def assemble(seed_path: Optional[str], output_path: str, delta: Delta,
+             fetch: Callable[[int, int], Iterable[bytes]],
+             done: Sequence[Tuple[int, int]] = (),
+             on_piece: Optional[Callable[[int, int], Any]] = None) -> None:
+    """Write the file described by `delta` to `output_path`.
+
+    Ranges available locally are copied from `seed_path`, the other ones are streamed from
+    ``fetch(offset, length)``. The result is checked against the expected digest and
+    :class:`exceptions.IntegrityError` is raised on mismatch.
+
+    The ``(offset, length)`` ranges of `done`, written into `output_path` by an interrupted
+    run, are read back to check the digest instead of being copied or fetched again.
+    `on_piece` is called with the offset and length of every piece once written and flushed
+    to disk, so that an interrupted run can be resumed from them.
+    """
+    pieces: List[Tuple[int, int, Optional[int]]] = \
+        [(target_offset, length, seed_offset) for target_offset, seed_offset, length
+         in delta.copies] + [(offset, length, None) for offset, length in delta.missing]
+    digest = hashlib.blake2b(digest_size=len(delta.digest))
+
+    with open(output_path, mode='r+b' if done else 'wb') as output, \
+            open(seed_path if delta.copies and seed_path else os.devnull, mode='rb') as seed:
+        for target_offset, length, seed_offset in sorted(pieces):
+            for offset, piece_length, written in _split_piece(target_offset, length, done):
+                if written:
+                    for chunk in _read_range(output, offset, piece_length):
+                        digest.update(chunk)
+                    continue
+                if seed_offset is None:
+                    chunks = fetch(offset, piece_length)
+                else:
+                    chunks = _read_range(seed, seed_offset + offset - target_offset,
+                                         piece_length)
+                output.seek(offset)
+                for chunk in chunks:
+                    digest.update(chunk)
+                    output.write(chunk)
+                output.flush()
+                os.fsync(output.fileno())
+                if on_piece is not None:
+                    on_piece(offset, piece_length)
+        output.truncate(delta.size)
+
+    if digest.digest() != delta.digest:
+        raise exceptions.IntegrityError('{0} does not match its expected digest'.format(
+            output_path))
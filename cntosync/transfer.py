@@ -0,0 +1,910 @@
+# --------------------------------License Notice----------------------------------
+# CNTOSync - Carpe Noctem Tactical Operations ArmA3 mod synchronization tool
+# Copyright (C) 2018 Carpe Noctem - Tactical Operations (aka. CNTO) (contact@carpenoctem.co)
+#
+# The authors of this software are listed in the AUTHORS file at the
+# root of this software's source code tree.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# All rights reserved.
+# --------------------------------License Notice----------------------------------
+
+"""Transfer remote repository files into a local repository.
+
+Files are downloaded into content-addressed partial files of the index directory and moved
+into place once complete and verified. Every segment is verified and flushed to disk before
+being recorded in the transfer journal, so an interrupted transfer resumes by fetching only
+the ranges the journal does not hold, without reading committed data again.
+
+Large files changed on the remote and carrying a sidecar signature are transferred as a delta
+of their local copy: blocks the local copy still holds are copied from it, and only the other
+ranges are fetched, see :func:`signature.compute_delta`. Copied and fetched pieces are
+journaled alike, so an interrupted delta transfer resumes from them too.
+
+Files the remote published a compressed blob of are fetched compressed and decompressed while
+written to their partial file, unless an interrupted transfer already committed part of them.
+
+Small files are fetched in memory and verified there, then handed to the writer stage, which
+commits them into place in batches, see :mod:`writer`.
+
+Repositories reachable through the filesystem, with ``file`` URLs, are copied without reading
+data in Python: files are hard linked when requested, reflinked on copy-on-write filesystems
+or copied within the kernel.
+"""
+
+import bisect
+import collections
+import functools
+import itertools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import (Any, Callable, Collection, Dict, Iterable, Iterator, List, Mapping,
+                    NamedTuple, Optional, Sequence, Tuple, cast)
+from urllib.parse import urlparse
+from urllib.request import url2pathname
+
+import msgpack
+
+from . import bandwidth
+from . import chunking
+from . import compression
+from . import configuration
+from . import exceptions
+from . import indexer
+from . import metrics
+from . import signature
+from .download import DownloadJob, Downloader, ProgressCallback, file_url
+from .fileutils import allocate, atomic_open, atomic_write, clone_file, copy_file
+from .journal import TransferJournal
+from .manifest import Manifest, apply_changes, write_manifest
+from .writer import FileWriter
+
+
+class TransferResult(NamedTuple):
+    """Outcome of a transfer.
+
+    `fetched_bytes` counts bytes downloaded by this run, `resumed_bytes` those already
+    committed by an interrupted run and reused.
+    """
+
+    files: int
+    fetched_bytes: int
+    resumed_bytes: int
+
+
+def local_path(url: str) -> str:
+    """Return the filesystem path of the ``file`` URL `url`."""
+    parsed_url = urlparse(url)
+    if parsed_url.netloc in ('', 'localhost'):
+        return url2pathname(parsed_url.path)
+
+    return url2pathname('//' + parsed_url.netloc + parsed_url.path)
+
+
+def fetch_index(url: str, downloader: Downloader) -> Dict[str, Any]:
+    """Download and decode the index of the repository served at `url`."""
+    index_url = file_url(url, configuration.index_directory + '/' + configuration.index_file)
+
+    return msgpack.unpackb(b''.join(downloader.fetch(index_url)), raw=False)
+
+
+def fetch_publication(url: str, downloader: Downloader) -> Optional[Dict[str, Any]]:
+    """Download the publication of the repository served at `url`, None if unpublished."""
+    try:
+        return msgpack.unpackb(b''.join(downloader.fetch(file_url(
+            url, configuration.index_directory + '/' + configuration.publication_file))),
+            raw=False)
+    except exceptions.DownloadError:
+        return None
+
+
+def compressed_tables(publication: Dict[str, Any]) -> Dict[str, str]:
+    """Return the names of the compressed tables of `publication` by mod.
+
+    Publications written before tables were split by mod have a single table, listed under
+    every mod.
+    """
+    compressed = publication.get('compressed')
+    if isinstance(compressed, str):
+        return {mod: compressed for mod in publication['shards']}
+
+    return compressed or {}
+
+
+def fetch_shard(url: str, downloader: Downloader, name: str,
+                compressions: Sequence[str] = ()) -> bytes:
+    """Download the published shard `name` of the repository served at `url`.
+
+    The shard is fetched in the first of `compressions` available, and checked against its
+    name, the digest of its content.
+    """
+    shard_path = '/'.join((configuration.index_directory, configuration.shard_directory, name))
+    available = compression.available_compressions()
+    compression_name = next((compression_name for compression_name in compressions
+                             if compression_name in available), None)
+    if compression_name is None:
+        data = b''.join(downloader.fetch(file_url(url, shard_path)))
+    else:
+        data = compression.decompress(b''.join(downloader.fetch(file_url(
+            url, shard_path + compression.suffixes[compression_name]))), compression_name)
+    digest = indexer.new_hash()
+    digest.update(data)
+    if digest.hexdigest() != name:
+        raise exceptions.IntegrityError('Shard {0} does not match its digest'.format(name))
+
+    return data
+
+
+def update_manifest(url: str, downloader: Downloader, path: str,
+                    publication: Dict[str, Any]) -> Optional[Manifest]:
+    """Bring the manifest at `path` to the revision of `publication` and open it.
+
+    The manifest previously fetched at `path` is identified by its digest: if it is one of
+    the few revisions preceding the published one, the delta indexes of the following
+    revisions are fetched and applied to it. Return None if the manifest at `path` is
+    missing, too old, or does not match the published one once updated.
+    """
+    try:
+        digest = indexer.hash_file(path).hex()
+    except FileNotFoundError:
+        return None
+    if digest == publication.get('manifest'):
+        return Manifest(path)
+    bases = [base for base, _ in publication.get('deltas', ())]
+    if digest not in bases:
+        return None
+
+    changes: Dict[str, Optional[List[Any]]] = {}
+    try:
+        for _, name in publication['deltas'][bases.index(digest):]:
+            deleted, entries = msgpack.unpackb(fetch_shard(
+                url, downloader, name, publication.get('compressions', ())), raw=False)
+            changes.update(dict.fromkeys(deleted))
+            changes.update((entry[0], entry) for entry in entries)
+    except (exceptions.DownloadError, exceptions.IntegrityError):
+        return None
+    with Manifest(path) as manifest:
+        write_manifest(path, apply_changes(manifest, changes))
+    if indexer.hash_file(path).hex() != publication['manifest']:
+        return None
+
+    return Manifest(path)
+
+
+def fetch_manifest(url: str, downloader: Downloader, path: str,
+                   folders: Optional[Collection[str]] = None,
+                   publication: Optional[Dict[str, Any]] = None) -> Manifest:
+    """Download the manifest of the repository served at `url` to `path` and open it.
+
+    Without `folders`, the manifest already at `path` is updated with the delta indexes of
+    the `publication` when possible, see :func:`update_manifest`, and downloaded otherwise.
+
+    With `folders`, the manifest only holds the entries of these top-level folders. They
+    are assembled from the shards of the `publication` of the repository, if it has one,
+    so that the index fetched is proportional to the folders. Fetched shards are kept in
+    the shard cache next to `path` and only fetched again once changed.
+    """
+    if folders is None and publication is not None:
+        manifest = update_manifest(url, downloader, path, publication)
+        if manifest is not None:
+            return manifest
+    if folders is None or publication is None:
+        manifest_url = file_url(url, configuration.index_directory + '/' +
+                                configuration.manifest_file)
+        with atomic_open(path) as stream:
+            for data in downloader.fetch(manifest_url):
+                stream.write(data)
+        if folders is not None:
+            with Manifest(path) as manifest:
+                write_manifest(path, (entry.pack() for entry in manifest.select(folders)))
+        return Manifest(path)
+
+    cache = os.path.join(os.path.dirname(path), configuration.shard_cache_directory)
+    os.makedirs(cache, exist_ok=True)
+    shards = {folder: publication['shards'][folder] for folder in folders
+              if folder in publication['shards']}
+    for name in set(shards.values()):
+        if not os.path.exists(os.path.join(cache, name)):
+            atomic_write(os.path.join(cache, name), fetch_shard(
+                url, downloader, name, publication.get('compressions', ())))
+    for name in os.listdir(cache):
+        if not name.startswith('.') and name not in shards.values():
+            os.remove(os.path.join(cache, name))
+
+    # The entries of a folder are contiguous in path order: shards are concatenated.
+    manifests = [Manifest(os.path.join(cache, shards[folder]))
+                 for folder in sorted(shards, key=lambda folder: folder + '/')]
+    try:
+        write_manifest(path, (entry.pack() for entry in itertools.chain(*manifests)))
+    finally:
+        for manifest in manifests:
+            manifest.close()
+
+    return Manifest(path)
+
+
+def fetch_signature(url: str, relative_path: str, downloader: Downloader) \
+        -> Optional[signature.Signature]:
+    """Download the sidecar signature of `relative_path`, None if the remote has none."""
+    try:
+        data = b''.join(downloader.fetch(file_url(url, relative_path + configuration.extension)))
+    except exceptions.DownloadError:
+        return None
+
+    return signature.Signature.unpack(data)
+
+
+def fetch_compressed_table(url: str, downloader: Downloader,
+                           publication: Optional[Dict[str, Any]] = None,
+                           folders: Optional[Collection[str]] = None) -> Dict[bytes, List[Any]]:
+    """Download the compressed table published at `url`, empty if the remote has none.
+
+    The table maps file digests to the compression and size of their compressed blob. The
+    `publication` is fetched unless given. With `folders`, only the tables of these
+    top-level folders are fetched.
+    """
+    if publication is None:
+        publication = fetch_publication(url, downloader)
+    tables = compressed_tables(publication) if publication is not None else {}
+    if folders is not None:
+        tables = {folder: name for folder, name in tables.items() if folder in folders}
+
+    table: Dict[bytes, List[Any]] = {}
+    for name in set(tables.values()):
+        try:
+            data = b''.join(downloader.fetch(file_url(url, '/'.join((
+                configuration.index_directory, configuration.shard_directory, name)))))
+        except exceptions.DownloadError:
+            continue
+        table.update(msgpack.unpackb(data, raw=False))
+
+    return table
+
+
+def fetch_recipes(url: str, downloader: Downloader, publication: Dict[str, Any],
+                  folders: Collection[str]) -> Dict[str, List[chunking.Chunk]]:
+    """Download the chunk recipes of the top-level `folders` of `publication`.
+
+    The result maps relative paths to the ``(digest, size)`` pairs of their chunks, it is
+    empty if the repository was published without chunks.
+    """
+    recipes: Dict[str, List[chunking.Chunk]] = {}
+    names = publication.get('recipes', {})
+    for name in {names[folder] for folder in folders if folder in names}:
+        data = fetch_shard(url, downloader, name, publication.get('compressions', ()))
+        for path, chunks in msgpack.unpackb(data, raw=False).items():
+            recipes[path] = [(digest, size) for digest, size in chunks]
+
+    return recipes
+
+
+class _Received(object):
+    """Count the bytes received for a file and the time spent waiting for them."""
+
+    def __init__(self, progress: Optional[ProgressCallback]) -> None:
+        self.progress = progress
+        self.size = 0
+        self.seconds = 0.0
+
+    def stream(self, chunks: Iterable[bytes]) -> Iterator[bytes]:
+        """Yield `chunks`, counting them and reporting them to the progress callback."""
+        iterator = iter(chunks)
+        while True:
+            start = time.perf_counter()
+            data = next(iterator, None)
+            self.seconds += time.perf_counter() - start
+            if data is None:
+                return
+            self.size += len(data)
+            if self.progress is not None:
+                self.progress(len(data))
+            yield data
+
+
+class _PendingFile(object):
+    """Download state of one content shared by one or more entries."""
+
+    def __init__(self, entries: List[indexer.FileEntry], path: str, remaining: int,
+                 file_signature: Optional[signature.Signature]) -> None:
+        self.entries = entries
+        self.path = path
+        self.remaining = remaining
+        self.signature = file_signature
+        self.verified = file_signature is not None
+
+
+def transfer_files(directory: str, url: str, entries: Sequence[indexer.FileEntry],
+                   journal: TransferJournal, downloader: Downloader,
+                   progress: Optional[ProgressCallback] = None,
+                   compressed: Optional[Mapping[bytes, Sequence[Any]]] = None,
+                   optional_mods: Collection[str] = (),
+                   recipes: Optional[Mapping[str, Sequence[chunking.Chunk]]] = None,
+                   chunk_sources: Optional[Mapping[bytes, Tuple[str, int]]] = None) \
+        -> TransferResult:
+    """Download `entries` of the repository served at `url` into `directory`.
+
+    Entries sharing the same content are downloaded once. Files with a sidecar signature are
+    verified segment by segment against it and the signature is stored along them, other
+    files are hashed once complete. :class:`exceptions.IntegrityError` is raised if data
+    does not match.
+
+    Files of at least `configuration.delta_threshold` bytes with a signature are rebuilt from
+    the current local file at one of their paths when there is one, fetching only the blocks
+    it does not hold, and are downloaded whole if the rebuilt file does not match.
+
+    Other files listed in the chunk `recipes` of a repository published with chunks are
+    assembled from their chunks when some of them are shared with other transferred files
+    or found in `chunk_sources`, which maps chunk digests to a local path and offset holding
+    them: shared chunks are fetched once, and chunks found locally are not fetched.
+
+    Contents listed in the `compressed` table are fetched as compressed blobs, falling back
+    to the original file when the blob is missing or invalid. `progress` is called with the
+    number of bytes received, compressed or not.
+
+    Downloads are prioritized by :func:`bandwidth.file_priority`, files of `optional_mods`
+    folders coming after those of required mods. Files smaller than
+    `configuration.batched_write_size` are committed in batches by a :class:`FileWriter`.
+
+    Once the `stop` event of `downloader` is set, :class:`exceptions.Cancelled` is raised
+    when running transfers stopped, the files and segments completed so far being kept in the
+    journal.
+    """
+    os.makedirs(journal.partial_directory, exist_ok=True)
+    groups: Dict[bytes, List[indexer.FileEntry]] = {}
+    for entry in entries:
+        groups.setdefault(entry.digest, []).append(entry)
+    for digest in list(journal.partial):
+        if digest not in groups:
+            journal.discard(digest)
+
+    signed = [group[0] for group in groups.values() if signature.needs_sidecar(group[0].size)]
+    with ThreadPoolExecutor(max_workers=downloader.workers) as executor:
+        signatures = dict(zip((entry.digest for entry in signed), executor.map(
+            lambda entry: fetch_signature(url, entry.path, downloader), signed)))
+
+    compressed = compressed or {}
+    available = compression.available_compressions()
+    lock = threading.Lock()
+    pending: Dict[str, _PendingFile] = {}
+    jobs: List[DownloadJob] = []
+    blobs: List[Tuple[DownloadJob, _PendingFile, str]] = []
+    deltas: List[Tuple[DownloadJob, _PendingFile, str]] = []
+    chunked: List[Tuple[DownloadJob, _PendingFile, Sequence[chunking.Chunk]]] = []
+    small: List[Tuple[DownloadJob, _PendingFile, Optional[str]]] = []
+    signatures = {digest: file_signature for digest, file_signature in signatures.items()
+                  if file_signature is not None and file_signature.digest == digest and
+                  file_signature.size == groups[digest][0].size}
+    seeds = {digest: _seed_path(directory, groups[digest]) for digest in signatures
+             if groups[digest][0].size >= configuration.delta_threshold}
+    chunk_sources = chunk_sources or {}
+    file_recipes = _chunk_recipes(groups, recipes or {}, chunk_sources,
+                                  {digest for digest, seed_path in seeds.items() if seed_path})
+    chunk_counts = collections.Counter(digest for chunks in file_recipes.values()
+                                       for digest, _ in chunks)
+    shared_chunks: Dict[bytes, Tuple[int, int]] = {}
+    resumed_bytes = fetched_bytes = 0
+    for digest, group in groups.items():
+        entry = group[0]
+        partial_path = journal.partial_path(digest)
+        if digest in journal.partial and os.path.isfile(partial_path):
+            ranges = journal.missing_ranges(digest, entry.size)
+        else:
+            journal.discard(digest)
+            journal.start_file(digest)
+            ranges = [(0, entry.size)]
+        missing = sum(length for _, length in ranges)
+        resumed_bytes += entry.size - missing
+        fetched_bytes += missing
+
+        state = _PendingFile(group, partial_path, missing, signatures.get(digest))
+        if not missing:
+            _finalize(directory, digest, state, journal)
+            continue
+        url_path = file_url(url, entry.path)
+        priority = min(bandwidth.file_priority(entry.size,
+                                               indexer.mod_folder(entry.path) in optional_mods)
+                       for entry in group)
+        compression_name = compressed[digest][0] if digest in compressed else None
+        if compression_name not in available:
+            compression_name = None
+        seed_path = seeds.get(digest)
+        if seed_path is not None:
+            deltas.append((DownloadJob(url_path, partial_path, entry.size,
+                                       None if ranges == [(0, entry.size)] else ranges,
+                                       priority),
+                           state, seed_path))
+            continue
+        if digest in file_recipes:
+            chunked.append((DownloadJob(url_path, partial_path, entry.size,
+                                        None if ranges == [(0, entry.size)] else ranges,
+                                        priority),
+                            state, file_recipes[digest]))
+            for chunk_digest, size in file_recipes[digest]:
+                if chunk_counts[chunk_digest] > 1 and chunk_digest not in chunk_sources:
+                    shared_chunks[chunk_digest] = \
+                        (size, min(priority, shared_chunks.get(chunk_digest, (0, priority))[1]))
+            continue
+        if ranges == [(0, entry.size)] and entry.size < configuration.batched_write_size:
+            small.append((DownloadJob(url_path, partial_path, entry.size, priority=priority),
+                          state, compression_name))
+            continue
+        if ranges == [(0, entry.size)] and compression_name is not None:
+            blobs.append((DownloadJob(url_path, partial_path, entry.size, priority=priority),
+                          state, compression_name))
+        elif ranges == [(0, entry.size)]:
+            jobs.append(DownloadJob(url_path, partial_path, entry.size, priority=priority))
+        else:
+            jobs.append(DownloadJob(url_path, partial_path, entry.size, ranges, priority))
+        pending[partial_path] = state
+    blobs.sort(key=lambda blob: (blob[0].priority, -blob[0].size))
+    deltas.sort(key=lambda delta: (delta[0].priority, -delta[0].size))
+    # Bytes received by the attempts to fetch a file, counted even if the attempt fails.
+    attempts: Dict[str, _Received] = {}
+    chunked.sort(key=lambda item: (item[0].priority, -item[0].size))
+    small.sort(key=lambda item: (item[0].priority, -item[0].size))
+
+    recorder = metrics.active()
+
+    def verify_range(job: DownloadJob, state: _PendingFile, offset: int, length: int) -> None:
+        if state.signature is None:
+            return
+        block_size = state.signature.block_size
+        if offset % block_size or (length % block_size and offset + length != job.size):
+            state.verified = False
+            return
+        start = time.perf_counter()
+        with open(job.path, mode='rb') as stream:
+            stream.seek(offset)
+            data = stream.read(length)
+        valid = signature.verify_blocks(state.signature, offset, data)
+        if recorder is not None:
+            recorder.add(metrics.VERIFY, size=length, seconds=time.perf_counter() - start)
+        if not valid:
+            raise exceptions.IntegrityError(
+                'Range {0}-{1} of {2} does not match its signature'.format(
+                    offset, offset + length, state.entries[0].path))
+
+    def on_segment(job: DownloadJob, offset: int, length: int) -> None:
+        state = pending[job.path]
+        digest = state.entries[0].digest
+        verify_range(job, state, offset, length)
+        journal.complete_range(digest, offset, length)
+        with lock:
+            state.remaining -= length
+            completed = not state.remaining
+        if completed:
+            _finalize(directory, digest, state, journal)
+        journal.flush()
+
+    def fetch_blob(job: DownloadJob, state: _PendingFile, compression_name: str) -> int:
+        digest = state.entries[0].digest
+        blob_url = file_url(url, '/'.join((configuration.index_directory,
+                                           configuration.blob_directory,
+                                           compression.blob_name(digest, compression_name))))
+        decompressor = compression.decompressor(compression_name)
+        file_digest = indexer.new_hash()
+        received = attempts[job.path] = _Received(progress)
+        written = 0
+        with open(job.path, mode='wb', buffering=configuration.write_buffer_size) as stream:
+            allocate(stream.fileno(), job.size)
+            start = time.perf_counter()
+            for data in received.stream(downloader.fetch(blob_url, priority=job.priority)):
+                decompressed = decompressor.decompress(data)
+                stream.write(decompressed)
+                file_digest.update(decompressed)
+                written += len(decompressed)
+            decompressed = decompressor.flush()
+            stream.write(decompressed)
+            file_digest.update(decompressed)
+            written += len(decompressed)
+            stream.flush()
+            os.fsync(stream.fileno())
+            if recorder is not None:
+                recorder.add(metrics.FETCH, size=received.size, seconds=received.seconds)
+                recorder.add(metrics.WRITE, size=written,
+                             seconds=time.perf_counter() - start - received.seconds)
+        if written != job.size or file_digest.digest() != digest:
+            raise exceptions.IntegrityError('Compressed blob of {0} does not match its '
+                                            'expected digest'.format(state.entries[0].path))
+
+        journal.complete_range(digest, 0, job.size)
+        state.remaining = 0
+        state.verified = True
+        _finalize(directory, digest, state, journal)
+        journal.flush()
+        return received.size
+
+    def assemble_file(job: DownloadJob, state: _PendingFile, seed_path: Optional[str],
+                      delta: signature.Delta, fetch: Callable[[int, int], Iterable[bytes]],
+                      received: _Received) -> int:
+        digest = state.entries[0].digest
+
+        def on_piece(offset: int, length: int) -> None:
+            verify_range(job, state, offset, length)
+            journal.complete_range(digest, offset, length)
+            journal.flush()
+
+        done = journal.partial.get(digest, []) if job.ranges is not None else []
+        start = time.perf_counter()
+        signature.assemble(seed_path, job.path, delta, fetch, done, on_piece)
+        if recorder is not None:
+            recorder.add(metrics.FETCH, size=received.size, seconds=received.seconds)
+            recorder.add(metrics.WRITE, size=job.size,
+                         seconds=time.perf_counter() - start - received.seconds)
+
+        journal.complete_range(digest, 0, job.size)
+        state.remaining = 0
+        state.verified = True
+        _finalize(directory, digest, state, journal)
+        journal.flush()
+        return received.size
+
+    def fetch_delta(job: DownloadJob, state: _PendingFile, seed_path: str) -> int:
+        received = attempts[job.path] = _Received(progress)
+        try:
+            seed_signature: Optional[signature.Signature] = signature.read_sidecar(seed_path)
+        except (OSError, ValueError, TypeError, msgpack.exceptions.UnpackException):
+            seed_signature = None
+        start = time.perf_counter()
+        delta = signature.compute_delta(seed_path, cast(signature.Signature, state.signature),
+                                        seed_signature)
+        if recorder is not None:
+            recorder.add(metrics.DIFF, 1, job.size, time.perf_counter() - start)
+
+        return assemble_file(job, state, seed_path, delta, lambda offset, length: received.stream(
+            downloader.fetch(job.url, offset, length, priority=job.priority)), received)
+
+    def read_chunk(digest: bytes, size: int) -> Optional[bytes]:
+        for path, offset in [(journal.chunk_path(digest), 0)] + \
+                ([chunk_sources[digest]] if digest in chunk_sources else []):
+            try:
+                with open(path, mode='rb') as stream:
+                    stream.seek(offset)
+                    data = stream.read(size)
+            except OSError:
+                continue
+            if len(data) == size and chunking.chunk_digest(data) == digest:
+                return data
+        return None
+
+    def fetch_chunk(digest: bytes, size: int, priority: int, received: _Received) -> bytes:
+        data = b''.join(received.stream(downloader.fetch(file_url(url, '/'.join((
+            configuration.index_directory, configuration.object_directory,
+            chunking.object_name(digest)))), priority=priority)))
+        if len(data) != size or chunking.chunk_digest(data) != digest:
+            raise exceptions.IntegrityError('Chunk {0} does not match its digest'.format(
+                digest.hex()))
+        return data
+
+    def store_chunk(digest: bytes, size: int, priority: int) -> int:
+        if read_chunk(digest, size) is not None:
+            return 0
+        received = _Received(progress)
+        try:
+            data = fetch_chunk(digest, size, priority, received)
+        except (exceptions.DownloadError, exceptions.IntegrityError):
+            return received.size
+        os.makedirs(os.path.dirname(journal.chunk_path(digest)), exist_ok=True)
+        atomic_write(journal.chunk_path(digest), data)
+        return received.size
+
+    def fetch_chunked(job: DownloadJob, state: _PendingFile,
+                      chunks: Sequence[chunking.Chunk]) -> int:
+        ends = list(itertools.accumulate(size for _, size in chunks))
+        received = attempts[job.path] = _Received(progress)
+        current: List[Any] = [None, b'']
+
+        def fetch(offset: int, length: int) -> Iterator[bytes]:
+            index = bisect.bisect_right(ends, offset)
+            while length > 0:
+                digest, size = chunks[index]
+                if current[0] != index:
+                    data = read_chunk(digest, size)
+                    current[:] = [index, data if data is not None else
+                                  fetch_chunk(digest, size, job.priority, received)]
+                start = offset - ends[index] + size
+                piece = current[1][start:start + length]
+                yield piece
+                offset += len(piece)
+                length -= len(piece)
+                index += 1
+
+        delta = signature.Delta(job.size, state.entries[0].digest, [], [(0, job.size)])
+        return assemble_file(job, state, None, delta, fetch, received)
+
+    def fetch_small(job: DownloadJob, state: _PendingFile,
+                    compression_name: Optional[str]) -> int:
+        entry = state.entries[0]
+        start = time.perf_counter()
+        received = _Received(progress)
+        verify_time = 0.0
+
+        def valid(content: bytes) -> bool:
+            nonlocal verify_time
+            verified = time.perf_counter()
+            file_digest = indexer.new_hash()
+            file_digest.update(content)
+            verify_time += time.perf_counter() - verified
+            return len(content) == entry.size and file_digest.digest() == entry.digest
+
+        content: Optional[bytes] = None
+        if compression_name is not None:
+            blob_url = file_url(url, '/'.join((configuration.index_directory,
+                                               configuration.blob_directory,
+                                               compression.blob_name(entry.digest,
+                                                                     compression_name))))
+            decompressor = compression.decompressor(compression_name)
+            try:
+                chunks = [decompressor.decompress(data) for data in
+                          received.stream(downloader.fetch(blob_url, priority=job.priority))]
+                content = b''.join(chunks) + decompressor.flush()
+            except (exceptions.DownloadError, exceptions.IntegrityError):
+                content = None
+            # Blobs are optional, the original file is fetched when the blob is unusable.
+            if content is not None and not valid(content):
+                content = None
+        if content is None:
+            content = b''.join(received.stream(downloader.fetch(job.url,
+                                                                priority=job.priority)))
+            if not valid(content):
+                journal.discard(entry.digest)
+                raise exceptions.IntegrityError(
+                    '{0} does not match its expected digest'.format(entry.path))
+        if recorder is not None:
+            recorder.add(metrics.FETCH, size=received.size,
+                         seconds=time.perf_counter() - start - verify_time)
+            recorder.add(metrics.VERIFY, 1, len(content), verify_time)
+
+        for item in state.entries:
+            target = os.path.join(directory, *item.path.split('/'))
+            writer.write(target, content, functools.partial(commit_file, item))
+            if state.signature is not None:
+                writer.write(signature.sidecar_path(target), state.signature.pack())
+        return received.size
+
+    def commit_file(entry: indexer.FileEntry, stat: os.stat_result) -> None:
+        journal.complete_file(entry.path, entry.digest, stat)
+        journal.flush()
+
+    try:
+        def fetch_pooled_small(job: DownloadJob, state: _PendingFile,
+                               compression_name: Optional[str]) -> int:
+            with pool.task():
+                return fetch_small(job, state, compression_name)
+
+        def fetch_pooled_blob(job: DownloadJob, state: _PendingFile,
+                              compression_name: str) -> int:
+            with pool.task():
+                return fetch_blob(job, state, compression_name)
+
+        def fetch_pooled_delta(job: DownloadJob, state: _PendingFile, seed_path: str) -> int:
+            with pool.task():
+                return fetch_delta(job, state, seed_path)
+
+        def store_pooled_chunk(digest: bytes, size: int, priority: int) -> int:
+            with pool.task():
+                return store_chunk(digest, size, priority)
+
+        def fetch_pooled_chunked(job: DownloadJob, state: _PendingFile,
+                                 chunks: Sequence[chunking.Chunk]) -> int:
+            with pool.task():
+                return fetch_chunked(job, state, chunks)
+
+        # Small files are verified in memory and committed in batches by the writer stage.
+        with FileWriter() as writer, \
+                ThreadPoolExecutor(max_workers=downloader.workers) as executor, \
+                metrics.pool('fetch', downloader.workers, len(small) + len(blobs) + len(deltas) +
+                             len(shared_chunks) + len(chunked)) as pool:
+            small_futures = [(job, executor.submit(fetch_pooled_small, job, state,
+                                                   compression_name))
+                             for job, state, compression_name in small]
+            futures = [(job, state, executor.submit(fetch_pooled_blob, job, state,
+                                                    compression_name))
+                       for job, state, compression_name in blobs]
+            delta_futures = [(job, state, executor.submit(fetch_pooled_delta, job, state,
+                                                          seed_path))
+                             for job, state, seed_path in deltas]
+            # Chunks shared between files are fetched once before the files are assembled.
+            chunk_futures = [executor.submit(store_pooled_chunk, digest, size, priority)
+                             for digest, (size, priority) in shared_chunks.items()]
+            try:
+                for chunk_future in chunk_futures:
+                    fetched_bytes += chunk_future.result()
+                delta_futures += [(job, state, executor.submit(fetch_pooled_chunked, job, state,
+                                                               chunks))
+                                  for job, state, chunks in chunked]
+                for job, small_future in small_futures:
+                    fetched_bytes += small_future.result() - job.size
+                for job, state, future in futures:
+                    try:
+                        fetched_bytes += future.result() - job.size
+                    except (exceptions.DownloadError, exceptions.IntegrityError):
+                        # Blobs are optional, download the original file when the blob is
+                        # missing, corrupted or stale.
+                        journal.discard(state.entries[0].digest)
+                        journal.start_file(state.entries[0].digest)
+                        fetched_bytes += attempts[job.path].size
+                        jobs.append(job)
+                        pending[job.path] = state
+                for job, state, future in delta_futures:
+                    missing = job.size if job.ranges is None else \
+                        sum(length for _, length in job.ranges)
+                    try:
+                        fetched_bytes += future.result() - missing
+                    except (OSError, exceptions.DownloadError, exceptions.IntegrityError):
+                        # The local copy or its sidecar changed or vanished since indexed, or
+                        # a chunk is missing, download the file whole instead.
+                        journal.discard(state.entries[0].digest)
+                        journal.start_file(state.entries[0].digest)
+                        resumed_bytes -= job.size - missing
+                        fetched_bytes += job.size - missing + attempts[job.path].size
+                        state.remaining = job.size
+                        state.verified = True
+                        jobs.append(DownloadJob(job.url, job.path, job.size,
+                                                priority=job.priority))
+                        pending[job.path] = state
+            except BaseException:
+                for _, small_future in small_futures:
+                    small_future.cancel()
+                for _, _, future in futures + delta_futures:
+                    future.cancel()
+                for chunk_future in chunk_futures:
+                    chunk_future.cancel()
+                raise
+        downloader.download(jobs, progress, on_segment)
+    finally:
+        journal.flush(force=True)
+
+    return TransferResult(len(entries), fetched_bytes, resumed_bytes)
+
+
+def copy_files(directory: str, source_directory: str, entries: Sequence[indexer.FileEntry],
+               journal: TransferJournal, workers: Optional[int] = None, link: bool = False,
+               progress: Optional[ProgressCallback] = None,
+               stop: Optional[threading.Event] = None) -> TransferResult:
+    """Copy `entries` of the repository at `source_directory` into `directory`.
+
+    Entries sharing the same content are copied once then cloned. With `link`, files are hard
+    linked to those of `source_directory` when both are on the same filesystem: they use no
+    additional space, but must not be modified in place. Source files whose size and
+    modification time match their entry are trusted, others are hashed once copied. Sidecar
+    signatures matching their file are copied along. `progress` is called with the size of
+    each copied content. Once `stop` is set, no further content is copied and
+    :class:`exceptions.Cancelled` is raised, copied files being kept in the journal.
+    """
+    os.makedirs(journal.partial_directory, exist_ok=True)
+    groups: Dict[bytes, List[indexer.FileEntry]] = {}
+    for entry in entries:
+        groups.setdefault(entry.digest, []).append(entry)
+    for digest in list(journal.partial):
+        journal.discard(digest)
+
+    recorder = metrics.active()
+
+    def copy_group(digest: bytes, group: List[indexer.FileEntry]) -> int:
+        with pool.task():
+            return copy_content(digest, group)
+
+    def copy_content(digest: bytes, group: List[indexer.FileEntry]) -> int:
+        if stop is not None and stop.is_set():
+            raise exceptions.Cancelled('Copy cancelled')
+        entry = group[0]
+        source_path = os.path.join(source_directory, *entry.path.split('/'))
+        state = _PendingFile(group, journal.partial_path(digest), 0, None)
+        stat = os.stat(source_path)
+        start = time.perf_counter()
+        clone_file(source_path, state.path, link)
+        if recorder is not None:
+            recorder.add(metrics.WRITE, size=entry.size, seconds=time.perf_counter() - start)
+        state.verified = (stat.st_size, stat.st_mtime_ns) == (entry.size, entry.mtime)
+        if signature.needs_sidecar(entry.size):
+            try:
+                file_signature = signature.read_sidecar(source_path)
+            except (OSError, ValueError, TypeError, msgpack.exceptions.UnpackException):
+                file_signature = None
+            if file_signature is not None and file_signature.digest == digest and \
+                    file_signature.size == entry.size:
+                state.signature = file_signature
+        _finalize(directory, digest, state, journal, link)
+        journal.flush()
+        if progress is not None:
+            progress(entry.size)
+        return entry.size
+
+    copied_bytes = 0
+    try:
+        workers = workers or configuration.download_workers
+        with ThreadPoolExecutor(max_workers=workers) as executor, \
+                metrics.pool('copy', workers, len(groups)) as pool:
+            futures = [executor.submit(copy_group, digest, group)
+                       for digest, group in groups.items()]
+            try:
+                for future in futures:
+                    copied_bytes += future.result()
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+    finally:
+        journal.flush(force=True)
+
+    return TransferResult(len(entries), copied_bytes, 0)
+
+
+def _chunk_recipes(groups: Mapping[bytes, List[indexer.FileEntry]],
+                   recipes: Mapping[str, Sequence[chunking.Chunk]],
+                   chunk_sources: Mapping[bytes, Tuple[str, int]],
+                   seeded: Collection[bytes]) -> Dict[bytes, Sequence[chunking.Chunk]]:
+    """Return the recipes of the contents of `groups` worth assembling from their chunks.
+
+    Contents are worth it when one of their chunks is found in `chunk_sources` or repeated
+    across recipes. Small contents and those rebuilt from a local copy, listed in `seeded`,
+    are left out.
+    """
+    usable: Dict[bytes, Sequence[chunking.Chunk]] = {}
+    for digest, group in groups.items():
+        if digest in seeded or group[0].size < configuration.batched_write_size:
+            continue
+        chunks = next((recipes[entry.path] for entry in group if entry.path in recipes), None)
+        if chunks and sum(size for _, size in chunks) == group[0].size:
+            usable[digest] = chunks
+    counts = collections.Counter(digest for chunks in usable.values() for digest, _ in chunks)
+
+    return {digest: chunks for digest, chunks in usable.items()
+            if any(counts[chunk] > 1 or chunk in chunk_sources for chunk, _ in chunks)}
+
+
+def _seed_path(directory: str, entries: List[indexer.FileEntry]) -> Optional[str]:
+    """Return the path of a local file at the path of one of `entries`, if any."""
+    for entry in entries:
+        path = os.path.join(directory, *entry.path.split('/'))
+        if os.path.isfile(path) and os.path.getsize(path):
+            return path
+    return None
+
+
+def _finalize(directory: str, digest: bytes, state: _PendingFile,
+              journal: TransferJournal, link: bool = False) -> None:
+    """Verify a complete content and move it to the paths of its entries.
+
+    Paths sharing the content get a clone of it, hard linked with `link`. The signature of
+    the content is stored in the sidecar of every path.
+    """
+    recorder = metrics.active()
+    if not state.verified:
+        start = time.perf_counter()
+        valid = indexer.hash_file(state.path) == digest
+        if recorder is not None:
+            recorder.add(metrics.VERIFY, 1, state.entries[0].size, time.perf_counter() - start)
+        if not valid:
+            journal.discard(digest)
+            raise exceptions.IntegrityError('{0} does not match its expected digest'.format(
+                state.entries[0].path))
+
+    first_path = None
+    for entry in state.entries:
+        target = os.path.join(directory, *entry.path.split('/'))
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        if first_path is None:
+            os.replace(state.path, target)
+            first_path = target
+        else:
+            copy_file(first_path, target, link)
+        if state.signature is not None:
+            atomic_write(signature.sidecar_path(target), state.signature.pack())
+        journal.complete_file(entry.path, digest, os.stat(target))
+    if recorder is not None:
+        recorder.add(metrics.WRITE, files=len(state.entries))
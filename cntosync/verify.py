@@ -0,0 +1,183 @@
+# --------------------------------License Notice----------------------------------
+# CNTOSync - Carpe Noctem Tactical Operations ArmA3 mod synchronization tool
+# Copyright (C) 2018 Carpe Noctem - Tactical Operations (aka. CNTO) (contact@carpenoctem.co)
+#
+# The authors of this software are listed in the AUTHORS file at the
+# root of this software's source code tree.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# All rights reserved.
+# --------------------------------License Notice----------------------------------
+
+"""Check that the files of a repository match its manifest.
+
+Three modes trade thoroughness for speed:
+
+* ``quick`` compares the size and modification time of every file with the manifest;
+* ``sampled`` also reads one random block in every `configuration.verification_stride`
+  bytes of files described by a sidecar signature and checks it against the signature, so
+  that unfinished download segments and truncated files are caught while reading a few
+  percent of the data. Files without a usable sidecar are hashed completely;
+* ``full`` hashes every file on a process pool.
+"""
+
+import os
+import random
+import threading
+from typing import Callable, Iterable, Iterator, List, NamedTuple, Optional
+
+import msgpack
+
+from . import configuration
+from . import exceptions
+from . import indexer
+from . import signature
+
+modes = ('quick', 'sampled', 'full')
+
+
+class VerifyResult(NamedTuple):
+    """Outcome of a verification.
+
+    `checked_bytes` counts the bytes read, `corrupted` lists files whose stat information or
+    content does not match the manifest.
+    """
+
+    mode: str
+    files: int
+    checked_bytes: int
+    missing: List[str]
+    corrupted: List[str]
+
+    @property
+    def ok(self) -> bool:
+        """Tell whether every file matches the manifest."""
+        return not self.missing and not self.corrupted
+
+
+def sample_blocks(path: str, entry: indexer.FileEntry,
+                  generator: Optional[random.Random] = None) -> Optional[int]:
+    """Check random blocks of the file at `path` against its sidecar signature.
+
+    Return the number of bytes read, -1 if a block does not match and None if the file has no
+    sidecar describing `entry`.
+    """
+    try:
+        file_signature = signature.read_sidecar(path)
+    except (OSError, ValueError, TypeError, msgpack.exceptions.UnpackException):
+        return None
+    if file_signature.digest != entry.digest or file_signature.size != entry.size:
+        return None
+
+    generator = generator or random.Random()
+    blocks = len(file_signature.strong)
+    stride = max(configuration.verification_stride // file_signature.block_size, 1)
+    indexes = {generator.randrange(start, min(start + stride, blocks))
+               for start in range(0, blocks, stride)}
+    indexes.update({blocks - 1} if blocks else ())
+    read = 0
+    with open(path, mode='rb') as stream:
+        for index in sorted(indexes):
+            offset = index * file_signature.block_size
+            stream.seek(offset)
+            data = stream.read(file_signature.block_length(index))
+            read += len(data)
+            if len(data) != file_signature.block_length(index) or \
+                    not signature.verify_blocks(file_signature, offset, data):
+                return -1
+
+    return read
+
+
+def verify(directory: str, entries: Iterable[indexer.FileEntry], mode: str = 'quick',
+           workers: Optional[int] = None, generator: Optional[random.Random] = None,
+           progress: Optional[Callable[[int], None]] = None,
+           stop: Optional[threading.Event] = None) -> VerifyResult:
+    """Check the files under `directory` against manifest `entries` in `mode`.
+
+    `workers` is the number of processes hashing files, `generator` picks sampled blocks.
+    `progress` is called with the number of bytes read, :class:`exceptions.Cancelled` is
+    raised once `stop` is set.
+    """
+    if mode not in modes:
+        raise ValueError('Unknown verification mode {0}'.format(mode))
+
+    files = checked_bytes = 0
+    missing: List[str] = []
+    corrupted: List[str] = []
+    pending: List[indexer.FileEntry] = []
+    for entry in entries:
+        if stop is not None and stop.is_set():
+            raise exceptions.Cancelled('Verification cancelled')
+        files += 1
+        path = os.path.join(directory, *entry.path.split('/'))
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            missing.append(entry.path)
+            continue
+        if stat.st_size != entry.size or (mode == 'quick' and stat.st_mtime_ns != entry.mtime):
+            corrupted.append(entry.path)
+        elif mode == 'sampled':
+            read = sample_blocks(path, entry, generator)
+            if read is None:
+                pending.append(entry)
+            elif read < 0:
+                corrupted.append(entry.path)
+            else:
+                checked_bytes += read
+                if progress is not None:
+                    progress(read)
+        elif mode == 'full':
+            pending.append(entry)
+
+    digests = indexer.hash_files([os.path.join(directory, *entry.path.split('/'))
+                                  for entry in pending],
+                                 [entry.size for entry in pending], workers,
+                                 progress=progress, stop=stop)
+    for entry, digest in zip(pending, digests):
+        checked_bytes += entry.size
+        if digest != entry.digest:
+            corrupted.append(entry.path)
+
+    return VerifyResult(mode, files, checked_bytes, missing, sorted(corrupted))
+
+
+def verify_remote(directory: str, remote: Iterable[indexer.FileEntry],
+                  lookup: Callable[[str], Optional[indexer.FileEntry]], mode: str = 'quick',
+                  workers: Optional[int] = None, generator: Optional[random.Random] = None,
+                  progress: Optional[Callable[[int], None]] = None,
+                  stop: Optional[threading.Event] = None) -> VerifyResult:
+    """Check the files under `directory` against `remote` manifest entries in `mode`.
+
+    Downloaded files do not keep the modification time of the remote, which is taken from
+    their entry in the local index, returned by ``lookup(path)``, see :func:`verify`. Files
+    indexed with another size or digest than the remote one are reported as corrupted, even
+    in ``quick`` mode.
+    """
+    mismatched: List[str] = []
+
+    def expected() -> Iterator[indexer.FileEntry]:
+        for entry in remote:
+            indexed = lookup(entry.path)
+            if indexed is None:
+                yield entry
+                continue
+            if (indexed.size, indexed.digest) != (entry.size, entry.digest):
+                mismatched.append(entry.path)
+            yield entry._replace(mtime=indexed.mtime)
+
+    result = verify(directory, expected(), mode, workers, generator, progress, stop)
+
+    return result._replace(corrupted=sorted(set(result.corrupted).union(mismatched)))
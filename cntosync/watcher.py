@@ -0,0 +1,268 @@
+# --------------------------------License Notice----------------------------------
+# CNTOSync - Carpe Noctem Tactical Operations ArmA3 mod synchronization tool
+# Copyright (C) 2018 Carpe Noctem - Tactical Operations (aka. CNTO) (contact@carpenoctem.co)
+#
+# The authors of this software are listed in the AUTHORS file at the
+# root of this software's source code tree.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# All rights reserved.
+# --------------------------------License Notice----------------------------------
+
+"""Watch a repository for changes and keep its index up to date.
+
+On Linux, changes are reported by inotify through a ctypes binding of the C library, with
+one watch per directory. Elsewhere, or when inotify is not available, the tree is scanned
+periodically instead. Changed paths are collected until no change happened for
+`configuration.watch_debounce` seconds, or for at most `configuration.watch_max_delay`
+seconds, then handed over at once: copying a whole mod triggers a single index update.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Set, Tuple, Union
+
+from . import configuration
+from . import indexer
+
+# Event masks, see inotify(7).
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_EXCL_UNLINK = 0x04000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+_WATCH_MASK = IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | \
+    IN_DELETE | IN_DELETE_SELF | IN_ONLYDIR | IN_EXCL_UNLINK
+_EVENT_HEADER = struct.Struct('iIII')
+
+# Changed relative paths, None when changes were lost and the whole tree must be scanned.
+Changes = Optional[Set[str]]
+
+
+def ignored(relative_path: str) -> bool:
+    """Tell whether changes of `relative_path` are irrelevant to the index.
+
+    These are the index directory, sidecar files and the temporary files sidecars are
+    written to.
+    """
+    name = relative_path.rpartition('/')[2]
+    return relative_path.split('/', 1)[0] == configuration.index_directory or \
+        name.endswith(configuration.extension) or \
+        (name.startswith('.') and configuration.extension + '.' in name)
+
+
+class InotifyWatcher(object):
+    """Report changes under a directory with Linux inotify."""
+
+    def __init__(self, directory: str) -> None:
+        """Watch every directory under `directory`, :class:`OSError` if inotify fails."""
+        self.directory = directory
+        library = ctypes.util.find_library('c')
+        self._libc = ctypes.CDLL(library, use_errno=True)
+        self._libc.inotify_init1.argtypes = [ctypes.c_int]
+        self._libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        self._descriptor = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._descriptor < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        self._watches: Dict[int, str] = {}
+        try:
+            self._watch_tree('')
+        except OSError:
+            self.close()
+            raise
+
+    def close(self) -> None:
+        """Stop watching."""
+        if self._descriptor >= 0:
+            os.close(self._descriptor)
+            self._descriptor = -1
+
+    def _watch_tree(self, relative_path: str) -> None:
+        pending = [relative_path]
+        while pending:
+            relative = pending.pop()
+            path = os.path.join(self.directory, *relative.split('/')) if relative \
+                else self.directory
+            watch = self._libc.inotify_add_watch(self._descriptor, os.fsencode(path),
+                                                 _WATCH_MASK)
+            if watch < 0:
+                error = ctypes.get_errno()
+                if error in (errno.ENOENT, errno.ENOTDIR):
+                    continue
+                raise OSError(error, os.strerror(error), path)
+            self._watches[watch] = relative
+            try:
+                with os.scandir(path) as iterator:
+                    for item in iterator:
+                        child = relative + '/' + item.name if relative else item.name
+                        if item.is_dir(follow_symlinks=False) and not ignored(child):
+                            pending.append(child)
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+
+    def _unwatch_tree(self, relative_path: str) -> None:
+        prefix = relative_path + '/'
+        for watch, relative in list(self._watches.items()):
+            if relative == relative_path or relative.startswith(prefix):
+                self._libc.inotify_rm_watch(self._descriptor, watch)
+                del self._watches[watch]
+
+    def read(self, timeout: Optional[float] = None) -> Changes:
+        """Wait up to `timeout` seconds, forever if None, and return the changed paths.
+
+        The returned set is empty when nothing changed in time.
+        """
+        ready, _, _ = select.select([self._descriptor], [], [], timeout)
+        if not ready:
+            return set()
+
+        changes: Set[str] = set()
+        overflow = False
+        while True:
+            try:
+                data = os.read(self._descriptor, 64 * 1024)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                watch, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+                name = os.fsdecode(data[offset + _EVENT_HEADER.size:
+                                        offset + _EVENT_HEADER.size + length].rstrip(b'\0'))
+                offset += _EVENT_HEADER.size + length
+                overflow = overflow or bool(mask & IN_Q_OVERFLOW)
+                relative = self._watches.get(watch)
+                if mask & IN_IGNORED:
+                    self._watches.pop(watch, None)
+                if relative is None or not name:
+                    continue
+                relative_path = relative + '/' + name if relative else name
+                if ignored(relative_path):
+                    continue
+                if mask & IN_ISDIR and mask & IN_MOVED_FROM:
+                    self._unwatch_tree(relative_path)
+                elif mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                    self._watch_tree(relative_path)
+                changes.add(relative_path)
+
+        return None if overflow else changes
+
+
+class PollingWatcher(object):
+    """Report changes under a directory by scanning it every `interval` seconds."""
+
+    def __init__(self, directory: str, interval: Optional[float] = None) -> None:
+        """Record the current state of `directory`."""
+        self.directory = directory
+        self.interval: float = interval or configuration.watch_poll_interval
+        self._snapshot = self._scan()
+        self._next_poll = time.monotonic() + self.interval
+
+    def _scan(self) -> Dict[str, Tuple[int, int, int]]:
+        return {relative_path: (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+                for relative_path, stat in indexer.scan(self.directory)}
+
+    def close(self) -> None:
+        """Stop watching."""
+
+    def read(self, timeout: Optional[float] = None) -> Changes:
+        """Wait up to `timeout` seconds, forever if None, and return the changed paths.
+
+        The returned set is empty when nothing changed in time.
+        """
+        wait = max(self._next_poll - time.monotonic(), 0)
+        if timeout is not None and timeout < wait:
+            time.sleep(timeout)
+            return set()
+        time.sleep(wait)
+        snapshot = self._scan()
+        self._next_poll = time.monotonic() + self.interval
+        changes = {relative_path for relative_path in snapshot.keys() | self._snapshot.keys()
+                   if snapshot.get(relative_path) != self._snapshot.get(relative_path)}
+        self._snapshot = snapshot
+
+        return changes
+
+
+Watcher = Union[InotifyWatcher, PollingWatcher]
+
+
+def open_watcher(directory: str, polling: bool = False) -> Watcher:
+    """Return an inotify watcher of `directory`, a polling one if unavailable or `polling`."""
+    if not polling and sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(directory)
+        except OSError:
+            pass
+
+    return PollingWatcher(directory)
+
+
+def watch(directory: str, update: Callable[[Changes], Any],
+          stop: Optional[threading.Event] = None, polling: bool = False) -> None:
+    """Call `update` with the paths changed under `directory`, debounced, until `stop` is set.
+
+    `update` receives None when changes were lost and the whole tree must be scanned, which is
+    also the case once watching started, so that earlier changes are not missed. When it
+    raises :class:`FileNotFoundError`, as a file vanished while being indexed, the changes are
+    handed over again with the next ones.
+    """
+    watcher = open_watcher(directory, polling)
+    pending: Set[str] = set()
+    lost = True
+    first_change: Optional[float] = time.monotonic()
+    try:
+        while stop is None or not stop.is_set():
+            timeout = configuration.watch_debounce if pending or lost or stop is not None \
+                else None
+            changes = watcher.read(timeout)
+            if changes is None or changes:
+                now = time.monotonic()
+                if changes is None:
+                    lost = True
+                else:
+                    pending |= changes
+                first_change = first_change if first_change is not None else now
+                if now - first_change < configuration.watch_max_delay:
+                    continue
+            if not pending and not lost:
+                continue
+
+            try:
+                update(None if lost else pending)
+            except FileNotFoundError:
+                continue
+            pending = set()
+            lost = False
+            first_change = None
+    finally:
+        watcher.close()
@@ -0,0 +1,199 @@
+# --------------------------------License Notice----------------------------------
+# CNTOSync - Carpe Noctem Tactical Operations ArmA3 mod synchronization tool
+# Copyright (C) 2018 Carpe Noctem - Tactical Operations (aka. CNTO) (contact@carpenoctem.co)
+#
+# The authors of this software are listed in the AUTHORS file at the
+# root of this software's source code tree.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# All rights reserved.
+# --------------------------------License Notice----------------------------------
+
+"""Write downloaded files to disk and commit them into place in batches.
+
+Writing thousands of small files with an open, write, fsync and rename cycle each stalls on
+hard drives and network shares, every file waiting for the disk in turn. The writer stage
+writes files from a single thread into temporary files next to their target, preallocated
+and written at once, then commits them in batches: every file of the batch is flushed to
+disk, renamed over its target, and each directory involved is flushed once. A file is thus
+either its previous version or its new one, never a partial one.
+"""
+
+import os
+import queue
+import tempfile
+import threading
+import time
+from types import TracebackType
+from typing import Any, Callable, List, NamedTuple, Optional, Set, Tuple, Type
+
+from . import configuration
+from . import metrics
+from .fileutils import allocate, sync_directory
+
+CommitCallback = Callable[[os.stat_result], None]
+_Item = Optional[Tuple[str, bytes, Optional[CommitCallback]]]
+
+
+class _PendingWrite(NamedTuple):
+    """A file written to `temporary_path`, neither flushed nor renamed to `path` yet."""
+
+    path: str
+    temporary_path: str
+    descriptor: int
+    size: int
+    on_commit: Optional[CommitCallback]
+
+
+class FileWriter(object):
+    """Write whole files from a dedicated thread, committing them in batches.
+
+    A batch is committed once `batch_files` files or `batch_bytes` bytes are pending, or
+    `interval` seconds after its first file was written. The callback of a file is called
+    from the writer thread with the stat of the file once committed. The first error stops
+    the writer: pending files are discarded and the error is raised by the next
+    :meth:`write` or by :meth:`close`.
+    """
+
+    def __init__(self, batch_files: Optional[int] = None, batch_bytes: Optional[int] = None,
+                 interval: Optional[float] = None) -> None:
+        """Start the writer thread."""
+        self.batch_files: int = batch_files or configuration.write_batch_files
+        self.batch_bytes: int = batch_bytes or configuration.write_batch_bytes
+        self.interval: float = interval or configuration.write_batch_interval
+        self._queue: 'queue.Queue[_Item]' = queue.Queue(configuration.write_queue_size)
+        self._pending: List[_PendingWrite] = []
+        self._pending_bytes = 0
+        self._created: Set[str] = set()
+        self._error: Optional[BaseException] = None
+        self._thread = threading.Thread(target=self._run, name='cntosync-writer', daemon=True)
+        self._thread.start()
+
+    def __enter__(self) -> 'FileWriter':
+        """Return the writer."""
+        return self
+
+    def __exit__(self, exception_type: Optional[Type[BaseException]],
+                 exception: Optional[BaseException],
+                 traceback: Optional[TracebackType]) -> None:
+        """Commit the pending files, raising the writer error unless already raising one."""
+        try:
+            self.close()
+        except Exception:
+            if exception is None:
+                raise
+
+    def write(self, path: str, data: bytes,
+              on_commit: Optional[CommitCallback] = None) -> None:
+        """Queue `data` to replace the content of `path`, blocking while the queue is full."""
+        self._check()
+        self._queue.put((path, data, on_commit))
+
+    def close(self) -> None:
+        """Commit the pending files and stop the writer thread."""
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        self._check()
+
+    def _check(self) -> None:
+        if self._error is not None:
+            raise self._error
+
+    def _run(self) -> None:
+        deadline: Optional[float] = None
+        while True:
+            try:
+                item = self._queue.get(timeout=None if deadline is None
+                                       else max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                self._attempt(self._commit)
+                deadline = None
+                continue
+            if item is None:
+                break
+            self._attempt(self._write, *item)
+            if deadline is None:
+                deadline = time.monotonic() + self.interval
+            if len(self._pending) >= self.batch_files or self._pending_bytes >= self.batch_bytes:
+                self._attempt(self._commit)
+                deadline = None
+        self._attempt(self._commit)
+
+    def _attempt(self, function: Callable[..., None], *args: Any) -> None:
+        """Call `function` unless the writer failed, failing it on error."""
+        if self._error is not None:
+            return
+        try:
+            function(*args)
+        except BaseException as error:
+            self._error = error
+            pending, self._pending, self._pending_bytes = self._pending, [], 0
+            for item in pending:
+                os.close(item.descriptor)
+                _remove(item.temporary_path)
+
+    def _write(self, path: str, data: bytes, on_commit: Optional[CommitCallback]) -> None:
+        start = time.perf_counter()
+        directory, name = os.path.split(path)
+        if directory not in self._created:
+            os.makedirs(directory, exist_ok=True)
+            self._created.add(directory)
+        descriptor, temporary_path = tempfile.mkstemp(prefix='.' + name + '.', dir=directory)
+        self._pending.append(_PendingWrite(path, temporary_path, descriptor, len(data),
+                                           on_commit))
+        self._pending_bytes += len(data)
+        allocate(descriptor, len(data))
+        view = memoryview(data)
+        while view:
+            view = view[os.write(descriptor, view):]
+        recorder = metrics.active()
+        if recorder is not None:
+            recorder.add(metrics.WRITE, size=len(data), seconds=time.perf_counter() - start)
+
+    def _commit(self) -> None:
+        pending, self._pending, self._pending_bytes = self._pending, [], 0
+        if not pending:
+            return
+        start = time.perf_counter()
+        committed = 0
+        try:
+            try:
+                for item in pending:
+                    os.fsync(item.descriptor)
+            finally:
+                for item in pending:
+                    os.close(item.descriptor)
+            for item in pending:
+                os.replace(item.temporary_path, item.path)
+                committed += 1
+        except BaseException:
+            for item in pending[committed:]:
+                _remove(item.temporary_path)
+            raise
+        for directory in set(os.path.dirname(item.path) for item in pending):
+            sync_directory(directory)
+        recorder = metrics.active()
+        if recorder is not None:
+            recorder.add(metrics.WRITE, files=len(pending), seconds=time.perf_counter() - start)
+        for item in pending:
+            if item.on_commit is not None:
+                item.on_commit(os.stat(item.path))
+
+
+def _remove(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
@@ -43,7 +43,7 @@ if __name__ == '__main__':
         long_description=LONG_DESCRIPTION,
         author='Carpe Noctem Tactical Operations developers',
         url='https://github.com/CntoDev/CNTOSync/',
-        packages=setuptools.find_packages(exclude=['tests']),
+        packages=setuptools.find_packages(exclude=['tests', 'benchmarks']),
         classifiers=[
             'Development Status :: 2 - Pre-Alpha',
             'Environment :: Console',
@@ -69,7 +69,15 @@ if __name__ == '__main__':
         install_requires=[
             'msgpack>=0.5.6,<1',
         ],
+        entry_points={
+            'console_scripts': [
+                'cntosync = cntosync.cli:main',
+            ],
+        },
         extras_require={
+            'zstd': [
+                'zstandard>=0.10,<1',
+            ],
             'dev': [
                 'ipython>=6.1,<7',
             ],
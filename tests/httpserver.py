@@ -0,0 +1,185 @@
+# --------------------------------License Notice----------------------------------
+# CNTOSync - Carpe Noctem Tactical Operations ArmA3 mod synchronization tool
+# Copyright (C) 2018 Carpe Noctem - Tactical Operations (aka. CNTO) (contact@carpenoctem.co)
+#
+# The authors of this software are listed in the AUTHORS file at the
+# root of this software's source code tree.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# All rights reserved.
+# --------------------------------License Notice----------------------------------
+
+"""Serve a repository over HTTP with range request support.
+
+This server stands in for the production HTTP server (nginx or similar) when testing and
+benchmarking the synchronization code locally. It serves files of a directory with
+keep-alive connections and single-range requests, and can simulate a remote link by
+delaying responses and limiting the rate at which all responses are sent, or a faulty mirror
+by failing or stalling responses.
+"""
+
+import os
+import posixpath
+import re
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from typing import Any, Iterator, Optional
+from urllib.parse import unquote, urlparse
+
+from cntosync.bandwidth import TokenBucket
+
+_RANGE_PATTERN = re.compile(r'bytes=(\d+)-(\d*)$')
+
+
+class RepositoryRequestHandler(BaseHTTPRequestHandler):
+    """Answer GET and HEAD requests for files of the served directory."""
+
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    server: 'RepositoryServer'
+
+    def log_message(self, format: str, *args: Any) -> None:  # noqa: A002
+        """Keep the output of tests and benchmarks clean."""
+        pass
+
+    def _resolve(self) -> Optional[str]:
+        """Return the filesystem path of the requested file, None if outside the directory."""
+        path = posixpath.normpath(unquote(urlparse(self.path).path))
+        parts = [part for part in path.split('/') if part]
+        separators = [separator for separator in (os.sep, os.altsep) if separator]
+        if any(part in (os.curdir, os.pardir) or any(separator in part for separator in separators)
+               for part in parts):
+            return None
+        return os.path.join(self.server.directory, *parts)
+
+    def do_HEAD(self) -> None:  # noqa: N802
+        """Send the headers of the requested file."""
+        self._respond(send_body=False)
+
+    def do_GET(self) -> None:  # noqa: N802
+        """Send the requested file, or the requested range of it."""
+        self._respond(send_body=True)
+
+    def _respond(self, send_body: bool) -> None:
+        if self.server.delay:
+            time.sleep(self.server.delay)
+        if self.server.error is not None:
+            self.send_error(self.server.error)
+            return
+        path = self._resolve()
+        if path is None or not os.path.isfile(path):
+            self.send_error(404)
+            return
+
+        size = os.path.getsize(path)
+        start, end = 0, size - 1
+        range_header = self.headers.get('Range')
+        if range_header:
+            match = _RANGE_PATTERN.match(range_header.strip())
+            if match is None or int(match.group(1)) >= size:
+                self.send_response(416)
+                self.send_header('Content-Range', 'bytes */{0}'.format(size))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            start = int(match.group(1))
+            end = min(int(match.group(2)), end) if match.group(2) else end
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {0}-{1}/{2}'.format(start, end, size))
+        else:
+            self.send_response(200)
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.end_headers()
+        if not send_body:
+            return
+
+        with open(path, mode='rb') as stream:
+            stream.seek(start)
+            remaining = end - start + 1
+            stall_after = self.server.stall_after
+            while remaining > 0:
+                data = stream.read(min(remaining, 16 * 1024))
+                if not data:
+                    break
+                if stall_after is not None:
+                    if stall_after < len(data):
+                        self.wfile.write(data[:stall_after])
+                        self.wfile.flush()
+                        # Hang without closing the connection, as a stalled link would.
+                        self.server.stopped.wait()
+                        self.close_connection = True
+                        return
+                    stall_after -= len(data)
+                if self.server.link is not None:
+                    self.server.link.consume(len(data))
+                self.wfile.write(data)
+                remaining -= len(data)
+
+
+class RepositoryServer(ThreadingMixIn, HTTPServer):
+    """Threaded HTTP server exposing `directory`.
+
+    `delay` is a number of seconds to wait before answering each request, simulating the
+    round-trip time of a remote server. `rate` is the number of bytes per second shared by
+    all responses, simulating a slow link.
+
+    Faults can be injected, and changed while serving: with `error`, every request is
+    answered with this HTTP status, with `stall_after`, responses stop after this number of
+    body bytes until the server shuts down.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, directory: str, address: str = '127.0.0.1', port: int = 0,
+                 delay: float = 0.0, rate: Optional[float] = None, error: Optional[int] = None,
+                 stall_after: Optional[int] = None) -> None:
+        """Bind the server to `address` and `port`, any free port by default."""
+        self.directory: str = os.path.abspath(directory)
+        self.address: str = address
+        self.delay: float = delay
+        self.link: Optional[TokenBucket] = TokenBucket(rate, 64 * 1024) if rate else None
+        self.error: Optional[int] = error
+        self.stall_after: Optional[int] = stall_after
+        self.stopped = threading.Event()
+        super().__init__((address, port), RepositoryRequestHandler)
+
+    def shutdown(self) -> None:
+        """Stop serving, releasing the stalled responses."""
+        self.stopped.set()
+        super().shutdown()
+
+    @property
+    def url(self) -> str:
+        """Return the base URL of the served directory."""
+        return 'http://{0}:{1}'.format(self.address, self.server_address[1])
+
+
+@contextmanager
+def serve(directory: str, **kwargs: Any) -> Iterator[RepositoryServer]:
+    """Serve `directory` from a background thread for the duration of the context."""
+    server = RepositoryServer(directory, **kwargs)
+    thread = threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.05},
+                              daemon=True)
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
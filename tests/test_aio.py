@@ -0,0 +1,130 @@
+# --------------------------------License Notice----------------------------------
+# CNTOSync - Carpe Noctem Tactical Operations ArmA3 mod synchronization tool
+# Copyright (C) 2018 Carpe Noctem - Tactical Operations (aka. CNTO) (contact@carpenoctem.co)
+#
+# The authors of this software are listed in the AUTHORS file at the
+# root of this software's source code tree.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# All rights reserved.
+# --------------------------------License Notice----------------------------------
+
+"""Test suite for `cntosync.aio`."""
+
+import asyncio
+import os
+import time
+
+import cntosync.aio as unit
+import cntosync.configuration as config
+from cntosync.bandwidth import TokenBucket
+from cntosync.filesync import Repository
+from cntosync.journal import TransferJournal
+
+from httpserver import serve
+
+import pytest
+
+
+def run(coroutine):
+    """Run `coroutine` in a new event loop and return its result."""
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+@pytest.fixture()
+def remote(tmpdir, mocker):
+    """Yield a served repository holding 2 MiB of mods, downloaded in small segments."""
+    mocker.patch.object(config, 'segment_size', 64 * 1024)
+    repository = Repository.initialize(str(tmpdir.mkdir('remote')), 'name', 'file://something')
+    for name in ('a', 'b', 'c', 'd'):
+        tmpdir.join('remote').ensure_dir('@mod').join(name + '.pbo').write_binary(
+            os.urandom(512 * 1024))
+    repository.build_index(workers=1)
+    with serve(repository.directory) as server:
+        yield server
+
+
+def test_open_index_verify(tmpdir):
+    """Assert operations stream their progress and return the result of the blocking API."""
+    Repository.initialize(str(tmpdir), 'name', 'file://something')
+    tmpdir.mkdir('@mod').join('mod.pbo').write_binary(b'content')
+
+    async def scenario():
+        repository = await unit.AsyncRepository.open_repository(str(tmpdir))
+        operation = repository.build_index(workers=1)
+        progress = [done async for done in operation]
+        index = await operation
+        verification = await repository.verify('full', workers=1)
+        sync_plan = await repository.plan_sync([])
+        return progress, index, verification, sync_plan
+
+    progress, index, verification, sync_plan = run(scenario())
+
+    assert progress[-1] == index.hashed_bytes == len(b'content')
+    assert sync_plan.deleted == ['@mod/mod.pbo']
+    assert verification.ok and verification.checked_bytes == len(b'content')
+    with pytest.raises(FileNotFoundError):
+        run(unit.AsyncRepository.open_repository(str(tmpdir.join('missing'))))
+
+
+def test_sync_cancel(remote, tmpdir):
+    """Assert a cancelled synchronization stops quickly and the next one resumes it."""
+    async def cancel():
+        repository = await unit.AsyncRepository.initialize(str(tmpdir.mkdir('local')), 'name',
+                                                           remote.url)
+        operation = repository.sync(workers=2, bucket=TokenBucket(512 * 1024))
+        async for done in operation:
+            if done > 300 * 1024:
+                break
+        start = time.perf_counter()
+        operation.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await operation
+        return repository.repository, time.perf_counter() - start
+
+    local, elapsed = run(cancel())
+
+    assert elapsed < 0.5
+    assert TransferJournal.load(local.journal_path).partial
+
+    async def resume():
+        return await unit.AsyncRepository(local).sync(workers=2)
+
+    result = run(resume())
+
+    assert result.files == 4 and result.resumed_bytes > 0
+    assert tmpdir.join('local', '@mod', 'a.pbo').read_binary() == \
+        tmpdir.join('remote', '@mod', 'a.pbo').read_binary()
+
+
+def test_sync_task_cancelled(remote, tmpdir):
+    """Assert cancelling the task awaiting an operation stops its workers."""
+    local = Repository.initialize(str(tmpdir.mkdir('local')), 'name', remote.url)
+    operation = None
+
+    async def scenario():
+        nonlocal operation
+        operation = unit.AsyncRepository(local).sync(workers=2, bucket=TokenBucket(512 * 1024))
+        await asyncio.wait_for(operation, 0.2)
+
+    start = time.perf_counter()
+    with pytest.raises(asyncio.TimeoutError):
+        run(scenario())
+
+    assert operation.stop.is_set()
+    assert time.perf_counter() - start < 1
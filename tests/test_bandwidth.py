@@ -0,0 +1,108 @@
+# --------------------------------License Notice----------------------------------
+# CNTOSync - Carpe Noctem Tactical Operations ArmA3 mod synchronization tool
+# Copyright (C) 2018 Carpe Noctem - Tactical Operations (aka. CNTO) (contact@carpenoctem.co)
+#
+# The authors of this software are listed in the AUTHORS file at the
+# root of this software's source code tree.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# All rights reserved.
+# --------------------------------License Notice----------------------------------
+
+"""Test suite for `cntosync.bandwidth`."""
+
+import threading
+import time
+
+import cntosync.bandwidth as unit
+import cntosync.configuration as config
+
+import pytest
+
+
+@pytest.mark.parametrize('size,optional,priority', [
+    (100, False, unit.PRIORITY_SMALL),
+    (100, True, unit.PRIORITY_SMALL),
+    (1024 * 1024, False, unit.PRIORITY_REQUIRED),
+    (1024 * 1024, True, unit.PRIORITY_OPTIONAL),
+    (config.large_priority_size, False, unit.PRIORITY_LARGE),
+    (config.large_priority_size, True, unit.PRIORITY_LARGE + 1),
+])
+def test_file_priority(size, optional, priority):
+    """Assert small files come first and large files last, optional after required."""
+    assert unit.file_priority(size, optional) == priority
+
+
+def test_unlimited():
+    """Assert an unlimited bucket never waits."""
+    bucket = unit.TokenBucket()
+    start = time.monotonic()
+    for _ in range(100):
+        bucket.consume(10 ** 9)
+    assert bucket.rate is None
+    assert time.monotonic() - start < 0.1
+
+
+def test_rate():
+    """Assert consumption beyond the burst size is spread at the configured rate."""
+    bucket = unit.TokenBucket(100000, 10000)
+    start = time.monotonic()
+    for _ in range(4):
+        bucket.consume(10000)
+    elapsed = time.monotonic() - start
+    assert 0.25 < elapsed < 0.6
+
+    bucket.consume(50000)
+    start = time.monotonic()
+    bucket.consume(1)
+    assert time.monotonic() - start > 0.3
+
+
+def test_priority_order():
+    """Assert waiting consumers are served by priority rather than arrival order."""
+    bucket = unit.TokenBucket(20000, 1000)
+    bucket.consume(1000)
+    served = []
+
+    def consume(priority):
+        bucket.consume(1000, priority)
+        served.append(priority)
+
+    threads = [threading.Thread(target=consume, args=(priority,)) for priority in (5, 3, 0)]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.01)
+    for thread in threads:
+        thread.join()
+
+    assert served == [0, 3, 5]
+
+
+def test_rate_change():
+    """Assert waiting consumers adapt to a new rate immediately."""
+    bucket = unit.TokenBucket(10, 10)
+    bucket.consume(10)
+    thread = threading.Thread(target=bucket.consume, args=(1000,))
+    thread.start()
+    time.sleep(0.05)
+    assert thread.is_alive()
+
+    start = time.monotonic()
+    bucket.rate = 100000
+    thread.join(1)
+    assert not thread.is_alive()
+    bucket.rate = None
+    assert bucket.rate is None
+    bucket.consume(10 ** 9)
+    assert time.monotonic() - start < 0.5
@@ -0,0 +1,137 @@
+# --------------------------------License Notice----------------------------------
+# CNTOSync - Carpe Noctem Tactical Operations ArmA3 mod synchronization tool
+# Copyright (C) 2018 Carpe Noctem - Tactical Operations (aka. CNTO) (contact@carpenoctem.co)
+#
+# The authors of this software are listed in the AUTHORS file at the
+# root of this software's source code tree.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# All rights reserved.
+# --------------------------------License Notice----------------------------------
+
+"""Test suite for `cntosync.chunking`."""
+
+import os
+import random
+
+import cntosync.chunking as unit
+import cntosync.configuration as config
+import cntosync.indexer as indexer
+
+import pytest
+
+
+@pytest.fixture()
+def small_chunks(mocker):
+    """Use tiny chunk sizes so that tests run on small files."""
+    mocker.patch.object(config, 'chunk_min_size', 64)
+    mocker.patch.object(config, 'chunk_average_size', 256)
+    mocker.patch.object(config, 'chunk_max_size', 1024)
+
+
+def random_bytes(seed, size):
+    """Return `size` pseudo-random bytes generated from `seed`."""
+    generator = random.Random(seed)
+    return bytes(generator.getrandbits(8) for _ in range(size))
+
+
+def chunks_of(data):
+    """Return the chunks of `data` as byte strings."""
+    chunks, start = [], 0
+    for end in unit.cut_points(data):
+        chunks.append(data[start:end])
+        start = end
+    return chunks
+
+
+def test_cut_points_bounds(small_chunks):
+    """Assert chunks cover the data and respect the size bounds."""
+    data = random_bytes(1, 20000)
+
+    chunks = chunks_of(data)
+
+    assert b''.join(chunks) == data
+    assert all(64 < len(chunk) <= 1024 for chunk in chunks[:-1])
+    assert 200 < len(data) / len(chunks) < 700
+    assert unit.cut_points(b'') == []
+
+
+def test_cut_points_shift_resistant(small_chunks):
+    """Assert inserting data only changes the chunks around the insertion."""
+    data = random_bytes(2, 20000)
+    original = set(chunks_of(data))
+
+    shifted = chunks_of(data[:5000] + b'inserted' + data[5000:])
+
+    assert len([chunk for chunk in shifted if chunk not in original]) <= 2
+
+
+def test_chunk_table_references():
+    """Assert chunks are reference counted across files."""
+    table = unit.ChunkTable()
+    table.add('a', b'file a', [(b'1', 10), (b'2', 20)])
+    table.add('b', b'file b', [(b'2', 20), (b'3', 30)])
+
+    assert table.chunks == {b'1': [10, 1], b'2': [20, 2], b'3': [30, 1]}
+    table.add('a', b'file a2', [(b'3', 30)])
+    assert table.chunks == {b'2': [20, 1], b'3': [30, 2]}
+    assert table.chunks_of('b') == [(b'2', 20), (b'3', 30)]
+    table.remove('b')
+    assert table.chunks == {b'3': [30, 1]}
+
+
+def test_chunk_table_persistence(tmpdir):
+    """Assert the table survives persistence and a missing table loads empty."""
+    path = str(tmpdir.join('chunks'))
+    table = unit.ChunkTable()
+    table.add('a', b'file a', [(b'1', 10)])
+
+    table.save(path)
+    loaded = unit.ChunkTable.load(path)
+
+    assert (loaded.chunks, loaded.files, loaded.dirty) == (table.chunks, table.files, False)
+    assert unit.ChunkTable.load(str(tmpdir.join('missing'))).files == {}
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_chunk_table_update(workers, small_chunks, tmpdir, mocker):
+    """Assert duplicated content is counted once and renamed files are not chunked again."""
+    data = random_bytes(3, 8000)
+    for name in ('@a', '@b'):
+        tmpdir.mkdir(name).join('data.pbo').write_binary(data)
+    table = unit.ChunkTable()
+
+    statistics = table.update(str(tmpdir), indexer.build(str(tmpdir), 1).entries, workers)
+
+    assert statistics.logical_bytes == 2 * len(data)
+    assert statistics.unique_bytes == len(data)
+    assert statistics.dedup_ratio == 2.0
+    assert statistics.chunked_bytes == 2 * len(data)
+    assert statistics.throughput_per_core > 0
+
+    os.rename(str(tmpdir.join('@b')), str(tmpdir.join('@c')))
+    spy_chunk_batch = mocker.spy(unit, 'chunk_batch')
+    statistics = table.update(str(tmpdir), indexer.build(str(tmpdir), 1).entries, 1)
+
+    assert sorted(table.files) == ['@a/data.pbo', '@c/data.pbo']
+    assert spy_chunk_batch.call_args[0][0] == []
+    assert statistics.dedup_ratio == 2.0
+
+
+def test_statistics_without_data():
+    """Assert ratios stay defined when nothing was chunked."""
+    statistics = unit.ChunkStatistics(0, 0, 0, 0, 0, 0, 0.0, 1)
+
+    assert statistics.dedup_ratio == 1.0
+    assert statistics.throughput_per_core == 0.0
@@ -0,0 +1,255 @@
+# --------------------------------License Notice----------------------------------
+# CNTOSync - Carpe Noctem Tactical Operations ArmA3 mod synchronization tool
+# Copyright (C) 2018 Carpe Noctem - Tactical Operations (aka. CNTO) (contact@carpenoctem.co)
+#
+# The authors of this software are listed in the AUTHORS file at the
+# root of this software's source code tree.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# All rights reserved.
+# --------------------------------License Notice----------------------------------
+
+"""Test suite for `cntosync.cli`."""
+
+import os
+import pathlib
+import subprocess
+import sys
+
+import cntosync.cli as unit
+import cntosync.configuration as config
+from cntosync import exceptions
+from cntosync.filesync import Repository
+
+import msgpack
+
+import pytest
+
+# Modules which ``cntosync status`` must not import, and the microseconds it may spend
+# importing the package, see `test_status_import_time`.
+HEAVY_MODULES = ('asyncio', 'concurrent.futures.process', 'cProfile', 'hashlib', 'http.client',
+                 'multiprocessing', 'ssl', 'tracemalloc', 'urllib.request', 'zstandard',
+                 'cntosync.aio', 'cntosync.chunking', 'cntosync.download', 'cntosync.indexer',
+                 'cntosync.transfer', 'cntosync.watcher')
+STATUS_IMPORT_BUDGET = 40000
+
+
+def test_init_status(tmpdir, capsys):
+    """Assert repositories are initialized and described."""
+    directory = str(tmpdir.join('repository'))
+
+    assert unit.main(['init', 'http://host/repo', directory, '--subscribe', '@a']) == 0
+    assert unit.main(['init', 'http://host/repo', directory]) == 1
+    assert unit.main(['init', 'invalid', str(tmpdir.join('other'))]) == 1
+    assert unit.main(['init', 'ftp://host/repo', str(tmpdir.join('other'))]) == 1
+    assert unit.main(['status', directory]) == 0
+
+    output = capsys.readouterr()
+    assert 'Initialized repository repository in ' in output.out
+    assert 'Repository: repository\nURL: http://host/repo\nSubscriptions: @a\n' \
+        'Index: not built\n' in output.out
+    assert 'is already a repository' in output.err
+    assert 'Invalid URL invalid' in output.err
+    assert 'Initialization failed: unsupported URL scheme, supported schemes are file, http, ' \
+        'https' in output.err
+    assert unit.main(['status', str(tmpdir)]) == 1
+
+
+def test_status_mirrors_interrupted(tmpdir, capsys):
+    """Assert mirrors and interrupted synchronizations are described."""
+    repository = Repository.initialize(str(tmpdir), 'name', 'http://host/repo',
+                                       mirrors=['http://mirror/repo'])
+    tmpdir.join(config.index_directory, config.journal_file).write_binary(b'journal')
+
+    assert unit.main(['status', repository.directory]) == 0
+
+    output = capsys.readouterr().out
+    assert 'Mirrors: http://mirror/repo\n' in output
+    assert 'Synchronization interrupted, run sync to resume it' in output
+
+
+def test_index_verify(tmpdir, capsys):
+    """Assert the index and verify commands report the files indexed and those corrupted."""
+    Repository.initialize(str(tmpdir), 'name', 'http://host/repo')
+    assert unit.main(['verify', str(tmpdir)]) == 1
+    tmpdir.mkdir('@mod').join('mod.pbo').write_binary(b'content')
+
+    assert unit.main(['index', str(tmpdir), '--workers', '1']) == 0
+    assert unit.main(['status', str(tmpdir)]) == 0
+    assert unit.main(['verify', str(tmpdir), '--mode', 'full', '--workers', '1']) == 0
+    tmpdir.join('@mod', 'mod.pbo').write_binary(b'CONTENT')
+    assert unit.main(['verify', str(tmpdir), '--mode', 'full', '--workers', '1']) == 1
+    tmpdir.join('@mod', 'mod.pbo').remove()
+    assert unit.main(['verify', str(tmpdir)]) == 1
+
+    output = capsys.readouterr()
+    assert 'is not indexed' in output.err
+    assert 'Indexed 1 files, 1 hashed (7 bytes): 1 added' in output.out
+    assert 'Index: 1 files, built ' in output.out
+    assert 'Verified 1 files, 7 bytes read: 0 missing, 0 corrupted' in output.out
+    assert 'corrupted: @mod/mod.pbo\nVerified 1 files, 7 bytes read: 0 missing, 1 corrupted' \
+        in output.out
+    assert 'missing: @mod/mod.pbo\n' in output.out
+
+
+@pytest.mark.parametrize('command, method', [('index', 'build_index'), ('sync', 'sync'),
+                                             ('verify', 'verify')])
+def test_cancelled(command, method, tmpdir, capsys, mocker):
+    """Assert cancelled commands exit with the status of an interrupted process."""
+    repository = Repository.initialize(str(tmpdir), 'name', 'http://host/repo')
+    repository.build_index(workers=1)
+    mocker.patch.object(Repository, method, side_effect=exceptions.Cancelled)
+
+    assert unit.main([command, str(tmpdir)]) == 130
+    assert 'cancelled' in capsys.readouterr().err
+
+
+@pytest.mark.parametrize('command, method, error, message', [
+    ('index', 'build_index', exceptions.InvalidIndex('manifest is truncated'),
+     'Indexing failed: manifest is truncated'),
+    ('sync', 'sync', exceptions.IntegrityError('@mod/mod.pbo does not match'),
+     'Synchronization failed: @mod/mod.pbo does not match'),
+    ('sync', 'sync', exceptions.DownloadError('http://host/repo', 'HTTP error 404'),
+     'Synchronization failed: HTTP error 404'),
+    ('sync', 'sync', exceptions.UnsupportedURLSchema(('http', 'https')),
+     'Synchronization failed: unsupported URL scheme, supported schemes are http, https'),
+    ('verify', 'verify', PermissionError(),
+     'Verification failed: PermissionError'),
+    ('watch', 'watch', exceptions.InvalidIndex('manifest is truncated'),
+     'Watching failed: manifest is truncated'),
+])
+def test_failed(command, method, error, message, tmpdir, capsys, mocker):
+    """Assert failed commands report the error and exit with status 1."""
+    repository = Repository.initialize(str(tmpdir), 'name', 'http://host/repo')
+    repository.build_index(workers=1)
+    mocker.patch.object(Repository, method, side_effect=error)
+
+    assert unit.main([command, str(tmpdir)]) == 1
+    assert message + '\n' in capsys.readouterr().err
+
+
+@pytest.mark.parametrize('command', ['status', 'index', 'sync'])
+def test_unsupported_version(command, tmpdir, capsys):
+    """Assert repositories written by an incompatible version are reported."""
+    repository = Repository.initialize(str(tmpdir), 'name', 'http://host/repo')
+    repository.build_index(workers=1)
+    tmpdir.join(config.index_directory, config.index_file).write_binary(msgpack.packb(
+        dict(repository.metadata, configuration_version='99.0')))
+
+    assert unit.main([command, str(tmpdir)]) == 1
+    assert 'failed: repository written by the incompatible version 99.0\n' in \
+        capsys.readouterr().err
+
+
+@pytest.mark.parametrize('command', ['index', 'sync', 'verify'])
+def test_not_repository(command, tmpdir, capsys):
+    """Assert commands fail on directories which are not repositories."""
+    assert unit.main([command, str(tmpdir)]) == 1
+    assert 'is not a repository' in capsys.readouterr().err
+
+
+def test_sync(tmpdir, capsys, mocker):
+    """Assert the sync command synchronizes the repository, cancellations being reported."""
+    remote = Repository.initialize(str(tmpdir.mkdir('remote')), 'remote', 'file://remote')
+    tmpdir.join('remote').mkdir('@mod').join('mod.pbo').write_binary(b'content')
+    remote.build_index(workers=1)
+    directory = str(tmpdir.join('local'))
+    unit.main(['init', pathlib.Path(remote.directory).as_uri(), directory])
+
+    assert unit.main(['sync', directory, '--workers', '1', '--limit', '1024']) == 0
+    assert tmpdir.join('local', '@mod', 'mod.pbo').read_binary() == b'content'
+    assert 'Synchronized 1 files: 7 bytes fetched' in capsys.readouterr().out
+
+    mocker.patch.object(Repository, 'sync', side_effect=exceptions.Cancelled)
+    assert unit.main(['sync', directory]) == 130
+    assert 'run sync again to resume it' in capsys.readouterr().err
+
+    mocker.patch.object(Repository, 'sync', side_effect=OSError('No space left on device'))
+    assert unit.main(['sync', directory]) == 1
+    assert 'Synchronization failed: No space left on device' in capsys.readouterr().err
+
+
+def test_status_import_time(tmpdir):
+    """Assert the status command starts fast, measured with ``-X importtime``."""
+    Repository.initialize(str(tmpdir), 'name', 'http://host/repo')
+    environment = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(unit.__file__)))
+    command = [sys.executable, '-X', 'importtime', '-m', 'cntosync.cli', 'status', str(tmpdir)]
+    # The first run compiles the modules which are not cached yet.
+    subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True,
+                   env=environment)
+    process = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True,
+                             env=environment, universal_newlines=True)
+
+    imports = {}
+    top_level = 0
+    for line in process.stderr.splitlines():
+        fields = line.split('|')
+        if not line.startswith('import time:') or not fields[1].strip().isdigit():
+            continue
+        cumulative, module = fields[1:]
+        imports[module.strip()] = int(cumulative)
+        if module.strip().startswith('cntosync') and not module.startswith('  '):
+            top_level += int(cumulative)
+    assert 'cntosync.filesync' in imports
+    assert [module for module in HEAVY_MODULES if module in imports] == []
+    assert top_level < STATUS_IMPORT_BUDGET
+
+
+def test_publish(tmpdir, capsys):
+    """Assert the publish command publishes the given repository."""
+    Repository.initialize(str(tmpdir), 'name', 'http://host/repo')
+    tmpdir.mkdir('@mod').join('mod.cpp').write_binary(b'content')
+
+    assert unit.main(['publish', str(tmpdir), '--workers', '1', '--compression', 'gzip']) == 0
+
+    assert 'Published generation 1, revision 1: 1 shards, 2 files written' in \
+        capsys.readouterr().out
+
+
+def test_publish_damaged_manifest(tmpdir, capsys):
+    """Assert publishing a repository with a damaged manifest reports it."""
+    repository = Repository.initialize(str(tmpdir), 'name', 'http://host/repo')
+    repository.build_index(workers=1)
+    tmpdir.join(config.index_directory, config.manifest_file).write_binary(b'damaged')
+
+    assert unit.main(['publish', str(tmpdir), '--workers', '1']) == 1
+    assert 'Publication failed: ' in capsys.readouterr().err
+
+
+def test_publish_not_repository(tmpdir, capsys):
+    """Assert publishing a directory which is not a repository fails."""
+    assert unit.main(['publish', str(tmpdir)]) == 1
+    assert 'is not a repository' in capsys.readouterr().err
+
+
+def test_watch(tmpdir, capsys, mocker):
+    """Assert the watch command watches the given repository until interrupted."""
+    Repository.initialize(str(tmpdir), 'name', 'http://host/repo')
+    watch = mocker.patch.object(Repository, 'watch', side_effect=KeyboardInterrupt)
+
+    assert unit.main(['watch', str(tmpdir), '--polling']) == 0
+    assert watch.call_args[1]['polling'] is True
+    report = watch.call_args[1]['on_update']
+    report(mocker.Mock(changed=False))
+    report(mocker.Mock(changed=True, added=['@mod/a.pbo'], modified=[], deleted=[],
+                       renamed=[]))
+    assert capsys.readouterr().out == \
+        'Indexed 1 added, 0 modified, 0 deleted and 0 renamed files\n'
+    assert unit.main(['watch', str(tmpdir.join('missing'))]) == 1
+
+
+def test_missing_command():
+    """Assert a command is required."""
+    with pytest.raises(SystemExit):
+        unit.main([])
@@ -0,0 +1,112 @@
+# --------------------------------License Notice----------------------------------
+# CNTOSync - Carpe Noctem Tactical Operations ArmA3 mod synchronization tool
+# Copyright (C) 2018 Carpe Noctem - Tactical Operations (aka. CNTO) (contact@carpenoctem.co)
+#
+# The authors of this software are listed in the AUTHORS file at the
+# root of this software's source code tree.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# All rights reserved.
+# --------------------------------License Notice----------------------------------
+
+"""Test suite for `cntosync.compression`."""
+
+import gzip
+import io
+import os
+
+import cntosync.compression as unit
+import cntosync.configuration as config
+from cntosync import exceptions
+
+import pytest
+
+
+@pytest.mark.parametrize('compression', unit.available_compressions())
+def test_roundtrip(compression):
+    """Assert compressed data is restored and compression is deterministic."""
+    data = b'repository index ' * 100
+
+    compressed = unit.compress(data, compression)
+
+    assert len(compressed) < len(data)
+    assert unit.compress(data, compression) == compressed
+    assert unit.decompress(compressed, compression) == data
+
+
+def test_zstd_unavailable(mocker):
+    """Assert zstd is not offered without the zstandard package."""
+    mocker.patch.object(unit, '_zstandard', return_value=None)
+    data = b'class CfgPatches;\n' * 200
+
+    assert unit.available_compressions() == ['gzip']
+    assert unit.preferred_compression() == 'gzip'
+    assert unit.sample_ratio(io.BytesIO(data), len(data)) < 1
+    for compress in (unit.compress, unit.decompress):
+        with pytest.raises(ValueError):
+            compress(b'data', 'zstd')
+    with pytest.raises(ValueError):
+        unit.decompressor('zstd')
+    with pytest.raises(ValueError):
+        unit.compress_stream(io.BytesIO(data), io.BytesIO(), 'zstd')
+
+
+def test_optional_module():
+    """Assert missing optional modules are reported as None."""
+    assert unit._optional_module('gzip') is gzip
+    assert unit._optional_module('cntosync_missing_module') is None
+
+
+@pytest.mark.parametrize('compression', unit.available_compressions())
+def test_stream_roundtrip(compression):
+    """Assert streamed compression is restored by a decompressor fed in pieces."""
+    data = b'class CfgPatches;\n' * 1000
+    target = io.BytesIO()
+
+    unit.compress_stream(io.BytesIO(data), target, compression, len(data))
+
+    compressed = target.getvalue()
+    assert unit.decompress(compressed, compression) == data
+    decompressor = unit.decompressor(compression)
+    restored = b''.join(decompressor.decompress(compressed[offset:offset + 100])
+                        for offset in range(0, len(compressed), 100))
+    assert len(compressed) < len(data)
+    assert restored + decompressor.flush() == data
+    assert unit.blob_name(b'\xab', compression) == 'ab' + unit.suffixes[compression]
+
+
+@pytest.mark.parametrize('compression', unit.available_compressions())
+def test_invalid_data(compression):
+    """Assert invalid compressed data is reported as an integrity error."""
+    data = b'garbage' * 10
+    compressed = unit.compress(b'class CfgPatches;\n' * 100, compression)
+
+    for invalid in (data, compressed[:len(compressed) // 2]):
+        with pytest.raises(exceptions.IntegrityError):
+            unit.decompress(invalid, compression)
+    with pytest.raises(exceptions.IntegrityError):
+        unit.decompressor(compression).decompress(data)
+
+
+def test_choose_compression(mocker):
+    """Assert only files large and compressible enough are compressed."""
+    mocker.patch.object(config, 'compression_min_size', 1024)
+    mocker.patch.object(config, 'compression_sample_size', 256)
+    text = b'class CfgPatches;\n' * 200
+    noise = os.urandom(4096)
+
+    assert unit.choose_compression(io.BytesIO(text), len(text)) == unit.preferred_compression()
+    assert unit.choose_compression(io.BytesIO(noise), len(noise)) is None
+    assert unit.choose_compression(io.BytesIO(text[:1000]), 1000) is None
+    assert unit.sample_ratio(io.BytesIO(noise + text), len(noise + text)) < 1
@@ -0,0 +1,263 @@
+# --------------------------------License Notice----------------------------------
+# CNTOSync - Carpe Noctem Tactical Operations ArmA3 mod synchronization tool
+# Copyright (C) 2018 Carpe Noctem - Tactical Operations (aka. CNTO) (contact@carpenoctem.co)
+#
+# The authors of this software are listed in the AUTHORS file at the
+# root of this software's source code tree.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# All rights reserved.
+# --------------------------------License Notice----------------------------------
+
+"""Test suite for `cntosync.download`."""
+
+import http.client
+import os
+import threading
+import time
+
+import cntosync.configuration as config
+import cntosync.download as unit
+from cntosync import exceptions
+from cntosync.bandwidth import PRIORITY_LARGE, PRIORITY_SMALL, TokenBucket
+
+from httpserver import serve
+
+import pytest
+
+
+@pytest.fixture()
+def remote(tmpdir):
+    """Serve a directory holding a few files and yield ``(server, directory)``."""
+    directory = tmpdir.mkdir('remote')
+    directory.mkdir('@mod').join('big file.pbo').write_binary(os.urandom(100000))
+    directory.join('@mod', 'small.bisign').write_binary(b'signature')
+    directory.join('@mod', 'empty').write_binary(b'')
+    with serve(str(directory)) as server:
+        yield server, directory
+
+
+def test_file_url():
+    """Assert relative paths are quoted and joined to the base URL."""
+    assert unit.file_url('http://host/repo/', '@mod/a b.pbo') == 'http://host/repo/@mod/a%20b.pbo'
+
+
+def test_preallocate(tmpdir, mocker):
+    """Assert target files get their final size, even without fallocate support."""
+    path = str(tmpdir.join('sub', 'file'))
+    unit.preallocate(path, 1000)
+    assert os.path.getsize(path) == 1000
+
+    mocker.patch('os.posix_fallocate', side_effect=OSError, create=True)
+    unit.preallocate(path, 10)
+    assert os.path.getsize(path) == 10
+
+
+@pytest.mark.parametrize('segment_size', [None, 30000])
+def test_download(segment_size, remote, tmpdir):
+    """Assert files are downloaded completely, large ones in several segments."""
+    server, directory = remote
+    names = ['big file.pbo', 'small.bisign', 'empty']
+    jobs = [unit.DownloadJob(unit.file_url(server.url, '@mod/' + name),
+                             str(tmpdir.join('local', name)),
+                             directory.join('@mod', name).size()) for name in names]
+    received = []
+
+    with unit.Downloader(workers=4, segment_size=segment_size) as downloader:
+        downloader.download(jobs, received.append)
+        if segment_size:
+            assert len(downloader.segments(jobs[0])) == 4
+
+    for name in names:
+        assert tmpdir.join('local', name).read_binary() == \
+            directory.join('@mod', name).read_binary()
+    assert sum(received) == 100009
+
+
+def test_fetch_range(remote):
+    """Assert a byte range is streamed and the connection reused."""
+    server, directory = remote
+    url = unit.file_url(server.url, '@mod/big file.pbo')
+    downloader = unit.Downloader(connections_per_host=1)
+
+    data = b''.join(downloader.fetch(url, 10, 20))
+    whole = b''.join(downloader.fetch(url))
+
+    assert data == directory.join('@mod', 'big file.pbo').read_binary()[10:30]
+    assert len(whole) == 100000
+    assert len(downloader.pool._idle[('http', server.url[7:])]) == 1
+    downloader.close()
+
+
+def test_fetch_missing_file(remote):
+    """Assert HTTP errors are reported as download errors."""
+    server, _ = remote
+    downloader = unit.Downloader()
+
+    with pytest.raises(exceptions.DownloadError) as error:
+        b''.join(downloader.fetch(server.url + '/missing'))
+
+    assert error.value.url == server.url + '/missing'
+
+
+def test_fetch_stop(remote, mocker):
+    """Assert setting the stop event interrupts responses being read and new requests."""
+    mocker.patch.object(config, 'read_chunk_size', 1000)
+    server, _ = remote
+    url = unit.file_url(server.url, '@mod/big file.pbo')
+    stop = threading.Event()
+    downloader = unit.Downloader(stop=stop)
+    chunks = downloader.fetch(url)
+
+    with pytest.raises(exceptions.Cancelled):
+        for _ in chunks:
+            stop.set()
+    with pytest.raises(exceptions.Cancelled):
+        b''.join(downloader.fetch(url))
+    downloader.close()
+
+
+def test_download_truncated(remote, tmpdir):
+    """Assert a file shorter than expected is reported."""
+    server, _ = remote
+    job = unit.DownloadJob(unit.file_url(server.url, '@mod/small.bisign'),
+                           str(tmpdir.join('small')), 100)
+
+    with pytest.raises(exceptions.DownloadError):
+        unit.Downloader().download([job])
+
+
+def test_download_priority(tmpdir):
+    """Assert small files are served quickly while large ones saturate the rate limit."""
+    directory = tmpdir.mkdir('remote')
+    for index in range(8):
+        directory.join('large{0}.pbo'.format(index)).write_binary(os.urandom(100000))
+    directory.join('small.cpp').write_binary(b'class CfgPatches;')
+    jobs = [unit.DownloadJob(None, str(tmpdir.join('local', 'large{0}.pbo'.format(index))),
+                             100000, priority=PRIORITY_LARGE) for index in range(8)]
+    bucket = TokenBucket(400000, 16 * 1024)
+
+    with serve(str(directory), rate=2000000) as server, \
+            unit.Downloader(workers=8, connections_per_host=9, bucket=bucket) as downloader:
+        jobs = [job._replace(url=unit.file_url(server.url, os.path.basename(job.path)))
+                for job in jobs]
+        start = time.monotonic()
+        thread = threading.Thread(target=downloader.download, args=(jobs,))
+        thread.start()
+        time.sleep(0.3)
+        small_start = time.monotonic()
+        assert b''.join(downloader.fetch(unit.file_url(server.url, 'small.cpp'),
+                                         priority=PRIORITY_SMALL)) == b'class CfgPatches;'
+        small_latency = time.monotonic() - small_start
+        assert thread.is_alive()
+        thread.join()
+        elapsed = time.monotonic() - start
+
+    assert small_latency < 0.15
+    assert 1.6 < elapsed < 3
+    for job in jobs:
+        assert os.path.getsize(job.path) == 100000
+
+
+def test_fetch_retries_dropped_connection(remote, mocker):
+    """Assert a request failing on a stale connection is sent again."""
+    server, _ = remote
+    downloader = unit.Downloader()
+    original = downloader._request
+    calls = []
+
+    def flaky_request(*args):
+        calls.append(args)
+        if len(calls) == 1:
+            raise http.client.RemoteDisconnected()
+        yield from original(*args)
+
+    mocker.patch.object(downloader, '_request', side_effect=flaky_request)
+
+    assert b''.join(downloader.fetch(unit.file_url(server.url, '@mod/small.bisign'))) == \
+        b'signature'
+    assert len(calls) == 2
+
+    mocker.patch.object(config, 'download_retries', 0)
+    calls.clear()
+    with pytest.raises(http.client.RemoteDisconnected):
+        b''.join(downloader.fetch(unit.file_url(server.url, '@mod/small.bisign')))
+
+
+def test_connection_closed_on_error(remote):
+    """Assert a connection is not returned to the pool when its use failed."""
+    server, _ = remote
+    pool = unit.ConnectionPool()
+
+    with pytest.raises(RuntimeError):
+        with pool.connection('http', 'localhost:1'):
+            raise RuntimeError()
+
+    assert pool._idle[('http', 'localhost:1')] == []
+    with pool.connection('https', 'localhost:1') as connection:
+        assert isinstance(connection, http.client.HTTPSConnection)
+
+
+@pytest.fixture()
+def mirrors(tmpdir):
+    """Serve the same directory from a healthy, a failing and a stalling mirror."""
+    directory = tmpdir.mkdir('remote')
+    directory.join('file.pbo').write_binary(os.urandom(100000))
+    with serve(str(directory)) as healthy, serve(str(directory), error=503) as failing, \
+            serve(str(directory), stall_after=20000) as stalling:
+        yield directory, healthy, failing, stalling
+
+
+def test_fetch_mirrors_failover(mirrors, mocker):
+    """Assert data is fetched from other mirrors when one fails or stalls midway."""
+    mocker.patch.object(config, 'mirror_stall_timeout', 0.2)
+    directory, healthy, failing, stalling = mirrors
+    content = directory.join('file.pbo').read_binary()
+
+    with unit.Downloader(mirrors=[stalling.url, failing.url, healthy.url]) as downloader:
+        for _ in range(5):
+            assert b''.join(downloader.fetch(stalling.url + '/file.pbo')) == content
+            assert b''.join(downloader.fetch(failing.url + '/file.pbo', 10, 30000)) == \
+                content[10:30010]
+        with pytest.raises(exceptions.DownloadError) as error:
+            b''.join(downloader.fetch(healthy.url + '/missing'))
+        mirror_states = downloader.mirrors.mirrors
+
+    assert error.value.status == 404
+    assert mirror_states[2].requests == 10
+    assert (mirror_states[2].failures, mirror_states[2].retry_at) == (0, 0)
+    assert mirror_states[0].failures + mirror_states[1].failures >= 2
+
+
+def test_download_mirrors_proportional(tmpdir, mocker):
+    """Assert segments are spread across mirrors by speed, the probe measuring latency."""
+    directory = tmpdir.mkdir('remote')
+    directory.mkdir(config.index_directory).join(config.index_file).write_binary(b'index')
+    directory.join('file.pbo').write_binary(os.urandom(200000))
+    with serve(str(directory)) as fast, serve(str(directory), delay=0.05) as slow:
+        with unit.Downloader(workers=4, segment_size=5000,
+                             mirrors=[slow.url, fast.url]) as downloader:
+            downloader.probe(config.index_directory + '/' + config.index_file)
+            fast_mirror = downloader.mirrors.mirrors[1]
+            slow_mirror = downloader.mirrors.mirrors[0]
+            assert fast_mirror.rtt < slow_mirror.rtt
+            start = time.monotonic()
+            downloader.download([unit.DownloadJob(slow.url + '/file.pbo',
+                                                  str(tmpdir.join('file.pbo')), 200000)])
+            elapsed = time.monotonic() - start
+
+    assert tmpdir.join('file.pbo').read_binary() == directory.join('file.pbo').read_binary()
+    assert fast_mirror.requests > 4 * (slow_mirror.requests - 1)
+    # 40 segments on the slow mirror alone would take half a second.
+    assert elapsed < 0.4
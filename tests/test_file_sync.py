@@ -23,11 +23,16 @@
 """Test suite for `cntosync.filesync`."""
 
 import os
+import pathlib
 from unittest.mock import call
 
 import cntosync.configuration as config
 import cntosync.filesync as unit
-from cntosync import exceptions
+from cntosync import chunking, exceptions, indexer
+from cntosync.download import Downloader
+from cntosync.publish import publish
+
+from httpserver import serve
 
 import pytest
 
@@ -161,6 +166,7 @@ def test_init_repo_unsupported_schema():
     'http://',
     'ftp:/malformed',
     '://onlyhost',
+    'file://',
 ])
 def test_init_repo_invalid_url(url):
     """Assert exception is raised if invalid url is passed."""
@@ -169,3 +175,320 @@ def test_init_repo_invalid_url(url):
 
     with pytest.raises(exceptions.InvalidURL):
         unit.Repository.initialize(directory, name, url)
+
+
+@pytest.mark.parametrize('version,compatible', [
+    (config.version, True),
+    ('0.0.1', True),
+    ('0.99.0', False),
+    ('1.0.0', False),
+    ('unknown', False),
+    (None, False),
+])
+def test_compatible_version(version, compatible):
+    """Assert repositories of the same major version and not more recent are compatible."""
+    assert unit.compatible_version(version) == compatible
+
+
+def test_metadata_cached(tmpdir, mocker):
+    """Assert the index file is parsed once per process until it changes."""
+    unit.Repository.initialize(str(tmpdir), 'name', 'file://something')
+    spy_unpackb = mocker.spy(unit.msgpack, 'unpackb')
+
+    assert unit.Repository(str(tmpdir)).metadata['display_name'] == 'name'
+    unit.Repository(str(tmpdir)).metadata['display_name'] = 'changed'
+    assert unit.Repository(str(tmpdir.join('.'))).metadata['display_name'] == 'name'
+    assert spy_unpackb.call_count == 1
+
+    unit.Repository.initialize(str(tmpdir), 'other', 'file://something', overwrite=True)
+    assert unit.Repository(str(tmpdir)).metadata['display_name'] == 'other'
+    assert spy_unpackb.call_count == 2
+
+
+def test_metadata_unsupported_version(tmpdir):
+    """Assert repositories written by an incompatible version are rejected."""
+    repository = unit.Repository.initialize(str(tmpdir), 'name', 'file://something')
+    tmpdir.join(config.index_directory, config.index_file).write_binary(
+        unit.msgpack.packb({'configuration_version': '1.0.0'}))
+
+    with pytest.raises(exceptions.UnsupportedVersion) as error:
+        repository.metadata
+    assert error.value.version == '1.0.0'
+
+
+def test_manifest_shared(tmpdir):
+    """Assert the manifest handle is shared and opened again once rebuilt."""
+    repository = unit.Repository.initialize(str(tmpdir), 'name', 'file://something')
+    tmpdir.mkdir('@mod').join('mod.cpp').write_binary(b'content')
+    repository.build_index(workers=1)
+
+    assert unit.Repository(str(tmpdir)).manifest is repository.manifest
+    assert repository.lookup('@mod/new.pbo') is None
+
+    tmpdir.join('@mod', 'new.pbo').write_binary(b'new')
+    repository.build_index(workers=1)
+    assert repository.lookup('@mod/new.pbo').size == 3
+
+
+def test_build_index(tmpdir):
+    """Assert the file manifest is stored in its own file."""
+    directory = str(tmpdir)
+    repository = unit.Repository.initialize(directory, 'name', 'file://something')
+    tmpdir.mkdir('@mod').join('mod.cpp').write_binary(b'content')
+
+    result = repository.build_index(workers=1)
+
+    with repository.open_manifest() as manifest:
+        assert list(manifest) == result.entries
+    assert repository.lookup('@mod/mod.cpp') == result.entries[0]
+    assert repository.lookup('@mod/missing') is None
+    assert repository.metadata['display_name'] == 'name'
+    assert [entry.path for entry in result.entries] == ['@mod/mod.cpp']
+
+
+def test_build_index_incremental(tmpdir, mocker):
+    """Assert the stat cache is persisted and used by the next indexing run."""
+    repository = unit.Repository.initialize(str(tmpdir), 'name', 'file://something')
+    tmpdir.mkdir('@mod').join('mod.cpp').write_binary(b'content')
+    first = repository.build_index(workers=1)
+    spy_build = mocker.spy(indexer, 'build')
+
+    second = repository.build_index(workers=1)
+    repository.build_index(workers=1, incremental=False)
+
+    assert os.path.isfile(repository.stat_cache_path)
+    assert second.hashed_files == 0
+    assert second.entries == first.entries
+    assert spy_build.call_args_list[0][0][2].files == first.stat_cache.files
+    assert spy_build.call_args_list[1][0][2] is None
+
+
+def test_build_index_chunking(tmpdir):
+    """Assert the chunk table is persisted and statistics reported when chunking."""
+    repository = unit.Repository.initialize(str(tmpdir), 'name', 'file://something')
+    tmpdir.mkdir('@mod').join('mod.cpp').write_binary(b'content')
+
+    assert repository.build_index(workers=1).chunk_statistics is None
+    result = repository.build_index(workers=1, content_defined_chunking=True)
+
+    assert result.chunk_statistics.files == 1
+    assert chunking.ChunkTable.load(repository.chunk_table_path).files['@mod/mod.cpp']
+
+
+def test_sync(tmpdir):
+    """Assert the repository is synchronized, reusing local files, and the journal removed."""
+    remote = unit.Repository.initialize(str(tmpdir.mkdir('remote')), 'name', 'file://something')
+    tmpdir.join('remote').mkdir('@mod').join('mod.cpp').write_binary(b'new content')
+    tmpdir.join('remote', '@mod').join('same.pbo').write_binary(b'same')
+    tmpdir.join('remote').mkdir('@other').join('moved.pbo').write_binary(b'moved')
+    remote.build_index(workers=1)
+
+    with serve(remote.directory) as server:
+        local = unit.Repository.initialize(str(tmpdir.mkdir('local')), 'name', server.url)
+        tmpdir.join('local').mkdir('@mod').join('mod.cpp').write_binary(b'old content')
+        tmpdir.join('local', '@mod').join('same.pbo').write_binary(b'same')
+        tmpdir.join('local', '@mod').join('moved.pbo').write_binary(b'moved')
+        tmpdir.join('local', '@mod').join('deleted.pbo').write_binary(b'deleted')
+        local.build_index(workers=1)
+        with remote.open_manifest() as remote_manifest:
+            sync_plan = local.plan_sync(remote_manifest)
+        result = local.sync(workers=1)
+
+    assert sync_plan.moved == [('@mod/moved.pbo', '@other/moved.pbo')]
+    assert sync_plan.deleted == ['@mod/deleted.pbo']
+    assert sync_plan.bytes_to_transfer == len(b'new content')
+    assert result.files == 1
+    assert tmpdir.join('local', '@mod', 'mod.cpp').read_binary() == b'new content'
+    assert sorted(os.listdir(str(tmpdir.join('local', '@mod')))) == ['mod.cpp', 'same.pbo']
+    assert not os.path.exists(local.journal_path)
+    with remote.open_manifest() as remote_manifest:
+        assert local.plan_sync(remote_manifest).empty
+
+
+def test_sync_delta(tmpdir, mocker):
+    """Assert a file modified on the remote is synchronized by fetching its changed block."""
+    mocker.patch.object(config, 'block_size', 1024)
+    mocker.patch.object(config, 'delta_threshold', 4096)
+    content = bytearray(os.urandom(64 * 1024))
+    remote = unit.Repository.initialize(str(tmpdir.mkdir('remote')), 'name', 'file://something')
+    tmpdir.join('remote').mkdir('@mod').join('mod.pbo').write_binary(bytes(content))
+    remote.build_index(workers=1)
+
+    with serve(remote.directory) as server:
+        local = unit.Repository.initialize(str(tmpdir.mkdir('local')), 'name', server.url)
+        assert local.sync(workers=1).fetched_bytes == len(content)
+        content[5000:5010] = b'0123456789'
+        tmpdir.join('remote', '@mod', 'mod.pbo').write_binary(bytes(content))
+        remote.build_index(workers=1, incremental=False)
+        result = local.sync(workers=1)
+
+    assert (result.files, result.fetched_bytes) == (1, 1024)
+    assert tmpdir.join('local', '@mod', 'mod.pbo').read_binary() == content
+
+
+@pytest.mark.parametrize('published', [False, True])
+def test_sync_subscriptions(published, tmpdir):
+    """Assert only subscribed folders are synchronized, others being left alone."""
+    remote = unit.Repository.initialize(str(tmpdir.mkdir('remote')), 'name', 'file://something')
+    for mod in ('@a', '@b', '@c'):
+        tmpdir.join('remote').mkdir(mod).join('mod.pbo').write_binary(mod.encode())
+    if published:
+        publish(remote, workers=1)
+    else:
+        remote.build_index(workers=1)
+    local_directory = tmpdir.mkdir('local')
+    local_directory.mkdir('@c').join('local.pbo').write_binary(b'local')
+
+    with serve(remote.directory) as server:
+        local = unit.Repository.initialize(str(local_directory), 'name', server.url,
+                                           subscriptions=['@a', '@b'])
+        local.subscribe(['@a'])
+        result = local.sync(workers=1)
+
+    assert local.subscriptions == ['@a']
+    assert result.files == 1
+    assert sorted(os.listdir(str(local_directory))) == ['.cntosync', '@a', '@c']
+    assert local_directory.join('@c', 'local.pbo').read_binary() == b'local'
+    assert [entry.path for entry in local.manifest] == ['@a/mod.pbo']
+
+    local.subscribe(None)
+    assert local.subscriptions is None
+
+
+def test_sync_revisions(tmpdir, mocker):
+    """Assert the remote manifest is kept and updated from the deltas of later revisions."""
+    remote = unit.Repository.initialize(str(tmpdir.mkdir('remote')), 'name', 'file://something')
+    tmpdir.join('remote').mkdir('@mod').join('mod.pbo').write_binary(b'content')
+    publish(remote, workers=1)
+    fetch = mocker.spy(Downloader, 'fetch')
+
+    with serve(remote.directory) as server:
+        local = unit.Repository.initialize(str(tmpdir.mkdir('local')), 'name', server.url)
+        local.sync(workers=1)
+        tmpdir.join('remote', '@mod', 'mod.pbo').write_binary(b'new content')
+        publish(remote, workers=1)
+        fetch.reset_mock()
+        local.sync(workers=1)
+
+    assert tmpdir.join('local', '@mod', 'mod.pbo').read_binary() == b'new content'
+    assert not any(call[0][1].endswith('/' + config.manifest_file)
+                   for call in fetch.call_args_list)
+
+
+@pytest.fixture()
+def small_chunks(mocker):
+    """Use tiny chunks so that tests run on small files."""
+    mocker.patch.object(config, 'chunk_min_size', 256)
+    mocker.patch.object(config, 'chunk_average_size', 1024)
+    mocker.patch.object(config, 'chunk_max_size', 4096)
+    mocker.patch.object(config, 'batched_write_size', 4096)
+
+
+def test_sync_chunks(small_chunks, tmpdir):
+    """Assert chunks shared between files published with chunks are fetched once."""
+    shared = os.urandom(64 * 1024)
+    remote = unit.Repository.initialize(str(tmpdir.mkdir('remote')), 'name', 'file://something')
+    tmpdir.join('remote').mkdir('@mod').join('a.pbo').write_binary(shared + os.urandom(8192))
+    tmpdir.join('remote', '@mod').join('b.pbo').write_binary(os.urandom(8192) + shared)
+    publish(remote, workers=1, chunks=True, compressions=[])
+    chunks = chunking.ChunkTable.load(remote.chunk_table_path).chunks
+
+    with serve(remote.directory) as server:
+        local = unit.Repository.initialize(str(tmpdir.mkdir('local')), 'name', server.url)
+        result = local.sync(workers=2)
+
+    assert result.fetched_bytes == sum(size for size, _ in chunks.values())
+    assert result.fetched_bytes < 2 * len(shared)
+    for name in ('a.pbo', 'b.pbo'):
+        assert tmpdir.join('local', '@mod', name).read_binary() == \
+            tmpdir.join('remote', '@mod', name).read_binary()
+    assert not os.path.exists(local.journal_path)
+
+
+def test_sync_local_chunks(small_chunks, tmpdir):
+    """Assert chunks of local files recorded in the chunk table are not fetched again."""
+    shared = os.urandom(64 * 1024)
+    extra = os.urandom(8192)
+    remote = unit.Repository.initialize(str(tmpdir.mkdir('remote')), 'name', 'file://something')
+    tmpdir.join('remote').mkdir('@mod').join('old.pbo').write_binary(shared)
+    tmpdir.join('remote', '@mod').join('new.pbo').write_binary(shared + extra)
+    publish(remote, workers=1, chunks=True, compressions=[])
+
+    with serve(remote.directory) as server:
+        local = unit.Repository.initialize(str(tmpdir.mkdir('local')), 'name', server.url)
+        tmpdir.join('local').mkdir('@mod').join('old.pbo').write_binary(shared)
+        local.build_index(workers=1, content_defined_chunking=True)
+        result = local.sync(workers=1)
+
+    assert 0 < result.fetched_bytes < len(extra) + config.chunk_max_size
+    assert tmpdir.join('local', '@mod', 'new.pbo').read_binary() == shared + extra
+
+
+def test_sync_mirrors(tmpdir):
+    """Assert repositories are synchronized from their mirrors when one of them fails."""
+    remote = unit.Repository.initialize(str(tmpdir.mkdir('remote')), 'name', 'file://something')
+    tmpdir.join('remote').mkdir('@mod').join('mod.pbo').write_binary(b'content')
+    publish(remote, workers=1)
+
+    with serve(remote.directory, error=503) as primary, serve(remote.directory) as mirror:
+        local = unit.Repository.initialize(str(tmpdir.mkdir('local')), 'name', primary.url,
+                                           mirrors=[mirror.url])
+        result = local.sync(workers=1)
+
+    assert local.mirrors == [mirror.url]
+    assert result.files == 1
+    assert tmpdir.join('local', '@mod', 'mod.pbo').read_binary() == b'content'
+
+
+def test_initialize_mirrors_invalid(tmpdir):
+    """Assert mirrors must be valid HTTP URLs."""
+    with pytest.raises(exceptions.InvalidURL):
+        unit.Repository.initialize(str(tmpdir), 'name', 'http://host/repo', mirrors=['invalid'])
+    with pytest.raises(exceptions.UnsupportedURLSchema):
+        unit.Repository.initialize(str(tmpdir), 'name', 'file:///srv/repo',
+                                   mirrors=['http://host/repo'])
+
+
+def test_sync_unsupported_schema(tmpdir, mocker):
+    """Assert synchronizing from a URL without download support fails."""
+    repository = unit.Repository.initialize(str(tmpdir), 'name', 'file://something')
+    mocker.patch.object(unit.Repository, 'metadata', {'url': 'ftp://host/repository'})
+
+    with pytest.raises(exceptions.UnsupportedURLSchema):
+        repository.sync()
+
+
+@pytest.mark.parametrize('link', [False, True])
+def test_sync_local(link, tmpdir):
+    """Assert repositories with a file URL are copied, or hard linked with `link`."""
+    master = unit.Repository.initialize(str(tmpdir.mkdir('master')), 'master', 'file://master')
+    tmpdir.join('master').mkdir('@mod').join('mod.pbo').write_binary(b'content')
+    tmpdir.join('master', '@mod').join('copy.pbo').write_binary(b'content')
+    master.build_index(workers=1)
+    url = pathlib.Path(master.directory).as_uri()
+    event = unit.Repository.initialize(str(tmpdir.mkdir('event')), 'event', url)
+
+    result = event.sync(workers=1, link=link)
+
+    assert (result.files, result.fetched_bytes) == (2, len(b'content'))
+    for name in ('mod.pbo', 'copy.pbo'):
+        path = tmpdir.join('event', '@mod', name)
+        assert path.read_binary() == b'content'
+        assert os.path.samefile(str(path), str(tmpdir.join('master', '@mod', 'copy.pbo'))) \
+            is link
+    assert event.sync(workers=1, link=link).files == 0
+
+
+def test_sync_local_subscriptions(tmpdir):
+    """Assert only subscribed folders are copied from repositories with a file URL."""
+    master = unit.Repository.initialize(str(tmpdir.mkdir('master')), 'master', 'file://master')
+    for mod in ('@a', '@b'):
+        tmpdir.join('master').mkdir(mod).join('mod.pbo').write_binary(mod.encode())
+    master.build_index(workers=1)
+    url = pathlib.Path(master.directory).as_uri()
+    event = unit.Repository.initialize(str(tmpdir.mkdir('event')), 'event', url,
+                                       subscriptions=['@b'])
+
+    assert event.sync(workers=1).files == 1
+    assert not tmpdir.join('event', '@a').exists()
+    assert tmpdir.join('event', '@b', 'mod.pbo').read_binary() == b'@b'
@@ -0,0 +1,215 @@
+# --------------------------------License Notice----------------------------------
+# CNTOSync - Carpe Noctem Tactical Operations ArmA3 mod synchronization tool
+# Copyright (C) 2018 Carpe Noctem - Tactical Operations (aka. CNTO) (contact@carpenoctem.co)
+#
+# The authors of this software are listed in the AUTHORS file at the
+# root of this software's source code tree.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# All rights reserved.
+# --------------------------------License Notice----------------------------------
+
+"""Test suite for `cntosync.fileutils`."""
+
+import errno
+import os
+
+import cntosync.fileutils as unit
+
+import pytest
+
+
+def test_atomic_write(tmpdir):
+    """Assert content is replaced and no temporary file is left behind."""
+    path = tmpdir.join('file')
+    path.write_binary(b'old')
+
+    unit.atomic_write(str(path), b'new')
+
+    assert path.read_binary() == b'new'
+    assert os.listdir(str(tmpdir)) == ['file']
+
+
+def test_atomic_write_failure(tmpdir, mocker):
+    """Assert the original file is kept and the temporary file removed on failure."""
+    path = tmpdir.join('file')
+    path.write_binary(b'old')
+    mocker.patch('os.replace', side_effect=OSError)
+
+    with pytest.raises(OSError):
+        unit.atomic_write(str(path), b'new')
+
+    assert path.read_binary() == b'old'
+    assert os.listdir(str(tmpdir)) == ['file']
+
+
+def test_atomic_open_failure(tmpdir):
+    """Assert nothing is replaced when writing fails midway."""
+    path = tmpdir.join('file')
+
+    with pytest.raises(RuntimeError), unit.atomic_open(str(path)) as stream:
+        stream.write(b'partial')
+        raise RuntimeError
+
+    assert os.listdir(str(tmpdir)) == []
+
+
+def test_allocate(tmpdir, mocker):
+    """Assert files get their final size, even without fallocate support."""
+    with open(str(tmpdir.join('file')), mode='wb') as stream:
+        unit.allocate(stream.fileno(), 1000)
+        assert os.path.getsize(str(tmpdir.join('file'))) == 1000
+        mocker.patch('os.posix_fallocate', side_effect=OSError, create=True)
+        unit.allocate(stream.fileno(), 10)
+        assert os.path.getsize(str(tmpdir.join('file'))) == 10
+
+
+def test_sync_directory(tmpdir, mocker):
+    """Assert directories are flushed, those which cannot be opened being ignored."""
+    fsync = mocker.spy(os, 'fsync')
+
+    unit.sync_directory(str(tmpdir))
+    unit.sync_directory(str(tmpdir.join('missing')))
+
+    assert fsync.call_count == 1
+
+
+def test_sync_directory_errors(tmpdir, mocker):
+    """Assert directories which cannot be flushed are ignored, other errors raised."""
+    mocker.patch('os.fsync', side_effect=OSError(errno.EINVAL, 'invalid argument'))
+    unit.sync_directory(str(tmpdir))
+
+    mocker.patch('os.fsync', side_effect=OSError(errno.EIO, 'input/output error'))
+    with pytest.raises(OSError):
+        unit.sync_directory(str(tmpdir))
+
+
+@pytest.mark.parametrize('link', [False, True])
+def test_clone_file(link, tmpdir):
+    """Assert files are hard linked with `link`, otherwise reflinked or copied."""
+    source = tmpdir.join('source')
+    source.write_binary(b'content' * 1000)
+
+    method = unit.clone_file(str(source), str(tmpdir.join('clone')), link)
+
+    assert tmpdir.join('clone').read_binary() == source.read_binary()
+    assert method in (('hardlink',) if link else ('reflink', 'copy'))
+    assert os.path.samefile(str(source), str(tmpdir.join('clone'))) is link
+
+
+def test_clone_file_link_unsupported(tmpdir, mocker):
+    """Assert files are copied when they cannot be hard linked."""
+    tmpdir.join('source').write_binary(b'content')
+    mocker.patch('os.link', side_effect=OSError(errno.EXDEV, 'cross-device link'))
+    mocker.patch.object(unit, 'reflink', return_value=False)
+
+    assert unit.clone_file(str(tmpdir.join('source')), str(tmpdir.join('clone')), True) == 'copy'
+    assert tmpdir.join('clone').read_binary() == b'content'
+
+
+def test_clone_file_link_error(tmpdir, mocker):
+    """Assert hard link errors other than unsupported links are raised."""
+    tmpdir.join('source').write_binary(b'content')
+    mocker.patch('os.link', side_effect=OSError(errno.EACCES, 'permission denied'))
+
+    with pytest.raises(OSError):
+        unit.clone_file(str(tmpdir.join('source')), str(tmpdir.join('clone')), True)
+
+
+@pytest.mark.skipif(not hasattr(unit, 'fcntl'), reason='reflinks are only made on Linux')
+def test_reflink(tmpdir, mocker):
+    """Assert reflinks are reported, unsupported ones ignored and other errors raised."""
+    tmpdir.join('source').write_binary(b'content')
+    ioctl = mocker.patch.object(unit.fcntl, 'ioctl')
+
+    assert unit.clone_file(str(tmpdir.join('source')), str(tmpdir.join('clone'))) == 'reflink'
+    assert ioctl.call_args[0][1] == unit._FICLONE
+
+    ioctl.side_effect = OSError(errno.EOPNOTSUPP, 'not supported')
+    assert not unit.reflink(0, 1)
+
+    ioctl.side_effect = OSError(errno.EIO, 'input/output error')
+    with pytest.raises(OSError):
+        unit.reflink(0, 1)
+
+
+def test_reflink_other_platforms(mocker):
+    """Assert reflinks are not attempted outside of Linux."""
+    mocker.patch.object(unit.sys, 'platform', 'win32')
+
+    assert not unit.reflink(0, 1)
+
+
+@pytest.mark.parametrize('unsupported', [[], ['copy_file_range'], ['copy_file_range',
+                                                                   'sendfile']])
+def test_copy_range(unsupported, tmpdir, mocker):
+    """Assert data is copied from the source position whatever the methods supported."""
+    for name in unsupported:
+        mocker.patch('os.' + name, side_effect=OSError(errno.ENOSYS, 'not supported'),
+                     create=True)
+    mocker.patch.object(unit.configuration, 'read_chunk_size', 7)
+    tmpdir.join('source').write_binary(bytes(range(100)))
+
+    with open(str(tmpdir.join('source')), mode='rb') as source, \
+            open(str(tmpdir.join('target')), mode='wb') as target:
+        source.seek(10)
+        assert unit.copy_range(source.fileno(), target.fileno(), 200) == 90
+
+    assert tmpdir.join('target').read_binary() == bytes(range(10, 100))
+
+
+@pytest.mark.parametrize('failing', ['copy_file_range', 'sendfile'])
+def test_copy_range_errors(failing, tmpdir, mocker):
+    """Assert kernel copy errors are raised once data was copied or if not about support."""
+    mocker.patch('os.copy_file_range', side_effect=OSError(errno.EXDEV, 'cross-device link'),
+                 create=True)
+    tmpdir.join('source').write_binary(bytes(range(100)))
+
+    with open(str(tmpdir.join('source')), mode='rb') as source, \
+            open(str(tmpdir.join('target')), mode='wb') as target:
+        mocker.patch('os.' + failing, create=True,
+                     side_effect=[10, OSError(errno.ENOSYS, 'not supported')])
+        with pytest.raises(OSError):
+            unit.copy_range(source.fileno(), target.fileno(), 200)
+        mocker.patch('os.' + failing, side_effect=OSError(errno.EIO, 'input/output error'),
+                     create=True)
+        with pytest.raises(OSError):
+            unit.copy_range(source.fileno(), target.fileno(), 200)
+
+
+def test_copy_file_keeps_links(tmpdir):
+    """Assert replacing a file does not modify the files hard linked to it."""
+    tmpdir.join('source').write_binary(b'new')
+    tmpdir.join('target').write_binary(b'old')
+    os.link(str(tmpdir.join('target')), str(tmpdir.join('linked')))
+
+    unit.copy_file(str(tmpdir.join('source')), str(tmpdir.join('target')))
+
+    assert tmpdir.join('target').read_binary() == b'new'
+    assert tmpdir.join('linked').read_binary() == b'old'
+    assert sorted(os.listdir(str(tmpdir))) == ['linked', 'source', 'target']
+
+
+def test_copy_file_failure(tmpdir, mocker):
+    """Assert the target is kept and the temporary clone removed when cloning fails."""
+    tmpdir.join('source').write_binary(b'new')
+    tmpdir.join('target').write_binary(b'old')
+    mocker.patch.object(unit, 'copy_range', side_effect=OSError(errno.ENOSPC, 'no space left'))
+    mocker.patch.object(unit, 'reflink', return_value=False)
+
+    with pytest.raises(OSError):
+        unit.copy_file(str(tmpdir.join('source')), str(tmpdir.join('target')))
+
+    assert tmpdir.join('target').read_binary() == b'old'
+    assert sorted(os.listdir(str(tmpdir))) == ['source', 'target']
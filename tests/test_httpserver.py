@@ -0,0 +1,134 @@
+# --------------------------------License Notice----------------------------------
+# CNTOSync - Carpe Noctem Tactical Operations ArmA3 mod synchronization tool
+# Copyright (C) 2018 Carpe Noctem - Tactical Operations (aka. CNTO) (contact@carpenoctem.co)
+#
+# The authors of this software are listed in the AUTHORS file at the
+# root of this software's source code tree.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# All rights reserved.
+# --------------------------------License Notice----------------------------------
+
+"""Test suite for the `httpserver` test helper."""
+
+import http.client
+import time
+from urllib.parse import urlparse
+
+from httpserver import serve
+
+import pytest
+
+
+@pytest.fixture()
+def connection(tmpdir):
+    """Serve a directory holding one file and yield a connection to the server."""
+    tmpdir.join('file').write_binary(b'0123456789')
+    with serve(str(tmpdir)) as server:
+        connection = http.client.HTTPConnection(urlparse(server.url).netloc)
+        yield connection
+        connection.close()
+
+
+def request(connection, method, path, headers=None):
+    """Send a request and return the status, headers and body of the response."""
+    connection.request(method, path, headers=headers or {})
+    response = connection.getresponse()
+    return response.status, response, response.read()
+
+
+def test_get_whole_file(connection):
+    """Assert the whole file is served with its length."""
+    status, response, body = request(connection, 'GET', '/file')
+
+    assert (status, body) == (200, b'0123456789')
+    assert response.getheader('Accept-Ranges') == 'bytes'
+
+
+@pytest.mark.parametrize('range_header,content,content_range', [
+    ('bytes=2-4', b'234', 'bytes 2-4/10'),
+    ('bytes=7-', b'789', 'bytes 7-9/10'),
+    ('bytes=8-20', b'89', 'bytes 8-9/10'),
+])
+def test_get_range(range_header, content, content_range, connection):
+    """Assert single ranges are served with partial content responses."""
+    status, response, body = request(connection, 'GET', '/file', {'Range': range_header})
+
+    assert (status, body) == (206, content)
+    assert response.getheader('Content-Range') == content_range
+
+
+@pytest.mark.parametrize('range_header', ['bytes=10-', 'lines=1-2'])
+def test_get_invalid_range(range_header, connection):
+    """Assert unsatisfiable ranges are refused."""
+    status, _, body = request(connection, 'GET', '/file', {'Range': range_header})
+
+    assert (status, body) == (416, b'')
+
+
+def test_get_not_found(connection):
+    """Assert missing files are not served."""
+    status, _, _ = request(connection, 'GET', '/missing')
+
+    assert status == 404
+
+
+@pytest.mark.parametrize('path', ['/../file', '/%2E%2E/%2E%2E/file'])
+def test_get_stays_in_directory(path, connection):
+    """Assert parent directory references cannot escape the served directory."""
+    status, _, body = request(connection, 'GET', path)
+
+    assert (status, body) == (200, b'0123456789')
+
+
+def test_head(connection):
+    """Assert HEAD requests only return headers."""
+    status, response, body = request(connection, 'HEAD', '/file')
+
+    assert (status, body) == (200, b'')
+    assert response.getheader('Content-Length') == '10'
+
+
+def test_rate(tmpdir):
+    """Assert responses are sent at the simulated link rate."""
+    tmpdir.join('file').write_binary(bytes(300000))
+    with serve(str(tmpdir), rate=1000000) as server:
+        connection = http.client.HTTPConnection(urlparse(server.url).netloc)
+        start = time.monotonic()
+        status, _, body = request(connection, 'GET', '/file')
+        elapsed = time.monotonic() - start
+        connection.close()
+
+    assert status == 200
+    assert len(body) == 300000
+    assert 0.2 < elapsed < 0.6
+
+
+def test_faults(tmpdir):
+    """Assert injected errors are answered and stalled responses stop midway."""
+    tmpdir.join('file').write_binary(bytes(50000))
+    with serve(str(tmpdir), error=503) as server:
+        connection = http.client.HTTPConnection(urlparse(server.url).netloc)
+        assert request(connection, 'GET', '/file')[0] == 503
+        server.error = None
+        server.stall_after = 1000
+        connection.close()
+        connection = http.client.HTTPConnection(urlparse(server.url).netloc, timeout=0.2)
+        connection.request('GET', '/file')
+        response = connection.getresponse()
+        assert response.status == 200
+        assert len(response.read(1000)) == 1000
+        with pytest.raises(OSError):
+            response.read(1)
+        connection.close()
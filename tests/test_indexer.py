@@ -0,0 +1,248 @@
+# --------------------------------License Notice----------------------------------
+# CNTOSync - Carpe Noctem Tactical Operations ArmA3 mod synchronization tool
+# Copyright (C) 2018 Carpe Noctem - Tactical Operations (aka. CNTO) (contact@carpenoctem.co)
+#
+# The authors of this software are listed in the AUTHORS file at the
+# root of this software's source code tree.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# All rights reserved.
+# --------------------------------License Notice----------------------------------
+
+"""Test suite for `cntosync.indexer`."""
+
+import hashlib
+import os
+import threading
+
+import cntosync.configuration as config
+import cntosync.indexer as unit
+from cntosync import exceptions
+
+import pytest
+
+
+def make_tree(root, files):
+    """Create `files`, a mapping of relative path to content, under `root`."""
+    for relative_path, content in files.items():
+        path = os.path.join(str(root), *relative_path.split('/'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, mode='wb') as stream:
+            stream.write(content)
+
+
+def expected_digest(content):
+    """Return the digest the indexer is expected to compute for `content`."""
+    return hashlib.blake2b(content, digest_size=config.digest_size).digest()
+
+
+def test_hash_file_streams(tmpdir, mocker):
+    """Assert files larger than the read buffer are hashed completely."""
+    mocker.patch.object(config, 'read_chunk_size', 7)
+    content = bytes(range(256)) * 3
+    make_tree(tmpdir, {'file': content})
+
+    assert unit.hash_file(str(tmpdir.join('file'))) == expected_digest(content)
+
+
+def test_scan_skips_index_directory(tmpdir):
+    """Assert the index directory is not part of the scan and paths use forward slashes."""
+    make_tree(tmpdir, {'@mod/addons/a.pbo': b'a', 'b.txt': b'b',
+                       config.index_directory + '/' + config.index_file: b''})
+
+    assert sorted(path for path, _ in unit.scan(str(tmpdir))) == ['@mod/addons/a.pbo', 'b.txt']
+
+
+def test_batches_split_large_files(mocker):
+    """Assert large files are alone in their batch and small files are grouped."""
+    mocker.patch.object(config, 'small_file_threshold', 10)
+    mocker.patch.object(config, 'small_file_batch_size', 2)
+
+    batches = unit._batches([(0, 1), (1, 100), (2, 2), (3, 3), (4, 50)])
+
+    assert batches == [[1], [4], [3, 2], [0]]
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_build(workers, tmpdir, mocker):
+    """Assert the manifest is sorted and holds the right sizes and digests."""
+    mocker.patch.object(config, 'small_file_batch_size', 1)
+    files = {'@b/addons/b.pbo': b'b' * 1000, '@a/mod.cpp': b'name = "a";', '@a/empty': b''}
+    make_tree(tmpdir, files)
+
+    result = unit.build(str(tmpdir), workers)
+
+    assert [entry.path for entry in result.entries] == sorted(files)
+    for entry in result.entries:
+        assert entry.size == len(files[entry.path])
+        assert entry.digest == expected_digest(files[entry.path])
+    assert result.hashed_files == 3
+    assert result.hashed_bytes == 1000 + len(b'name = "a";')
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_hash_files_progress_stop(workers, tmpdir, mocker):
+    """Assert progress reports hashed batches and a set stop event cancels hashing."""
+    mocker.patch.object(config, 'small_file_batch_size', 1)
+    files = {'a': b'a' * 100, 'b': b'b' * 10, 'c': b''}
+    make_tree(tmpdir, files)
+    paths = [str(tmpdir.join(name)) for name in files]
+    sizes = [len(content) for content in files.values()]
+    received = []
+    stop = threading.Event()
+
+    digests = unit.hash_files(paths, sizes, workers, progress=received.append, stop=stop)
+    stop.set()
+
+    assert digests == [expected_digest(content) for content in files.values()]
+    assert sorted(received) == [0, 10, 100]
+    with pytest.raises(exceptions.Cancelled):
+        unit.hash_files(paths, sizes, workers, stop=stop)
+
+
+def test_entry_pack_roundtrip():
+    """Assert an entry survives its compact representation."""
+    entry = unit.FileEntry('@a/mod.cpp', 3, 42, b'digest')
+
+    assert unit.FileEntry.unpack(entry.pack()) == entry
+
+
+def test_build_incremental_unchanged(tmpdir, mocker):
+    """Assert no file is hashed when nothing changed since the previous run."""
+    make_tree(tmpdir, {'@a/a.pbo': b'a', '@b/b.pbo': b'b'})
+    first = unit.build(str(tmpdir), 1)
+    mock_hash_files = mocker.patch('cntosync.indexer.hash_files', return_value=[])
+
+    second = unit.build(str(tmpdir), 1, first.stat_cache)
+
+    mock_hash_files.assert_called_once_with([], [], 1, True, None, None)
+    assert second.entries == first.entries
+    assert (second.added, second.modified, second.deleted, second.renamed) == ([], [], [], [])
+
+
+def test_build_incremental_changes(tmpdir):
+    """Assert additions, modifications, deletions and renames are detected."""
+    make_tree(tmpdir, {'@a/a.pbo': b'a', '@a/old.pbo': b'old', '@b/gone.pbo': b'gone'})
+    first = unit.build(str(tmpdir), 1)
+    os.rename(str(tmpdir.join('@a', 'old.pbo')), str(tmpdir.join('@a', 'new.pbo')))
+    os.remove(str(tmpdir.join('@b', 'gone.pbo')))
+    make_tree(tmpdir, {'@a/a.pbo': b'changed', '@c/c.pbo': b'c'})
+
+    second = unit.build(str(tmpdir), 1, first.stat_cache)
+
+    assert second.added == ['@c/c.pbo']
+    assert second.modified == ['@a/a.pbo']
+    assert second.deleted == ['@b/gone.pbo']
+    assert second.renamed == [('@a/old.pbo', '@a/new.pbo')]
+    assert second.hashed_files == 2
+    assert {entry.path: entry.digest for entry in second.entries} == {
+        '@a/a.pbo': expected_digest(b'changed'), '@a/new.pbo': expected_digest(b'old'),
+        '@c/c.pbo': expected_digest(b'c')}
+
+
+def test_build_changed_paths(tmpdir):
+    """Assert only changed paths are looked at, changed directories being scanned."""
+    make_tree(tmpdir, {'@a/a.pbo': b'a', '@a/old.pbo': b'old', '@b/gone.pbo': b'gone'})
+    first = unit.build(str(tmpdir), 1)
+    os.rename(str(tmpdir.join('@a', 'old.pbo')), str(tmpdir.join('@a', 'new.pbo')))
+    os.remove(str(tmpdir.join('@b', 'gone.pbo')))
+    make_tree(tmpdir, {'@a/a.pbo': b'changed', '@c/addons/c.pbo': b'c', '@d/unseen.pbo': b'd',
+                       '@a/new.pbo' + config.extension: b''})
+
+    second = unit.build(str(tmpdir), 1, first.stat_cache, changed=[
+        '@a/old.pbo', '@a/new.pbo', '@a/a.pbo', '@b/', '@c', '@a/new.pbo' + config.extension,
+        config.index_directory + '/' + config.index_file])
+
+    assert (second.added, second.modified, second.deleted) == \
+        (['@c/addons/c.pbo'], ['@a/a.pbo'], ['@b/gone.pbo'])
+    assert second.renamed == [('@a/old.pbo', '@a/new.pbo')]
+    assert [entry.path for entry in second.entries] == \
+        ['@a/a.pbo', '@a/new.pbo', '@c/addons/c.pbo']
+    assert not tmpdir.join('@a', 'new.pbo' + config.extension).exists()
+
+
+def test_build_folders(tmpdir):
+    """Assert only the subscribed folders are indexed, other entries being deleted."""
+    make_tree(tmpdir, {'@a/a.pbo': b'a', '@b/b.pbo': b'b', 'root.txt': b'root'})
+    first = unit.build(str(tmpdir), 1)
+
+    second = unit.build(str(tmpdir), 1, first.stat_cache, folders=['@a', '@missing'])
+
+    assert [entry.path for entry in second.entries] == ['@a/a.pbo']
+    assert second.deleted == ['@b/b.pbo', 'root.txt']
+    assert second.hashed_files == 0
+
+    make_tree(tmpdir, {'@a/new.pbo': b'new', '@b/new.pbo': b'new'})
+    third = unit.build(str(tmpdir), 1, second.stat_cache, changed=['@a/new.pbo', '@b/new.pbo'],
+                       folders=['@a'])
+
+    assert (third.added, third.deleted) == (['@a/new.pbo'], [])
+
+
+def test_build_incremental_racy_file(tmpdir):
+    """Assert files modified after the previous scan started are hashed again."""
+    make_tree(tmpdir, {'file': b'content'})
+    first = unit.build(str(tmpdir), 1)
+    stat_cache = unit.StatCache(0, first.stat_cache.files)
+
+    second = unit.build(str(tmpdir), 1, stat_cache)
+
+    assert second.hashed_files == 1
+    assert second.modified == []
+
+
+def test_build_trusted(tmpdir, mocker):
+    """Assert trusted records are used without hashing and reported when new."""
+    make_tree(tmpdir, {'old': b'old', 'synced': b'synced'})
+    first = unit.build(str(tmpdir), 1)
+    make_tree(tmpdir, {'synced': b'downloaded'})
+    stat = os.stat(str(tmpdir.join('synced')))
+    trusted = {'synced': [stat.st_ino, stat.st_size, stat.st_mtime_ns, b'digest']}
+    mock_hash_files = mocker.patch('cntosync.indexer.hash_files', return_value=[])
+
+    second = unit.build(str(tmpdir), 1, first.stat_cache, trusted)
+
+    mock_hash_files.assert_called_once_with([], [], 1, True, None, None)
+    assert second.modified == ['synced']
+    assert second.entries[1] == unit.FileEntry('synced', stat.st_size, stat.st_mtime_ns,
+                                               b'digest')
+
+
+def test_build_compression_choice(tmpdir, mocker):
+    """Assert the sidecar records whether compressing a file pays off."""
+    mocker.patch.object(config, 'compression_min_size', 1024)
+    mocker.patch.object(config, 'compression_sample_size', 256)
+    mocker.patch.object(config, 'delta_threshold', 1024)
+    make_tree(tmpdir, {'config.cpp': b'class CfgPatches;\n' * 200,
+                       'texture.paa': os.urandom(4096), 'small.sqf': b'hint "small";'})
+
+    unit.build(str(tmpdir), workers=1)
+
+    assert unit.signature.read_sidecar(str(tmpdir.join('config.cpp'))).compression == \
+        unit.compression.preferred_compression()
+    assert unit.signature.read_sidecar(str(tmpdir.join('texture.paa'))).compression is None
+    assert not tmpdir.join('small.sqf' + config.extension).exists()
+
+
+def test_stat_cache_roundtrip(tmpdir):
+    """Assert the stat cache survives persistence and a corrupted cache is ignored."""
+    path = str(tmpdir.join('statcache'))
+    stat_cache = unit.StatCache(42, {'@a/a.pbo': [1, 2, 3, b'digest']})
+
+    unit.save_stat_cache(path, stat_cache)
+
+    assert unit.load_stat_cache(path) == stat_cache
+    tmpdir.join('statcache').write_binary(b'\xc1')
+    assert unit.load_stat_cache(path) == unit.StatCache(0, {})
+    assert unit.load_stat_cache(str(tmpdir.join('missing'))) == unit.StatCache(0, {})
@@ -0,0 +1,115 @@
+# --------------------------------License Notice----------------------------------
+# CNTOSync - Carpe Noctem Tactical Operations ArmA3 mod synchronization tool
+# Copyright (C) 2018 Carpe Noctem - Tactical Operations (aka. CNTO) (contact@carpenoctem.co)
+#
+# The authors of this software are listed in the AUTHORS file at the
+# root of this software's source code tree.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# All rights reserved.
+# --------------------------------License Notice----------------------------------
+
+"""Test suite for `cntosync.journal`."""
+
+import os
+
+import cntosync.configuration as config
+import cntosync.journal as unit
+
+import pytest
+
+
+@pytest.fixture()
+def journal(tmpdir):
+    """Return an empty journal stored in `tmpdir`."""
+    return unit.TransferJournal(str(tmpdir.join('journal')))
+
+
+@pytest.mark.parametrize('ranges,merged', [
+    ([], []),
+    ([(10, 5), (0, 10)], [(0, 15)]),
+    ([(0, 5), (7, 3), (2, 2)], [(0, 5), (7, 3)]),
+    ([(0, 10), (2, 3)], [(0, 10)]),
+])
+def test_merge_ranges(ranges, merged):
+    """Assert adjacent and overlapping ranges are merged."""
+    assert unit.merge_ranges(ranges) == merged
+
+
+def test_missing_ranges(journal):
+    """Assert the ranges between completed ones are reported missing."""
+    journal.start_file(b'digest')
+    assert journal.missing_ranges(b'digest', 30) == [(0, 30)]
+
+    journal.complete_range(b'digest', 10, 10)
+    journal.complete_range(b'digest', 0, 5)
+
+    assert journal.missing_ranges(b'digest', 30) == [(5, 5), (20, 10)]
+    assert not journal.start_file(b'digest')
+
+
+def test_flush_interval(journal, mocker):
+    """Assert the journal is persisted at most once per interval unless forced."""
+    mocker.patch.object(config, 'journal_flush_interval', 3600)
+    journal.complete_range(b'digest', 0, 5)
+
+    journal.flush()
+    assert not os.path.exists(journal.path)
+
+    journal.flush(force=True)
+    assert unit.TransferJournal.load(journal.path).partial == {b'digest': [(0, 5)]}
+
+
+def test_complete_file_roundtrip(journal, tmpdir):
+    """Assert completed files survive persistence and are recognized while unchanged."""
+    tmpdir.join('file').write_binary(b'content')
+    journal.complete_range(b'digest', 0, 7)
+    journal.complete_file('file', b'digest', os.stat(str(tmpdir.join('file'))))
+    journal.flush(force=True)
+
+    loaded = unit.TransferJournal.load(journal.path)
+
+    assert loaded.partial == {}
+    assert loaded.is_completed('file', b'digest', os.stat(str(tmpdir.join('file'))))
+    assert not loaded.is_completed('file', b'other', os.stat(str(tmpdir.join('file'))))
+    tmpdir.join('file').write_binary(b'changed content')
+    assert not loaded.is_completed('file', b'digest', os.stat(str(tmpdir.join('file'))))
+
+
+def test_load_corrupted(tmpdir):
+    """Assert an unreadable journal is ignored."""
+    tmpdir.join('journal').write_binary(b'\xc1')
+
+    assert unit.TransferJournal.load(str(tmpdir.join('journal'))).partial == {}
+
+
+def test_discard_and_clear(journal):
+    """Assert partial files and chunks are removed along with their journal records."""
+    os.makedirs(journal.partial_directory)
+    for digest in (b'\x01', b'\x02'):
+        journal.start_file(digest)
+        open(journal.partial_path(digest), 'wb').close()
+    journal.flush(force=True)
+
+    journal.discard(b'\x01')
+    journal.discard(b'\x03')
+    assert list(journal.partial) == [b'\x02']
+    assert os.listdir(journal.partial_directory) == ['02']
+
+    os.makedirs(os.path.dirname(journal.chunk_path(b'\x04')))
+    open(journal.chunk_path(b'\x04'), 'wb').close()
+    journal.clear()
+    assert os.listdir(journal.partial_directory) == []
+    assert not os.path.exists(journal.path)
+    journal.clear()
@@ -0,0 +1,152 @@
+# --------------------------------License Notice----------------------------------
+# CNTOSync - Carpe Noctem Tactical Operations ArmA3 mod synchronization tool
+# Copyright (C) 2018 Carpe Noctem - Tactical Operations (aka. CNTO) (contact@carpenoctem.co)
+#
+# The authors of this software are listed in the AUTHORS file at the
+# root of this software's source code tree.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# All rights reserved.
+# --------------------------------License Notice----------------------------------
+
+"""Test suite for `cntosync.manifest`."""
+
+import cntosync.configuration as config
+import cntosync.manifest as unit
+from cntosync import exceptions
+from cntosync.indexer import FileEntry
+
+import pytest
+
+
+ENTRIES = [FileEntry('@mod{0:02d}/file.pbo'.format(number), number, number * 10,
+                     bytes([number]) * 20) for number in range(50)]
+
+
+@pytest.fixture()
+def manifest(tmpdir):
+    """Yield an open manifest holding `ENTRIES`."""
+    path = str(tmpdir.join('manifest'))
+    assert unit.write_manifest(path, (entry.pack() for entry in ENTRIES)) == len(ENTRIES)
+    with unit.Manifest(path) as opened:
+        yield opened
+
+
+@pytest.mark.parametrize('read_chunk_size', [7, 1024 * 1024])
+def test_iterate(read_chunk_size, manifest, mocker):
+    """Assert entries are streamed in order, as many times as needed."""
+    mocker.patch.object(config, 'read_chunk_size', read_chunk_size)
+
+    assert len(manifest) == len(ENTRIES)
+    assert list(manifest) == ENTRIES
+    assert list(manifest) == ENTRIES
+
+
+def test_get(manifest):
+    """Assert entries are looked up by path."""
+    for entry in ENTRIES:
+        assert manifest.get(entry.path) == entry
+    assert manifest.get('@mod00') is None
+    assert manifest.get('@mod99/file.pbo') is None
+    assert manifest.entry(49) == ENTRIES[49]
+    with pytest.raises(IndexError):
+        manifest.entry(50)
+
+
+def test_select(tmpdir):
+    """Assert the entries of top-level folders are selected without entries of others."""
+    paths = ['@a b/x', '@a/x', '@a/y/z', '@a0/x', '@ab/x', 'a', 'readme.txt', 'z/x']
+    entries = [FileEntry(path, 1, 1, b'\x00' * 20) for path in paths]
+    path = str(tmpdir.join('manifest'))
+    unit.write_manifest(path, (entry.pack() for entry in entries))
+
+    with unit.Manifest(path) as manifest:
+        assert [entry.path for entry in manifest.select(['@a'])] == ['@a/x', '@a/y/z']
+        assert [entry.path for entry in manifest.select(['z', '@ab', '@a b', '@missing', 'a'])] \
+            == ['@a b/x', '@ab/x', 'z/x']
+        assert list(manifest.select([])) == []
+
+
+def test_apply_changes():
+    """Assert changed entries are merged in path order and deleted ones skipped."""
+    added = FileEntry('@mod00/added.pbo', 1, 1, b'\x01' * 20)
+    modified = ENTRIES[1]._replace(size=100)
+    last = FileEntry('z', 1, 1, b'\x02' * 20)
+    changes = {added.path: added.pack(), modified.path: modified.pack(), ENTRIES[2].path: None,
+               'missing': None, last.path: last.pack()}
+
+    assert list(unit.apply_changes(ENTRIES[:4], changes)) == \
+        [added.pack(), ENTRIES[0].pack(), modified.pack(), ENTRIES[3].pack(), last.pack()]
+    assert list(unit.apply_changes(ENTRIES[:2], {})) == [ENTRIES[0].pack(), ENTRIES[1].pack()]
+
+
+def test_empty(tmpdir):
+    """Assert an empty manifest is valid."""
+    path = str(tmpdir.join('manifest'))
+    unit.write_manifest(path, [])
+
+    with unit.Manifest(path) as manifest:
+        assert list(manifest) == []
+        assert manifest.get('file') is None
+
+
+def test_unsorted(tmpdir):
+    """Assert entries must be sorted by path and nothing is written otherwise."""
+    with pytest.raises(ValueError):
+        unit.write_manifest(str(tmpdir.join('manifest')), [['b', 0, 0, b''], ['a', 0, 0, b'']])
+    assert tmpdir.listdir() == []
+
+
+@pytest.mark.parametrize('content', [b'', b'CNTOMAN\x01' + bytes(24), b'x' * 100])
+def test_invalid(content, tmpdir):
+    """Assert malformed files are rejected."""
+    tmpdir.join('manifest').write_binary(content)
+
+    with pytest.raises(exceptions.InvalidIndex):
+        unit.Manifest(str(tmpdir.join('manifest')))
+
+
+def test_truncated(manifest, tmpdir):
+    """Assert a manifest cut short is rejected."""
+    tmpdir.join('truncated').write_binary(tmpdir.join('manifest').read_binary()[:-1])
+
+    with pytest.raises(exceptions.InvalidIndex):
+        unit.Manifest(str(tmpdir.join('truncated')))
+
+
+def test_get_encoded_paths(tmpdir):
+    """Assert paths of every string length encoding and non-ASCII paths are looked up."""
+    paths = sorted(['a' * 31, 'a' * 32, 'b' * 300, 'b' * 70000, 'café', 'cafe', 'z中'])
+    path = str(tmpdir.join('manifest'))
+    unit.write_manifest(path, [[name, 0, 0, b''] for name in paths])
+
+    with unit.Manifest(path) as manifest:
+        for name in paths:
+            assert manifest.get(name).path == name
+        assert manifest.get('a' * 33) is None
+
+
+def test_replaced_while_open(manifest):
+    """Assert an opened manifest keeps reading the file it opened."""
+    unit.write_manifest(manifest.path, (entry.pack() for entry in ENTRIES[:3]))
+
+    assert manifest.get(ENTRIES[10].path) == ENTRIES[10]
+    assert list(manifest) == ENTRIES
+    with unit.Manifest(manifest.path) as replaced:
+        assert list(replaced) == ENTRIES[:3]
+    unit.write_manifest(manifest.path, [])
+
+    assert list(manifest) == ENTRIES
+    with unit.Manifest(manifest.path) as replaced:
+        assert len(replaced) == 0
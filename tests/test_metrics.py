@@ -0,0 +1,156 @@
+# --------------------------------License Notice----------------------------------
+# CNTOSync - Carpe Noctem Tactical Operations ArmA3 mod synchronization tool
+# Copyright (C) 2018 Carpe Noctem - Tactical Operations (aka. CNTO) (contact@carpenoctem.co)
+#
+# The authors of this software are listed in the AUTHORS file at the
+# root of this software's source code tree.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# All rights reserved.
+# --------------------------------License Notice----------------------------------
+
+"""Test suite for `cntosync.metrics`."""
+
+import json
+import os
+import pathlib
+import threading
+
+import cntosync.configuration as config
+import cntosync.metrics as unit
+from cntosync.filesync import Repository
+from cntosync.publish import publish
+
+from httpserver import serve
+
+import pytest
+
+
+@pytest.fixture()
+def master(tmpdir):
+    """Return an indexed repository holding a few files."""
+    directory = tmpdir.mkdir('master')
+    directory.mkdir('@mod').join('large.pbo').write_binary(os.urandom(300000))
+    directory.join('@mod', 'small.bisign').write_binary(b'signature')
+    repository = Repository.initialize(str(directory), 'master', 'http://localhost/')
+    repository.build_index(workers=1)
+    return repository
+
+
+def test_disabled():
+    """Assert hooks do nothing without an active recorder."""
+    assert unit.active() is None
+    assert unit.stage(unit.HASH) is unit.pool('hash', 4) is unit._NULL
+    with unit.stage(unit.HASH) as stage, unit.pool('hash', 4) as pool, pool.task():
+        stage.count(1, 10)
+        pool.busy(1.0)
+        pool.queue(3)
+
+
+def test_stage(mocker):
+    """Assert stages are timed and count what they processed, reporting to the callback."""
+    callback = mocker.Mock()
+    recorder = unit.Recorder(callback)
+
+    with unit.recording(recorder):
+        assert unit.active() is recorder
+        with unit.stage(unit.HASH) as stage:
+            stage.count(2, 100)
+        threads = [threading.Thread(target=recorder.add, args=(unit.FETCH, 1, 10, 0.5))
+                   for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    assert unit.active() is None
+
+    summary = recorder.summary()['stages']
+    assert summary[unit.HASH]['calls'] == 1
+    assert summary[unit.HASH]['files'] == 2
+    assert summary[unit.HASH]['bytes'] == 100
+    assert summary[unit.HASH]['seconds'] > 0
+    assert summary[unit.FETCH] == {'seconds': 5.0, 'calls': 0, 'files': 10, 'bytes': 100,
+                                   'throughput': 20.0}
+    callback.assert_called_once_with('stage', unit.HASH, summary[unit.HASH])
+
+
+def test_pool():
+    """Assert pools record the busy time of their workers and the depth of their queue."""
+    recorder = unit.Recorder()
+
+    with unit.recording(recorder):
+        with unit.pool('download', 2, 3) as pool:
+            for _ in range(3):
+                with pool.task():
+                    pass
+            pool.busy(1.0)
+
+    metrics = recorder.summary()['pools']['download']
+    assert metrics['workers'] == 2
+    assert metrics['tasks'] == 3
+    assert metrics['queue_max'] == 2
+    assert metrics['queue_mean'] == 1
+    assert metrics['busy'] >= 1
+    assert metrics['utilization'] == metrics['busy'] / (2 * metrics['seconds'])
+
+
+def test_unknown_profiler():
+    """Assert only known profilers are accepted."""
+    with pytest.raises(ValueError):
+        unit.Recorder(profile=unit.HASH, profiler='perf')
+
+
+def test_sync_local(master, tmpdir, mocker):
+    """Assert operations write a summary of every stage and pool into the repository."""
+    callback = mocker.Mock()
+    local = Repository.initialize(str(tmpdir.join('local')), 'local',
+                                  pathlib.Path(master.directory).as_uri())
+
+    with unit.recording(unit.Recorder(callback, profile=unit.DIFF)) as recorder:
+        local.sync(workers=1)
+        local.verify('full')
+
+    path = os.path.join(local.directory, config.index_directory, config.metrics_file)
+    with open(path) as stream:
+        summary = json.load(stream)
+    assert summary == callback.call_args[0][2]
+    assert summary['stages'] == json.loads(json.dumps(recorder.summary()['stages']))
+    assert sorted(summary['operations']) == ['index', 'sync', 'verify']
+    assert summary['operations']['index']['calls'] == 2
+    assert summary['stages'][unit.DIFF]['files'] == 2
+    assert summary['stages'][unit.DIFF]['bytes'] == 300009
+    assert summary['stages'][unit.WRITE]['files'] == 2
+    assert summary['stages'][unit.VERIFY]['bytes'] == 300009
+    assert summary['pools']['copy']['tasks'] == 2
+    assert os.path.isfile(summary['profile']['path'])
+    assert [call[0][1] for call in callback.call_args_list if call[0][0] == 'operation'] == \
+        ['sync', 'verify']
+
+
+def test_sync_http(master, tmpdir):
+    """Assert downloads record the fetched and written bytes."""
+    publish(master, workers=1)
+    with serve(master.directory) as server:
+        local = Repository.initialize(str(tmpdir.join('local')), 'local', server.url)
+        with unit.recording(unit.Recorder(profile=unit.HASH,
+                                          profiler='tracemalloc')) as recorder:
+            local.sync(workers=2)
+
+    summary = recorder.summary()
+    assert summary['stages'][unit.FETCH]['bytes'] >= 300009
+    assert summary['stages'][unit.WRITE]['bytes'] == 300009
+    assert summary['pools']['download']['tasks'] == 1
+    assert summary['pools']['fetch']['tasks'] == 1
+    assert summary['profile']['peak_memory'] > 0
+    assert summary['profile']['allocations']
@@ -0,0 +1,82 @@
+# --------------------------------License Notice----------------------------------
+# CNTOSync - Carpe Noctem Tactical Operations ArmA3 mod synchronization tool
+# Copyright (C) 2018 Carpe Noctem - Tactical Operations (aka. CNTO) (contact@carpenoctem.co)
+#
+# The authors of this software are listed in the AUTHORS file at the
+# root of this software's source code tree.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# All rights reserved.
+# --------------------------------License Notice----------------------------------
+
+"""Test suite for `cntosync.mirrors`."""
+
+import cntosync.configuration as config
+import cntosync.mirrors as unit
+
+
+def test_relative():
+    """Assert URLs are matched against the base URL of every mirror."""
+    mirrors = unit.MirrorSet(['http://a/repo/', 'http://b'])
+
+    assert mirrors.relative('http://a/repo/@mod/file.pbo') == '/@mod/file.pbo'
+    assert mirrors.relative('http://b/file') == '/file'
+    assert mirrors.relative('http://a/repository/file') is None
+
+
+def test_choose_proportional():
+    """Assert mirrors are drawn in proportion to their expected speed."""
+    mirrors = unit.MirrorSet(['http://fast', 'http://slow', 'http://unknown'], seed=0)
+    fast, slow, unknown = mirrors.mirrors
+    mirrors.record(fast, 0.01, 10 * 2 ** 20, 1.0)
+    mirrors.record(slow, 0.01, 2 ** 20, 1.0)
+
+    draws = [mirrors.choose(2 ** 20, exclude=[unknown]) for _ in range(2000)]
+
+    assert 8 < draws.count(fast) / draws.count(slow) < 12
+    # Unmeasured mirrors are assumed to perform like the average of the others.
+    assert mirrors.expected_time(unknown, 2 ** 20) == 0.01 + 2 ** 20 / (5.5 * 2 ** 20)
+
+
+def test_choose_small_requests_by_latency():
+    """Assert requests too small to measure throughput are spread by round-trip time."""
+    mirrors = unit.MirrorSet(['http://near', 'http://far'], seed=0)
+    near, far = mirrors.mirrors
+    mirrors.record(near, 0.01)
+    mirrors.record(far, 0.1)
+
+    draws = [mirrors.choose(1000) for _ in range(1000)]
+
+    assert draws.count(near) > 8 * draws.count(far)
+    assert (near.throughput, far.throughput) == (None, None)
+
+
+def test_fail_backoff(mocker):
+    """Assert failed mirrors are avoided until their growing backoff period ends."""
+    mocker.patch.object(config, 'mirror_backoff', 10)
+    clock = mocker.patch('time.monotonic', return_value=100.0)
+    mirrors = unit.MirrorSet(['http://a', 'http://b'])
+    first, second = mirrors.mirrors
+
+    mirrors.fail(first)
+    mirrors.fail(first)
+    assert first.retry_at == 120
+    assert {mirrors.choose() for _ in range(20)} == {second}
+    mirrors.fail(second)
+    assert mirrors.choose() is second
+    assert mirrors.choose(exclude=[first, second]) is None
+
+    clock.return_value = 120.0
+    mirrors.record(first, 0.05)
+    assert (first.failures, first.retry_at) == (0, 0)
@@ -0,0 +1,120 @@
+# --------------------------------License Notice----------------------------------
+# CNTOSync - Carpe Noctem Tactical Operations ArmA3 mod synchronization tool
+# Copyright (C) 2018 Carpe Noctem - Tactical Operations (aka. CNTO) (contact@carpenoctem.co)
+#
+# The authors of this software are listed in the AUTHORS file at the
+# root of this software's source code tree.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# All rights reserved.
+# --------------------------------License Notice----------------------------------
+
+"""Test suite for `cntosync.plan`."""
+
+import os
+
+import cntosync.plan as unit
+from cntosync.indexer import FileEntry
+from cntosync.journal import TransferJournal
+
+
+def entry(path, digest, size=1):
+    """Return a packed manifest entry."""
+    return [path, size, 0, digest]
+
+
+LOCAL = [entry('@a/kept.pbo', b'k'), entry('@a/modified.pbo', b'm'),
+         entry('@a/old name.pbo', b'r'), entry('@a/removed.pbo', b'd'),
+         entry('@b/moving.pbo', b'v')]
+REMOTE = [entry('@a/copy.pbo', b'k'), entry('@a/kept.pbo', b'k'),
+          entry('@a/modified.pbo', b'M', 10), entry('@a/new name.pbo', b'r'),
+          entry('@c/moving.pbo', b'v'), entry('@c/new.pbo', b'n', 5)]
+
+
+def test_plan_sync():
+    """Assert every kind of operation is planned and local contents are reused."""
+    plan = unit.plan_sync(LOCAL, REMOTE)
+
+    assert plan.added == [FileEntry('@c/new.pbo', 5, 0, b'n')]
+    assert plan.modified == [FileEntry('@a/modified.pbo', 10, 0, b'M')]
+    assert plan.deleted == ['@a/removed.pbo']
+    assert plan.renamed == [('@a/old name.pbo', '@a/new name.pbo')]
+    assert plan.moved == [('@b/moving.pbo', '@c/moving.pbo')]
+    assert plan.copied == [('@a/kept.pbo', '@a/copy.pbo')]
+    assert plan.digests == {'@a/copy.pbo': b'k', '@a/new name.pbo': b'r', '@c/moving.pbo': b'v'}
+    assert plan.bytes_to_transfer == 15
+    assert not plan.empty
+
+
+def test_plan_sync_no_reuse_of_overwritten_files():
+    """Assert contents of modified files are downloaded rather than copied."""
+    plan = unit.plan_sync([entry('a', b'1'), entry('b', b'2')],
+                          [entry('a', b'2'), entry('b', b'1')])
+
+    assert [item.path for item in plan.transfers] == ['a', 'b']
+    assert plan.copied == []
+
+
+def test_plan_sync_duplicates():
+    """Assert several removed files with the same content each serve one target."""
+    plan = unit.plan_sync([entry('@a/1', b'x'), entry('@a/2', b'x')],
+                          [entry('@a/3', b'x'), entry('@a/4', b'x'), entry('@a/5', b'x')])
+
+    assert plan.renamed == [('@a/2', '@a/3'), ('@a/1', '@a/4')]
+    assert plan.copied == []
+    assert plan.added == [FileEntry('@a/5', 1, 0, b'x')]
+
+
+def test_plan_sync_unchanged():
+    """Assert identical manifests give an empty plan."""
+    assert unit.plan_sync(REMOTE, REMOTE).empty
+
+
+def test_apply_local_changes(tmpdir):
+    """Assert files are copied, renamed, moved and deleted, reused ones being journaled."""
+    for item in LOCAL:
+        tmpdir.join(item[0]).write_binary(item[3], ensure=True)
+    tmpdir.join('@a', 'removed.pbo.cntosync').write_binary(b'signature')
+    journal = TransferJournal(str(tmpdir.join('journal')))
+    plan = unit.plan_sync(LOCAL, REMOTE)
+
+    unit.apply_local_changes(str(tmpdir), plan, journal)
+
+    assert sorted(os.listdir(str(tmpdir.join('@a')))) == [
+        'copy.pbo', 'kept.pbo', 'modified.pbo', 'new name.pbo']
+    assert not tmpdir.join('@b').check()
+    assert tmpdir.join('@c', 'moving.pbo').read_binary() == b'v'
+    assert tmpdir.join('@a', 'copy.pbo').read_binary() == b'k'
+    assert sorted(TransferJournal.load(journal.path).completed) == [
+        '@a/copy.pbo', '@a/new name.pbo', '@c/moving.pbo']
+
+
+def test_apply_local_changes_sidecars(tmpdir):
+    """Assert sidecars follow renamed, moved and copied files and stale ones are removed."""
+    for item in LOCAL:
+        tmpdir.join(item[0]).write_binary(item[3], ensure=True)
+    for path in ('@a/kept.pbo', '@b/moving.pbo'):
+        tmpdir.join(path + '.cntosync').write_binary(b'signature of ' + path.encode())
+    tmpdir.join('@a', 'new name.pbo.cntosync').write_binary(b'stale')
+    plan = unit.plan_sync(LOCAL, REMOTE)
+
+    unit.apply_local_changes(str(tmpdir), plan, TransferJournal(str(tmpdir.join('journal'))))
+
+    assert tmpdir.join('@c', 'moving.pbo.cntosync').read_binary() == \
+        b'signature of @b/moving.pbo'
+    assert tmpdir.join('@a', 'copy.pbo.cntosync').read_binary() == \
+        b'signature of @a/kept.pbo'
+    assert tmpdir.join('@a', 'kept.pbo.cntosync').check()
+    assert not tmpdir.join('@a', 'new name.pbo.cntosync').check()
+    assert not tmpdir.join('@b').check()
@@ -0,0 +1,179 @@
+# --------------------------------License Notice----------------------------------
+# CNTOSync - Carpe Noctem Tactical Operations ArmA3 mod synchronization tool
+# Copyright (C) 2018 Carpe Noctem - Tactical Operations (aka. CNTO) (contact@carpenoctem.co)
+#
+# The authors of this software are listed in the AUTHORS file at the
+# root of this software's source code tree.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# All rights reserved.
+# --------------------------------License Notice----------------------------------
+
+"""Test suite for `cntosync.publish`."""
+
+import os
+
+import cntosync.configuration as config
+import cntosync.publish as unit
+from cntosync import compression
+from cntosync.filesync import Repository
+from cntosync.manifest import Manifest
+
+import msgpack
+
+import pytest
+
+
+@pytest.fixture()
+def repository(tmpdir):
+    """Return a repository holding two mods and a file at its root."""
+    repository = Repository.initialize(str(tmpdir), 'name', 'http://host/repo')
+    tmpdir.mkdir('@a').join('a.pbo').write_binary(b'a' * 1000)
+    tmpdir.mkdir('@b').join('b.pbo').write_binary(b'b' * 1000)
+    tmpdir.join('readme.txt').write_binary(b'readme')
+    return repository
+
+
+def publication(repository):
+    """Return the content of the publication file of `repository`."""
+    return unit.load_publication(os.path.join(repository.directory, config.index_directory,
+                                              config.publication_file))
+
+
+def shard_path(repository, name):
+    """Return the path of the published file `name`."""
+    return os.path.join(repository.directory, config.index_directory, config.shard_directory,
+                        name)
+
+
+def test_publish(repository):
+    """Assert one shard is published per mod, with its compressed variants."""
+    result = unit.publish(repository, workers=1, compressions=['gzip'])
+
+    published = publication(repository)
+    assert result == unit.PublishResult(1, 1, 3, 6, result.written_bytes, 0)
+    assert sorted(published['shards']) == ['', '@a', '@b']
+    with Manifest(shard_path(repository, published['shards']['@a'])) as shard:
+        assert [entry.path for entry in shard] == ['@a/a.pbo']
+    with Manifest(shard_path(repository, published['shards'][''])) as shard:
+        assert [entry.path for entry in shard] == ['readme.txt']
+    with open(shard_path(repository, published['shards']['@b']), mode='rb') as stream:
+        data = stream.read()
+    with open(shard_path(repository, published['shards']['@b'] + '.gz'), mode='rb') as stream:
+        assert compression.decompress(stream.read(), 'gzip') == data
+
+
+def test_publish_incremental(repository, tmpdir):
+    """Assert only changed shards are written and files of older publications removed."""
+    first = unit.publish(repository, workers=1, compressions=[])
+    assert unit.publish(repository, workers=1, compressions=[]) == \
+        unit.PublishResult(2, 1, 3, 0, 0, 0)
+    first_shard = publication(repository)['shards']['@a']
+
+    tmpdir.join('@a', 'a.pbo').write_binary(b'changed')
+    third = unit.publish(repository, workers=1, compressions=[])
+    # The shard of the changed mod and the delta index of the revision are written.
+    assert (third.generation, third.revision, third.written_files, third.removed_files) == \
+        (3, 2, 2, 0)
+    assert os.path.exists(shard_path(repository, first_shard))
+
+    tmpdir.join('@a', 'a.pbo').write_binary(b'changed again')
+    fourth = unit.publish(repository, workers=1, compressions=[])
+    assert (fourth.written_files, fourth.removed_files) == (2, 1)
+    assert not os.path.exists(shard_path(repository, first_shard))
+    assert first.shards == fourth.shards == 3
+
+
+def test_publish_deltas(repository, tmpdir, mocker):
+    """Assert every revision publishes the entries changed since the previous one."""
+    mocker.patch.object(config, 'delta_revisions', 2)
+    unit.publish(repository, workers=1, compressions=[])
+    first = publication(repository)
+    assert (first['revision'], first['deltas']) == (1, [])
+
+    tmpdir.join('@a', 'a.pbo').write_binary(b'changed')
+    tmpdir.mkdir('@c').join('c.pbo').write_binary(b'c')
+    tmpdir.join('readme.txt').remove()
+    unit.publish(repository, workers=1, compressions=[])
+    second = publication(repository)
+    [[base, name]] = second['deltas']
+    assert (second['revision'], base) == (2, first['manifest'])
+    with open(shard_path(repository, name), mode='rb') as stream:
+        deleted, entries = msgpack.unpackb(stream.read(), raw=False)
+    assert deleted == ['readme.txt']
+    assert [entry[0] for entry in entries] == ['@a/a.pbo', '@c/c.pbo']
+
+    assert unit.publish(repository, workers=1, compressions=[]).revision == 2
+    assert publication(repository)['deltas'] == second['deltas']
+    for content in (b'third', b'fourth'):
+        tmpdir.join('@c', 'c.pbo').write_binary(content)
+        unit.publish(repository, workers=1, compressions=[])
+    fourth = publication(repository)
+    assert fourth['revision'] == 4
+    # Only the deltas of the last two revisions are kept.
+    assert [base for base, _ in fourth['deltas']][0] == second['manifest']
+    assert len(fourth['deltas']) == 2
+
+
+def test_publish_chunks(repository, tmpdir):
+    """Assert chunks are published once with recipes rebuilding every file."""
+    unit.publish(repository, workers=1, chunks=True, compressions=[])
+
+    published = publication(repository)
+    objects = os.path.join(repository.directory, config.index_directory, config.object_directory)
+    for mod, name in published['recipes'].items():
+        with open(shard_path(repository, name), mode='rb') as stream:
+            recipe = msgpack.unpackb(stream.read(), raw=False)
+        for path, chunks in recipe.items():
+            content = b''
+            for digest, size in chunks:
+                with open(os.path.join(objects, unit.object_name(digest)), mode='rb') as stream:
+                    data = stream.read()
+                assert len(data) == size
+                content += data
+            assert content == tmpdir.join(path).read_binary()
+
+    os.remove(str(tmpdir.join('@b', 'b.pbo')))
+    unit.publish(repository, workers=1, chunks=True, compressions=[])
+    result = unit.publish(repository, workers=1, chunks=True, compressions=[])
+    assert result.removed_files == 3
+    assert sum(len(files) for _, _, files in os.walk(objects)) == 2
+
+
+def test_publish_compressed_blobs(repository, tmpdir, mocker):
+    """Assert compressible files are published as blobs listed in the compressed table."""
+    mocker.patch.object(config, 'compression_min_size', 512)
+    mocker.patch.object(config, 'compression_sample_size', 256)
+    unit.publish(repository, workers=1, compressions=[])
+
+    table = unit.load_compressed_table(
+        unit._Publisher(shard_path(repository, ''), []), publication(repository))
+    blobs = os.path.join(repository.directory, config.index_directory, config.blob_directory)
+    assert len(table) == 2
+    assert sorted(publication(repository)['compressed']) == ['@a', '@b']
+    for entry in repository.manifest:
+        if entry.path == 'readme.txt':
+            continue
+        compression_name, size = table[entry.digest]
+        content = tmpdir.join(entry.path).read_binary()
+        with open(os.path.join(blobs, compression.blob_name(entry.digest, compression_name)),
+                  mode='rb') as stream:
+            data = stream.read()
+        assert len(data) == size
+        assert compression.decompress(data, compression_name) == content
+
+    os.remove(str(tmpdir.join('@b', 'b.pbo')))
+    unit.publish(repository, workers=1, compressions=[])
+    unit.publish(repository, workers=1, compressions=[])
+    assert len(os.listdir(blobs)) == 1
@@ -0,0 +1,271 @@
+# --------------------------------License Notice----------------------------------
+# CNTOSync - Carpe Noctem Tactical Operations ArmA3 mod synchronization tool
+# Copyright (C) 2018 Carpe Noctem - Tactical Operations (aka. CNTO) (contact@carpenoctem.co)
+#
+# The authors of this software are listed in the AUTHORS file at the
+# root of this software's source code tree.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# All rights reserved.
+# --------------------------------License Notice----------------------------------
+
+"""Test suite for `cntosync.signature`."""
+
+import hashlib
+import random
+import zlib
+
+import cntosync.configuration as config
+import cntosync.indexer as indexer
+import cntosync.signature as unit
+from cntosync import exceptions
+
+import pytest
+
+
+@pytest.fixture()
+def small_blocks(mocker):
+    """Use tiny blocks so that tests run on small files."""
+    mocker.patch.object(config, 'block_size', 16)
+    mocker.patch.object(config, 'delta_threshold', 64)
+
+
+def random_bytes(seed, size):
+    """Return `size` pseudo-random bytes generated from `seed`."""
+    generator = random.Random(seed)
+    return bytes(generator.getrandbits(8) for _ in range(size))
+
+
+def make_signature(content):
+    """Return the signature of `content`."""
+    hasher = unit.BlockHasher()
+    hasher.update(content)
+    return hasher.finish(len(content), hashlib.blake2b(content, digest_size=20).digest())
+
+
+def rebuild(tmpdir, seed, target):
+    """Rebuild `target` from `seed` and return the delta and the fetched ranges."""
+    seed_path, output_path = str(tmpdir.join('seed')), str(tmpdir.join('output'))
+    tmpdir.join('seed').write_binary(seed)
+    delta = unit.compute_delta(seed_path, make_signature(target))
+    fetched = []
+
+    def fetch(offset, length):
+        fetched.append((offset, length))
+        yield target[offset:offset + length]
+
+    unit.assemble(seed_path, output_path, delta, fetch)
+    assert tmpdir.join('output').read_binary() == target
+
+    return delta, fetched
+
+
+def test_block_hasher_pieces(small_blocks):
+    """Assert the signature does not depend on how the stream is split."""
+    content = bytes(range(200))
+    whole = make_signature(content)
+    hasher = unit.BlockHasher()
+    for offset in range(0, len(content), 7):
+        hasher.update(content[offset:offset + 7])
+
+    assert hasher.finish(len(content), whole.digest) == whole
+    assert len(whole.weak) == 13
+    assert whole.weak[0] == zlib.adler32(content[:16])
+    assert whole.block_length(12) == 8
+
+
+def test_signature_pack_roundtrip(small_blocks):
+    """Assert a signature survives serialization."""
+    signature = make_signature(bytes(range(100)))
+
+    assert unit.Signature.unpack(signature.pack()) == signature
+
+
+def test_signature_unpack_version_1(small_blocks):
+    """Assert sidecars written before the compression choice was recorded are read."""
+    signature = make_signature(bytes(range(100)))._replace(compression='zstd')
+    data = unit.msgpack.packb([1, *unit.msgpack.unpackb(signature.pack())[1:7]],
+                              use_bin_type=True)
+
+    assert unit.Signature.unpack(signature.pack()).compression == 'zstd'
+    assert unit.Signature.unpack(data) == signature._replace(compression=None)
+
+
+@pytest.mark.parametrize('size, needed', [(63, False), (64, True), (100, True)])
+def test_needs_sidecar(size, needed, small_blocks, mocker):
+    """Assert sidecars are needed from the smallest of the delta and compression sizes."""
+    mocker.patch.object(config, 'compression_min_size', 100)
+
+    assert unit.needs_sidecar(size) is needed
+    mocker.patch.object(config, 'delta_threshold', 1000)
+    assert unit.needs_sidecar(size) is (size >= 100)
+
+
+def test_signature_unpack_unknown_version():
+    """Assert unknown sidecar format versions are rejected."""
+    data = unit.msgpack.packb([99, 0, 16, b'', 8, b'', b''], use_bin_type=True)
+
+    with pytest.raises(ValueError):
+        unit.Signature.unpack(data)
+
+
+def test_delta_in_place_change(small_blocks, tmpdir):
+    """Assert only the modified block is fetched."""
+    seed = random_bytes(1, 160)
+    target = seed[:40] + b'X' * 8 + seed[48:]
+
+    delta, fetched = rebuild(tmpdir, seed, target)
+
+    assert fetched == [(32, 16)]
+    assert delta.transfer_size == 16
+    assert delta.copies == [(0, 0, 32), (48, 48, 112)]
+
+
+def test_delta_insertion(small_blocks, tmpdir):
+    """Assert the rolling search re-synchronizes after shifted content."""
+    seed = random_bytes(2, 160)
+    target = seed[:20] + b'inserted' + seed[20:]
+
+    delta, _ = rebuild(tmpdir, seed, target)
+
+    assert delta.transfer_size <= 2 * config.block_size
+    assert delta.transfer_size < len(target)
+
+
+def test_delta_rolling_limit(small_blocks, tmpdir, mocker):
+    """Assert shifted content is not searched once the rolling budget is exhausted."""
+    mocker.patch.object(config, 'rolling_search_limit', 0)
+    seed = random_bytes(3, 160)
+    target = b'shift' + seed
+
+    delta, _ = rebuild(tmpdir, seed, target)
+
+    assert delta.copies == [(160, 155, 5)]
+
+
+@pytest.mark.parametrize('seed', [None, b'', b'unrelated content of the seed'])
+def test_delta_without_usable_seed(seed, small_blocks, tmpdir):
+    """Assert the whole file is fetched in one range when nothing can be reused."""
+    target = bytes(range(100))
+    seed_path = None
+    if seed is not None:
+        tmpdir.join('seed').write_binary(seed)
+        seed_path = str(tmpdir.join('seed'))
+
+    delta = unit.compute_delta(seed_path, make_signature(target))
+
+    assert delta.missing == [(0, 100)]
+    assert delta.copies == []
+
+
+def test_delta_tail_block(small_blocks, tmpdir):
+    """Assert the short last block is reused when appended data is removed."""
+    target = bytes(range(40))
+
+    delta, fetched = rebuild(tmpdir, target + b'appended', target)
+
+    assert fetched == []
+    assert delta.copies == [(0, 0, 40)]
+
+
+def test_assemble_corrupted(small_blocks, tmpdir):
+    """Assert data not matching the expected digest is reported."""
+    target = bytes(range(40))
+    delta = unit.compute_delta(None, make_signature(target))
+
+    with pytest.raises(exceptions.IntegrityError):
+        unit.assemble(None, str(tmpdir.join('output')), delta, lambda offset, length: [b'x'])
+
+
+def test_delta_seed_signature(small_blocks, tmpdir, mocker):
+    """Assert blocks left in place are matched through the seed signature, not searched."""
+    seed = random_bytes(4, 100)
+    target = seed[:32] + b'x' * 16 + seed[48:]
+    tmpdir.join('seed').write_binary(seed)
+    find_blocks = mocker.spy(unit, '_find_blocks')
+
+    delta = unit.compute_delta(str(tmpdir.join('seed')), make_signature(target),
+                               make_signature(seed))
+
+    assert delta.missing == [(32, 16)]
+    assert sorted(find_blocks.call_args[0][2]) == [0, 1, 3, 4, 5, 6]
+    find_blocks.reset_mock()
+
+    delta = unit.compute_delta(str(tmpdir.join('seed')), make_signature(seed),
+                               make_signature(seed))
+
+    assert (delta.copies, delta.missing) == ([(0, 0, 100)], [])
+    assert not find_blocks.called
+
+    delta = unit.compute_delta(str(tmpdir.join('seed')), make_signature(target),
+                               make_signature(seed + b'stale'))
+
+    assert delta.missing == [(32, 16)]
+    assert find_blocks.call_args[0][2] == {}
+
+
+def test_assemble_resume(small_blocks, tmpdir, mocker):
+    """Assert pieces are reported once on disk and an interrupted assembly resumes from them."""
+    mocker.patch.object(config, 'segment_size', 32)
+    seed = random_bytes(5, 160)
+    target = seed[:16] + b'x' * 48 + seed[64:144] + b'y' * 16
+    tmpdir.join('seed').write_binary(seed)
+    seed_path, output_path = str(tmpdir.join('seed')), str(tmpdir.join('output'))
+    delta = unit.compute_delta(seed_path, make_signature(target))
+    pieces, fetched, interrupted = [], [], [144]
+
+    def fetch(offset, length):
+        fetched.append((offset, length))
+        if offset in interrupted:
+            interrupted.remove(offset)
+            raise KeyboardInterrupt
+        yield target[offset:offset + length]
+
+    with pytest.raises(KeyboardInterrupt):
+        unit.assemble(seed_path, output_path, delta, fetch,
+                      on_piece=lambda offset, length: pieces.append((offset, length)))
+
+    assert pieces == [(0, 16), (16, 32), (48, 16), (64, 32), (96, 32), (128, 16)]
+    assert fetched == [(16, 32), (48, 16), (144, 16)]
+
+    del pieces[:], fetched[:]
+    unit.assemble(seed_path, output_path, delta, fetch, [(0, 80), (96, 48)],
+                  lambda offset, length: pieces.append((offset, length)))
+
+    assert pieces == [(80, 16), (144, 16)]
+    assert fetched == [(144, 16)]
+    assert tmpdir.join('output').read_binary() == target
+
+
+def test_indexer_maintains_sidecars(small_blocks, tmpdir):
+    """Assert sidecars are written for large files, moved on rename and removed when stale."""
+    tmpdir.join('large').write_binary(bytes(range(100)))
+    tmpdir.join('small').write_binary(b'small')
+    first = indexer.build(str(tmpdir), 1)
+
+    signature = unit.read_sidecar(str(tmpdir.join('large')))
+    assert signature == make_signature(bytes(range(100)))
+    assert not tmpdir.join('small' + config.extension).exists()
+    assert [entry.path for entry in first.entries] == ['large', 'small']
+
+    tmpdir.join('large').rename(tmpdir.join('moved'))
+    second = indexer.build(str(tmpdir), 1, indexer.StatCache(2 ** 62, first.stat_cache.files))
+
+    assert second.renamed == [('large', 'moved')]
+    assert unit.read_sidecar(str(tmpdir.join('moved'))) == signature
+
+    tmpdir.join('moved').write_binary(b'now small')
+    indexer.build(str(tmpdir), 1, second.stat_cache)
+
+    assert not tmpdir.join('moved' + config.extension).exists()
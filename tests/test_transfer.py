@@ -0,0 +1,470 @@
+# --------------------------------License Notice----------------------------------
+# CNTOSync - Carpe Noctem Tactical Operations ArmA3 mod synchronization tool
+# Copyright (C) 2018 Carpe Noctem - Tactical Operations (aka. CNTO) (contact@carpenoctem.co)
+#
+# The authors of this software are listed in the AUTHORS file at the
+# root of this software's source code tree.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# All rights reserved.
+# --------------------------------License Notice----------------------------------
+
+"""Test suite for `cntosync.transfer`."""
+
+import collections
+import os
+import random
+import shutil
+
+import cntosync.configuration as config
+import cntosync.transfer as unit
+from cntosync import bandwidth, chunking, exceptions, indexer, metrics, signature
+from cntosync.download import Downloader
+from cntosync.filesync import Repository
+from cntosync.journal import TransferJournal
+from cntosync.manifest import write_manifest
+from cntosync.publish import load_publication, publish
+
+from httpserver import serve
+
+import pytest
+
+
+def random_bytes(seed, size):
+    """Return `size` pseudo-random bytes generated from `seed`."""
+    generator = random.Random(seed)
+    return bytes(generator.getrandbits(8) for _ in range(size))
+
+
+@pytest.fixture()
+def remote(tmpdir, mocker):
+    """Serve a directory with signed files and yield ``(server, entries)``."""
+    mocker.patch.object(config, 'block_size', 64)
+    mocker.patch.object(config, 'delta_threshold', 256)
+    mocker.patch.object(config, 'batched_write_size', 256)
+    directory = tmpdir.mkdir('remote')
+    directory.mkdir('@mod').join('large.pbo').write_binary(random_bytes(1, 1000))
+    directory.join('@mod', 'copy.pbo').write_binary(random_bytes(1, 1000))
+    directory.join('@mod', 'small.bisign').write_binary(b'signature')
+    entries = indexer.build(str(directory), workers=1).entries
+    with serve(str(directory)) as server:
+        yield server, entries
+
+
+@pytest.fixture()
+def local(tmpdir):
+    """Return a local directory and its transfer journal."""
+    directory = tmpdir.mkdir('local')
+    return directory, TransferJournal(str(directory.join(config.index_directory, 'journal')))
+
+
+def assert_synchronized(directory, entries):
+    """Assert every entry is present in `directory` with the expected content."""
+    for entry in entries:
+        assert indexer.hash_file(str(directory.join(entry.path))) == entry.digest
+
+
+def test_fetch_index(tmpdir):
+    """Assert the remote index is downloaded and decoded."""
+    tmpdir.mkdir(config.index_directory).join(config.index_file).write_binary(
+        b'\x81\xa4name\xa6remote')
+    with serve(str(tmpdir)) as server, Downloader() as downloader:
+        assert unit.fetch_index(server.url, downloader) == {'name': 'remote'}
+        assert unit.fetch_signature(server.url, 'missing', downloader) is None
+        assert unit.fetch_compressed_table(server.url, downloader) == {}
+
+
+def test_transfer(remote, local):
+    """Assert files are transferred once per content and recorded as completed."""
+    server, entries = remote
+    directory, journal = local
+
+    with Downloader(workers=2, segment_size=128) as downloader:
+        result = unit.transfer_files(str(directory), server.url, entries, journal, downloader)
+
+    assert result == unit.TransferResult(3, 1009, 0)
+    assert_synchronized(directory, entries)
+    assert journal.partial == {}
+    assert signature.read_sidecar(str(directory.join('@mod', 'copy.pbo'))).digest == \
+        entries[0].digest
+    assert sorted(journal.completed) == ['@mod/copy.pbo', '@mod/large.pbo', '@mod/small.bisign']
+    assert os.listdir(journal.partial_directory) == []
+
+
+@pytest.mark.parametrize('optional_mods,priority', [
+    ((), bandwidth.PRIORITY_REQUIRED),
+    (('@mod',), bandwidth.PRIORITY_OPTIONAL),
+])
+def test_transfer_priority(optional_mods, priority, remote, local, mocker):
+    """Assert downloads are prioritized by size and by mod, small files first."""
+    server, entries = remote
+    directory, journal = local
+    mocker.patch.object(config, 'small_priority_size', 100)
+    downloader = Downloader()
+    download = mocker.spy(downloader, 'download')
+    fetch = mocker.spy(downloader, 'fetch')
+
+    unit.transfer_files(str(directory), server.url, entries, journal, downloader,
+                        optional_mods=optional_mods)
+
+    priorities = {os.path.basename(job.url): job.priority for job in download.call_args[0][0]}
+    assert priorities == {'copy.pbo': priority}
+    fetch.assert_any_call(server.url + '/@mod/small.bisign',
+                          priority=bandwidth.PRIORITY_SMALL)
+    assert_synchronized(directory, entries)
+
+
+def test_transfer_resume(remote, local, mocker):
+    """Assert an interrupted transfer resumes without fetching committed ranges again."""
+    server, entries = remote
+    directory, journal = local
+    large = [entry for entry in entries if entry.path == '@mod/large.pbo']
+    original = Downloader._download_segment
+    calls = []
+
+    def interrupted(self, job, offset, length, *args):
+        calls.append(offset)
+        if len(calls) > 3:
+            raise KeyboardInterrupt
+        return original(self, job, offset, length, *args)
+
+    mocker.patch.object(Downloader, '_download_segment', interrupted)
+    with Downloader(workers=1, segment_size=128) as downloader, \
+            pytest.raises(KeyboardInterrupt):
+        unit.transfer_files(str(directory), server.url, large, journal, downloader)
+    mocker.stopall()
+
+    journal = TransferJournal.load(journal.path)
+    assert journal.partial == {large[0].digest: [(0, 384)]}
+
+    with Downloader(workers=1, segment_size=128) as downloader:
+        result = unit.transfer_files(str(directory), server.url, large, journal, downloader)
+
+    assert result == unit.TransferResult(1, 616, 384)
+    assert_synchronized(directory, large)
+
+
+def test_transfer_corrupted(remote, local, mocker):
+    """Assert data which does not match the signature is never committed."""
+    server, entries = remote
+    directory, journal = local
+    large = [entry for entry in entries if entry.path == '@mod/large.pbo']
+    mocker.patch('cntosync.signature.verify_blocks', return_value=False)
+
+    with Downloader(workers=1, segment_size=128) as downloader, \
+            pytest.raises(exceptions.IntegrityError):
+        unit.transfer_files(str(directory), server.url, large, journal, downloader)
+
+    assert TransferJournal.load(journal.path).partial == {large[0].digest: []}
+    assert not directory.join('@mod', 'large.pbo').check()
+
+
+def test_transfer_digest_mismatch(remote, local):
+    """Assert a complete file which does not match its digest is discarded."""
+    server, entries = remote
+    directory, journal = local
+    small = [entry._replace(digest=b'0' * config.digest_size) for entry in entries
+             if entry.path == '@mod/small.bisign']
+
+    with Downloader(workers=1) as downloader, pytest.raises(exceptions.IntegrityError):
+        unit.transfer_files(str(directory), server.url, small, journal, downloader)
+
+    assert journal.partial == {}
+    assert os.listdir(journal.partial_directory) == []
+
+
+@pytest.mark.parametrize('seed,fetched', [('shifted', 64), ('stale', 1000), ('vanished', 1000)])
+def test_transfer_delta(seed, fetched, remote, local, mocker):
+    """Assert a modified file is rebuilt from its local copy, or fetched whole if stale."""
+    server, entries = remote
+    directory, journal = local
+    large = [entry for entry in entries if entry.path == '@mod/large.pbo']
+    seed_path = directory.mkdir('@mod').join('large.pbo')
+    if seed == 'shifted':
+        seed_path.write_binary(b'inserted' + random_bytes(1, 1000)[64:])
+    elif seed == 'vanished':
+        seed_path.write_binary(random_bytes(1, 1000)[64:])
+        mocker.patch('cntosync.signature.compute_delta', side_effect=FileNotFoundError)
+    else:
+        seed_path.write_binary(random_bytes(3, 1000))
+        with Downloader() as downloader:
+            file_signature = unit.fetch_signature(server.url, '@mod/large.pbo', downloader)
+        seed_path.new(basename='large.pbo' + config.extension).write_binary(
+            file_signature.pack())
+
+    received = []
+
+    with Downloader(workers=1) as downloader, \
+            metrics.recording(metrics.Recorder()) as recorder:
+        result = unit.transfer_files(str(directory), server.url, large, journal, downloader,
+                                     received.append)
+
+    assert result == unit.TransferResult(1, fetched, 0)
+    assert sum(received) == fetched
+    assert recorder.stages.get(metrics.DIFF, metrics.StageMetrics()).files == \
+        (seed != 'vanished')
+    assert_synchronized(directory, large)
+    assert journal.partial == {}
+    assert signature.read_sidecar(str(seed_path)).digest == large[0].digest
+
+
+def test_transfer_delta_resume(remote, local, mocker):
+    """Assert an interrupted delta transfer resumes from its copied and fetched pieces."""
+    server, entries = remote
+    directory, journal = local
+    large = [entry for entry in entries if entry.path == '@mod/large.pbo']
+    mocker.patch.object(config, 'segment_size', 128)
+    content = bytearray(random_bytes(1, 1000))
+    content[64:74] = content[640:650] = b'0123456789'
+    directory.mkdir('@mod').join('large.pbo').write_binary(bytes(content))
+    original = Downloader.fetch
+    interrupted = [640]
+
+    def fetch(self, url, offset=0, length=None, **kwargs):
+        if offset in interrupted:
+            interrupted.remove(offset)
+            raise KeyboardInterrupt
+        return original(self, url, offset, length, **kwargs)
+
+    mocker.patch.object(Downloader, 'fetch', fetch)
+    with Downloader(workers=1) as downloader, pytest.raises(KeyboardInterrupt):
+        unit.transfer_files(str(directory), server.url, large, journal, downloader)
+
+    journal = TransferJournal.load(journal.path)
+    assert journal.partial == {large[0].digest: [(0, 640)]}
+
+    with Downloader(workers=1) as downloader:
+        result = unit.transfer_files(str(directory), server.url, large, journal, downloader)
+
+    assert result == unit.TransferResult(1, 64, 640)
+    assert_synchronized(directory, large)
+
+
+@pytest.fixture()
+def published(tmpdir, mocker):
+    """Serve a published repository with one compressible file and yield ``(server, entries)``."""
+    mocker.patch.object(config, 'compression_min_size', 512)
+    mocker.patch.object(config, 'compression_sample_size', 256)
+    mocker.patch.object(config, 'batched_write_size', 256)
+    directory = tmpdir.mkdir('remote')
+    repository = Repository.initialize(str(directory), 'remote', 'http://host/repo')
+    directory.mkdir('@mod').join('config.cpp').write_binary(b'class CfgPatches;\n' * 100)
+    directory.join('@mod', 'texture.paa').write_binary(random_bytes(2, 1000))
+    publish(repository, workers=1, compressions=[])
+    with serve(str(directory)) as server:
+        yield server, list(repository.manifest)
+
+
+@pytest.mark.parametrize('missing_blob', [False, True])
+@pytest.mark.parametrize('batched', [False, True])
+def test_transfer_compressed(missing_blob, batched, published, local, tmpdir, mocker):
+    """Assert published blobs are decompressed on the fly, originals fetched without them.
+
+    Files are fetched in memory and written in batches when `batched`, streamed otherwise.
+    """
+    if batched:
+        mocker.patch.object(config, 'batched_write_size', 4096)
+    server, entries = published
+    directory, journal = local
+    received = []
+    if missing_blob:
+        for blob in tmpdir.join('remote', config.index_directory, config.blob_directory).listdir():
+            blob.remove()
+
+    with Downloader(workers=2) as downloader:
+        compressed = unit.fetch_compressed_table(server.url, downloader)
+        result = unit.transfer_files(str(directory), server.url, entries, journal, downloader,
+                                     received.append, compressed)
+
+    config_digest = entries[0].digest
+    assert list(compressed) == [config_digest]
+    expected = 1800 if missing_blob else compressed[config_digest][1]
+    assert result == unit.TransferResult(2, expected + 1000, 0)
+    assert sum(received) == result.fetched_bytes
+    assert_synchronized(directory, entries)
+    assert sorted(journal.completed) == ['@mod/config.cpp', '@mod/texture.paa']
+
+
+@pytest.mark.parametrize('damage', ['stale', 'garbage'])
+@pytest.mark.parametrize('batched', [False, True])
+def test_transfer_corrupted_blob(damage, batched, published, local, tmpdir, mocker):
+    """Assert blobs which do not decompress to the expected content fall back to originals."""
+    if batched:
+        mocker.patch.object(config, 'batched_write_size', 4096)
+    server, entries = published
+    directory, journal = local
+    blobs = tmpdir.join('remote', config.index_directory, config.blob_directory).listdir()
+    for blob in blobs:
+        name = blob.basename.partition('.')[2]
+        blob.write_binary(b'garbage' * 10 if damage == 'garbage' else unit.compression.compress(
+            b'class CfgMods;\n' * 100, 'zstd' if name == 'zst' else 'gzip'))
+    received = []
+
+    with Downloader(workers=2) as downloader:
+        compressed = unit.fetch_compressed_table(server.url, downloader)
+        result = unit.transfer_files(str(directory), server.url, entries, journal, downloader,
+                                     received.append, compressed)
+
+    assert result.fetched_bytes == sum(received)
+    assert result.fetched_bytes == sum(blob.size() for blob in blobs) + 1800 + 1000
+    assert_synchronized(directory, entries)
+    assert journal.partial == {}
+
+
+@pytest.fixture()
+def chunked(tmpdir, mocker):
+    """Serve a repository published with chunks, two files sharing most of their content."""
+    mocker.patch.object(config, 'chunk_min_size', 256)
+    mocker.patch.object(config, 'chunk_average_size', 1024)
+    mocker.patch.object(config, 'chunk_max_size', 4096)
+    mocker.patch.object(config, 'batched_write_size', 4096)
+    directory = tmpdir.mkdir('remote')
+    repository = Repository.initialize(str(directory), 'remote', 'http://host/repo')
+    shared = random_bytes(4, 32 * 1024)
+    directory.mkdir('@mod').join('a.pbo').write_binary(shared + random_bytes(5, 4096))
+    directory.join('@mod', 'b.pbo').write_binary(random_bytes(6, 4096) + shared)
+    publish(repository, workers=1, chunks=True, compressions=[])
+    with serve(str(directory)) as server:
+        yield server, list(repository.manifest), repository
+
+
+@pytest.mark.parametrize('damage', ['stored', 'missing', 'corrupted'])
+def test_transfer_chunks(damage, chunked, local):
+    """Assert a stored chunk is reused and a missing or corrupted one falls back to files."""
+    server, entries, repository = chunked
+    directory, journal = local
+    with Downloader(workers=1) as downloader:
+        recipes = unit.fetch_recipes(server.url, downloader, load_publication(os.path.join(
+            repository.directory, config.index_directory, config.publication_file)), ['@mod'])
+    counts = collections.Counter(digest for chunks in recipes.values() for digest, _ in chunks)
+    digest, size = next(chunk for chunk in recipes['@mod/a.pbo'] if counts[chunk[0]] > 1)
+    object_path = os.path.join(repository.directory, config.index_directory,
+                               config.object_directory, chunking.object_name(digest))
+    unique_size = sum({chunk: size for chunks in recipes.values() for chunk, size in chunks}
+                      .values())
+    if damage == 'stored':
+        os.makedirs(os.path.dirname(journal.chunk_path(digest)))
+        shutil.copyfile(object_path, journal.chunk_path(digest))
+    elif damage == 'missing':
+        os.remove(object_path)
+    else:
+        with open(object_path, mode='r+b') as stream:
+            stream.write(b'corrupted')
+    received = []
+
+    with Downloader(workers=1) as downloader:
+        result = unit.transfer_files(str(directory), server.url, entries, journal, downloader,
+                                     received.append, recipes=recipes)
+
+    assert result.fetched_bytes == sum(received)
+    if damage == 'stored':
+        assert result == unit.TransferResult(2, unique_size - size, 0)
+    else:
+        assert result.fetched_bytes > sum(entry.size for entry in entries)
+    assert_synchronized(directory, entries)
+
+
+def test_fetch_manifest_folders(local, tmpdir):
+    """Assert only the shards of the folders are fetched, cached and the stale ones removed."""
+    directory = tmpdir.mkdir('remote')
+    repository = Repository.initialize(str(directory), 'remote', 'http://host/repo')
+    for mod in ('@a', '@ab', '@b'):
+        directory.mkdir(mod).join('file.pbo').write_binary(mod.encode())
+    directory.join('readme.txt').write_binary(b'readme')
+    publish(repository, workers=1)
+    path = str(local[0].mkdir(config.index_directory).join(config.manifest_file))
+    cache = local[0].join(config.index_directory, config.shard_cache_directory)
+
+    with serve(str(directory)) as server, Downloader() as downloader:
+        publication = unit.fetch_publication(server.url, downloader)
+        with unit.fetch_manifest(server.url, downloader, path, ['@b', '@a'], None) as manifest:
+            assert [entry.path for entry in manifest] == ['@a/file.pbo', '@b/file.pbo']
+        with unit.fetch_manifest(server.url, downloader, path, ['@b', '@a'],
+                                 publication) as manifest:
+            assert [entry.path for entry in manifest] == ['@a/file.pbo', '@b/file.pbo']
+        assert sorted(cache.listdir()) == sorted(
+            cache.join(publication['shards'][mod]) for mod in ('@a', '@b'))
+
+        cache.join(publication['shards']['@a']).write_binary(b'corrupted')
+        with unit.fetch_manifest(server.url, downloader, path, ['@ab', '@missing'],
+                                 publication) as manifest:
+            assert [entry.path for entry in manifest] == ['@ab/file.pbo']
+        assert cache.listdir() == [cache.join(publication['shards']['@ab'])]
+
+        name = publication['shards']['@a']
+        directory.join(config.index_directory, config.shard_directory, name).write_binary(b'')
+        with pytest.raises(exceptions.IntegrityError):
+            unit.fetch_shard(server.url, downloader, name)
+
+
+def test_fetch_manifest_deltas(local, tmpdir, mocker):
+    """Assert a manifest a few revisions behind is updated with the published deltas."""
+    directory = tmpdir.mkdir('remote')
+    repository = Repository.initialize(str(directory), 'remote', 'http://host/repo')
+    directory.mkdir('@a').join('a.pbo').write_binary(b'a')
+    directory.join('readme.txt').write_binary(b'readme')
+    publish(repository, workers=1)
+    path = str(local[0].mkdir(config.index_directory).join(config.manifest_file))
+    manifest_path = config.index_directory + '/' + config.manifest_file
+
+    with serve(str(directory)) as server, Downloader() as downloader:
+        fetch = mocker.spy(downloader, 'fetch')
+        unit.fetch_manifest(server.url, downloader, path,
+                            publication=unit.fetch_publication(server.url, downloader)).close()
+        for name, content in (('@a/a.pbo', b'changed'), ('@b/b.pbo', b'b')):
+            os.makedirs(str(directory.join(name.split('/')[0])), exist_ok=True)
+            directory.join(name).write_binary(content)
+            publish(repository, workers=1)
+        directory.join('readme.txt').remove()
+        publish(repository, workers=1)
+        publication = unit.fetch_publication(server.url, downloader)
+        fetch.reset_mock()
+
+        with unit.fetch_manifest(server.url, downloader, path, publication=publication) \
+                as manifest:
+            assert list(manifest) == list(repository.manifest)
+        fetched = [call[0][0] for call in fetch.call_args_list]
+        assert len(fetched) == 3
+        assert not any(url.endswith(manifest_path) for url in fetched)
+
+        fetch.reset_mock()
+        unit.fetch_manifest(server.url, downloader, path, publication=publication).close()
+        assert fetch.call_count == 0
+
+        # Manifests unknown to the publication are downloaded again.
+        write_manifest(path, [])
+        with unit.fetch_manifest(server.url, downloader, path, publication=publication) \
+                as manifest:
+            assert list(manifest) == list(repository.manifest)
+        assert fetch.call_args[0][0].endswith(manifest_path)
+
+
+def test_copy_files_changed_source(remote, local, tmpdir):
+    """Assert source files changed since they were indexed are verified once copied."""
+    _, entries = remote
+    directory, journal = local
+    source = tmpdir.join('remote')
+    source.join('@mod', 'small.bisign').write_binary(b'tampered!')
+
+    with pytest.raises(exceptions.IntegrityError):
+        unit.copy_files(str(directory), str(source), entries, journal, workers=1)
+
+    source.join('@mod', 'small.bisign').write_binary(b'signature')
+    os.utime(str(source.join('@mod', 'small.bisign')),
+             ns=(entries[2].mtime, entries[2].mtime))
+    result = unit.copy_files(str(directory), str(source), entries, journal, workers=1)
+
+    assert result == unit.TransferResult(3, 1009, 0)
+    assert_synchronized(directory, entries)
+    assert os.listdir(journal.partial_directory) == []
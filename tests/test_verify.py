@@ -0,0 +1,147 @@
+# --------------------------------License Notice----------------------------------
+# CNTOSync - Carpe Noctem Tactical Operations ArmA3 mod synchronization tool
+# Copyright (C) 2018 Carpe Noctem - Tactical Operations (aka. CNTO) (contact@carpenoctem.co)
+#
+# The authors of this software are listed in the AUTHORS file at the
+# root of this software's source code tree.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# All rights reserved.
+# --------------------------------License Notice----------------------------------
+
+"""Test suite for `cntosync.verify`."""
+
+import os
+import random
+import threading
+
+import cntosync.configuration as config
+import cntosync.verify as unit
+from cntosync import exceptions
+from cntosync.filesync import Repository
+
+from httpserver import serve
+
+import pytest
+
+
+@pytest.fixture()
+def repository(tmpdir, mocker):
+    """Return an indexed repository holding a signed large file and a small file."""
+    mocker.patch.object(config, 'block_size', 16)
+    mocker.patch.object(config, 'delta_threshold', 64)
+    mocker.patch.object(config, 'verification_stride', 64)
+    repository = Repository.initialize(str(tmpdir), 'name', 'http://host/repo')
+    tmpdir.mkdir('@mod').join('large.pbo').write_binary(
+        bytes(random.Random(0).getrandbits(8) for _ in range(1000)))
+    tmpdir.join('@mod', 'small.bisign').write_binary(b'small')
+    repository.build_index(workers=1)
+    return repository
+
+
+def overwrite(path, offset, data):
+    """Overwrite `data` at `offset` of the file at `path`, keeping its modification time."""
+    stat = os.stat(path)
+    with open(path, mode='r+b') as stream:
+        stream.seek(offset)
+        stream.write(data)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+
+@pytest.mark.parametrize('mode, checked_bytes', [
+    ('quick', {0}),
+    ('sampled', {253, 269}),
+    ('full', {1005}),
+])
+def test_verify(mode, checked_bytes, repository):
+    """Assert intact repositories pass, reading data according to the mode."""
+    result = repository.verify(mode, workers=1)
+
+    assert result == unit.VerifyResult(mode, 2, result.checked_bytes, [], [])
+    assert result.checked_bytes in checked_bytes
+    assert result.ok
+
+
+@pytest.mark.parametrize('mode, detected', [
+    ('quick', False),
+    ('sampled', True),
+    ('full', True),
+])
+def test_verify_unfinished_segment(mode, detected, repository, tmpdir):
+    """Assert a zero-filled range left by an unfinished download is caught by reading."""
+    overwrite(str(tmpdir.join('@mod', 'large.pbo')), 128, bytes(64))
+
+    assert repository.verify(mode, workers=1).corrupted == (['@mod/large.pbo'] if detected
+                                                            else [])
+
+
+def test_verify_small_file(repository, tmpdir):
+    """Assert files without a sidecar are hashed in sampled mode."""
+    overwrite(str(tmpdir.join('@mod', 'small.bisign')), 0, b'S')
+
+    assert repository.verify('sampled').corrupted == ['@mod/small.bisign']
+
+
+def test_verify_stat(repository, tmpdir):
+    """Assert missing, truncated and touched files are reported."""
+    os.remove(str(tmpdir.join('@mod', 'small.bisign')))
+    with open(str(tmpdir.join('@mod', 'large.pbo')), mode='r+b') as stream:
+        stream.truncate(990)
+
+    for mode in unit.modes:
+        result = repository.verify(mode, workers=1)
+        assert (result.missing, result.corrupted) == (['@mod/small.bisign'], ['@mod/large.pbo'])
+        assert not result.ok
+
+
+def test_verify_sample_blocks(repository, tmpdir):
+    """Assert one block is read per stride plus the last block."""
+    path = str(tmpdir.join('@mod', 'large.pbo'))
+    entry = repository.lookup('@mod/large.pbo')
+    generator = random.Random(0)
+
+    assert {unit.sample_blocks(path, entry, generator) for _ in range(20)} == \
+        {15 * 16 + 8, 16 * 16 + 8}
+    assert unit.sample_blocks(path, entry._replace(digest=b'other')) is None
+    with pytest.raises(ValueError):
+        repository.verify('thorough')
+
+
+def test_verify_progress_stop(repository, tmpdir):
+    """Assert bytes read are reported and verification stops once requested."""
+    progress = []
+    stop = threading.Event()
+
+    result = repository.verify('sampled', workers=1, progress=progress.append, stop=stop)
+    stop.set()
+
+    assert sum(progress) == result.checked_bytes
+    with pytest.raises(exceptions.Cancelled):
+        repository.verify('sampled', workers=1, stop=stop)
+
+
+@pytest.mark.parametrize('mode', unit.modes)
+def test_verify_remote_manifest(mode, repository, tmpdir):
+    """Assert files corrupted then indexed again are reported against the remote manifest."""
+    with serve(repository.directory) as server:
+        local = Repository.initialize(str(tmpdir.mkdir('local')), 'name', server.url)
+        local.sync(workers=1)
+    assert local.verify(mode, workers=1).ok
+
+    overwrite(str(tmpdir.join('local', '@mod', 'large.pbo')), 128, bytes(64))
+    os.remove(str(tmpdir.join('local', '@mod', 'small.bisign')))
+    local.build_index(workers=1, incremental=False)
+    result = local.verify(mode, workers=1)
+
+    assert (result.missing, result.corrupted) == (['@mod/small.bisign'], ['@mod/large.pbo'])
@@ -0,0 +1,228 @@
+# --------------------------------License Notice----------------------------------
+# CNTOSync - Carpe Noctem Tactical Operations ArmA3 mod synchronization tool
+# Copyright (C) 2018 Carpe Noctem - Tactical Operations (aka. CNTO) (contact@carpenoctem.co)
+#
+# The authors of this software are listed in the AUTHORS file at the
+# root of this software's source code tree.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# All rights reserved.
+# --------------------------------License Notice----------------------------------
+
+"""Test suite for `cntosync.watcher`."""
+
+import errno
+import os
+import sys
+import threading
+import time
+
+import cntosync.configuration as config
+import cntosync.watcher as unit
+from cntosync.filesync import Repository
+
+import pytest
+
+inotify_only = pytest.mark.skipif(not sys.platform.startswith('linux'),
+                                  reason='inotify is only available on Linux')
+
+
+def read_until(watcher, expected, timeout=5.0):
+    """Collect changes reported by `watcher` until `expected` paths were all reported."""
+    changes = set()
+    deadline = time.monotonic() + timeout
+    while not expected <= changes and time.monotonic() < deadline:
+        changes |= watcher.read(0.1)
+    return changes
+
+
+@pytest.mark.parametrize('relative_path, ignored', [
+    ('@mod/addons/a.pbo', False),
+    ('@mod/addons/a.pbo' + config.extension, True),
+    ('@mod/addons/.a.pbo' + config.extension + '.x1y2', True),
+    ('@mod/.hidden', False),
+    (config.index_directory + '/' + config.manifest_file, True),
+])
+def test_ignored(relative_path, ignored):
+    """Assert changes of index files and sidecars are ignored."""
+    assert unit.ignored(relative_path) is ignored
+
+
+@inotify_only
+def test_inotify_watcher(tmpdir):
+    """Assert changes are reported, including in directories created after watching."""
+    tmpdir.mkdir('@mod').join('a.pbo').write_binary(b'a')
+    tmpdir.mkdir(config.index_directory)
+    watcher = unit.InotifyWatcher(str(tmpdir))
+    try:
+        assert watcher.read(0) == set()
+        tmpdir.join('@mod', 'a.pbo').write_binary(b'changed')
+        tmpdir.join('@mod', 'a.pbo' + config.extension).write_binary(b'sidecar')
+        tmpdir.join(config.index_directory, config.manifest_file).write_binary(b'manifest')
+        tmpdir.mkdir('@new')
+        assert read_until(watcher, {'@mod/a.pbo', '@new'}) == {'@mod/a.pbo', '@new'}
+
+        tmpdir.join('@new').mkdir('addons')
+        assert read_until(watcher, {'@new/addons'}) == {'@new/addons'}
+        tmpdir.join('@new', 'addons', 'b.pbo').write_binary(b'b')
+        assert read_until(watcher, {'@new/addons/b.pbo'}) == {'@new/addons/b.pbo'}
+
+        tmpdir.join('@new').rename(tmpdir.join('@renamed'))
+        assert read_until(watcher, {'@new', '@renamed'}) == {'@new', '@renamed'}
+        tmpdir.join('@renamed', 'addons', 'b.pbo').remove()
+        assert read_until(watcher, {'@renamed/addons/b.pbo'}) == {'@renamed/addons/b.pbo'}
+    finally:
+        watcher.close()
+
+
+def test_polling_watcher(tmpdir):
+    """Assert created, modified and deleted files are reported by a scan."""
+    tmpdir.mkdir('@mod').join('a.pbo').write_binary(b'a')
+    tmpdir.join('@mod', 'b.pbo').write_binary(b'b')
+    watcher = unit.PollingWatcher(str(tmpdir), interval=0.05)
+
+    assert watcher.read(0) == set()
+    tmpdir.join('@mod', 'a.pbo').write_binary(b'changed')
+    tmpdir.join('@mod', 'b.pbo').remove()
+    tmpdir.join('@mod', 'c.pbo').write_binary(b'c')
+    assert watcher.read() == {'@mod/a.pbo', '@mod/b.pbo', '@mod/c.pbo'}
+    assert watcher.read() == set()
+
+
+def test_open_watcher_fallback(tmpdir, mocker):
+    """Assert polling is used when inotify cannot be set up."""
+    mocker.patch.object(unit, 'InotifyWatcher', side_effect=OSError)
+
+    assert isinstance(unit.open_watcher(str(tmpdir)), unit.PollingWatcher)
+    assert isinstance(unit.open_watcher(str(tmpdir), polling=True), unit.PollingWatcher)
+
+
+@inotify_only
+def test_inotify_init_failure(tmpdir, mocker):
+    """Assert inotify failures are raised and polling is used instead."""
+    libc = mocker.patch('ctypes.CDLL').return_value
+    libc.inotify_init1.return_value = -1
+    mocker.patch('ctypes.get_errno', return_value=errno.EMFILE)
+
+    with pytest.raises(OSError) as error:
+        unit.InotifyWatcher(str(tmpdir))
+    assert error.value.errno == errno.EMFILE
+    assert isinstance(unit.open_watcher(str(tmpdir)), unit.PollingWatcher)
+
+
+@inotify_only
+def test_inotify_watch_failure(tmpdir, mocker):
+    """Assert the inotify descriptor is closed when the tree cannot be watched."""
+    mocker.patch.object(unit.InotifyWatcher, '_watch_tree',
+                        side_effect=OSError(errno.ENOSPC, 'no space left'))
+    close = mocker.spy(unit.InotifyWatcher, 'close')
+
+    with pytest.raises(OSError):
+        unit.InotifyWatcher(str(tmpdir))
+    assert close.call_count == 1
+    assert isinstance(unit.open_watcher(str(tmpdir)), unit.PollingWatcher)
+
+
+@inotify_only
+def test_inotify_vanished_directory(tmpdir, mocker):
+    """Assert directories removed while being watched are skipped, other errors raised."""
+    tmpdir.mkdir('@mod')
+    watcher = unit.InotifyWatcher(str(tmpdir))
+    try:
+        mocker.patch('os.scandir', side_effect=FileNotFoundError)
+        watcher._watch_tree('@mod')
+        assert sorted(watcher._watches.values()) == ['', '@mod']
+
+        add_watch = mocker.patch.object(watcher, '_libc').inotify_add_watch
+        add_watch.return_value = -1
+        get_errno = mocker.patch('ctypes.get_errno', return_value=errno.ENOENT)
+        watcher._watch_tree('@gone')
+        get_errno.return_value = errno.EACCES
+        with pytest.raises(OSError):
+            watcher._watch_tree('@denied')
+        assert sorted(watcher._watches.values()) == ['', '@mod']
+    finally:
+        watcher.close()
+
+
+class FakeWatcher(object):
+    """Watcher reporting a predefined sequence of changes, then setting `stop`."""
+
+    def __init__(self, changes, stop):
+        """Report `changes` in order, then set `stop`."""
+        self.changes = list(changes)
+        self.stop = stop
+        self.closed = False
+
+    def read(self, timeout=None):
+        """Return the next changes."""
+        if not self.changes:
+            self.stop.set()
+            return set()
+        return self.changes.pop(0)
+
+    def close(self):
+        """Record that watching stopped."""
+        self.closed = True
+
+
+def test_watch_lost_changes_and_retry(mocker):
+    """Assert lost changes trigger a full scan and changes are retried after a failed update."""
+    stop = threading.Event()
+    watcher = FakeWatcher([None, set(), {'a'}, set(), {'b'}, set()], stop)
+    mocker.patch.object(unit, 'open_watcher', return_value=watcher)
+    updates = []
+
+    def update(changes):
+        updates.append(None if changes is None else set(changes))
+        if changes == {'a'}:
+            raise FileNotFoundError
+
+    unit.watch('directory', update, stop)
+
+    assert updates == [None, {'a'}, {'a', 'b'}]
+    assert watcher.closed
+
+
+@pytest.mark.parametrize('polling', [False, True])
+def test_watch_debounced(polling, tmpdir, mocker):
+    """Assert the tree is indexed once, then a burst of changes triggers a single update."""
+    mocker.patch.object(config, 'watch_debounce', 0.3)
+    mocker.patch.object(config, 'watch_poll_interval', 0.1)
+    repository = Repository.initialize(str(tmpdir), 'name', 'http://host/repo')
+    tmpdir.mkdir('@mod').join('first.pbo').write_binary(b'first')
+    updates = []
+    stop = threading.Event()
+    thread = threading.Thread(target=repository.watch, kwargs={
+        'workers': 1, 'stop': stop, 'on_update': updates.append, 'polling': polling})
+    thread.start()
+    try:
+        deadline = time.monotonic() + 5
+        while not updates and time.monotonic() < deadline:
+            time.sleep(0.05)
+        addons = tmpdir.mkdir('@new').mkdir('addons')
+        for number in range(50):
+            addons.join('{0}.pbo'.format(number)).write_binary(b'pbo')
+            time.sleep(0.002)
+        while len(updates) < 2 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        time.sleep(0.5)
+    finally:
+        stop.set()
+        thread.join()
+
+    assert [len(result.added) for result in updates] == [1, 50]
+    assert repository.lookup('@new/addons/49.pbo') is not None
+    assert not os.path.exists(os.path.join(repository.directory, '@new', 'addons',
+                                           '49.pbo' + config.extension))
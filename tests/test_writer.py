@@ -0,0 +1,89 @@
+# --------------------------------License Notice----------------------------------
+# CNTOSync - Carpe Noctem Tactical Operations ArmA3 mod synchronization tool
+# Copyright (C) 2018 Carpe Noctem - Tactical Operations (aka. CNTO) (contact@carpenoctem.co)
+#
+# The authors of this software are listed in the AUTHORS file at the
+# root of this software's source code tree.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# All rights reserved.
+# --------------------------------License Notice----------------------------------
+
+"""Test suite for `cntosync.writer`."""
+
+import os
+import threading
+
+import cntosync.writer as unit
+
+import pytest
+
+
+def test_write(tmpdir, mocker):
+    """Assert files replace their target in batches, leaving hard linked files untouched."""
+    tmpdir.join('old').write_binary(b'old')
+    os.link(str(tmpdir.join('old')), str(tmpdir.join('linked')))
+    fsync = mocker.spy(os, 'fsync')
+    committed = []
+
+    with unit.FileWriter(batch_files=2, interval=60) as writer:
+        for name, data in (('old', b'new'), ('sub/a', b'a'), ('sub/deep/b', b'')):
+            writer.write(str(tmpdir.join(name)), data,
+                         lambda stat, name=name: committed.append((name, stat.st_size)))
+
+    assert committed == [('old', 3), ('sub/a', 1), ('sub/deep/b', 0)]
+    assert tmpdir.join('old').read_binary() == b'new'
+    assert tmpdir.join('linked').read_binary() == b'old'
+    assert tmpdir.join('sub', 'a').read_binary() == b'a'
+    assert sorted(os.listdir(str(tmpdir))) == ['linked', 'old', 'sub']
+    assert os.listdir(str(tmpdir.join('sub', 'deep'))) == ['b']
+    # Every file and the directories of each batch are flushed.
+    assert fsync.call_count == 3 + 2 + 1
+
+
+def test_write_interval(tmpdir):
+    """Assert pending files are committed once the batch interval elapsed."""
+    committed = threading.Event()
+
+    with unit.FileWriter(interval=0.01) as writer:
+        writer.write(str(tmpdir.join('file')), b'data', lambda stat: committed.set())
+        assert committed.wait(5)
+        assert tmpdir.join('file').read_binary() == b'data'
+
+
+def test_write_failure(tmpdir, mocker):
+    """Assert targets are kept and temporary files removed when a batch fails."""
+    tmpdir.join('file').write_binary(b'old')
+    mocker.patch('os.fsync', side_effect=OSError)
+    writer = unit.FileWriter(interval=60)
+    writer.write(str(tmpdir.join('file')), b'new')
+
+    with pytest.raises(OSError):
+        writer.close()
+
+    assert tmpdir.join('file').read_binary() == b'old'
+    assert os.listdir(str(tmpdir)) == ['file']
+    with pytest.raises(OSError):
+        writer.write(str(tmpdir.join('other')), b'data')
+
+
+def test_write_error_stops_writer(tmpdir):
+    """Assert files queued after an error are discarded, the error raised on close."""
+    tmpdir.join('directory').write_binary(b'not a directory')
+
+    with pytest.raises(OSError), unit.FileWriter(interval=60) as writer:
+        writer.write(str(tmpdir.join('directory', 'file')), b'data')
+        writer.write(str(tmpdir.join('file')), b'data')
+
+    assert os.listdir(str(tmpdir)) == ['directory']